@@ -0,0 +1,68 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Compares the cold start cost of import-time and lazy boto3 clients.
+
+Every measurement runs in a fresh interpreter, like a new Lambda execution
+environment. "import" is the time until the module level code finished,
+"first call" additionally includes creating the client on first use.
+
+Usage: python benchmarks/bench_client_init.py [runs]
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+
+LAYER_PATH = os.path.join(
+    os.path.dirname(__file__), "../lib/common/python-layer/python"
+)
+
+# the services of the create_get_message_rule Lambda function
+SERVICES = ["iot", "stepfunctions"]
+
+EAGER = f"""
+import time
+start = time.perf_counter()
+import boto3
+clients = [boto3.client(s) for s in {SERVICES!r}]
+imported = time.perf_counter()
+print(imported - start, imported - start)
+"""
+
+LAZY = f"""
+import time
+start = time.perf_counter()
+from iottoolbox.clients import lazy_client
+clients = [lazy_client(s) for s in {SERVICES!r}]
+imported = time.perf_counter()
+clients[0].meta
+print(imported - start, time.perf_counter() - start)
+"""
+
+
+def measure(code, runs):
+    env = dict(os.environ, PYTHONPATH=LAYER_PATH)
+    env.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    imports, first_calls = [], []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", code], env=env, capture_output=True, check=True
+        ).stdout.split()
+        imports.append(float(output[0]) * 1000)
+        first_calls.append(float(output[1]) * 1000)
+    return statistics.median(imports), statistics.median(first_calls)
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    print(f"median of {runs} runs, clients: {', '.join(SERVICES)}")
+    print(f"{'':>22}{'import [ms]':>14}{'first call [ms]':>18}")
+    for name, code in [("import-time clients", EAGER), ("lazy clients", LAZY)]:
+        imported, first_call = measure(code, runs)
+        print(f"{name:>22}{imported:>14.1f}{first_call:>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Measures cold starts of the Python Lambda functions and flags regressions.
+
+Every function is started in fresh interpreters with stubbed AWS clients
+(see cold_start_runner.py). Reported are the median init time (importing
+index.py), the median first invocation and an import time breakdown by
+package from "python -X importtime". Functions are measured in the default
+mode and in the trimmed mode (TOOLBOX_LAZY_IMPORTS=true, see
+iottoolbox/lazy.py).
+
+Results are compared with a stored baseline. Run with --update-baseline
+to store the current results, baselines are machine specific and not
+checked in.
+
+Usage: python benchmarks/bench_cold_start.py [--runs N] [--update-baseline]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+LIB_DIR = os.path.join(BENCHMARKS_DIR, "../lib")
+LAYER_DIR = os.path.join(LIB_DIR, "common/python-layer/python")
+RUNNER = os.path.join(BENCHMARKS_DIR, "cold_start_runner.py")
+DEFAULT_BASELINE = os.path.join(BENCHMARKS_DIR, "cold_start_baseline.json")
+
+RESULT_PREFIX = "COLD_START_RESULT "
+MODES = {
+    "default": {"TOOLBOX_LAZY_IMPORTS": "false"},
+    "trimmed": {"TOOLBOX_LAZY_IMPORTS": "true"},
+}
+METRICS = ["init_ms", "first_invoke_ms"]
+
+SHARED_LAMBDA_DIR = "test-iot-rules/stepfunction/shared/lambda"
+SQL = "SELECT temperature FROM 'iot/test' WHERE temperature > 50"
+RULE_ENV = {
+    "RECEIVE_MESSAGE_LAMBDA_ARN": "arn:aws:lambda:us-east-1:123456789012:function:r",
+    "PUBLISH_MESSAGE_ROLE_ARN": "arn:aws:iam::123456789012:role/publish",
+    "REPUBLISH_ERROR_TOPIC": "iottoolbox/error",
+}
+
+FUNCTIONS = {
+    "invoke-stepfunction": {
+        "path": "api/lambda/invoke-stepfunction",
+        "env": {
+            "SFN_CUSTOM_MESSAGE_ARN": "custom",
+            "SFN_TOPIC_MESSAGE_ARN": "topic",
+            "SFN_BATCH_MESSAGE_ARN": "batch",
+            "SFN_POLL_INITIAL_DELAY": "0",
+        },
+        "event": {"sql": SQL, "awsIotSqlVersion": "2016-03-23", "message": {}},
+        "responses": {
+            "stepfunctions": {
+                "start_execution": {"executionArn": "arn"},
+                "describe_execution": {"status": "SUCCEEDED", "output": "{}"},
+            }
+        },
+    },
+    "define_rule_name": {
+        "path": "test-iot-rules/stepfunction/custom-message/lambda/define_rule_name",
+        "env": {},
+        "event": {
+            "execution": "1234-5678",
+            "input": {"sql": SQL, "awsIotSqlVersion": "2016-03-23"},
+        },
+    },
+    "define_topicmsg_rule_name": {
+        "path": "test-iot-rules/stepfunction/topic-message/lambda/"
+        "define_topicmsg_rule_name",
+        "env": {},
+        "event": {
+            "execution": "1234-5678",
+            "input": {"sql": SQL, "awsIotSqlVersion": "2016-03-23"},
+        },
+    },
+    "create_get_message_rule": {
+        "path": "test-iot-rules/stepfunction/topic-message/lambda/"
+        "create_get_message_rule",
+        "env": RULE_ENV,
+        "event": {
+            "taskToken": "token",
+            "getMessageRuleName": "rule",
+            "input": {"sql": SQL, "awsIotSqlVersion": "2016-03-23"},
+        },
+        "responses": {"iot": {}, "stepfunctions": {}},
+    },
+    "create_ingest_rule": {
+        "path": f"{SHARED_LAMBDA_DIR}/create_ingest_rule",
+        "env": RULE_ENV,
+        "event": {
+            "ingestRuleName": "rule",
+            "input": {"sql": SQL, "awsIotSqlVersion": "2016-03-23"},
+        },
+        "responses": {"iot": {}},
+    },
+    "ingest_message": {
+        "path": f"{SHARED_LAMBDA_DIR}/ingest_message",
+        "env": {},
+        "event": {
+            "taskToken": "token",
+            "input": {"ingestRuleName": "rule", "message": {"temperature": 55}},
+        },
+        "responses": {"iot-data": {}},
+    },
+    "receive_message": {
+        "path": f"{SHARED_LAMBDA_DIR}/receive_message",
+        "env": {},
+        "event": {"temperature": 55, "sfnTaskToken": "token"},
+        "responses": {"stepfunctions": {}},
+    },
+    "delete_rule": {
+        "path": f"{SHARED_LAMBDA_DIR}/delete_rule",
+        "env": {},
+        "event": {"ingestRuleName": "rule", "result": {"temperature": 55}},
+        "responses": {"iot": {}},
+    },
+    "sweep_rules": {
+        "path": f"{SHARED_LAMBDA_DIR}/sweep_rules",
+        "env": {"RULE_POOL_TTL_SECONDS": "900"},
+        "event": {},
+        "responses": {"iot": {"list_topic_rules": {"rules": []}}},
+    },
+}
+
+
+def get_env(function, mode):
+    env = dict(os.environ)
+    env.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    env["POWERTOOLS_METRICS_NAMESPACE"] = "IotToolbox"
+    env["POWERTOOLS_SERVICE_NAME"] = "cold-start-benchmark"
+    env.update(function["env"])
+    env.update(MODES[mode])
+    return env
+
+
+def run_child(function, mode, importtime=False):
+    spec = {"event": function["event"], "responses": function.get("responses", {})}
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    command += [
+        RUNNER,
+        os.path.join(LIB_DIR, function["path"]),
+        LAYER_DIR,
+        json.dumps(spec),
+    ]
+    completed = subprocess.run(
+        command,
+        env=get_env(function, mode),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    for line in completed.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX) :]), completed.stderr
+    raise Exception(f"No result from {function['path']}:\n{completed.stderr}")
+
+
+def parse_importtime(stderr):
+    """Returns the cumulative import time [ms] of index.py's imports by package."""
+    breakdown = defaultdict(float)
+    children = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2 + 1
+        name = name.strip()
+        if depth == 1:
+            if name == "index":
+                for child_name, child_cumulative in children:
+                    breakdown[child_name.split(".")[0]] += child_cumulative / 1000
+                breakdown["total"] = int(cumulative) / 1000
+            children = []
+        elif depth == 2:
+            children.append((name, int(cumulative)))
+    return dict(breakdown)
+
+
+def measure(function, mode, runs):
+    samples = defaultdict(list)
+    for _ in range(runs):
+        result, _ = run_child(function, mode)
+        for metric in METRICS:
+            samples[metric].append(result[metric])
+    _, stderr = run_child(function, mode, importtime=True)
+
+    result = {metric: statistics.median(samples[metric]) for metric in METRICS}
+    result["imports_ms"] = parse_importtime(stderr)
+    return result
+
+
+def find_regressions(results, baseline, tolerance, min_delta_ms):
+    regressions = []
+    for name, modes in results.items():
+        for mode, result in modes.items():
+            previous = baseline.get(name, {}).get(mode)
+            if not previous:
+                continue
+            for metric in METRICS:
+                old, new = previous[metric], result[metric]
+                if new > old * (1 + tolerance) and new - old > min_delta_ms:
+                    regressions.append(
+                        f"{name} ({mode}) {metric}: {old:.1f} ms -> {new:.1f} ms"
+                    )
+    return regressions
+
+
+def print_results(results):
+    print(f"{'function':<28}{'mode':<10}{'init [ms]':>12}{'first invoke [ms]':>20}")
+    for name, modes in results.items():
+        for mode, result in modes.items():
+            print(
+                f"{name:<28}{mode:<10}{result['init_ms']:>12.1f}"
+                f"{result['first_invoke_ms']:>20.1f}"
+            )
+            imports = sorted(
+                (item for item in result["imports_ms"].items() if item[0] != "total"),
+                key=lambda item: -item[1],
+            )
+            print(
+                " " * 4
+                + ", ".join(f"{package} {ms:.1f}" for package, ms in imports[:5])
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--mode", choices=list(MODES), action="append")
+    parser.add_argument("--function", choices=list(FUNCTIONS), action="append")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--min-delta-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.function or FUNCTIONS:
+        results[name] = {
+            mode: measure(FUNCTIONS[name], mode, args.runs)
+            for mode in args.mode or MODES
+        }
+    print_results(results)
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nBaseline written to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print("\nNo baseline found, run with --update-baseline to create one")
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = find_regressions(results, baseline, args.tolerance, args.min_delta_ms)
+    if regressions:
+        print("\nRegressions:\n" + "\n".join(regressions))
+        sys.exit(1)
+    print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Compares execution waiters of invoke-stepfunction against a local stub.
+
+Usage: python benchmarks/bench_execution_waiter.py
+"""
+
+import os
+import sys
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(
+    0,
+    os.path.join(os.path.dirname(__file__), "../lib/api/lambda/invoke-stepfunction"),
+)
+
+from index import BackoffWaiter, ExecutionWaiter  # noqa: E402
+from stubs import StepFunctionsStub, VirtualClock  # noqa: E402
+
+EXECUTION_DURATIONS = [0.5, 1.5, 3, 10, 25]
+
+
+class FixedIntervalWaiter(ExecutionWaiter):
+    """The previous behaviour: poll every 100 ms."""
+
+    def __init__(self, sleep, interval=0.1):
+        self._sleep = sleep
+        self.interval = interval
+
+    def wait(self, sfn_client, execution_arn, timeout=None):
+        while True:
+            response = sfn_client.describe_execution(executionArn=execution_arn)
+            if response["status"] == "SUCCEEDED":
+                return response
+            self._sleep(self.interval)
+
+
+def run(name, create_waiter):
+    print(f"\n{name}")
+    print(f"{'duration [s]':>14}{'describe calls':>16}{'added latency [ms]':>20}")
+    for duration in EXECUTION_DURATIONS:
+        clock = VirtualClock()
+        stub = StepFunctionsStub(clock, duration)
+        execution_arn = stub.start_execution(stateMachineArn="arn", input="{}")[
+            "executionArn"
+        ]
+        create_waiter(clock).wait(stub, execution_arn)
+        added_latency = (clock() - stub.finished_at(execution_arn)) * 1000
+        print(f"{duration:>14}{stub.describe_calls:>16}{added_latency:>20.0f}")
+
+
+def main():
+    run("fixed 100 ms interval", lambda clock: FixedIntervalWaiter(clock.sleep))
+    run(
+        "backoff with jitter",
+        lambda clock: BackoffWaiter(sleep=clock.sleep, clock=clock),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Compares the latency of separate and fused rule tester stages.
+
+The stages run in-process with a stubbed IoT client. For separate stages the
+state is serialized to JSON between the stages, like Step Functions does
+between tasks. The Lambda invoke and state transition overhead can't be
+measured locally, it is added per task with --invoke-overhead-ms (a typical
+warm LambdaInvoke task adds 20-50 ms). Also reported is the number of
+distinct Lambda functions a request passes, each of them can cold start.
+
+Usage: python benchmarks/bench_fused_stages.py [--runs N] [--invoke-overhead-ms MS]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+LIB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../lib")
+sys.path[:0] = [
+    os.path.join(LIB_DIR, "test-iot-rules/stepfunction/shared/lambda"),
+    os.path.join(LIB_DIR, "common/python-layer/python"),
+]
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("POWERTOOLS_METRICS_NAMESPACE", "IotToolbox")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.update(
+    {
+        "TOOLBOX_IOT_RULE_PREFIX": "iottoolbox",
+        "RULE_POOL_TTL_SECONDS": "0",
+        "RECEIVE_MESSAGE_LAMBDA_ARN": "arn:aws:lambda:us-east-1:123456789012:function:r",
+        "PUBLISH_MESSAGE_ROLE_ARN": "arn:aws:iam::123456789012:role/publish",
+        "REPUBLISH_ERROR_TOPIC": "iottoolbox/error",
+    }
+)
+
+from fused_stages import index  # noqa: E402
+
+
+class StubIotClient:
+    def create_topic_rule(self, **kwargs):
+        return {}
+
+    def delete_topic_rule(self, **kwargs):
+        return {}
+
+
+INPUT = {
+    "sql": "SELECT temperature, upper(device) AS device FROM 'iot/test' "
+    "WHERE temperature > 50",
+    "awsIotSqlVersion": "2016-03-23",
+    "message": {"temperature": 55, "device": "sensor-1", "readings": [1] * 100},
+}
+
+# the stages of the custom message state machine that don't wait for a
+# callback, before and after the ingest step
+SEPARATE = ["define_rule_name", "create_ingest_rule", "delete_rule"]
+FUSED = ["prepare_custom_message", "delete_rule"]
+
+
+def hop(state):
+    return json.loads(json.dumps(state))
+
+
+def run_separate(execution):
+    state = hop(index.define_rule_name({"execution": execution, "input": INPUT}))
+    state["input"] = index.create_ingest_rule(hop(state))
+    state["result"] = {"temperature": 55}
+    return index.delete_rule({"input": hop(state)})
+
+
+def run_fused(execution):
+    state = hop(index.prepare_custom_message({"execution": execution, "input": INPUT}))
+    state["result"] = {"temperature": 55}
+    return index.delete_rule({"input": hop(state)})
+
+
+def measure(run, runs):
+    samples = []
+    for i in range(runs):
+        start = time.perf_counter()
+        run(f"{i:08d}-0000")
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=1000)
+    parser.add_argument("--invoke-overhead-ms", type=float, default=30.0)
+    args = parser.parse_args()
+
+    index.get_stage_module("create_ingest_rule")._iot_client = StubIotClient()
+    index.get_stage_module("delete_rule").iot_client = StubIotClient()
+
+    print(
+        f"median of {args.runs} runs, "
+        f"{args.invoke_overhead_ms:.0f} ms overhead per Lambda task"
+    )
+    print(
+        f"{'':>10}{'tasks':>8}{'functions':>11}{'compute [ms]':>15}"
+        f"{'modeled [ms]':>15}"
+    )
+    for name, run, tasks, functions in [
+        ("separate", run_separate, len(SEPARATE), len(SEPARATE)),
+        ("fused", run_fused, len(FUSED), 1),
+    ]:
+        compute = measure(run, args.runs)
+        modeled = compute + tasks * args.invoke_overhead_ms
+        print(f"{name:>10}{tasks:>8}{functions:>11}{compute:>15.3f}{modeled:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
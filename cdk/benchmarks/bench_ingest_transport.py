@@ -0,0 +1,120 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Compares publishing test messages over HTTPS and over a persistent MQTT 5
+connection (see iottoolbox/ingest_transport.py).
+
+"https" publishes with the iot-data client against a local Publish API
+stub, "mqtt" with the awscrt MQTT 5 client against a local broker stub.
+Both answer after --latency-ms, like the round trip to AWS IoT Core. Pass
+--broker host:port to publish to a real local broker, e.g. mosquitto,
+instead. Reported are the median latency of single publishes, like one
+message per ingest_message invocation, and the throughput of publishing
+--messages messages at once.
+
+Needs the awscrt package. Usage:
+python benchmarks/bench_ingest_transport.py [--messages N] [--runs N] [--latency-ms MS] [--broker HOST:PORT]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), "../lib/common/python-layer/python")
+)
+
+import boto3  # noqa: E402
+from iottoolbox.clients import get_config  # noqa: E402
+from iottoolbox.ingest_transport import (  # noqa: E402
+    CrtMqttConnection,
+    HttpsTransport,
+    MqttTransport,
+)
+from iottoolbox.serialization import dumps_bytes  # noqa: E402
+from stubs import IotDataPlaneStub, MqttBrokerStub  # noqa: E402
+
+
+def request(i):
+    return dict(
+        topic="$aws/rules/iottoolbox_ingest_bench",
+        qos=1,
+        payload=dumps_bytes({"temperature": i, "sfnTaskToken": "t" * 600}),
+        userProperties=[{"device": f"sensor-{i}"}],
+        contentType="application/json",
+    )
+
+
+def measure_latency(transport, runs):
+    samples = []
+    for i in range(runs):
+        start = time.perf_counter()
+        transport.publish(request(i))
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def measure_throughput(transport, messages):
+    requests = [request(i) for i in range(messages)]
+    start = time.perf_counter()
+    transport.publish_many(requests)
+    return messages / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--broker", help="host:port of a local MQTT 5 broker")
+    args = parser.parse_args()
+    latency = args.latency_ms / 1000
+
+    data_plane = IotDataPlaneStub(latency)
+    iot_data_client = boto3.client(
+        "iot-data",
+        endpoint_url=data_plane.endpoint_url,
+        region_name="us-east-1",
+        aws_access_key_id="bench",
+        aws_secret_access_key="bench",
+        config=get_config(),
+    )
+    https = HttpsTransport(iot_data_client)
+
+    broker = None
+    if args.broker:
+        host, port = args.broker.rsplit(":", 1)
+    else:
+        broker = MqttBrokerStub(latency)
+        host, port = "127.0.0.1", broker.port
+    start = time.perf_counter()
+    connection = CrtMqttConnection(host, int(port))
+    if not connection.wait_connected(5):
+        sys.exit(f"Could not connect to the MQTT broker at {host}:{port}")
+    connect_ms = (time.perf_counter() - start) * 1000
+    mqtt = MqttTransport(connection, https, publish_timeout=5)
+
+    print(
+        f"{args.latency_ms:.0f} ms round trip, MQTT connect {connect_ms:.1f} ms "
+        "(once per execution environment)"
+    )
+    print(f"{'':>6}{'latency [ms]':>15}{'messages/s':>15}")
+    for transport in [https, mqtt]:
+        # warm up connections and clients
+        transport.publish(request(0))
+        latency_ms = measure_latency(transport, args.runs)
+        throughput = measure_throughput(transport, args.messages)
+        print(f"{transport.name:>6}{latency_ms:>15.2f}{throughput:>15.0f}")
+    if mqtt.fallbacks:
+        print(f"{mqtt.fallbacks} MQTT publishes fell back to HTTPS")
+
+    connection.stop()
+    data_plane.stop()
+    if broker:
+        broker.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Measures the logging overhead per invocation in the full and summary
+log modes (see iottoolbox/log_budget.py).
+
+An invocation logs its event and the publish request, like ingest_message.
+Reported are the time per invocation and the bytes written to the log,
+which CloudWatch bills for ingestion.
+
+Usage: python benchmarks/bench_log_budget.py [runs]
+"""
+
+import io
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), "../lib/common/python-layer/python")
+)
+os.environ.setdefault("POWERTOOLS_SERVICE_NAME", "log-budget-benchmark")
+
+from aws_lambda_powertools import Logger  # noqa: E402
+from iottoolbox import log_budget  # noqa: E402
+from iottoolbox.serialization import dumps  # noqa: E402
+
+SIZES_KB = [1, 32, 128]
+
+
+def message(size_kb):
+    readings = [
+        {"sensor": f"sensor-{i}", "temperature": 20 + i % 10}
+        for i in range(size_kb * 1024 // 40)
+    ]
+    return {"device": "device-1", "readings": readings}
+
+
+def invocation(logger, payload):
+    event = {"input": {"message": payload}, "taskToken": "token" * 100}
+    log_budget.log_event(logger, event)
+    request = {"topic": "$aws/rules/rule", "qos": 1, "payload": dumps(payload)}
+    log_budget.log_payload(logger, "Publish message request", request, "request")
+
+
+def measure(logger, stream, mode, payload, runs):
+    log_budget.LOG_MODE = mode
+    stream.seek(0)
+    stream.truncate()
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        invocation(logger, payload)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), len(stream.getvalue()) / runs / 1024
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    stream = io.StringIO()
+    logger = Logger(stream=stream)
+    print(f"median of {runs} runs, log sample rate {log_budget.SAMPLE_RATE}")
+    print(f"{'message':>10}{'mode':>10}{'time [ms]':>12}{'logged [KB]':>14}")
+    for size_kb in SIZES_KB:
+        payload = message(size_kb)
+        for mode in ["full", "summary"]:
+            duration, logged = measure(logger, stream, mode, payload, runs)
+            print(f"{size_kb:>8}KB{mode:>10}{duration:>12.3f}{logged:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Compares the task token stripping of receive_message with the previous
+recursive implementation.
+
+Measures the time from the received event to the serialized output on a
+128 KB message, a deeply nested message and a message with a nested copy
+of the token. "recursive" is the previous behaviour: a recursive walk over
+all objects that copies the keys of every object, followed by serializing.
+It skips arrays, which is why it is faster on the nested token message, but
+leaves tokens in objects inside arrays.
+
+Usage: python benchmarks/bench_receive_message.py [runs]
+"""
+
+import json
+import os
+import statistics
+import sys
+import time
+
+LIB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../lib")
+sys.path[:0] = [
+    os.path.join(LIB_DIR, "test-iot-rules/stepfunction/shared/lambda"),
+    os.path.join(LIB_DIR, "common/python-layer/python"),
+]
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from receive_message.index import handle_event  # noqa: E402
+
+TOKEN = "AAAAKgAAAAIAAAAAAAAAA" * 20
+
+
+def recursive_remove_key_from_message(message, remove_key):
+    if isinstance(message, dict):
+        for key in list(message.keys()):
+            if key == remove_key:
+                del message[key]
+            else:
+                recursive_remove_key_from_message(message[key], remove_key)
+
+
+def recursive_handle_event(event):
+    event.pop("sfnTaskToken")
+    recursive_remove_key_from_message(event, "sfnTaskToken")
+    return json.dumps(event)
+
+
+class StubSfnClient:
+    def send_task_success(self, taskToken, output):
+        return {}
+
+
+def large_message():
+    readings = [
+        {"sensor": f"sensor-{i}", "temperature": 20 + i % 10, "tags": {"unit": "C"}}
+        for i in range(1900)
+    ]
+    return {"device": "device-1", "readings": readings, "sfnTaskToken": TOKEN}
+
+
+def deep_message():
+    message = inner = {"sfnTaskToken": TOKEN}
+    for i in range(400):
+        inner["level"] = {"index": i, "values": [1, 2, 3]}
+        inner = inner["level"]
+    return message
+
+
+def nested_token_message():
+    message = large_message()
+    message["copy"] = dict(message)
+    return message
+
+
+def measure(handler, message, runs):
+    serialized = json.dumps(message)
+    events = [json.loads(serialized) for _ in range(runs)]
+    samples = []
+    for event in events:
+        start = time.perf_counter()
+        handler(event)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    sfn_client = StubSfnClient()
+    print(f"median of {runs} runs")
+    print(f"{'message':>14}{'size [KB]':>11}{'recursive [ms]':>16}{'new [ms]':>10}")
+    for name, message in [
+        ("large", large_message()),
+        ("deep", deep_message()),
+        ("nested token", nested_token_message()),
+    ]:
+        size = len(json.dumps(message)) / 1024
+        recursive = measure(recursive_handle_event, message, runs)
+        new = measure(lambda event: handle_event(sfn_client, event), message, runs)
+        print(f"{name:>14}{size:>11.1f}{recursive:>16.3f}{new:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
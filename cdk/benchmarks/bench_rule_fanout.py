@@ -0,0 +1,73 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Measures the sustained rule tests per second when many tests create and
+delete their topic rules at once (see iottoolbox/rate_limit.py).
+
+Every test creates and deletes a rule against a local IoT stub that throttles
+calls above --max-tps. --concurrency tests run in parallel, like concurrent
+executions of the state machines. Compared are retrying throttled calls with
+backoff only and taking a token from a shared bucket before every call.
+Reported are the tests per second, the throttled calls and the failed tests.
+
+Usage: python benchmarks/bench_rule_fanout.py [--tests N] [--concurrency N] [--max-tps N]
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), "../lib/common/python-layer/python")
+)
+
+from iottoolbox.rate_limit import LocalTokenBucket, RateLimitedClient  # noqa: E402
+from stubs import IotControlPlaneStub  # noqa: E402
+
+
+def run_test(client, i):
+    try:
+        client.create_topic_rule(ruleName=f"rule{i}")
+        client.delete_topic_rule(ruleName=f"rule{i}")
+        return True
+    except Exception:
+        return False
+
+
+def measure(limiter, tests, concurrency, max_tps):
+    iot_client = IotControlPlaneStub(max_tps)
+    client = RateLimitedClient(iot_client, limiter)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        succeeded = sum(executor.map(lambda i: run_test(client, i), range(tests)))
+    duration = time.perf_counter() - start
+    return succeeded / duration, iot_client.throttled_calls, tests - succeeded
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--max-tps", type=int, default=50)
+    args = parser.parse_args()
+
+    print(
+        f"{args.tests} tests, concurrency {args.concurrency}, "
+        f"IoT limit {args.max_tps} TPS"
+    )
+    print(f"{'':>14}{'tests/s':>10}{'throttled':>12}{'failed':>8}")
+    limiters = {
+        "backoff only": None,
+        "token bucket": LocalTokenBucket(args.max_tps, burst=1),
+    }
+    for name, limiter in limiters.items():
+        rate, throttled, failed = measure(
+            limiter, args.tests, args.concurrency, args.max_tps
+        )
+        print(f"{name:>14}{rate:>10.1f}{throttled:>12}{failed:>8}")
+
+
+if __name__ == "__main__":
+    main()
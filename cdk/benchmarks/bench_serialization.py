@@ -0,0 +1,81 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Compares the JSON throughput of the standard library and iottoolbox's
+serialization module across payload sizes up to the 128 KB IoT limit.
+
+Without orjson installed, both rows use the standard library.
+
+Usage: python benchmarks/bench_serialization.py [seconds per measurement]
+"""
+
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), "../lib/common/python-layer/python")
+)
+
+from iottoolbox import serialization  # noqa: E402
+
+SIZES_KB = [1, 8, 32, 128]
+
+
+def payload(size_kb):
+    readings, size = [], 0
+    while size < size_kb * 1024:
+        reading = {
+            "sensor": f"sensor-{len(readings)}",
+            "temperature": 20.5 + len(readings) % 10,
+            "ok": True,
+            "tags": ["a", "b"],
+        }
+        readings.append(reading)
+        size += len(json.dumps(reading)) + 2
+    return {"device": "device-1", "readings": readings}
+
+
+def throughput(function, size, seconds):
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    runs = max(1, int(number * seconds / 0.2))
+    return size * runs / timer.timeit(runs) / 1024 / 1024
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 0.5
+    print(f"backend: {serialization.BACKEND}, throughput in MB/s")
+    print(f"{'size':>8}{'':>16}{'dumps':>10}{'dumps_bytes':>13}{'loads':>10}")
+    for size_kb in SIZES_KB:
+        obj = payload(size_kb)
+        encoded = json.dumps(obj)
+        size = len(encoded)
+        for name, dumps, dumps_bytes, loads in [
+            (
+                "json",
+                json.dumps,
+                lambda o: json.dumps(o).encode("utf-8"),
+                json.loads,
+            ),
+            (
+                "serialization",
+                serialization.dumps,
+                serialization.dumps_bytes,
+                serialization.loads,
+            ),
+        ]:
+            results = [
+                throughput(lambda: dumps(obj), size, seconds),
+                throughput(lambda: dumps_bytes(obj), size, seconds),
+                throughput(lambda: loads(encoded), size, seconds),
+            ]
+            print(
+                f"{size_kb:>6}KB{name:>16}"
+                f"{results[0]:>10.0f}{results[1]:>13.0f}{results[2]:>10.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Compares row-at-a-time and columnar evaluation of IoT SQL statements.
+
+Evaluates statements against synthetic sensor payloads, similar to a day of
+recorded traffic, and checks that both approaches return the same rows.
+
+Usage: python benchmarks/bench_sql_batch.py [number of payloads]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), "../lib/common/python-layer/python")
+)
+
+from iottoolbox.sql import parse  # noqa: E402
+from iottoolbox.sql_batch import evaluate_batch  # noqa: E402
+from iottoolbox.sql_eval import evaluate  # noqa: E402
+
+STATEMENTS = [
+    "SELECT * FROM 'sensors/+' WHERE temperature > 30",
+    "SELECT device, state.reported.battery AS battery FROM 'sensors/+' "
+    "WHERE state.reported.battery < 20 AND status = 'online'",
+    "SELECT device, temperature * 1.8 + 32 AS fahrenheit FROM 'sensors/+' "
+    "WHERE NOT (status = 'offline') OR readings[0] >= 90",
+    "SELECT upper(device) AS device FROM 'sensors/+' WHERE humidity > 95",
+]
+
+
+def create_payloads(count, seed=42):
+    rand = random.Random(seed)
+    payloads = []
+    for i in range(count):
+        payload = {
+            "device": f"device-{i % 500}",
+            "temperature": round(rand.uniform(-10, 40), 1),
+            "status": rand.choice(["online", "online", "online", "offline"]),
+            "readings": [rand.randint(0, 100) for _ in range(3)],
+            "state": {"reported": {"battery": rand.randint(0, 100)}},
+        }
+        if rand.random() < 0.5:
+            payload["humidity"] = rand.randint(0, 100)
+        payloads.append(payload)
+    return payloads
+
+
+def measure(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    payloads = create_payloads(count)
+    print(f"{count} payloads")
+    print(
+        f"{'matched':>10}{'row [s]':>10}{'columnar [s]':>14}{'speedup':>10}  statement"
+    )
+    for sql in STATEMENTS:
+        statement = parse(sql)
+        rows, row_seconds = measure(lambda: [evaluate(statement, p) for p in payloads])
+        result, batch_seconds = measure(lambda: evaluate_batch(statement, payloads))
+        if rows != result.rows:
+            raise Exception(f"Results differ for {sql}")
+        matched = sum(result.mask)
+        speedup = row_seconds / batch_seconds
+        print(
+            f"{matched:>10}{row_seconds:>10.2f}{batch_seconds:>14.2f}{speedup:>10.1f}"
+            f"  {sql}"
+        )
+
+
+if __name__ == "__main__":
+    main()
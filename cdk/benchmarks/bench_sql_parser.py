@@ -0,0 +1,78 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Compares the IoT SQL parser with the previous regex based splitting.
+
+Reports how many statements of the test corpus each approach splits
+correctly and the time per statement, with and without memoization.
+
+Usage: python benchmarks/bench_sql_parser.py
+"""
+
+import json
+import os
+import re
+import sys
+import timeit
+
+LAYER_PATH = os.path.join(
+    os.path.dirname(__file__), "../lib/common/python-layer/python"
+)
+sys.path.insert(0, LAYER_PATH)
+
+from iottoolbox.sql import get_select_sql, get_where_sql, parse  # noqa: E402
+
+ITERATIONS = 2000
+
+with open(os.path.join(LAYER_PATH, "iottoolbox/testdata/sql_corpus.json")) as f:
+    CORPUS = [case for case in json.load(f) if case.get("valid", True)]
+
+
+def regex_split(input_sql):
+    """The previous behaviour of create_ingest_sql."""
+    where_str = None
+    select_str = None
+    if re.search("WHERE", input_sql, flags=re.IGNORECASE):
+        where_str = re.split("WHERE", input_sql, flags=re.IGNORECASE)[-1]
+    if re.search("^SELECT", input_sql, flags=re.IGNORECASE):
+        head = re.split("WHERE", input_sql, flags=re.IGNORECASE)[0]
+        select_str = re.split("^SELECT", head if where_str else input_sql, flags=re.I)[
+            -1
+        ]
+    if select_str and re.search("FROM", select_str, flags=re.IGNORECASE):
+        select_str = re.split("FROM", select_str, flags=re.IGNORECASE)[0]
+    return (
+        select_str.strip() if select_str else None,
+        where_str.strip() if where_str else None,
+    )
+
+
+def parser_split(input_sql, parse_function=parse):
+    statement = parse_function(input_sql)
+    return get_select_sql(input_sql, statement), get_where_sql(input_sql, statement)
+
+
+def cold_parser_split(input_sql):
+    return parser_split(input_sql, parse.__wrapped__)
+
+
+def run(name, split):
+    correct = sum(
+        split(case["sql"]) == (case["select"], case.get("where")) for case in CORPUS
+    )
+    seconds = timeit.timeit(
+        lambda: [split(case["sql"]) for case in CORPUS], number=ITERATIONS
+    )
+    per_statement = seconds / (ITERATIONS * len(CORPUS)) * 1e6
+    print(f"{name:>20}{correct:>10}/{len(CORPUS)}{per_statement:>18.1f}")
+
+
+def main():
+    print(f"{'':>20}{'correct':>13}{'us per statement':>18}")
+    run("regex split", regex_split)
+    run("parser, cold", cold_parser_split)
+    run("parser, memoized", parser_split)
+
+
+if __name__ == "__main__":
+    main()
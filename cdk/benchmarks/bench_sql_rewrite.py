@@ -0,0 +1,120 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Compares the getMessage rule rewrite of create_get_message_rule with the
+previous implementation.
+
+"chained replace" is the previous behaviour: the whole wrapper statement is
+rebuilt with two replace() calls per test and always captures all message
+properties. The template rewrite caches the statement per topic filter and
+property set and only inserts the task token. Also reports the size of the
+captured properties carried through the later stages for a message that
+sets all of them.
+
+Usage: python benchmarks/bench_sql_rewrite.py
+"""
+
+import json
+import os
+import sys
+import timeit
+
+LIB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../lib")
+LAYER_PATH = os.path.join(LIB_DIR, "common/python-layer/python")
+sys.path[:0] = [
+    os.path.join(LIB_DIR, "test-iot-rules/stepfunction/topic-message/lambda"),
+    LAYER_PATH,
+]
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from create_get_message_rule.index import (  # noqa: E402
+    create_wrapper_sql,
+    get_capture_properties,
+    logger,
+    parse_input_sql,
+)
+from iottoolbox.message_cache import MQTT_PROPERTIES, USER_PROPERTIES  # noqa: E402
+
+ITERATIONS = 2000
+TOKEN = "AAAAKgAAAAIAAAAAAAAAA" * 20
+
+STATEMENTS = [
+    "SELECT * FROM 'device/+/telemetry'",
+    "SELECT temperature, humidity FROM 'device/+/telemetry' WHERE temperature > 30",
+    "SELECT get_mqtt_property('content_type') AS type FROM 'device/+/status'",
+    "SELECT *, get_user_properties('tenant') AS tenant FROM 'tenant/#' "
+    "WHERE get_mqtt_property('response_topic') <> ''",
+]
+
+PROPERTIES = {
+    "userProperties": [{"tenant": "tenant-1"}, {"site": "site-42"}],
+    "mqttProperties": {
+        "contentType": "application/json",
+        "payloadFormatIndicator": "UTF8_DATA",
+        "responseTopic": "device/device-1/response",
+        "correlationData": "Y29ycmVsYXRpb24tZGF0YQ==",
+    },
+}
+
+
+def chained_replace_sql(input_sql, task_token):
+    """The previous behaviour of create_wrapper_sql."""
+    from_str, select_str_exists = parse_input_sql(input_sql)
+
+    new_sql = """SELECT {
+            'message': *,
+            'sfnTaskToken': '##TASKTOKEN##',
+            'properties': {
+                'userProperties': get_user_properties(),
+                'mqttProperties': {
+                    'contentType': get_mqtt_property('content_type'),
+                    'payloadFormatIndicator': get_mqtt_property('format_indicator'),
+                    'responseTopic': get_mqtt_property('response_topic'),
+                    'correlationData': get_mqtt_property('correlation_data'),
+                }
+            }
+        }
+        FROM '##FROM##'
+        """.replace("##TASKTOKEN##", task_token).replace("##FROM##", from_str.strip())
+    logger.info("Updated SQL", extra={"new_sql": new_sql})
+    return new_sql
+
+
+def captured_properties(input_sql):
+    properties = get_capture_properties(input_sql)
+    return {
+        "userProperties": (
+            PROPERTIES["userProperties"] if USER_PROPERTIES in properties else []
+        ),
+        "mqttProperties": {
+            key: PROPERTIES["mqttProperties"][key]
+            for name, key in MQTT_PROPERTIES.items()
+            if name in properties
+        },
+    }
+
+
+def run(name, rewrite):
+    seconds = timeit.timeit(
+        lambda: [rewrite(sql, TOKEN) for sql in STATEMENTS], number=ITERATIONS
+    )
+    per_statement = seconds / (ITERATIONS * len(STATEMENTS)) * 1e6
+    print(f"{name:>20}{per_statement:>18.1f}")
+
+
+def main():
+    print(f"{'':>20}{'us per statement':>18}")
+    run("chained replace", chained_replace_sql)
+    run("template", create_wrapper_sql)
+
+    print()
+    print(f"{'statement':>10}{'all properties [B]':>20}{'captured [B]':>14}")
+    for i, sql in enumerate(STATEMENTS):
+        full = len(json.dumps(PROPERTIES))
+        trimmed = len(json.dumps(captured_properties(sql)))
+        print(f"{i:>10}{full:>20}{trimmed:>14}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Compares the latency of rejecting a malformed statement in
+invoke-stepfunction with the previous path through the state machine.
+
+"state machine" is the previous behaviour: the execution is started, the
+rule name is defined, create_ingest_rule fails to parse the statement and
+delete_rule reports the SqlParseException, then the waiter picks up the
+result. The stages run in-process with a stubbed IoT client, the Lambda
+invoke and state transition overhead is added per task with
+--invoke-overhead-ms and the polling latency of the waiter is simulated on
+a virtual clock. "validation" rejects the statement in handle_event before
+starting an execution, "cached" is a repeated submission of the same
+statement.
+
+Usage: python benchmarks/bench_sql_validation.py [--runs N] [--invoke-overhead-ms MS]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+LIB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../lib")
+sys.path[:0] = [
+    os.path.join(LIB_DIR, "api/lambda/invoke-stepfunction"),
+    os.path.join(LIB_DIR, "test-iot-rules/stepfunction/shared/lambda"),
+    os.path.join(LIB_DIR, "common/python-layer/python"),
+]
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("POWERTOOLS_METRICS_NAMESPACE", "IotToolbox")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.update(
+    {
+        "TOOLBOX_IOT_RULE_PREFIX": "iottoolbox",
+        "RULE_POOL_TTL_SECONDS": "0",
+        "RECEIVE_MESSAGE_LAMBDA_ARN": "arn:aws:lambda:us-east-1:123456789012:function:r",
+        "PUBLISH_MESSAGE_ROLE_ARN": "arn:aws:iam::123456789012:role/publish",
+        "REPUBLISH_ERROR_TOPIC": "iottoolbox/error",
+    }
+)
+
+import index as invoke  # noqa: E402
+from fused_stages import index as stages  # noqa: E402
+from iottoolbox.sql import validate  # noqa: E402
+from stubs import StepFunctionsStub, VirtualClock  # noqa: E402
+
+# the define rule name, create ingest rule and delete rule tasks
+TASKS = 3
+
+
+class StubIotClient:
+    def create_topic_rule(self, **kwargs):
+        return {}
+
+    def delete_topic_rule(self, **kwargs):
+        return {}
+
+
+def request(i):
+    # a distinct statement per run, so validation can't hit the cache
+    return {
+        "sql": f"SELECT temperature, humidity AS h{i} FROM 'iot/test' "
+        "WHERE temperature > AND humidity < 80",
+        "awsIotSqlVersion": "2016-03-23",
+        "message": {"temperature": 55, "humidity": 20},
+    }
+
+
+def hop(state):
+    return json.loads(json.dumps(state))
+
+
+def run_state_machine(i):
+    state = hop(stages.define_rule_name({"execution": f"{i:08d}", "input": request(i)}))
+    try:
+        stages.create_ingest_rule(hop(state))
+    except Exception as e:
+        state["error"] = {"Error": e.__class__.__name__}
+    return stages.delete_rule({"input": hop(state)})
+
+
+def run_validation(i):
+    return invoke.handle_event(request(i), None, "custom", "topic", "batch")
+
+
+def run_cached(i):
+    return invoke.handle_event(request(0), None, "custom", "topic", "batch")
+
+
+def measure(run, runs):
+    samples = []
+    for i in range(runs):
+        start = time.perf_counter()
+        run(i)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def polling_latency(duration):
+    """Time from the end of the execution until the waiter returns, in ms."""
+    clock = VirtualClock()
+    stub = StepFunctionsStub(clock, duration)
+    execution_arn = stub.start_execution(stateMachineArn="arn", input="{}")[
+        "executionArn"
+    ]
+    invoke.BackoffWaiter(sleep=clock.sleep, clock=clock).wait(stub, execution_arn)
+    return (clock() - stub.finished_at(execution_arn)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=1000)
+    parser.add_argument("--invoke-overhead-ms", type=float, default=30.0)
+    args = parser.parse_args()
+
+    stages.get_stage_module("create_ingest_rule")._iot_client = StubIotClient()
+    stages.get_stage_module("delete_rule").iot_client = StubIotClient()
+    validate(request(0)["sql"], "2016-03-23")
+
+    print(
+        f"median of {args.runs} runs, "
+        f"{args.invoke_overhead_ms:.0f} ms overhead per Lambda task"
+    )
+    print(f"{'':>14}{'compute [ms]':>15}{'modeled [ms]':>15}")
+    compute = measure(run_state_machine, args.runs)
+    execution = compute + TASKS * args.invoke_overhead_ms
+    modeled = execution + polling_latency(execution / 1000)
+    print(f"{'state machine':>14}{compute:>15.3f}{modeled:>15.1f}")
+    for name, run in [("validation", run_validation), ("cached", run_cached)]:
+        compute = measure(run, args.runs)
+        print(f"{name:>14}{compute:>15.3f}{compute:>15.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Child process of bench_cold_start.py, measures one cold start.
+
+Imports a Lambda function's index.py with stubbed AWS clients and invokes
+its handler once. Deliberately only uses the standard library before the
+measured import, so nothing is preloaded on behalf of the function.
+
+Usage: python benchmarks/cold_start_runner.py <lambda dir> <layer dir> <spec>
+"""
+
+import json
+import sys
+import time
+
+RESULT_PREFIX = "COLD_START_RESULT "
+
+
+class StubPaginator:
+    def __init__(self, response):
+        self.response = response
+
+    def paginate(self, **kwargs):
+        return [self.response]
+
+
+class StubClient:
+    """Returns the configured response for every call of an operation."""
+
+    def __init__(self, responses):
+        self.responses = responses
+
+    def get_paginator(self, operation_name):
+        return StubPaginator(self.responses.get(operation_name, {}))
+
+    def __getattr__(self, name):
+        return lambda **kwargs: self.responses.get(name, {})
+
+
+class LambdaContext:
+    function_name = "cold-start-benchmark"
+    function_version = "$LATEST"
+    memory_limit_in_mb = 128
+    invoked_function_arn = (
+        "arn:aws:lambda:us-east-1:123456789012:function:cold-start-benchmark"
+    )
+    aws_request_id = "00000000-0000-0000-0000-000000000000"
+
+    def get_remaining_time_in_millis(self):
+        return 30000
+
+
+def main():
+    lambda_dir, layer_dir, spec = sys.argv[1], sys.argv[2], json.loads(sys.argv[3])
+    sys.path[:0] = [lambda_dir, layer_dir]
+
+    from iottoolbox import clients
+
+    for service_name, responses in spec.get("responses", {}).items():
+        clients._clients[service_name] = StubClient(responses)
+
+    start = time.perf_counter()
+    import index
+
+    initialized = time.perf_counter()
+    index.lambda_handler(spec["event"], LambdaContext())
+    invoked = time.perf_counter()
+
+    result = {
+        "init_ms": (initialized - start) * 1000,
+        "first_invoke_ms": (invoked - initialized) * 1000,
+    }
+    print(RESULT_PREFIX + json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Local stand-ins for AWS services used by the benchmarks."""
+
+import itertools
+import json
+import socket
+import socketserver
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from botocore.exceptions import ClientError
+
+
+class VirtualClock:
+    """Deterministic clock so benchmarks don't need to sleep for real."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class StepFunctionsStub:
+    """Minimal Step Functions client whose executions finish after a fixed time.
+
+    Every DescribeExecution call is counted. If ``max_tps`` is set, calls
+    exceeding that rate within one second of virtual time are throttled.
+    """
+
+    def __init__(self, clock, duration, output="{}", max_tps=None):
+        self.clock = clock
+        self.duration = duration
+        self.output = output
+        self.max_tps = max_tps
+        self.describe_calls = 0
+        self.throttled_calls = 0
+        self._executions = {}
+        self._ids = itertools.count()
+        self._window = (None, 0)
+
+    def start_execution(self, stateMachineArn, input):
+        execution_arn = f"{stateMachineArn}:execution:{next(self._ids)}"
+        self._executions[execution_arn] = self.clock() + self.duration
+        return {"executionArn": execution_arn}
+
+    def finished_at(self, execution_arn):
+        return self._executions[execution_arn]
+
+    def describe_execution(self, executionArn):
+        self.describe_calls += 1
+        if self.max_tps is not None:
+            second = int(self.clock())
+            window_second, calls = self._window
+            calls = calls + 1 if window_second == second else 1
+            self._window = (second, calls)
+            if calls > self.max_tps:
+                self.throttled_calls += 1
+                raise ClientError(
+                    {"Error": {"Code": "ThrottlingException"}}, "DescribeExecution"
+                )
+
+        if self.clock() >= self._executions[executionArn]:
+            return {"status": "SUCCEEDED", "output": self.output}
+        return {"status": "RUNNING"}
+
+
+class IotControlPlaneStub:
+    """IoT client whose topic rule operations are throttled above ``max_tps``
+    calls per second of wall clock time, like the account-wide limits."""
+
+    def __init__(self, max_tps, latency=0.02):
+        self.max_tps = max_tps
+        self.latency = latency
+        self.calls = 0
+        self.throttled_calls = 0
+        self._window = (None, 0)
+        self._lock = threading.Lock()
+
+    def _call(self, operation):
+        with self._lock:
+            second = int(time.monotonic())
+            window_second, calls = self._window
+            calls = calls + 1 if window_second == second else 1
+            self._window = (second, calls)
+            if calls > self.max_tps:
+                self.throttled_calls += 1
+                raise ClientError({"Error": {"Code": "ThrottlingException"}}, operation)
+            self.calls += 1
+        time.sleep(self.latency)
+        return {}
+
+    def create_topic_rule(self, **kwargs):
+        return self._call("CreateTopicRule")
+
+    def delete_topic_rule(self, **kwargs):
+        return self._call("DeleteTopicRule")
+
+
+def _read_exactly(sock, n):
+    data = b""
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        data += chunk
+    return data
+
+
+def _read_varint(read):
+    value, shift = 0, 0
+    while True:
+        byte = read(1)[0]
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value
+        shift += 7
+
+
+def _decode_varint(data, offset):
+    value, shift = 0, 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+
+class MqttBrokerStub:
+    """MQTT 5 broker on localhost that accepts every client and acknowledges
+    QoS 1 publishes after ``latency`` seconds, like a network round trip.
+
+    Only CONNECT, PUBLISH, PINGREQ and DISCONNECT are supported. Received
+    publishes are counted and their raw properties kept for the last one.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.publishes = 0
+        self.last_properties = b""
+        self._lock = threading.Lock()
+        broker = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                broker._serve(self.request)
+
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def _serve(self, sock):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        write_lock = threading.Lock()
+
+        def send(data):
+            with write_lock:
+                sock.sendall(data)
+
+        try:
+            while True:
+                header = _read_exactly(sock, 1)[0]
+                body = _read_exactly(
+                    sock, _read_varint(lambda n: _read_exactly(sock, n))
+                )
+                packet_type = header >> 4
+                if packet_type == 1:  # CONNECT
+                    send(bytes([0x20, 0x03, 0x00, 0x00, 0x00]))
+                elif packet_type == 3:  # PUBLISH
+                    self._receive_publish(header, body, send)
+                elif packet_type == 12:  # PINGREQ
+                    send(bytes([0xD0, 0x00]))
+                elif packet_type == 14:  # DISCONNECT
+                    return
+        except (ConnectionError, OSError):
+            return
+
+    def _receive_publish(self, header, body, send):
+        qos = (header >> 1) & 0x03
+        (topic_length,) = struct.unpack_from("!H", body)
+        offset = 2 + topic_length
+        packet_id = None
+        if qos:
+            packet_id = body[offset : offset + 2]
+            offset += 2
+        properties_length, offset = _decode_varint(body, offset)
+        with self._lock:
+            self.publishes += 1
+            self.last_properties = body[offset : offset + properties_length]
+        if packet_id is not None:
+            puback = bytes([0x40, 0x02]) + packet_id
+            if self.latency:
+                threading.Timer(self.latency, send, [puback]).start()
+            else:
+                send(puback)
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class IotDataPlaneStub:
+    """HTTP endpoint on localhost answering Publish API calls of the iot-data
+    client after ``latency`` seconds. Connections are kept alive, like the
+    pooled HTTPS connections of boto3."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.publishes = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body are written separately
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                stub.publishes += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                body = json.dumps({}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.endpoint_url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
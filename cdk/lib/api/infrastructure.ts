@@ -9,15 +9,23 @@ import * as lambda from 'aws-cdk-lib/aws-lambda'
 import * as iam from 'aws-cdk-lib/aws-iam'
 import * as apigateway from 'aws-cdk-lib/aws-apigateway'
 import * as logs from 'aws-cdk-lib/aws-logs'
+import * as dynamodb from 'aws-cdk-lib/aws-dynamodb'
+import * as events from 'aws-cdk-lib/aws-events'
+import * as targets from 'aws-cdk-lib/aws-events-targets'
+import { RemovalPolicy } from 'aws-cdk-lib'
+import { TableEncryption } from 'aws-cdk-lib/aws-dynamodb'
 import { RetentionDays } from 'aws-cdk-lib/aws-logs'
 import { ToolboxLambdaFunction } from '../common/toolbox-lambda-function'
-import { customMessageRequestSchema, topicMessageRequestSchema } from './schemas'
+import { batchMessageRequestSchema, customMessageRequestSchema, topicMessageRequestSchema } from './schemas'
 import { WafConstruct } from '../common/waf'
+import { TOOLBOX_CLAIM_CHECK_THRESHOLD, TOOLBOX_RESULT_CACHE_TTL_SECONDS, TOOLBOX_RESULT_TTL_SECONDS } from '../constants'
 import path = require('path');
 
 export interface ApiConstructProps {
   stepfunctionTopicMessage: cdk.aws_stepfunctions.StateMachine;
   stepfunctionCustomMessage: cdk.aws_stepfunctions.StateMachine;
+  stepfunctionBatchMessage: cdk.aws_stepfunctions.StateMachine;
+  claimCheckBucket: cdk.aws_s3.Bucket;
   startRecordingFunction: cdk.aws_lambda.Function;
   stopRecordingFunction: cdk.aws_lambda.Function;
   listRecordingsFunction: cdk.aws_lambda.Function;
@@ -38,6 +46,30 @@ export class ApiConstruct extends Construct {
   constructor (scope: Construct, id: string, props: ApiConstructProps) {
     super(scope, id)
 
+    // results of asynchronous rule tests, polled instead of DescribeExecution
+    const resultsTable = new dynamodb.Table(this, 'ResultsTable', {
+      partitionKey: {
+        name: 'executionId',
+        type: dynamodb.AttributeType.STRING
+      },
+      timeToLiveAttribute: 'expiresAt',
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      removalPolicy: RemovalPolicy.DESTROY,
+      encryption: TableEncryption.AWS_MANAGED
+    })
+
+    // results of identical custom and batch message tests, shared by all containers
+    const resultCacheTable = new dynamodb.Table(this, 'ResultCacheTable', {
+      partitionKey: {
+        name: 'requestKey',
+        type: dynamodb.AttributeType.STRING
+      },
+      timeToLiveAttribute: 'expiresAt',
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      removalPolicy: RemovalPolicy.DESTROY,
+      encryption: TableEncryption.AWS_MANAGED
+    })
+
     const invokeStepFunction = ToolboxLambdaFunction.Python(this, 'invokeStepFunction', {
       code: lambda.Code.fromAsset(
         path.join(__dirname, 'lambda/invoke-stepfunction')
@@ -46,10 +78,25 @@ export class ApiConstruct extends Construct {
         SFN_CUSTOM_MESSAGE_ARN:
         props.stepfunctionCustomMessage.stateMachineArn,
         SFN_TOPIC_MESSAGE_ARN:
-        props.stepfunctionTopicMessage.stateMachineArn
+        props.stepfunctionTopicMessage.stateMachineArn,
+        SFN_BATCH_MESSAGE_ARN:
+        props.stepfunctionBatchMessage.stateMachineArn,
+        RESULTS_TABLE: resultsTable.tableName,
+        TOOLBOX_RESULT_TTL_SECONDS: `${TOOLBOX_RESULT_TTL_SECONDS}`,
+        CLAIM_CHECK_BUCKET: props.claimCheckBucket.bucketName,
+        TOOLBOX_CLAIM_CHECK_THRESHOLD: `${TOOLBOX_CLAIM_CHECK_THRESHOLD}`,
+        TOOLBOX_RESULT_CACHE: 'dynamodb',
+        RESULT_CACHE_TABLE: resultCacheTable.tableName,
+        TOOLBOX_RESULT_CACHE_TTL_SECONDS: `${TOOLBOX_RESULT_CACHE_TTL_SECONDS}`
       },
       timeout: cdk.Duration.seconds(29)
     })
+    invokeStepFunction.addToRolePolicy(
+      new iam.PolicyStatement({
+        resources: [props.claimCheckBucket.arnForObjects('*')],
+        actions: ['s3:PutObject', 's3:GetObject']
+      })
+    )
 
     props.stepfunctionCustomMessage.grantStartExecution(invokeStepFunction)
     props.stepfunctionCustomMessage.grantRead(invokeStepFunction)
@@ -57,6 +104,62 @@ export class ApiConstruct extends Construct {
     props.stepfunctionTopicMessage.grantStartExecution(invokeStepFunction)
     props.stepfunctionTopicMessage.grantRead(invokeStepFunction)
 
+    props.stepfunctionBatchMessage.grantStartExecution(invokeStepFunction)
+    props.stepfunctionBatchMessage.grantRead(invokeStepFunction)
+
+    resultsTable.grantWriteData(invokeStepFunction)
+    resultCacheTable.grantReadWriteData(invokeStepFunction)
+
+    const stateMachines = [
+      props.stepfunctionCustomMessage,
+      props.stepfunctionTopicMessage,
+      props.stepfunctionBatchMessage
+    ]
+
+    const storeTestResult = ToolboxLambdaFunction.Python(this, 'storeTestResult', {
+      code: lambda.Code.fromAsset(
+        path.join(__dirname, 'lambda/store_test_result')
+      ),
+      environment: {
+        RESULTS_TABLE: resultsTable.tableName,
+        TOOLBOX_RESULT_TTL_SECONDS: `${TOOLBOX_RESULT_TTL_SECONDS}`
+      }
+    })
+    resultsTable.grantWriteData(storeTestResult)
+    stateMachines.forEach(s => s.grantRead(storeTestResult))
+
+    // only asynchronous executions are polled, they are named with the
+    // ASYNC_EXECUTION_PREFIX of iottoolbox/execution_results.py
+    new events.Rule(this, 'TestResultRule', {
+      eventPattern: {
+        source: ['aws.states'],
+        detailType: ['Step Functions Execution Status Change'],
+        detail: {
+          stateMachineArn: stateMachines.map(s => s.stateMachineArn),
+          name: events.Match.prefix('async-'),
+          status: ['SUCCEEDED', 'FAILED', 'TIMED_OUT', 'ABORTED']
+        }
+      },
+      targets: [new targets.LambdaFunction(storeTestResult)]
+    })
+
+    const getTestResult = ToolboxLambdaFunction.Python(this, 'getTestResult', {
+      code: lambda.Code.fromAsset(
+        path.join(__dirname, 'lambda/get_test_result')
+      ),
+      environment: {
+        RESULTS_TABLE: resultsTable.tableName,
+        CLAIM_CHECK_BUCKET: props.claimCheckBucket.bucketName
+      }
+    })
+    resultsTable.grantReadData(getTestResult)
+    getTestResult.addToRolePolicy(
+      new iam.PolicyStatement({
+        resources: [props.claimCheckBucket.arnForObjects('*')],
+        actions: ['s3:GetObject']
+      })
+    )
+
     const apiGWInvokeStepfunctionRole = new iam.Role(this, 'DeleteRecordingsRole', {
       assumedBy: new iam.ServicePrincipal('apigateway.amazonaws.com')
     })
@@ -101,6 +204,8 @@ export class ApiConstruct extends Construct {
 
     const topicMessageModel = restApi.addModel('TopicMessageModel', topicMessageRequestSchema)
 
+    const batchMessageModel = restApi.addModel('BatchMessageModel', batchMessageRequestSchema)
+
     const startRecordModel = restApi.addModel('StartRecordModel', {
       contentType: 'application/json',
       modelName: 'StartRecordModel',
@@ -177,6 +282,8 @@ export class ApiConstruct extends Construct {
     const testRules = restApi.root.addResource('test-iot-rule')
     const customMessage = testRules.addResource('custom-message')
     const topicMessage = testRules.addResource('topic-message')
+    const batchMessage = testRules.addResource('batch-message')
+    const testResult = testRules.addResource('results').addResource('{executionId}')
 
     const records = restApi.root.addResource('record')
     const startRecording = records.addResource('start')
@@ -503,6 +610,50 @@ export class ApiConstruct extends Construct {
       }
     )
 
+    const integrationTestResult = new apigateway.LambdaIntegration(
+      getTestResult,
+      {
+        proxy: false,
+        allowTestInvoke: true,
+        requestTemplates: {
+          'application/json': JSON.stringify({
+            executionId: "$util.escapeJavaScript($input.params('executionId'))"
+          })
+        },
+        integrationResponses: [
+          {
+            statusCode: '200',
+            responseTemplates: {
+              'application/json': '$input.body'
+            },
+            responseParameters: {
+              'method.response.header.Content-Type': "'application/json'",
+              'method.response.header.Access-Control-Allow-Origin': "'*'",
+              'method.response.header.Access-Control-Allow-Credentials':
+                "'true'"
+            }
+          },
+          {
+            selectionPattern: '(\n|.)+',
+            statusCode: '400',
+            responseTemplates: {
+              'application/json': JSON.stringify({
+                state: 'error',
+                message:
+                  "$util.escapeJavaScript($input.path('$.errorMessage'))"
+              })
+            },
+            responseParameters: {
+              'method.response.header.Content-Type': "'application/json'",
+              'method.response.header.Access-Control-Allow-Origin': "'*'",
+              'method.response.header.Access-Control-Allow-Credentials':
+                "'true'"
+            }
+          }
+        ]
+      }
+    )
+
     const integrationTopicMessage = new apigateway.LambdaIntegration(
       invokeStepFunction,
       {
@@ -542,6 +693,45 @@ export class ApiConstruct extends Construct {
       }
     )
 
+    const integrationBatchMessage = new apigateway.LambdaIntegration(
+      invokeStepFunction,
+      {
+        proxy: false,
+        allowTestInvoke: true,
+        integrationResponses: [
+          {
+            statusCode: '200',
+            responseTemplates: {
+              'application/json': '$input.body'
+            },
+            responseParameters: {
+              'method.response.header.Content-Type': "'application/json'",
+              'method.response.header.Access-Control-Allow-Origin': "'*'",
+              'method.response.header.Access-Control-Allow-Credentials':
+                "'true'"
+            }
+          },
+          {
+            selectionPattern: '(\n|.)+',
+            statusCode: '400',
+            responseTemplates: {
+              'application/json': JSON.stringify({
+                state: 'error',
+                message:
+                  "$util.escapeJavaScript($input.path('$.errorMessage'))"
+              })
+            },
+            responseParameters: {
+              'method.response.header.Content-Type': "'application/json'",
+              'method.response.header.Access-Control-Allow-Origin': "'*'",
+              'method.response.header.Access-Control-Allow-Credentials':
+                "'true'"
+            }
+          }
+        ]
+      }
+    )
+
     records.addMethod(
       'GET',
       integrationListRecordings,
@@ -795,6 +985,64 @@ export class ApiConstruct extends Construct {
       }
     )
 
+    batchMessage.addMethod(
+      'POST',
+      integrationBatchMessage,
+      {
+        requestModels: {
+          'application/json': batchMessageModel
+        },
+
+        methodResponses: [
+          {
+            statusCode: '200',
+            responseParameters: {
+              'method.response.header.Content-Type': true,
+              'method.response.header.Access-Control-Allow-Origin': true,
+              'method.response.header.Access-Control-Allow-Credentials': true
+            }
+          },
+          {
+            statusCode: '400',
+            responseParameters: {
+              'method.response.header.Content-Type': true,
+              'method.response.header.Access-Control-Allow-Origin': true,
+              'method.response.header.Access-Control-Allow-Credentials': true
+            }
+          }
+        ]
+      }
+    )
+
+    testResult.addMethod(
+      'GET',
+      integrationTestResult,
+      {
+        requestParameters: {
+          'method.request.path.executionId': true
+        },
+
+        methodResponses: [
+          {
+            statusCode: '200',
+            responseParameters: {
+              'method.response.header.Content-Type': true,
+              'method.response.header.Access-Control-Allow-Origin': true,
+              'method.response.header.Access-Control-Allow-Credentials': true
+            }
+          },
+          {
+            statusCode: '400',
+            responseParameters: {
+              'method.response.header.Content-Type': true,
+              'method.response.header.Access-Control-Allow-Origin': true,
+              'method.response.header.Access-Control-Allow-Credentials': true
+            }
+          }
+        ]
+      }
+    )
+
     if (props.waf) {
       props.waf.addAclAssociation('ApiGateway', restApi.deploymentStage.stageArn)
     }
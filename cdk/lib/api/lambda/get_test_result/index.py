@@ -0,0 +1,56 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import os
+from typing import Dict
+
+from aws_lambda_powertools import Logger
+from iottoolbox.claim_check import resolve_all
+from iottoolbox.clients import lazy_client
+from iottoolbox.execution_results import get_result
+from iottoolbox.log_budget import log_event
+
+logger = Logger()
+
+_dynamodb_client = lazy_client("dynamodb")
+_s3_client = lazy_client("s3")
+RESULTS_TABLE = os.getenv("RESULTS_TABLE", None)
+CLAIM_CHECK_BUCKET = os.getenv("CLAIM_CHECK_BUCKET", None)
+
+
+class ExecutionNotFoundException(Exception):
+    pass
+
+
+def handle_event(
+    event: Dict[str, any],
+    dynamodb_client,
+    results_table,
+    s3_client=None,
+    claim_check_bucket=None,
+):
+    """Returns the stored result of an asynchronous test.
+
+    Only reads the results table, so polling never calls DescribeExecution.
+    Results are stored with their claim check references, which are
+    resolved here.
+    """
+    execution_id = event.get("executionId")
+    result = (
+        get_result(dynamodb_client, results_table, execution_id)
+        if execution_id
+        else None
+    )
+    if result is None:
+        raise ExecutionNotFoundException(f"Execution {execution_id} not found")
+    if claim_check_bucket and result["output"] is not None:
+        result["output"] = resolve_all(s3_client, result["output"])
+    return result
+
+
+@logger.inject_lambda_context
+def lambda_handler(event, context):
+    log_event(logger, event)
+    return handle_event(
+        event, _dynamodb_client, RESULTS_TABLE, _s3_client, CLAIM_CHECK_BUCKET
+    )
@@ -0,0 +1,57 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import io
+from unittest.mock import Mock
+
+import pytest
+from get_test_result.index import ExecutionNotFoundException, handle_event
+
+
+def test_handle_event():
+    dynamodb_client = Mock()
+    dynamodb_client.get_item.return_value = {
+        "Item": {
+            "executionId": {"S": "exec-1"},
+            "status": {"S": "RUNNING"},
+            "expiresAt": {"N": "1"},
+        }
+    }
+
+    result = handle_event({"executionId": "exec-1"}, dynamodb_client, "results")
+
+    assert result == {
+        "executionId": "exec-1",
+        "status": "RUNNING",
+        "output": None,
+        "error": None,
+    }
+    dynamodb_client.get_item.assert_called_once()
+
+
+@pytest.mark.parametrize("event", [{"executionId": "unknown"}, {"executionId": ""}])
+def test_handle_event_not_found(event):
+    dynamodb_client = Mock()
+    dynamodb_client.get_item.return_value = {}
+
+    with pytest.raises(ExecutionNotFoundException):
+        handle_event(event, dynamodb_client, "results")
+
+
+def test_handle_event_claim_check():
+    dynamodb_client = Mock()
+    dynamodb_client.get_item.return_value = {
+        "Item": {
+            "executionId": {"S": "exec-1"},
+            "status": {"S": "SUCCEEDED"},
+            "output": {"S": '{"output": {"claimCheck": {"bucket": "b", "key": "k"}}}'},
+        }
+    }
+    s3_client = Mock()
+    s3_client.get_object.return_value = {"Body": io.BytesIO(b'{"a": 1}')}
+
+    result = handle_event(
+        {"executionId": "exec-1"}, dynamodb_client, "results", s3_client, "b"
+    )
+
+    assert result["output"] == {"output": {"a": 1}}
@@ -1,50 +1,443 @@
 #  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 #  SPDX-License-Identifier: Apache-2.0
 
-import json
 import os
+import random
 import time
-from typing import Dict
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterator, List, Optional
 
-import boto3
-from aws_lambda_powertools import Logger
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+from iottoolbox.claim_check import (
+    CLAIM_CHECK_THRESHOLD,
+    offload_fields,
+    put_payload,
+    resolve_all,
+)
+from iottoolbox.clients import lazy_client
+from iottoolbox.execution_results import (
+    RUNNING,
+    get_async_execution_name,
+    get_execution_id,
+    put_running,
+)
+from iottoolbox.lazy import lazy_import
+from iottoolbox.log_budget import log_event
+from iottoolbox.result_cache import (
+    HIT,
+    MISS,
+    ResultCache,
+    get_cache_key,
+    get_result_cache,
+    is_cacheable,
+)
+from iottoolbox.serialization import dumps, dumps_bytes, loads
+from iottoolbox.sql import DEFAULT_SQL_VERSION, validate
+from iottoolbox.timing import record_size, set_correlation_id, timed
+
+# only needed for throttled polls and local mode
+botocore_exceptions = lazy_import("botocore.exceptions")
+sql_batch = lazy_import("iottoolbox.sql_batch")
+sql_eval = lazy_import("iottoolbox.sql_eval")
 
 logger = Logger()
+metrics = Metrics()
 
-_sfn_client = boto3.client("stepfunctions")
+_sfn_client = lazy_client("stepfunctions")
+_dynamodb_client = lazy_client("dynamodb")
+_s3_client = lazy_client("s3")
 SFN_CUSTOM_MESSAGE_ARN = os.getenv("SFN_CUSTOM_MESSAGE_ARN", None)
 SFN_TOPIC_MESSAGE_ARN = os.getenv("SFN_TOPIC_MESSAGE_ARN", None)
+SFN_BATCH_MESSAGE_ARN = os.getenv("SFN_BATCH_MESSAGE_ARN", None)
+RESULTS_TABLE = os.getenv("RESULTS_TABLE", None)
+CLAIM_CHECK_BUCKET = os.getenv("CLAIM_CHECK_BUCKET", None)
+_result_cache = get_result_cache(_dynamodb_client)
+
+LOCAL_MODE = "local"
 
 STEP_FUNCTION_ACCEPTED_VALUES = ["SUCCEEDED", "FAILED", "TIMED_OUT", "ABORTED"]
 
+POLL_INITIAL_DELAY = float(os.getenv("SFN_POLL_INITIAL_DELAY", "0.1"))
+POLL_MAX_DELAY = float(os.getenv("SFN_POLL_MAX_DELAY", "0.8"))
+POLL_MULTIPLIER = 1.5
+# keep some headroom to return an error before the Lambda itself times out
+DEADLINE_SAFETY_MARGIN_MS = 500
+
+
+class ExecutionTimeoutException(Exception):
+    pass
+
+
+class ExecutionWaiter(ABC):
+    """Waits until a Step Functions execution reached a terminal status.
+
+    Implementations return the final DescribeExecution response.
+    """
+
+    @abstractmethod
+    def wait(
+        self, sfn_client, execution_arn: str, timeout: Optional[float] = None
+    ) -> Dict[str, any]: ...
+
+
+class BackoffWaiter(ExecutionWaiter):
+    """Polls DescribeExecution with capped exponential backoff and jitter.
+
+    Short executions are picked up quickly while long-running ones (e.g.
+    waiting for a device message) only cost a handful of API calls. Jitter
+    spreads the calls of concurrently running tests so they don't hit the
+    Step Functions API in lockstep. Throttled calls are treated like any
+    other unfinished poll.
+    """
+
+    def __init__(
+        self,
+        initial_delay: float = POLL_INITIAL_DELAY,
+        max_delay: float = POLL_MAX_DELAY,
+        multiplier: float = POLL_MULTIPLIER,
+        sleep: Callable[[float], None] = time.sleep,
+        clock: Callable[[], float] = time.monotonic,
+        rand: Callable[[], float] = random.random,
+    ):
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self._sleep = sleep
+        self._clock = clock
+        self._rand = rand
+
+    def delays(self) -> Iterator[float]:
+        delay = self.initial_delay
+        while True:
+            # equal jitter: never drop below half of the nominal delay
+            yield delay / 2 + self._rand() * delay / 2
+            delay = min(delay * self.multiplier, self.max_delay)
+
+    def wait(
+        self, sfn_client, execution_arn: str, timeout: Optional[float] = None
+    ) -> Dict[str, any]:
+        deadline = self._clock() + timeout if timeout is not None else None
+
+        for delay in self.delays():
+            if deadline is not None:
+                remaining = deadline - self._clock()
+                if remaining <= 0:
+                    raise ExecutionTimeoutException(
+                        f"Execution {execution_arn} did not finish in time"
+                    )
+                delay = min(delay, remaining)
+            self._sleep(delay)  # nosemgrep: arbitrary-sleep
+
+            try:
+                response_describe = sfn_client.describe_execution(
+                    executionArn=execution_arn
+                )
+            except botocore_exceptions.ClientError as e:
+                if e.response.get("Error", {}).get("Code") != "ThrottlingException":
+                    raise e
+                logger.warning("DescribeExecution throttled", extra={"delay": delay})
+                continue
+
+            if response_describe["status"] in STEP_FUNCTION_ACCEPTED_VALUES:
+                return response_describe
+
+
+def get_timeout(context) -> Optional[float]:
+    if context is None or not hasattr(context, "get_remaining_time_in_millis"):
+        return None
+    remaining_ms = context.get_remaining_time_in_millis() - DEADLINE_SAFETY_MARGIN_MS
+    return max(remaining_ms, 0) / 1000
+
+
+def get_statemachine_arn(
+    event: Dict[str, any],
+    sfn_custom_message_arn: str,
+    sfn_topic_message_arn: str,
+    sfn_batch_message_arn: str,
+) -> str:
+    if "messages" in event:
+        return sfn_batch_message_arn
+    if "message" in event:
+        return sfn_custom_message_arn
+    return sfn_topic_message_arn
+
+
+def validate_request(event: Dict[str, any]) -> Optional[Dict[str, any]]:
+    """Returns the syntax error of the statement found by the local parser,
+    or None if the statement is valid.
+
+    The parser doesn't cover every construct of the rules engine, the test
+    runs anyway and only CreateTopicRule rejects a statement. The error is
+    added to the result in sqlError if the rules engine rejects it as well.
+    """
+    sql = event.get("sql")
+    if not isinstance(sql, str):
+        return None
+    diagnostic = validate(
+        sql,
+        event.get("awsIotSqlVersion") or DEFAULT_SQL_VERSION,
+        # topic message tests subscribe to the topic filter of the statement
+        require_topic="message" not in event and "messages" not in event,
+    )
+    return diagnostic.to_dict() if diagnostic is not None else None
+
+
+def evaluate_locally(event: Dict[str, any]) -> Optional[Dict[str, any]]:
+    """Answers custom and batch message tests without the state machine.
+
+    Returns None if the statement uses features the local evaluator doesn't
+    support, the test then runs against the rules engine.
+    """
+    try:
+        if "messages" in event:
+            return sql_batch.evaluate_batch_request(event)
+        return sql_eval.evaluate_request(event)
+    except sql_eval.UnsupportedSqlError as e:
+        logger.info("Falling back to the rules engine", extra={"reason": str(e)})
+        return None
+
+
+def get_cached_result(
+    result_cache: ResultCache, cache_key: str
+) -> Optional[Dict[str, any]]:
+    """Returns the cached result of an identical test, tests run as usual
+    if the cache can't be read."""
+    try:
+        with timed(metrics, "ResultCacheLookup"):
+            result = result_cache.get(cache_key)
+    except Exception as e:
+        logger.warning("Failed to read cached result", extra={"exception": e})
+        return None
+    metrics.add_metric(
+        name="ResultCacheHit" if result is not None else "ResultCacheMiss",
+        unit=MetricUnit.Count,
+        value=1,
+    )
+    return result
+
+
+def cache_result(
+    result_cache: ResultCache,
+    cache_key: Optional[str],
+    result: Dict[str, any],
+    exact_no_match: bool = False,
+) -> Dict[str, any]:
+    """Stores the result of a test that gives the same result on every run
+    and reports the cache miss in the response."""
+    if cache_key is None:
+        return result
+    if is_cacheable(result, exact_no_match):
+        try:
+            result_cache.put(cache_key, result)
+        except Exception as e:
+            logger.warning("Failed to cache result", extra={"exception": e})
+    result["cache"] = MISS
+    return result
+
+
+def get_execution_result(response_describe: Dict[str, any]) -> Dict[str, any]:
+    """Returns the output of a finished execution, or its error and cause if
+    it failed, timed out or was aborted."""
+    if response_describe["status"] == "SUCCEEDED":
+        return loads(response_describe["output"])
+    result = {
+        "output": None,
+        "error": response_describe.get("error") or response_describe["status"],
+    }
+    if response_describe.get("cause"):
+        result["cause"] = response_describe["cause"]
+    return result
+
+
+def get_finished_result(output: Dict[str, any]) -> Dict[str, any]:
+    """Returns a result that didn't need an execution in the format of
+    get_test_result, there is nothing to poll."""
+    return {"executionId": None, "status": "SUCCEEDED", "output": output, "error": None}
+
+
+def offload_messages(s3_client, bucket: str, event: Dict[str, any], size: int):
+    """Stores the largest messages of the test in S3 until the execution
+    input fits the claim check threshold.
+
+    The messages of batch tests are always stored in S3 as a whole, the
+    distributed Map of the batch state machine reads them from there. Every
+    item is the input of a child execution, so messages above the threshold
+    are stored on their own as well.
+    """
+    if "messages" not in event:
+        offload_fields(
+            s3_client, bucket, [event], "message", size, CLAIM_CHECK_THRESHOLD
+        )
+        return
+    for item in event["messages"]:
+        if "message" in item:
+            message_size = len(dumps_bytes(item["message"]))
+            offload_fields(
+                s3_client,
+                bucket,
+                [item],
+                "message",
+                message_size,
+                CLAIM_CHECK_THRESHOLD,
+            )
+    event["messages"] = put_payload(s3_client, bucket, event["messages"])
+
+
+def compare_variants(
+    variants: List[str],
+    event: Dict[str, any],
+    result: Dict[str, any],
+    sfn_client: any,
+    sfn_custom_message_arn: str,
+    waiter: ExecutionWaiter,
+    timeout: Optional[float] = None,
+) -> List[Dict[str, any]]:
+    """Tests the SQL variants of a local mode topic message test against the
+    captured message.
+
+    Variants the local evaluator doesn't support are started in parallel as
+    custom message tests and waited for afterwards.
+    """
+    if result.get("input") is None:
+        # no message was captured, there is nothing to compare against
+        return [
+            {"sql": sql, "output": None, "error": result.get("error")}
+            for sql in variants
+        ]
+
+    requests = [
+        {
+            "sql": sql,
+            "awsIotSqlVersion": event.get("awsIotSqlVersion"),
+            "message": result["input"],
+            "userProperties": result.get("userProperties", []),
+            "mqttProperties": result.get("mqttProperties", {}),
+        }
+        for sql in variants
+    ]
+    with timed(metrics, "LocalEvaluation"):
+        responses = [evaluate_locally(request) for request in requests]
+
+    execution_arns = {}
+    for i, request in enumerate(requests):
+        if responses[i] is None:
+            response_start = sfn_client.start_execution(
+                stateMachineArn=sfn_custom_message_arn, input=dumps(request)
+            )
+            execution_arns[i] = response_start["executionArn"]
+    for i, execution_arn in execution_arns.items():
+        response_describe = waiter.wait(sfn_client, execution_arn, timeout=timeout)
+        responses[i] = get_execution_result(response_describe)
+
+    return [
+        {
+            "sql": sql,
+            "output": response.get("output"),
+            "error": response.get("error"),
+        }
+        for sql, response in zip(variants, responses)
+    ]
+
 
 def handle_event(
     event: Dict[str, any],
     sfn_client: any,
     sfn_custom_message_arn: str,
     sfn_topic_message_arn: str,
+    sfn_batch_message_arn: str,
+    waiter: Optional[ExecutionWaiter] = None,
+    timeout: Optional[float] = None,
+    dynamodb_client: any = None,
+    results_table: Optional[str] = None,
+    s3_client: any = None,
+    claim_check_bucket: Optional[str] = None,
+    result_cache: Optional[ResultCache] = None,
 ):
-    statemachine_arn = (
-        sfn_custom_message_arn if "message" in event else sfn_topic_message_arn
-    )
-    response_start = sfn_client.start_execution(
-        stateMachineArn=statemachine_arn,
-        input=json.dumps(event),
+    # asynchronous tests return the execution right away, the result is
+    # stored by store_test_result and polled from get_test_result. Batch
+    # tests take longer than the API Gateway integration timeout.
+    run_async = event.pop("async", False) or "messages" in event
+    # e.g. to rerun a test after a rule action error
+    use_cache = not event.pop("noCache", False)
+    with timed(metrics, "SqlValidation"):
+        sql_error = validate_request(event)
+    if sql_error is not None:
+        logger.warning("SQL not parsed locally", extra={"sqlError": sql_error})
+        metrics.add_metric(name="SqlParseWarning", unit=MetricUnit.Count, value=1)
+    cache_key = None
+    if result_cache is not None and use_cache:
+        cache_key = get_cache_key(event)
+    if cache_key is not None:
+        cached = get_cached_result(result_cache, cache_key)
+        if cached is not None:
+            cached["cache"] = HIT
+            return get_finished_result(cached) if run_async else cached
+        # asynchronous results are stored by store_test_result
+        if run_async:
+            cache_key = None
+    # asynchronous tests and cloud mode compare the variants in the state machine
+    variants = None
+    if event.get("mode") == LOCAL_MODE and not run_async and "variants" in event:
+        variants = event.pop("variants")
+        # only tells the state machine which message properties to capture
+        event["localVariants"] = variants
+    if event.get("mode") == LOCAL_MODE and ("message" in event or "messages" in event):
+        with timed(metrics, "LocalEvaluation"):
+            response = evaluate_locally(event)
+        if response is not None:
+            # no-matches of the local evaluator are exact if its WHERE clause is
+            exact_no_match = cache_key is not None and sql_eval.is_exact_sql(
+                event["sql"], event.get("awsIotSqlVersion") or DEFAULT_SQL_VERSION
+            )
+            response = cache_result(result_cache, cache_key, response, exact_no_match)
+            return get_finished_result(response) if run_async else response
+
+    waiter = waiter or BackoffWaiter()
+    statemachine_arn = get_statemachine_arn(
+        event, sfn_custom_message_arn, sfn_topic_message_arn, sfn_batch_message_arn
     )
+    execution_input = dumps(event)
+    if claim_check_bucket and (
+        "messages" in event or len(execution_input) > CLAIM_CHECK_THRESHOLD
+    ):
+        with timed(metrics, "ClaimCheck"):
+            offload_messages(s3_client, claim_check_bucket, event, len(execution_input))
+        execution_input = dumps(event)
+    record_size(metrics, "StartExecution", len(execution_input))
+    start_args = {"stateMachineArn": statemachine_arn, "input": execution_input}
+    if run_async:
+        # only asynchronous executions are stored by store_test_result
+        start_args["name"] = get_async_execution_name()
+    with timed(metrics, "StartExecution"):
+        response_start = sfn_client.start_execution(**start_args)
+    execution_arn = response_start["executionArn"]
+    execution_id = get_execution_id(execution_arn)
+    set_correlation_id(metrics, execution_id)
 
-    execution_in_progress = True
-    output = []
+    if run_async:
+        put_running(dynamodb_client, results_table, execution_arn)
+        return {"executionId": execution_id, "status": RUNNING}
 
-    while execution_in_progress:
-        response_describe = sfn_client.describe_execution(
-            executionArn=response_start["executionArn"]
-        )
-        if response_describe["status"] in STEP_FUNCTION_ACCEPTED_VALUES:
-            execution_in_progress = False
-            output = response_describe["output"]
-        time.sleep(0.1)  # nosemgrep: arbitrary-sleep
+    with timed(metrics, "Execution"):
+        response_describe = waiter.wait(sfn_client, execution_arn, timeout=timeout)
 
-    return json.loads(output)
+    result = get_execution_result(response_describe)
+    if claim_check_bucket:
+        result = resolve_all(s3_client, result)
+    if sql_error is not None and result.get("error") == sql_eval.SQL_PARSE_ERROR:
+        result["sqlError"] = sql_error
+    if variants is not None:
+        result["variants"] = compare_variants(
+            variants,
+            event,
+            result,
+            sfn_client,
+            sfn_custom_message_arn,
+            waiter,
+            timeout=timeout,
+        )
+    return cache_result(result_cache, cache_key, result)
 
 
 def check_env():
@@ -54,10 +447,27 @@ def check_env():
     if not SFN_TOPIC_MESSAGE_ARN:
         raise Exception("SFN_TOPIC_MESSAGE_ARN environment variable not defined")
 
+    if not SFN_BATCH_MESSAGE_ARN:
+        raise Exception("SFN_BATCH_MESSAGE_ARN environment variable not defined")
+
+    if not RESULTS_TABLE:
+        raise Exception("RESULTS_TABLE environment variable not defined")
+
 
+@metrics.log_metrics
 @logger.inject_lambda_context
 def lambda_handler(event, context):
-    logger.info(event)
+    log_event(logger, event)
     return handle_event(
-        event, _sfn_client, SFN_CUSTOM_MESSAGE_ARN, SFN_TOPIC_MESSAGE_ARN
+        event,
+        _sfn_client,
+        SFN_CUSTOM_MESSAGE_ARN,
+        SFN_TOPIC_MESSAGE_ARN,
+        SFN_BATCH_MESSAGE_ARN,
+        timeout=get_timeout(context),
+        dynamodb_client=_dynamodb_client,
+        results_table=RESULTS_TABLE,
+        s3_client=_s3_client,
+        claim_check_bucket=CLAIM_CHECK_BUCKET,
+        result_cache=_result_cache,
     )
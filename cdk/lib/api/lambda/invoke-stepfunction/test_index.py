@@ -0,0 +1,662 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import io
+import json
+from unittest.mock import Mock
+
+import pytest
+from botocore.exceptions import ClientError
+from iottoolbox.result_cache import InMemoryResultCache
+from iottoolbox.serialization import dumps
+from index import (
+    BackoffWaiter,
+    ExecutionTimeoutException,
+    handle_event,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def create_waiter(clock, rand=lambda: 1.0):
+    return BackoffWaiter(
+        initial_delay=0.1,
+        max_delay=0.8,
+        multiplier=2,
+        sleep=clock.sleep,
+        clock=clock,
+        rand=rand,
+    )
+
+
+def test_delays_are_capped():
+    waiter = create_waiter(FakeClock())
+    delays = waiter.delays()
+    assert [next(delays) for _ in range(6)] == pytest.approx(
+        [0.1, 0.2, 0.4, 0.8, 0.8, 0.8]
+    )
+
+
+def test_delays_are_jittered():
+    waiter = create_waiter(FakeClock(), rand=lambda: 0.0)
+    delays = waiter.delays()
+    assert [next(delays) for _ in range(3)] == pytest.approx([0.05, 0.1, 0.2])
+
+
+def test_wait_returns_terminal_response():
+    clock = FakeClock()
+    sfn_client = Mock()
+    sfn_client.describe_execution = Mock(
+        side_effect=[
+            {"status": "RUNNING"},
+            {"status": "RUNNING"},
+            {"status": "SUCCEEDED", "output": "{}"},
+        ]
+    )
+
+    response = create_waiter(clock).wait(sfn_client, "arn")
+
+    assert response == {"status": "SUCCEEDED", "output": "{}"}
+    assert sfn_client.describe_execution.call_count == 3
+    sfn_client.describe_execution.assert_called_with(executionArn="arn")
+    assert clock.now == pytest.approx(0.7)
+
+
+def test_wait_retries_throttling():
+    sfn_client = Mock()
+    throttled = ClientError(
+        {"Error": {"Code": "ThrottlingException"}}, "DescribeExecution"
+    )
+    sfn_client.describe_execution = Mock(side_effect=[throttled, {"status": "FAILED"}])
+
+    response = create_waiter(FakeClock()).wait(sfn_client, "arn")
+
+    assert response == {"status": "FAILED"}
+
+
+def test_wait_raises_other_errors():
+    sfn_client = Mock()
+    sfn_client.describe_execution = Mock(
+        side_effect=ClientError(
+            {"Error": {"Code": "ExecutionDoesNotExist"}}, "DescribeExecution"
+        )
+    )
+
+    with pytest.raises(ClientError):
+        create_waiter(FakeClock()).wait(sfn_client, "arn")
+
+
+def test_wait_times_out():
+    clock = FakeClock()
+    sfn_client = Mock()
+    sfn_client.describe_execution = Mock(return_value={"status": "RUNNING"})
+
+    with pytest.raises(ExecutionTimeoutException):
+        create_waiter(clock).wait(sfn_client, "arn", timeout=2)
+
+    assert clock.now == pytest.approx(2)
+
+
+@pytest.mark.parametrize(
+    "event,expected_arn",
+    [
+        ({"sql": "SELECT *", "message": {}}, "custom-arn"),
+        ({"sql": "SELECT * FROM 'foo'"}, "topic-arn"),
+    ],
+)
+def test_handle_event(event, expected_arn):
+    sfn_client = Mock()
+    sfn_client.start_execution = Mock(return_value={"executionArn": "exec-arn"})
+    waiter = Mock()
+    waiter.wait = Mock(
+        return_value={"status": "SUCCEEDED", "output": json.dumps({"output": 1})}
+    )
+
+    result = handle_event(
+        event,
+        sfn_client,
+        "custom-arn",
+        "topic-arn",
+        "batch-arn",
+        waiter=waiter,
+        timeout=5,
+    )
+
+    assert result == {"output": 1}
+    sfn_client.start_execution.assert_called_with(
+        stateMachineArn=expected_arn, input=dumps(event)
+    )
+    waiter.wait.assert_called_with(sfn_client, "exec-arn", timeout=5)
+
+
+@pytest.mark.parametrize(
+    "response_describe,expected",
+    [
+        (
+            {"status": "FAILED", "error": "States.Runtime", "cause": "boom"},
+            {"output": None, "error": "States.Runtime", "cause": "boom"},
+        ),
+        ({"status": "TIMED_OUT"}, {"output": None, "error": "TIMED_OUT"}),
+        ({"status": "ABORTED"}, {"output": None, "error": "ABORTED"}),
+    ],
+)
+def test_handle_event_execution_failed(response_describe, expected):
+    sfn_client = Mock()
+    sfn_client.start_execution = Mock(return_value={"executionArn": "exec-arn"})
+    waiter = Mock()
+    waiter.wait = Mock(return_value=response_describe)
+
+    result = handle_event(
+        {"sql": "SELECT *", "message": {}},
+        sfn_client,
+        "custom-arn",
+        "topic-arn",
+        "batch-arn",
+        waiter=waiter,
+    )
+
+    assert result == expected
+
+
+def test_handle_event_local_mode():
+    sfn_client = Mock()
+    event = {
+        "sql": "SELECT a AS b FROM 'foo'",
+        "awsIotSqlVersion": "2016-03-23",
+        "mode": "local",
+        "message": {"a": 1},
+        "userProperties": [],
+        "mqttProperties": {},
+    }
+
+    result = handle_event(event, sfn_client, "custom-arn", "topic-arn", "batch-arn")
+
+    assert result == {
+        "output": {"b": 1},
+        "error": None,
+        "input": {"a": 1},
+        "userProperties": [],
+        "mqttProperties": {},
+    }
+    sfn_client.start_execution.assert_not_called()
+
+
+def test_handle_event_async_local_mode():
+    sfn_client = Mock()
+    event = {
+        "sql": "SELECT a AS b FROM 'foo'",
+        "mode": "local",
+        "message": {"a": 1},
+        "async": True,
+    }
+
+    result = handle_event(event, sfn_client, "custom-arn", "topic-arn", "batch-arn")
+
+    assert result["executionId"] is None
+    assert result["status"] == "SUCCEEDED"
+    assert result["output"]["output"] == {"b": 1}
+    assert result["error"] is None
+    sfn_client.start_execution.assert_not_called()
+
+
+def test_handle_event_local_mode_batch():
+    sfn_client = Mock()
+    event = {
+        "sql": "SELECT a FROM 'foo' WHERE a > 1",
+        "awsIotSqlVersion": "2016-03-23",
+        "mode": "local",
+        "messages": [
+            {"message": {"a": 1}, "userProperties": [], "mqttProperties": {}},
+            {"message": {"a": 2}, "userProperties": [], "mqttProperties": {}},
+        ],
+    }
+
+    result = handle_event(event, sfn_client, "custom-arn", "topic-arn", "batch-arn")
+
+    # batch tests are always asynchronous
+    assert result["executionId"] is None
+    assert result["status"] == "SUCCEEDED"
+    assert [(r["output"], r["error"]) for r in result["output"]["results"]] == [
+        (None, "States.HeartbeatTimeout"),
+        ({"a": 2}, None),
+    ]
+    sfn_client.start_execution.assert_not_called()
+
+
+def test_handle_event_batch(mocker):
+    mocker.patch("index.CLAIM_CHECK_THRESHOLD", 100)
+    put_payload = mocker.patch(
+        "index.put_payload",
+        return_value={"claimCheck": {"bucket": "bucket", "key": "messages"}},
+    )
+    put_message = mocker.patch(
+        "iottoolbox.claim_check.put_payload",
+        return_value={"claimCheck": {"bucket": "bucket", "key": "message"}},
+    )
+    sfn_client = Mock()
+    sfn_client.start_execution = Mock(
+        return_value={"executionArn": "arn:aws:states:execution:sm:exec-1"}
+    )
+    dynamodb_client = Mock()
+    s3_client = Mock()
+    event = {
+        "sql": "SELECT FROM",
+        "mode": "local",
+        "messages": [{"message": {"a": 1}}, {"message": {"data": "a" * 200}}],
+    }
+
+    result = handle_event(
+        event,
+        sfn_client,
+        "custom-arn",
+        "topic-arn",
+        "batch-arn",
+        dynamodb_client=dynamodb_client,
+        results_table="results",
+        s3_client=s3_client,
+        claim_check_bucket="bucket",
+    )
+
+    # the distributed Map reads the messages from S3, only messages above
+    # the threshold are stored on their own
+    assert result == {"executionId": "exec-1", "status": "RUNNING"}
+    put_message.assert_called_once_with(s3_client, "bucket", {"data": "a" * 200})
+    put_payload.assert_called_once_with(
+        s3_client,
+        "bucket",
+        [
+            {"message": {"a": 1}},
+            {"message": {"claimCheck": {"bucket": "bucket", "key": "message"}}},
+        ],
+    )
+    kwargs = sfn_client.start_execution.call_args.kwargs
+    assert kwargs["stateMachineArn"] == "batch-arn"
+    assert kwargs["input"] == dumps(
+        {
+            "sql": "SELECT FROM",
+            "mode": "local",
+            "messages": {"claimCheck": {"bucket": "bucket", "key": "messages"}},
+        }
+    )
+
+
+@pytest.mark.parametrize(
+    "event,expected",
+    [
+        (
+            {"sql": "SELECT a FROM 'foo' WHERE", "message": {"a": 1}},
+            {
+                "message": "Expected expression, found end of statement",
+                "position": 25,
+                "line": 1,
+                "column": 26,
+            },
+        ),
+        (
+            {"sql": "SELECT a", "awsIotSqlVersion": "2016-03-23"},
+            {
+                "message": "FROM clause with topic filter missing",
+                "position": 8,
+                "line": 1,
+                "column": 9,
+            },
+        ),
+    ],
+)
+def test_handle_event_reports_sql_error(event, expected):
+    sfn_client = Mock()
+    sfn_client.start_execution = Mock(return_value={"executionArn": "exec-arn"})
+    waiter = Mock()
+    waiter.wait = Mock(
+        return_value={
+            "status": "SUCCEEDED",
+            "output": json.dumps({"output": None, "error": "SqlParseException"}),
+        }
+    )
+
+    result = handle_event(
+        event, sfn_client, "custom-arn", "topic-arn", "batch-arn", waiter=waiter
+    )
+
+    assert result == {
+        "output": None,
+        "error": "SqlParseException",
+        "sqlError": expected,
+    }
+    sfn_client.start_execution.assert_called_once()
+
+
+def test_handle_event_runs_sql_the_parser_rejects():
+    sfn_client = Mock()
+    sfn_client.start_execution = Mock(return_value={"executionArn": "exec-arn"})
+    waiter = Mock()
+    waiter.wait = Mock(
+        return_value={"status": "SUCCEEDED", "output": json.dumps({"output": 1})}
+    )
+    event = {"sql": "SELECT a FROM 'foo' WHERE b NOT IN [1, 2]", "message": {}}
+
+    result = handle_event(
+        event, sfn_client, "custom-arn", "topic-arn", "batch-arn", waiter=waiter
+    )
+
+    # the local syntax error is only reported if the rules engine agrees
+    assert result == {"output": 1}
+
+
+def test_handle_event_async_runs_sql_the_parser_rejects():
+    sfn_client = Mock()
+    sfn_client.start_execution = Mock(
+        return_value={"executionArn": "arn:aws:states:execution:sm:exec-1"}
+    )
+    event = {"sql": "SELECT * FROM", "message": {}, "async": True}
+
+    result = handle_event(
+        event,
+        sfn_client,
+        "custom-arn",
+        "topic-arn",
+        "batch-arn",
+        dynamodb_client=Mock(),
+        results_table="results",
+    )
+
+    assert result == {"executionId": "exec-1", "status": "RUNNING"}
+    sfn_client.start_execution.assert_called_once()
+
+
+def test_handle_event_local_mode_falls_back():
+    sfn_client = Mock()
+    sfn_client.start_execution = Mock(return_value={"executionArn": "exec-arn"})
+    waiter = Mock()
+    waiter.wait = Mock(
+        return_value={"status": "SUCCEEDED", "output": json.dumps({"output": 1})}
+    )
+    event = {
+        "sql": "SELECT machinelearning_predict('m', 'r', *) AS p",
+        "mode": "local",
+        "message": {"a": 1},
+    }
+
+    result = handle_event(
+        event, sfn_client, "custom-arn", "topic-arn", "batch-arn", waiter=waiter
+    )
+
+    assert result == {"output": 1}
+    sfn_client.start_execution.assert_called_with(
+        stateMachineArn="custom-arn", input=dumps(event)
+    )
+
+
+def test_handle_event_async():
+    sfn_client = Mock()
+    sfn_client.start_execution = Mock(
+        return_value={"executionArn": "arn:aws:states:execution:sm:exec-1"}
+    )
+    dynamodb_client = Mock()
+    waiter = Mock()
+    event = {"sql": "SELECT *", "message": {}, "async": True}
+
+    result = handle_event(
+        event,
+        sfn_client,
+        "custom-arn",
+        "topic-arn",
+        "batch-arn",
+        waiter=waiter,
+        dynamodb_client=dynamodb_client,
+        results_table="results",
+    )
+
+    assert result == {"executionId": "exec-1", "status": "RUNNING"}
+    kwargs = sfn_client.start_execution.call_args.kwargs
+    assert kwargs["stateMachineArn"] == "custom-arn"
+    assert kwargs["input"] == dumps({"sql": "SELECT *", "message": {}})
+    # store_test_result only stores executions named like this
+    assert kwargs["name"].startswith("async-")
+    assert dynamodb_client.put_item.call_args.kwargs["TableName"] == "results"
+    waiter.wait.assert_not_called()
+
+
+def test_handle_event_local_mode_variants():
+    sfn_client = Mock()
+    sfn_client.start_execution = Mock(
+        side_effect=[{"executionArn": "topic-exec"}, {"executionArn": "variant-exec"}]
+    )
+    waiter = Mock()
+    waiter.wait = Mock(
+        side_effect=[
+            {
+                "status": "SUCCEEDED",
+                "output": json.dumps(
+                    {"output": {"a": 1}, "error": None, "input": {"a": 1}}
+                ),
+            },
+            {"status": "SUCCEEDED", "output": json.dumps({"output": {"p": 2}})},
+        ]
+    )
+    event = {
+        "sql": "SELECT a FROM 'foo'",
+        "awsIotSqlVersion": "2016-03-23",
+        "mode": "local",
+        "variants": [
+            "SELECT a AS b FROM 'foo'",
+            "SELECT machinelearning_predict('m', 'r', *) AS p FROM 'foo'",
+        ],
+    }
+
+    result = handle_event(
+        event, sfn_client, "custom-arn", "topic-arn", "batch-arn", waiter=waiter
+    )
+
+    assert result["variants"] == [
+        {"sql": "SELECT a AS b FROM 'foo'", "output": {"b": 1}, "error": None},
+        {
+            "sql": "SELECT machinelearning_predict('m', 'r', *) AS p FROM 'foo'",
+            "output": {"p": 2},
+            "error": None,
+        },
+    ]
+    # the message is captured once, only the unsupported variant is started
+    topic_call, variant_call = sfn_client.start_execution.call_args_list
+    assert topic_call.kwargs["stateMachineArn"] == "topic-arn"
+    topic_input = json.loads(topic_call.kwargs["input"])
+    assert "variants" not in topic_input
+    assert topic_input["localVariants"] == [v["sql"] for v in result["variants"]]
+    assert variant_call.kwargs["stateMachineArn"] == "custom-arn"
+    assert json.loads(variant_call.kwargs["input"])["message"] == {"a": 1}
+
+
+def test_handle_event_claim_check(mocker):
+    mocker.patch("index.CLAIM_CHECK_THRESHOLD", 100)
+    put_payload = mocker.patch(
+        "iottoolbox.claim_check.put_payload",
+        return_value={"claimCheck": {"bucket": "bucket", "key": "k"}},
+    )
+    s3_client = Mock()
+    s3_client.get_object.return_value = {
+        "Body": io.BytesIO(dumps({"data": "a" * 200}).encode())
+    }
+    sfn_client = Mock()
+    sfn_client.start_execution = Mock(return_value={"executionArn": "exec-arn"})
+    waiter = Mock()
+    waiter.wait = Mock(
+        return_value={
+            "status": "SUCCEEDED",
+            "output": json.dumps(
+                {"output": None, "input": {"claimCheck": {"bucket": "b", "key": "k"}}}
+            ),
+        }
+    )
+    event = {"sql": "SELECT *", "message": {"data": "a" * 200}}
+
+    result = handle_event(
+        event,
+        sfn_client,
+        "custom-arn",
+        "topic-arn",
+        "batch-arn",
+        waiter=waiter,
+        s3_client=s3_client,
+        claim_check_bucket="bucket",
+    )
+
+    put_payload.assert_called_once_with(s3_client, "bucket", {"data": "a" * 200})
+    execution_input = json.loads(sfn_client.start_execution.call_args.kwargs["input"])
+    assert execution_input["message"] == {
+        "claimCheck": {"bucket": "bucket", "key": "k"}
+    }
+    # references left in the result are resolved
+    assert result == {"output": None, "input": {"data": "a" * 200}}
+
+
+def test_handle_event_result_cache():
+    result_cache = InMemoryResultCache()
+    sfn_client = Mock()
+    sfn_client.start_execution = Mock(return_value={"executionArn": "exec-arn"})
+    waiter = Mock()
+    waiter.wait = Mock(
+        return_value={
+            "status": "SUCCEEDED",
+            "output": json.dumps({"output": {"a": 1}, "error": None}),
+        }
+    )
+
+    def run(event):
+        return handle_event(
+            event,
+            sfn_client,
+            "custom-arn",
+            "topic-arn",
+            "batch-arn",
+            waiter=waiter,
+            result_cache=result_cache,
+        )
+
+    event = {"sql": "SELECT a FROM 'foo'", "message": {"a": 1}}
+    assert run(dict(event)) == {"output": {"a": 1}, "error": None, "cache": "miss"}
+    assert run(dict(event)) == {"output": {"a": 1}, "error": None, "cache": "hit"}
+    assert sfn_client.start_execution.call_count == 1
+
+    # opted out requests run again and aren't reported
+    assert run({**event, "noCache": True}) == {"output": {"a": 1}, "error": None}
+    assert sfn_client.start_execution.call_count == 2
+    assert "noCache" not in json.loads(
+        sfn_client.start_execution.call_args.kwargs["input"]
+    )
+
+    assert run({**event, "async": True}) == {
+        "executionId": None,
+        "status": "SUCCEEDED",
+        "output": {"output": {"a": 1}, "error": None, "cache": "hit"},
+        "error": None,
+    }
+
+
+def test_handle_event_result_cache_local_mode():
+    result_cache = InMemoryResultCache()
+    event = {"sql": "SELECT a FROM 'foo'", "mode": "local", "message": {"a": 1}}
+
+    result = handle_event(
+        dict(event),
+        Mock(),
+        "custom-arn",
+        "topic-arn",
+        "batch-arn",
+        result_cache=result_cache,
+    )
+
+    assert result["cache"] == "miss"
+    assert len(result_cache) == 1
+
+
+@pytest.mark.parametrize(
+    "sql,expected",
+    [
+        ("SELECT a FROM 'foo' WHERE a = 2", 1),
+        # not evaluated exactly, the rules engine might match
+        ("SELECT a FROM 'foo' WHERE a + 1 = 3", 0),
+    ],
+)
+def test_handle_event_result_cache_local_no_match(sql, expected):
+    result_cache = InMemoryResultCache()
+    event = {"sql": sql, "mode": "local", "message": {"a": 1}}
+
+    result = handle_event(
+        event, Mock(), "custom-arn", "topic-arn", "batch-arn", result_cache=result_cache
+    )
+
+    assert result["error"] == "States.HeartbeatTimeout"
+    assert len(result_cache) == expected
+
+
+@pytest.mark.parametrize("error", ["IotRuleActionError", "States.HeartbeatTimeout"])
+def test_handle_event_result_cache_skips_transient_errors(error):
+    result_cache = InMemoryResultCache()
+    sfn_client = Mock()
+    sfn_client.start_execution = Mock(return_value={"executionArn": "exec-arn"})
+    waiter = Mock()
+    waiter.wait = Mock(
+        return_value={
+            "status": "SUCCEEDED",
+            "output": json.dumps({"output": None, "error": error}),
+        }
+    )
+    event = {"sql": "SELECT a FROM 'foo'", "message": {"a": 1}}
+
+    result = handle_event(
+        event,
+        sfn_client,
+        "custom-arn",
+        "topic-arn",
+        "batch-arn",
+        waiter=waiter,
+        result_cache=result_cache,
+    )
+
+    assert result["cache"] == "miss"
+    assert len(result_cache) == 0
+
+
+def test_handle_event_result_cache_error():
+    result_cache = Mock()
+    result_cache.get.side_effect = ValueError()
+    result_cache.put.side_effect = ValueError()
+    event = {"sql": "SELECT a FROM 'foo'", "mode": "local", "message": {"a": 1}}
+
+    result = handle_event(
+        event, Mock(), "custom-arn", "topic-arn", "batch-arn", result_cache=result_cache
+    )
+
+    assert result["output"] == {"a": 1}
+    assert result["cache"] == "miss"
+
+
+def test_handle_event_result_cache_topic_message():
+    result_cache = Mock()
+    sfn_client = Mock()
+    sfn_client.start_execution = Mock(return_value={"executionArn": "exec-arn"})
+    waiter = Mock()
+    waiter.wait = Mock(return_value={"status": "SUCCEEDED", "output": "{}"})
+
+    result = handle_event(
+        {"sql": "SELECT a FROM 'foo'"},
+        sfn_client,
+        "custom-arn",
+        "topic-arn",
+        "batch-arn",
+        waiter=waiter,
+        result_cache=result_cache,
+    )
+
+    assert result == {}
+    result_cache.get.assert_not_called()
+    result_cache.put.assert_not_called()
@@ -0,0 +1,58 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import os
+from typing import Dict
+
+from aws_lambda_powertools import Logger
+from iottoolbox.clients import lazy_client
+from iottoolbox.execution_results import (
+    get_execution_id,
+    is_async_execution,
+    put_result,
+)
+from iottoolbox.log_budget import log_event
+
+logger = Logger()
+
+_dynamodb_client = lazy_client("dynamodb")
+_sfn_client = lazy_client("stepfunctions")
+RESULTS_TABLE = os.getenv("RESULTS_TABLE", None)
+
+
+def get_output(detail: Dict[str, any], sfn_client) -> str:
+    # EventBridge drops outputs above its event size limit
+    if detail.get("outputDetails", {}).get("included", True) and detail.get("output"):
+        return detail["output"]
+    logger.info(
+        "Output not included in the event",
+        extra={"executionId": get_execution_id(detail["executionArn"])},
+    )
+    response = sfn_client.describe_execution(executionArn=detail["executionArn"])
+    return response.get("output")
+
+
+def handle_event(event: Dict[str, any], dynamodb_client, sfn_client, results_table):
+    detail = event["detail"]
+    # the rule only matches asynchronous executions, nothing else is polled
+    if not is_async_execution(detail["executionArn"]):
+        logger.info("Not an asynchronous execution")
+        return
+    status = detail["status"]
+    output = None
+    if status == "SUCCEEDED":
+        output = get_output(detail, sfn_client)
+    put_result(
+        dynamodb_client,
+        results_table,
+        detail["executionArn"],
+        status,
+        output=output,
+        error=detail.get("error") or (None if status == "SUCCEEDED" else status),
+    )
+
+
+@logger.inject_lambda_context
+def lambda_handler(event, context):
+    log_event(logger, event)
+    handle_event(event, _dynamodb_client, _sfn_client, RESULTS_TABLE)
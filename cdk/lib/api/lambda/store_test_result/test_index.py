@@ -0,0 +1,83 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+from unittest.mock import Mock
+
+import pytest
+from store_test_result.index import handle_event
+
+EXECUTION_ARN = "arn:aws:states:us-east-1:123456789012:execution:sm:async-1"
+
+
+def create_event(**detail):
+    return {
+        "detail-type": "Step Functions Execution Status Change",
+        "detail": {"executionArn": EXECUTION_ARN, **detail},
+    }
+
+
+def stored_item(dynamodb_client):
+    return dynamodb_client.put_item.call_args.kwargs["Item"]
+
+
+def test_handle_event_succeeded():
+    dynamodb_client = Mock()
+    sfn_client = Mock()
+    event = create_event(
+        status="SUCCEEDED",
+        output='{"output": 1}',
+        outputDetails={"included": True},
+    )
+
+    handle_event(event, dynamodb_client, sfn_client, "results")
+
+    item = stored_item(dynamodb_client)
+    assert item["executionId"] == {"S": "async-1"}
+    assert item["status"] == {"S": "SUCCEEDED"}
+    assert item["output"] == {"S": '{"output": 1}'}
+    assert "error" not in item
+    sfn_client.describe_execution.assert_not_called()
+
+
+def test_handle_event_output_not_included():
+    dynamodb_client = Mock()
+    sfn_client = Mock()
+    sfn_client.describe_execution.return_value = {"output": '{"output": 2}'}
+    event = create_event(
+        status="SUCCEEDED", output=None, outputDetails={"included": False}
+    )
+
+    handle_event(event, dynamodb_client, sfn_client, "results")
+
+    assert stored_item(dynamodb_client)["output"] == {"S": '{"output": 2}'}
+    sfn_client.describe_execution.assert_called_once_with(executionArn=EXECUTION_ARN)
+
+
+@pytest.mark.parametrize(
+    "detail,error",
+    [
+        ({"status": "FAILED", "error": "States.Runtime"}, "States.Runtime"),
+        ({"status": "TIMED_OUT"}, "TIMED_OUT"),
+    ],
+)
+def test_handle_event_failed(detail, error):
+    dynamodb_client = Mock()
+    sfn_client = Mock()
+
+    handle_event(create_event(**detail), dynamodb_client, sfn_client, "results")
+
+    item = stored_item(dynamodb_client)
+    assert item["status"] == {"S": detail["status"]}
+    assert item["error"] == {"S": error}
+    assert "output" not in item
+    sfn_client.describe_execution.assert_not_called()
+
+
+def test_handle_event_sync_execution():
+    dynamodb_client = Mock()
+    event = create_event(status="SUCCEEDED", output='{"output": 1}')
+    event["detail"]["executionArn"] = "arn:aws:states:us-east-1:1:execution:sm:exec-1"
+
+    handle_event(event, dynamodb_client, Mock(), "results")
+
+    dynamodb_client.put_item.assert_not_called()
@@ -0,0 +1,42 @@
+/*
+ * Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ * SPDX-License-Identifier: Apache-2.0
+ */
+
+import * as apigateway from 'aws-cdk-lib/aws-apigateway'
+import { customMessageRequestSchema } from './custom-message-request'
+import { TOOLBOX_BATCH_MAX_MESSAGES } from '../../constants'
+
+const customMessageProperties = customMessageRequestSchema.schema.properties
+
+export const batchMessageRequestSchema = {
+  contentType: 'application/json',
+  modelName: 'BatchMessageModel',
+  schema: {
+    schema: apigateway.JsonSchemaVersion.DRAFT4,
+    title: 'Toolbox for AWS IoT Rule Tester schema - Batch Messages',
+    type: apigateway.JsonSchemaType.OBJECT,
+    properties: {
+      sql: customMessageProperties.sql,
+      awsIotSqlVersion: customMessageProperties.awsIotSqlVersion,
+      mode: customMessageProperties.mode,
+      async: customMessageProperties.async,
+      noCache: customMessageProperties.noCache,
+      messages: {
+        type: apigateway.JsonSchemaType.ARRAY,
+        minItems: 1,
+        maxItems: TOOLBOX_BATCH_MAX_MESSAGES,
+        items: {
+          type: apigateway.JsonSchemaType.OBJECT,
+          properties: {
+            message: customMessageProperties.message,
+            userProperties: customMessageProperties.userProperties,
+            mqttProperties: customMessageProperties.mqttProperties
+          },
+          required: ['message', 'userProperties', 'mqttProperties']
+        }
+      }
+    },
+    required: ['sql', 'awsIotSqlVersion', 'messages']
+  }
+}
@@ -18,6 +18,12 @@ export const customMessageRequestSchema = {
         type: apigateway.JsonSchemaType.STRING,
         enum: ['2015-10-08', '2016-03-23']
       },
+      mode: {
+        type: apigateway.JsonSchemaType.STRING,
+        enum: ['cloud', 'local']
+      },
+      async: { type: apigateway.JsonSchemaType.BOOLEAN },
+      noCache: { type: apigateway.JsonSchemaType.BOOLEAN },
       message: { type: apigateway.JsonSchemaType.OBJECT },
       userProperties: {
         type: apigateway.JsonSchemaType.ARRAY,
@@ -5,3 +5,4 @@
 
 export * from './custom-message-request'
 export * from './topic-message-request'
+export * from './batch-message-request'
@@ -4,6 +4,7 @@
  */
 
 import * as apigateway from 'aws-cdk-lib/aws-apigateway'
+import { TOOLBOX_MESSAGE_CACHE_TTL_SECONDS } from '../../constants'
 
 export const topicMessageRequestSchema = {
   contentType: 'application/json',
@@ -17,7 +18,22 @@ export const topicMessageRequestSchema = {
       awsIotSqlVersion: {
         type: apigateway.JsonSchemaType.STRING,
         enum: ['2015-10-08', '2016-03-23']
-      }
+      },
+      mode: {
+        type: apigateway.JsonSchemaType.STRING,
+        enum: ['cloud', 'local']
+      },
+      variants: {
+        type: apigateway.JsonSchemaType.ARRAY,
+        maxItems: 10,
+        items: { type: apigateway.JsonSchemaType.STRING }
+      },
+      maxMessageAge: {
+        type: apigateway.JsonSchemaType.INTEGER,
+        minimum: 1,
+        maximum: TOOLBOX_MESSAGE_CACHE_TTL_SECONDS
+      },
+      async: { type: apigateway.JsonSchemaType.BOOLEAN }
     },
     required: ['sql', 'awsIotSqlVersion']
   }
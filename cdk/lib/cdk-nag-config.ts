@@ -51,6 +51,12 @@ export function configureCdkNag (app: cdk.App, toolboxStack: IotToolbox, deployF
       ]
     }
   ])
+  NagSuppressions.addResourceSuppressionsByPath(toolboxStack, `/${toolboxStack.testIotRulesConstruct.node.path}/SharedConstructs/ClaimCheckBucket/Resource`, [
+    {
+      id: 'AwsSolutions-S1',
+      reason: 'Suppress disallowed use of S3 buckets without access logging as the bucket only holds payloads of rule tests for up to one day.'
+    }
+  ])
   if (toolboxStack.s3AccessLoggingConstruct) {
     NagSuppressions.addResourceSuppressionsByPath(toolboxStack, `/${toolboxStack.s3AccessLoggingConstruct?.node.path}/S3AccessLogs/Resource`, [
       {
@@ -0,0 +1,108 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Claim check for payloads of the rule tester state machines.
+
+Step Functions limits the state to 256 KB and copies it on every state
+transition. With CLAIM_CHECK_BUCKET set, payloads are stored in Amazon S3
+once the input of an execution or the output of a task exceeds
+TOOLBOX_CLAIM_CHECK_THRESHOLD bytes, and only a reference
+{"claimCheck": {"bucket": ..., "key": ...}} travels through the state
+machine. Functions resolve references only where they need the payload,
+e.g. ingest_message before publishing it, and the API resolves the ones
+left in the result of a test.
+"""
+
+import os
+import uuid
+from typing import Any, Dict, List
+
+from iottoolbox.serialization import dumps_bytes, loads
+
+CLAIM_CHECK_BUCKET = os.getenv("CLAIM_CHECK_BUCKET")
+CLAIM_CHECK_THRESHOLD = int(os.getenv("TOOLBOX_CLAIM_CHECK_THRESHOLD", "65536"))
+
+CLAIM_CHECK_KEY = "claimCheck"
+KEY_PREFIX = "payloads/"
+
+
+def is_reference(value: Any) -> bool:
+    if not isinstance(value, dict) or len(value) != 1:
+        return False
+    reference = value.get(CLAIM_CHECK_KEY)
+    return (
+        isinstance(reference, dict)
+        and isinstance(reference.get("bucket"), str)
+        and isinstance(reference.get("key"), str)
+    )
+
+
+def put_payload(s3_client, bucket: str, value: Any) -> Dict[str, Any]:
+    """Stores the payload and returns the reference replacing it."""
+    key = f"{KEY_PREFIX}{uuid.uuid4().hex}.json"
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=dumps_bytes(value),
+        ContentType="application/json",
+    )
+    return {CLAIM_CHECK_KEY: {"bucket": bucket, "key": key}}
+
+
+def offload_fields(
+    s3_client,
+    bucket: str,
+    items: List[Dict[str, Any]],
+    field: str,
+    size: int,
+    threshold: int = CLAIM_CHECK_THRESHOLD,
+) -> int:
+    """Stores the field of the items in S3, largest first, until the size of
+    the state is at most threshold. Returns the size of the state after
+    offloading."""
+    sizes = sorted(
+        (
+            (len(dumps_bytes(item[field])), i)
+            for i, item in enumerate(items)
+            if field in item and not is_reference(item[field])
+        ),
+        reverse=True,
+    )
+    for field_size, i in sizes:
+        if size <= threshold:
+            break
+        reference = put_payload(s3_client, bucket, items[i][field])
+        items[i][field] = reference
+        size -= field_size - len(dumps_bytes(reference))
+    return size
+
+
+def resolve(s3_client, value: Any) -> Any:
+    """Returns the payload a reference points to, other values as they are."""
+    if not is_reference(value):
+        return value
+    reference = value[CLAIM_CHECK_KEY]
+    response = s3_client.get_object(Bucket=reference["bucket"], Key=reference["key"])
+    return loads(response["Body"].read())
+
+
+def resolve_all(s3_client, value: Any) -> Any:
+    """Replaces all references in value with their payloads. Payloads don't
+    contain references, so they are not walked."""
+    if is_reference(value):
+        return resolve(s3_client, value)
+    stack = [value]
+    while stack:
+        current = stack.pop()
+        if isinstance(current, dict):
+            children = list(current.items())
+        elif isinstance(current, list):
+            children = list(enumerate(current))
+        else:
+            continue
+        for key, child in children:
+            if is_reference(child):
+                current[key] = resolve(s3_client, child)
+            elif isinstance(child, (dict, list)):
+                stack.append(child)
+    return value
@@ -0,0 +1,66 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Shared, lazily created boto3 clients.
+
+Creating a boto3 client (and importing boto3 itself) is a large part of a
+Lambda cold start. Modules declare their clients with lazy_client() at import
+time, the client is created on first use and cached for the lifetime of the
+execution environment. All clients use the same explicit botocore Config.
+"""
+
+import os
+import threading
+from typing import Any, Dict
+
+CONNECT_TIMEOUT_SECONDS = int(os.getenv("TOOLBOX_BOTO_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT_SECONDS = int(os.getenv("TOOLBOX_BOTO_READ_TIMEOUT", "10"))
+MAX_ATTEMPTS = int(os.getenv("TOOLBOX_BOTO_MAX_ATTEMPTS", "5"))
+MAX_POOL_CONNECTIONS = int(os.getenv("TOOLBOX_BOTO_MAX_POOL_CONNECTIONS", "20"))
+
+_clients: Dict[str, Any] = {}
+_lock = threading.Lock()
+
+
+def get_config():
+    from botocore.config import Config
+
+    return Config(
+        connect_timeout=CONNECT_TIMEOUT_SECONDS,
+        read_timeout=READ_TIMEOUT_SECONDS,
+        retries={"mode": "adaptive", "max_attempts": MAX_ATTEMPTS},
+        max_pool_connections=MAX_POOL_CONNECTIONS,
+        tcp_keepalive=True,
+    )
+
+
+def get_client(service_name: str):
+    """Returns the cached client of a service, creating it on first use."""
+    client = _clients.get(service_name)
+    if client is None:
+        # the default boto3 session isn't thread-safe while creating clients
+        with _lock:
+            client = _clients.get(service_name)
+            if client is None:
+                import boto3
+
+                client = boto3.client(service_name, config=get_config())
+                _clients[service_name] = client
+    return client
+
+
+class LazyClient:
+    """Proxy that creates the client on first attribute access."""
+
+    def __init__(self, service_name: str):
+        self.service_name = service_name
+
+    def __getattr__(self, name: str):
+        return getattr(get_client(self.service_name), name)
+
+    def __repr__(self):
+        return f"LazyClient({self.service_name!r})"
+
+
+def lazy_client(service_name: str) -> LazyClient:
+    return LazyClient(service_name)
@@ -0,0 +1,100 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Results of asynchronously submitted rule tests.
+
+Submitted executions are stored with status RUNNING, the final status and
+output are stored when Step Functions reports the end of the execution.
+Polls only read the table and never call DescribeExecution. Items expire
+after TOOLBOX_RESULT_TTL_SECONDS. Only executions named with
+ASYNC_EXECUTION_PREFIX are stored, synchronous tests and the executions
+started by the state machines themselves are never polled.
+"""
+
+import os
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+from iottoolbox.serialization import loads
+
+RESULT_TTL_SECONDS = int(os.getenv("TOOLBOX_RESULT_TTL_SECONDS", "3600"))
+
+RUNNING = "RUNNING"
+# also matched by the rule triggering store_test_result, see api/infrastructure.ts
+ASYNC_EXECUTION_PREFIX = "async-"
+
+
+def get_execution_id(execution_arn: str) -> str:
+    return execution_arn.split(":")[-1]
+
+
+def get_async_execution_name() -> str:
+    return f"{ASYNC_EXECUTION_PREFIX}{uuid.uuid4()}"
+
+
+def is_async_execution(execution_arn: str) -> bool:
+    return get_execution_id(execution_arn).startswith(ASYNC_EXECUTION_PREFIX)
+
+
+def get_expires_at(now: Optional[float] = None) -> str:
+    return str(int((now or time.time()) + RESULT_TTL_SECONDS))
+
+
+def put_running(dynamodb_client, table_name: str, execution_arn: str):
+    """Stores a submitted execution, unless its result was already stored."""
+    try:
+        dynamodb_client.put_item(
+            TableName=table_name,
+            Item={
+                "executionId": {"S": get_execution_id(execution_arn)},
+                "executionArn": {"S": execution_arn},
+                "status": {"S": RUNNING},
+                "expiresAt": {"N": get_expires_at()},
+            },
+            ConditionExpression="attribute_not_exists(executionId)",
+        )
+    except Exception as e:
+        # fast executions can finish before they are stored as running
+        if e.__class__.__name__ != "ConditionalCheckFailedException":
+            raise e
+
+
+def put_result(
+    dynamodb_client,
+    table_name: str,
+    execution_arn: str,
+    status: str,
+    output: Optional[str] = None,
+    error: Optional[str] = None,
+):
+    item = {
+        "executionId": {"S": get_execution_id(execution_arn)},
+        "executionArn": {"S": execution_arn},
+        "status": {"S": status},
+        "expiresAt": {"N": get_expires_at()},
+    }
+    if output is not None:
+        item["output"] = {"S": output}
+    if error is not None:
+        item["error"] = {"S": error}
+    dynamodb_client.put_item(TableName=table_name, Item=item)
+
+
+def get_result(
+    dynamodb_client, table_name: str, execution_id: str
+) -> Optional[Dict[str, Any]]:
+    response = dynamodb_client.get_item(
+        TableName=table_name,
+        Key={"executionId": {"S": execution_id}},
+        ConsistentRead=True,
+    )
+    item = response.get("Item")
+    if item is None:
+        return None
+    return {
+        "executionId": execution_id,
+        "status": item["status"]["S"],
+        "output": loads(item["output"]["S"]) if "output" in item else None,
+        "error": item["error"]["S"] if "error" in item else None,
+    }
@@ -0,0 +1,299 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Transports publishing test messages to the basic ingest topic of a rule.
+
+HttpsTransport calls the Publish API of the IoT data plane, one request per
+message. MqttTransport keeps an MQTT 5 connection to AWS IoT Core open for
+the lifetime of the execution environment. QoS 1 publishes are pipelined
+and the user and MQTT properties of the test are sent as MQTT 5 properties.
+Messages that can't be published over MQTT, e.g. while the connection is
+down after the execution environment was frozen, fall back to HTTPS.
+
+Set TOOLBOX_INGEST_TRANSPORT=mqtt and IOT_DATA_ENDPOINT to use MQTT. It
+needs the awscrt package, e.g. from an additional layer, and falls back to
+HTTPS if it isn't installed. Compare the transports with
+benchmarks/bench_ingest_transport.py.
+"""
+
+import base64
+import importlib.util
+import os
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from typing import Any, Dict, Iterable, List, Optional
+
+INGEST_TRANSPORT = os.getenv("TOOLBOX_INGEST_TRANSPORT", "https")
+IOT_DATA_ENDPOINT = os.getenv("IOT_DATA_ENDPOINT", None)
+CLIENT_ID_PREFIX = os.getenv("TOOLBOX_MQTT_CLIENT_ID_PREFIX", "iottoolbox-ingest")
+CONNECT_TIMEOUT_SECONDS = float(os.getenv("TOOLBOX_MQTT_CONNECT_TIMEOUT", "1"))
+# below the heartbeat timeout of the ingest tasks, so the fallback still counts
+PUBLISH_TIMEOUT_SECONDS = float(os.getenv("TOOLBOX_MQTT_PUBLISH_TIMEOUT", "1"))
+MAX_IN_FLIGHT = int(os.getenv("TOOLBOX_MQTT_MAX_IN_FLIGHT", "100"))
+KEEP_ALIVE_SECONDS = 60
+
+# PUBACK reason codes below 0x80 are successful
+PUBACK_ERROR = 0x80
+
+
+class IngestTransport(ABC):
+    """Publishes requests in the format of the IoT data plane Publish API."""
+
+    name = None
+
+    @abstractmethod
+    def publish(self, request: Dict[str, Any]) -> Dict[str, Any]: ...
+
+    def publish_many(self, requests: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [self.publish(request) for request in requests]
+
+
+class HttpsTransport(IngestTransport):
+    name = "https"
+
+    def __init__(self, iot_data_client):
+        self.iot_data_client = iot_data_client
+
+    def publish(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        return self.iot_data_client.publish(**request)
+
+
+def get_publish_packet(request: Dict[str, Any]) -> Dict[str, Any]:
+    """Maps a Publish API request to the fields of an MQTT 5 PUBLISH packet."""
+    packet = {
+        "topic": request["topic"],
+        "payload": request["payload"],
+        "qos": request.get("qos", 1),
+    }
+    user_properties = [
+        (str(name), str(value))
+        for user_property in request.get("userProperties", [])
+        for name, value in user_property.items()
+    ]
+    if user_properties:
+        packet["user_properties"] = user_properties
+    if "contentType" in request:
+        packet["content_type"] = request["contentType"]
+    if "payloadFormatIndicator" in request:
+        packet["utf8"] = request["payloadFormatIndicator"] == "UTF8_DATA"
+    if "responseTopic" in request:
+        packet["response_topic"] = request["responseTopic"]
+    if "correlationData" in request:
+        # base64 encoded in the Publish API, binary in MQTT
+        packet["correlation_data"] = base64.b64decode(request["correlationData"])
+    if "messageExpiry" in request:
+        packet["message_expiry"] = int(request["messageExpiry"])
+    return packet
+
+
+class MqttTransport(IngestTransport):
+    """Publishes over a persistent MQTT 5 connection and falls back to
+    another transport for messages that couldn't be published.
+
+    The connection publishes packets from get_publish_packet and returns a
+    Future per publish, resolving to the PUBACK reason code.
+    """
+
+    name = "mqtt"
+
+    def __init__(
+        self,
+        connection,
+        fallback: IngestTransport,
+        connect_timeout: float = CONNECT_TIMEOUT_SECONDS,
+        publish_timeout: float = PUBLISH_TIMEOUT_SECONDS,
+        max_in_flight: int = MAX_IN_FLIGHT,
+    ):
+        self.connection = connection
+        self.fallback = fallback
+        self.connect_timeout = connect_timeout
+        self.publish_timeout = publish_timeout
+        self.max_in_flight = max_in_flight
+        self.fallbacks = 0
+
+    def publish(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        return self.publish_many([request])[0]
+
+    def publish_many(self, requests: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        requests = list(requests)
+        if not self.connection.wait_connected(self.connect_timeout):
+            return self._publish_fallback(requests, "not connected")
+
+        responses = []
+        for i in range(0, len(requests), self.max_in_flight):
+            window = requests[i : i + self.max_in_flight]
+            # all publishes of a window are sent before waiting for a PUBACK
+            futures = [self._send(request) for request in window]
+            for request, future in zip(window, futures):
+                responses.append(self._wait(request, future))
+        return responses
+
+    def _send(self, request: Dict[str, Any]) -> Future:
+        try:
+            return self.connection.publish(get_publish_packet(request))
+        except Exception as e:
+            future = Future()
+            future.set_exception(e)
+            return future
+
+    def _wait(self, request: Dict[str, Any], future: Future) -> Dict[str, Any]:
+        try:
+            reason_code = future.result(timeout=self.publish_timeout)
+        except Exception as e:
+            # a message that timed out can still arrive, like any QoS 1
+            # message it can be ingested more than once
+            return self._publish_fallback([request], repr(e))[0]
+        if reason_code >= PUBACK_ERROR:
+            return self._publish_fallback([request], f"PUBACK {reason_code}")[0]
+        return {"transport": self.name, "reasonCode": reason_code}
+
+    def _publish_fallback(
+        self, requests: List[Dict[str, Any]], reason: str
+    ) -> List[Dict[str, Any]]:
+        self.fallbacks += len(requests)
+        responses = self.fallback.publish_many(requests)
+        return [
+            {**response, "transport": self.fallback.name, "fallbackReason": reason}
+            for response in responses
+        ]
+
+
+def crt_available() -> bool:
+    return importlib.util.find_spec("awscrt") is not None
+
+
+class CrtMqttConnection:
+    """MQTT 5 client of the AWS Common Runtime with a connection status.
+
+    With a region, the client connects to AWS IoT Core over websockets
+    signed with the credentials of the function. Without a region it uses a
+    plain TCP connection, e.g. to a local broker. awscrt is only imported
+    here, functions publishing over HTTPS don't load it.
+    """
+
+    def __init__(
+        self,
+        host_name: str,
+        port: Optional[int] = None,
+        region: Optional[str] = None,
+        client_id: Optional[str] = None,
+    ):
+        from awscrt import mqtt5
+
+        self._mqtt5 = mqtt5
+        self._connected = threading.Event()
+        options = dict(
+            host_name=host_name,
+            port=port or (443 if region else 1883),
+            connect_options=mqtt5.ConnectPacket(
+                client_id=client_id or f"{CLIENT_ID_PREFIX}-{uuid.uuid4().hex}",
+                keep_alive_interval_sec=KEEP_ALIVE_SECONDS,
+            ),
+            session_behavior=mqtt5.ClientSessionBehaviorType.CLEAN,
+            # messages published while disconnected fall back to HTTPS
+            offline_queue_behavior=mqtt5.ClientOperationQueueBehaviorType.FAIL_ALL_ON_DISCONNECT,
+            ack_timeout_sec=max(int(PUBLISH_TIMEOUT_SECONDS), 1),
+            on_lifecycle_event_connection_success_fn=lambda _: self._connected.set(),
+            on_lifecycle_event_disconnection_fn=lambda _: self._connected.clear(),
+            on_lifecycle_event_stopped_fn=lambda _: self._connected.clear(),
+        )
+        if region:
+            from awscrt import io
+
+            options["tls_ctx"] = io.ClientTlsContext(io.TlsContextOptions())
+            options["websocket_handshake_transform"] = self._get_signer(region)
+        self.client = mqtt5.Client(mqtt5.ClientOptions(**options))
+        self.client.start()
+
+    @staticmethod
+    def _get_signer(region: str):
+        from awscrt import auth
+
+        credentials_provider = auth.AwsCredentialsProvider.new_default_chain()
+
+        def sign_handshake(transform_args):
+            try:
+                signing_config = auth.AwsSigningConfig(
+                    algorithm=auth.AwsSigningAlgorithm.V4,
+                    signature_type=auth.AwsSignatureType.HTTP_REQUEST_QUERY_PARAMS,
+                    credentials_provider=credentials_provider,
+                    region=region,
+                    service="iotdevicegateway",
+                    # AWS IoT expects the session token unsigned
+                    omit_session_token=True,
+                )
+                signing = auth.aws_sign_request(
+                    transform_args.http_request, signing_config
+                )
+                signing.add_done_callback(
+                    lambda f: transform_args.set_done(f.exception())
+                )
+            except Exception as e:
+                transform_args.set_done(e)
+
+        return sign_handshake
+
+    def _get_format_indicator(self, utf8: Optional[bool]):
+        if utf8 is None:
+            return None
+        if utf8:
+            return self._mqtt5.PayloadFormatIndicator.AWS_MQTT5_PFI_UTF8
+        return self._mqtt5.PayloadFormatIndicator.AWS_MQTT5_PFI_BYTES
+
+    def wait_connected(self, timeout: float) -> bool:
+        return self._connected.wait(timeout)
+
+    def publish(self, packet: Dict[str, Any]) -> Future:
+        mqtt5 = self._mqtt5
+        publish = self.client.publish(
+            mqtt5.PublishPacket(
+                topic=packet["topic"],
+                payload=packet["payload"],
+                qos=mqtt5.QoS(packet["qos"]),
+                user_properties=[
+                    mqtt5.UserProperty(name, value)
+                    for name, value in packet.get("user_properties", [])
+                ],
+                content_type=packet.get("content_type"),
+                payload_format_indicator=self._get_format_indicator(packet.get("utf8")),
+                response_topic=packet.get("response_topic"),
+                correlation_data=packet.get("correlation_data"),
+                message_expiry_interval_sec=packet.get("message_expiry"),
+            )
+        )
+        reason_code = Future()
+
+        def on_done(f):
+            try:
+                puback = f.result().puback
+                # QoS 0 publishes complete without a PUBACK
+                reason_code.set_result(int(puback.reason_code) if puback else 0)
+            except Exception as e:
+                reason_code.set_exception(e)
+
+        publish.add_done_callback(on_done)
+        return reason_code
+
+    def stop(self):
+        self.client.stop()
+
+
+def get_ingest_transport(
+    iot_data_client,
+    transport: str = INGEST_TRANSPORT,
+    endpoint: Optional[str] = IOT_DATA_ENDPOINT,
+    region: Optional[str] = os.getenv("AWS_REGION"),
+) -> IngestTransport:
+    https = HttpsTransport(iot_data_client)
+    transport = transport.lower()
+    if transport == "https":
+        return https
+    if transport != "mqtt":
+        raise ValueError(f"Unknown ingest transport {transport}")
+    if not crt_available():
+        return https
+    if not endpoint:
+        raise Exception("IOT_DATA_ENDPOINT environment variable not defined")
+    return MqttTransport(CrtMqttConnection(endpoint, region=region), https)
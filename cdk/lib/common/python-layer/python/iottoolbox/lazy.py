@@ -0,0 +1,33 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Optional deferred imports for modules that aren't needed on every path.
+
+With TOOLBOX_LAZY_IMPORTS=true, lazy_import() returns a module that is only
+executed on first attribute access. This moves the import cost from the cold
+start to the first invocation that actually needs the module. Otherwise the
+module is imported immediately, so import errors surface at init time.
+Compare both modes with benchmarks/bench_cold_start.py.
+"""
+
+import importlib
+import importlib.util
+import os
+import sys
+
+LAZY_IMPORTS = os.getenv("TOOLBOX_LAZY_IMPORTS", "false").lower() == "true"
+
+
+def lazy_import(name: str, lazy: bool = LAZY_IMPORTS):
+    if name in sys.modules or not lazy:
+        return importlib.import_module(name)
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,101 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Limits how much of the messages the Lambda functions log.
+
+With TOOLBOX_LOG_MODE=full, events and requests are logged as they are.
+With TOOLBOX_LOG_MODE=summary, only a summary of payloads is logged at info
+level: the encoded size, the top-level keys and a hash to correlate the same
+payload across functions. The payload itself, with task tokens redacted and
+long strings truncated, is logged at debug level, or for a sampled share of
+invocations (TOOLBOX_LOG_SAMPLE_RATE). Summaries and redacted payloads are
+only built if they are logged. Compare the modes with
+benchmarks/bench_log_budget.py.
+"""
+
+import hashlib
+import logging
+import os
+import random
+from typing import Any
+
+from iottoolbox.serialization import dumps_bytes
+
+LOG_MODE = os.getenv("TOOLBOX_LOG_MODE", "full").lower()
+SAMPLE_RATE = float(os.getenv("TOOLBOX_LOG_SAMPLE_RATE", "0"))
+
+REDACTED_KEYS = frozenset({"taskToken", "sfnTaskToken"})
+REDACTED = "***"
+MAX_KEYS = 20
+MAX_STRING_LENGTH = 256
+MAX_ITEMS = 20
+MAX_DEPTH = 8
+
+_sampled = False
+
+
+def summarize(payload: Any) -> dict:
+    if isinstance(payload, dict):
+        payload = {k: v for k, v in payload.items() if k not in REDACTED_KEYS}
+    encoded = dumps_bytes(payload)
+    summary = {
+        "size": len(encoded),
+        "sha256": hashlib.sha256(encoded).hexdigest()[:16],
+    }
+    if isinstance(payload, dict):
+        keys = list(payload)
+        summary["keys"] = keys[:MAX_KEYS]
+        if len(keys) > MAX_KEYS:
+            summary["moreKeys"] = len(keys) - MAX_KEYS
+    elif isinstance(payload, list):
+        summary["items"] = len(payload)
+    return summary
+
+
+def redact(payload: Any, depth: int = 0) -> Any:
+    """Returns a copy without task tokens, with long strings and lists
+    truncated and objects below MAX_DEPTH elided."""
+    if isinstance(payload, str):
+        if len(payload) > MAX_STRING_LENGTH:
+            return f"{payload[:MAX_STRING_LENGTH]}...({len(payload)} chars)"
+        return payload
+    if not isinstance(payload, (dict, list)):
+        return payload
+    if depth >= MAX_DEPTH:
+        return "..."
+    if isinstance(payload, dict):
+        return {
+            k: REDACTED if k in REDACTED_KEYS else redact(v, depth + 1)
+            for k, v in payload.items()
+        }
+    items = [redact(v, depth + 1) for v in payload[:MAX_ITEMS]]
+    if len(payload) > MAX_ITEMS:
+        items.append(f"...({len(payload)} items)")
+    return items
+
+
+def log_payload(logger, message: str, payload: Any, key: str = "payload"):
+    if LOG_MODE != "summary":
+        logger.info(message, extra={key: payload})
+        return
+
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(message, extra={f"{key}Summary": summarize(payload)})
+    if _sampled:
+        logger.info(message, extra={key: redact(payload), "sampled": True})
+    elif logger.isEnabledFor(logging.DEBUG):
+        logger.debug(message, extra={key: redact(payload)})
+
+
+def log_event(logger, event: Any):
+    """Logs the event of an invocation, call once at the start of a handler.
+
+    Also decides if the payloads of this invocation are sampled.
+    """
+    global _sampled
+    _sampled = SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+
+    if LOG_MODE != "summary":
+        logger.info(event)
+        return
+    log_payload(logger, "Event", event, key="event")
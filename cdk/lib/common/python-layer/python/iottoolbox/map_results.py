@@ -0,0 +1,57 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Results of the distributed Map state of the batch message state machine.
+
+The Map writes the results of its child executions to Amazon S3 instead of
+its state, so batches aren't limited by the state size. Its output is only
+{"ResultWriterDetails": {"Bucket": ..., "Key": <manifest>}}, the manifest
+lists the result files of succeeded and failed child executions. Child
+executions don't finish in the order of the input, every item carries its
+index, see ITEM_INDEX_KEY.
+"""
+
+from typing import Any, Dict, List
+
+from iottoolbox.serialization import loads
+
+RESULT_WRITER_DETAILS = "ResultWriterDetails"
+ITEM_INDEX_KEY = "itemIndex"
+RESULT_FILE_STATUSES = ("SUCCEEDED", "FAILED")
+
+
+def is_written(results: Any) -> bool:
+    """Returns True if the results were written to S3 by the Map state."""
+    return isinstance(results, dict) and RESULT_WRITER_DETAILS in results
+
+
+def _read_json(s3_client, bucket: str, key: str) -> Any:
+    response = s3_client.get_object(Bucket=bucket, Key=key)
+    return loads(response["Body"].read())
+
+
+def get_item_result(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Returns the output of a child execution, or its input with the error
+    of the execution if it failed."""
+    if entry.get("Status") == "SUCCEEDED" and entry.get("Output"):
+        return loads(entry["Output"])
+    item = loads(entry["Input"]) if entry.get("Input") else {}
+    item["error"] = {
+        "Error": entry.get("Error") or entry.get("Status", "States.TaskFailed"),
+        "Cause": entry.get("Cause"),
+    }
+    return item
+
+
+def read_results(s3_client, results: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Returns the results of the child executions in the order of the items."""
+    details = results[RESULT_WRITER_DETAILS]
+    manifest = _read_json(s3_client, details["Bucket"], details["Key"])
+    bucket = manifest.get("DestinationBucket", details["Bucket"])
+    items = []
+    for status in RESULT_FILE_STATUSES:
+        for result_file in manifest.get("ResultFiles", {}).get(status, []):
+            for entry in _read_json(s3_client, bucket, result_file["Key"]):
+                items.append(get_item_result(entry))
+    items.sort(key=lambda item: item.get(ITEM_INDEX_KEY, 0))
+    return items
@@ -0,0 +1,121 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Cache of recently captured topic messages.
+
+The getMessage rule of a topic message test hands the captured message to
+receive_message, which stores it as the latest message of its topic filter.
+Tests with a maxMessageAge are answered from the cache if the latest
+message of their topic filter is recent enough, instead of waiting for the
+next message of the device.
+
+getMessage rules only capture the properties the statement of the test
+reads. Cached messages are only served to tests that read a subset of the
+properties captured with them.
+
+The cache holds one message per topic filter. Messages larger than
+TOOLBOX_MESSAGE_CACHE_MAX_BYTES are not cached and messages expire after
+TOOLBOX_MESSAGE_CACHE_TTL_SECONDS.
+"""
+
+import os
+import time
+from typing import Any, Dict, FrozenSet, Iterable, Optional
+
+from iottoolbox.serialization import dumps, loads
+
+MESSAGE_CACHE_TTL_SECONDS = int(os.getenv("TOOLBOX_MESSAGE_CACHE_TTL_SECONDS", "600"))
+MESSAGE_CACHE_MAX_BYTES = int(os.getenv("TOOLBOX_MESSAGE_CACHE_MAX_BYTES", "65536"))
+
+# keys of the topic filter and captured properties in the output of the
+# getMessage rule
+TOPIC_FILTER_KEY = "captureTopicFilter"
+CAPTURED_PROPERTIES_KEY = "captureProperties"
+
+USER_PROPERTIES = "user_properties"
+# get_mqtt_property names mapped to the property names of the rule tester
+MQTT_PROPERTIES = {
+    "content_type": "contentType",
+    "format_indicator": "payloadFormatIndicator",
+    "response_topic": "responseTopic",
+    "correlation_data": "correlationData",
+}
+CAPTURE_PROPERTIES: FrozenSet[str] = frozenset([USER_PROPERTIES, *MQTT_PROPERTIES])
+
+
+def parse_captured_properties(captured_properties: Optional[str]) -> FrozenSet[str]:
+    """Parses the comma separated properties of a getMessage rule output,
+    messages of rules without the list have all properties."""
+    if captured_properties is None:
+        return CAPTURE_PROPERTIES
+    return frozenset(name for name in captured_properties.split(",") if name)
+
+
+def put_message(
+    dynamodb_client,
+    table_name: str,
+    topic_filter: str,
+    captured: Dict[str, Any],
+    now: Optional[float] = None,
+    properties: Iterable[str] = CAPTURE_PROPERTIES,
+) -> bool:
+    """Stores the captured message and its properties as the latest message
+    of the topic filter. Returns False if the message was too large or a
+    newer message was already stored."""
+    data = dumps(
+        {"message": captured.get("message"), "properties": captured.get("properties")}
+    )
+    if len(data) > MESSAGE_CACHE_MAX_BYTES:
+        return False
+
+    now = now or time.time()
+    try:
+        dynamodb_client.put_item(
+            TableName=table_name,
+            Item={
+                "topicFilter": {"S": topic_filter},
+                "data": {"S": data},
+                "capturedAt": {"N": str(now)},
+                "properties": {"S": ",".join(sorted(properties))},
+                "expiresAt": {"N": str(int(now + MESSAGE_CACHE_TTL_SECONDS))},
+            },
+            ConditionExpression="attribute_not_exists(capturedAt) OR capturedAt < :capturedAt",
+            ExpressionAttributeValues={":capturedAt": {"N": str(now)}},
+        )
+        return True
+    except Exception as e:
+        # concurrent tests of the same topic filter capture the same messages
+        if e.__class__.__name__ != "ConditionalCheckFailedException":
+            raise e
+        return False
+
+
+def get_message(
+    dynamodb_client,
+    table_name: str,
+    topic_filter: str,
+    max_age: float,
+    properties: Iterable[str] = CAPTURE_PROPERTIES,
+    now: Optional[float] = None,
+) -> Optional[Dict[str, Any]]:
+    """Returns the latest message of the topic filter with its properties and
+    capture time, or None if there is none captured within max_age seconds
+    or it lacks some of the properties."""
+    response = dynamodb_client.get_item(
+        TableName=table_name, Key={"topicFilter": {"S": topic_filter}}
+    )
+    item = response.get("Item")
+    if item is None:
+        return None
+
+    # expired items are only deleted eventually
+    captured_at = float(item["capturedAt"]["N"])
+    if captured_at + max_age < (now or time.time()):
+        return None
+    captured_properties = item.get("properties", {}).get("S")
+    if not parse_captured_properties(captured_properties).issuperset(properties):
+        return None
+
+    captured = loads(item["data"]["S"])
+    captured["capturedAt"] = captured_at
+    return captured
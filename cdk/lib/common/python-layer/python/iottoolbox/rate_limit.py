@@ -0,0 +1,247 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Client-side rate limiting of the AWS IoT control plane.
+
+Concurrent rule tests create and delete topic rules from several Lambda
+functions, and CreateTopicRule and DeleteTopicRule have low account-wide TPS
+limits. The functions wrap their IoT client with rate_limited(), which takes
+a token before every call of these operations and retries throttled calls
+with backoff once the retries of botocore are exhausted.
+
+With RATE_LIMIT_TABLE set, the tokens are shared by all functions through a
+DynamoDB counter per bucket and second, so the account stays below
+TOOLBOX_IOT_RULE_TPS however many tests run at once. Calls exceeding the
+limit wait for the next second, for at most TOOLBOX_RATE_LIMIT_MAX_WAIT
+seconds. Without a table every execution environment has its own bucket.
+"""
+
+import os
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Iterable, Optional
+
+from iottoolbox.clients import lazy_client
+
+IOT_RULE_TPS = int(os.getenv("TOOLBOX_IOT_RULE_TPS", "5"))
+MAX_WAIT_SECONDS = float(os.getenv("TOOLBOX_RATE_LIMIT_MAX_WAIT", "10"))
+THROTTLE_MAX_ATTEMPTS = int(os.getenv("TOOLBOX_THROTTLE_MAX_ATTEMPTS", "3"))
+THROTTLE_BASE_DELAY = 1.0
+THROTTLE_MAX_DELAY = 8.0
+
+IOT_RULE_OPERATIONS = ("create_topic_rule", "delete_topic_rule")
+THROTTLING_ERROR_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "LimitExceededException",
+}
+
+
+class RateLimitExceededException(Exception):
+    pass
+
+
+def is_throttling(e: Exception) -> bool:
+    response = getattr(e, "response", None)
+    if isinstance(response, dict):
+        code = response.get("Error", {}).get("Code")
+        if code:
+            return code in THROTTLING_ERROR_CODES
+    return e.__class__.__name__ in THROTTLING_ERROR_CODES
+
+
+class RateLimiter(ABC):
+    """Hands out tokens at a fixed rate.
+
+    acquire() blocks until a token is available and returns the seconds it
+    waited, or raises RateLimitExceededException after timeout seconds.
+    """
+
+    @abstractmethod
+    def acquire(self, timeout: float = MAX_WAIT_SECONDS) -> float: ...
+
+
+class LocalTokenBucket(RateLimiter):
+    """Token bucket of a single execution environment."""
+
+    def __init__(
+        self,
+        rate: float,
+        burst: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.rate = rate
+        self.burst = burst or rate
+        self._tokens = self.burst
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _take(self) -> float:
+        """Takes a token, returns the seconds until one is available if there
+        is none."""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            # tolerate the rounding of refilled tokens
+            if self._tokens >= 1 - 1e-9:
+                self._tokens = max(self._tokens - 1, 0)
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self, timeout: float = MAX_WAIT_SECONDS) -> float:
+        waited = 0.0
+        while True:
+            wait = self._take()
+            if wait == 0:
+                return waited
+            if waited + wait > timeout:
+                raise RateLimitExceededException(
+                    f"No token available within {timeout} seconds"
+                )
+            self._sleep(wait)  # nosemgrep: arbitrary-sleep
+            waited += wait
+
+
+class DynamoDbRateLimiter(RateLimiter):
+    """Rate limiter shared through a DynamoDB counter per one second window.
+
+    Taking a token is a single conditional update. The counters expire
+    through the TTL of the table.
+    """
+
+    def __init__(
+        self,
+        dynamodb_client,
+        table_name: str,
+        bucket: str,
+        rate: int,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep,
+        rand: Callable[[], float] = random.random,
+    ):
+        self.dynamodb_client = dynamodb_client
+        self.table_name = table_name
+        self.bucket = bucket
+        self.rate = rate
+        self._clock = clock
+        self._sleep = sleep
+        self._rand = rand
+
+    def _take(self, window: int) -> bool:
+        try:
+            self.dynamodb_client.update_item(
+                TableName=self.table_name,
+                Key={"bucket": {"S": f"{self.bucket}#{window}"}},
+                UpdateExpression="ADD #count :one SET expiresAt = :expiresAt",
+                ConditionExpression="attribute_not_exists(#count) OR #count < :rate",
+                ExpressionAttributeNames={"#count": "count"},
+                ExpressionAttributeValues={
+                    ":one": {"N": "1"},
+                    ":rate": {"N": str(self.rate)},
+                    ":expiresAt": {"N": str(window + 60)},
+                },
+            )
+            return True
+        except Exception as e:
+            if e.__class__.__name__ != "ConditionalCheckFailedException":
+                raise e
+            return False
+
+    def acquire(self, timeout: float = MAX_WAIT_SECONDS) -> float:
+        started = self._clock()
+        while True:
+            now = self._clock()
+            if self._take(int(now)):
+                return now - started
+            # spread the waiting callers over the next window
+            wait = int(now) + 1 - now + self._rand() * 0.5 / self.rate
+            if now + wait - started > timeout:
+                raise RateLimitExceededException(
+                    f"No token available within {timeout} seconds"
+                )
+            self._sleep(wait)  # nosemgrep: arbitrary-sleep
+
+
+def get_max_call_seconds(
+    max_attempts: int = THROTTLE_MAX_ATTEMPTS, max_wait: float = MAX_WAIT_SECONDS
+) -> float:
+    """Returns how long a rate limited call waits at most, for tokens and
+    between throttled attempts, without the calls themselves."""
+    backoff = sum(
+        min(THROTTLE_BASE_DELAY * 2**attempt, THROTTLE_MAX_DELAY)
+        for attempt in range(max_attempts - 1)
+    )
+    return max_attempts * max_wait + backoff
+
+
+def call_with_backoff(
+    limiter: Optional[RateLimiter],
+    fn: Callable,
+    *args,
+    max_attempts: int = THROTTLE_MAX_ATTEMPTS,
+    sleep: Optional[Callable[[float], None]] = None,
+    rand: Optional[Callable[[], float]] = None,
+    **kwargs,
+):
+    """Calls fn after taking a token, retries throttled calls with capped
+    exponential backoff and jitter. Every attempt takes a token."""
+    sleep = sleep or time.sleep
+    rand = rand or random.random
+    delay = THROTTLE_BASE_DELAY
+    for attempt in range(1, max_attempts + 1):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt == max_attempts or not is_throttling(e):
+                raise e
+        sleep(delay / 2 + rand() * delay / 2)  # nosemgrep: arbitrary-sleep
+        delay = min(delay * 2, THROTTLE_MAX_DELAY)
+
+
+class RateLimitedClient:
+    """Proxy of a boto3 client that rate limits the given operations."""
+
+    def __init__(
+        self,
+        client,
+        limiter: Optional[RateLimiter],
+        operations: Iterable[str] = IOT_RULE_OPERATIONS,
+    ):
+        self.client = client
+        self.limiter = limiter
+        self.operations = frozenset(operations)
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self.client, name)
+        if name not in self.operations:
+            return attribute
+
+        def call(*args, **kwargs):
+            return call_with_backoff(self.limiter, attribute, *args, **kwargs)
+
+        return call
+
+
+def get_rate_limiter(bucket: str = "iot-rules") -> RateLimiter:
+    table_name = os.getenv("RATE_LIMIT_TABLE")
+    if table_name:
+        return DynamoDbRateLimiter(
+            lazy_client("dynamodb"), table_name, bucket, IOT_RULE_TPS
+        )
+    return LocalTokenBucket(IOT_RULE_TPS)
+
+
+def rate_limited(client, bucket: str = "iot-rules") -> RateLimitedClient:
+    """Wraps an IoT client so topic rule operations share the account-wide
+    rate limit."""
+    return RateLimitedClient(client, get_rate_limiter(bucket))
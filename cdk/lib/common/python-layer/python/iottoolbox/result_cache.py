@@ -0,0 +1,216 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Cache of the results of custom and batch message tests.
+
+The result of a test only depends on the statement, the SQL version, the
+mode and the messages with their properties. Results are stored under a hash
+of these fields, so identical requests are answered without running the test
+again. Topic message tests depend on the next message of a device and are
+never cached, neither are statements calling NONDETERMINISTIC_FUNCTIONS.
+
+Set TOOLBOX_RESULT_CACHE to "memory" to cache results per Lambda container,
+to "dynamodb" to share them through RESULT_CACHE_TABLE or to "none". Results
+expire after TOOLBOX_RESULT_CACHE_TTL_SECONDS and results larger than
+TOOLBOX_RESULT_CACHE_MAX_BYTES are not cached.
+"""
+
+import hashlib
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from iottoolbox.rule_pool import normalize_sql
+from iottoolbox.serialization import dumps, loads
+from iottoolbox.sql import (
+    DEFAULT_SQL_VERSION,
+    SqlSyntaxError,
+    iter_function_calls,
+    parse,
+)
+from iottoolbox.sql_eval import ENVIRONMENT_FUNCTIONS, NO_MATCH_ERROR, SQL_PARSE_ERROR
+
+RESULT_CACHE = os.getenv("TOOLBOX_RESULT_CACHE", "memory")
+RESULT_CACHE_TABLE = os.getenv("RESULT_CACHE_TABLE", None)
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("TOOLBOX_RESULT_CACHE_TTL_SECONDS", "300"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("TOOLBOX_RESULT_CACHE_MAX_BYTES", "65536"))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("TOOLBOX_RESULT_CACHE_MAX_ENTRIES", "256"))
+
+# the request fields the result depends on
+KEY_FIELDS = ("mode", "message", "messages", "userProperties", "mqttProperties")
+
+# errors of the rule tests that are the same for every run, rule action
+# errors and timeouts of the execution can be transient
+CACHEABLE_ERRORS = (None, SQL_PARSE_ERROR)
+
+# functions whose result can change between runs of the same test
+NONDETERMINISTIC_FUNCTIONS = ENVIRONMENT_FUNCTIONS | frozenset(
+    [
+        "rand",
+        "traceid",
+        "aws_lambda",
+        "get_dynamodb",
+        "get_registry_data",
+        "get_secret",
+        "get_thing_shadow",
+        "machinelearning_predict",
+    ]
+)
+
+HIT = "hit"
+MISS = "miss"
+
+
+def get_cache_key(event: Dict[str, Any]) -> Optional[str]:
+    """Returns the hash of the request, or None if the test can't be cached."""
+    if "message" not in event and "messages" not in event:
+        return None
+    if not isinstance(event.get("sql"), str):
+        return None
+    sql_version = event.get("awsIotSqlVersion") or DEFAULT_SQL_VERSION
+    try:
+        statement = parse(event["sql"], sql_version)
+    except SqlSyntaxError:
+        return None
+    for call in iter_function_calls(statement):
+        if call.name.lower() in NONDETERMINISTIC_FUNCTIONS:
+            return None
+    canonical = {
+        "sql": normalize_sql(event["sql"]),
+        "awsIotSqlVersion": sql_version,
+        **{name: event[name] for name in KEY_FIELDS if name in event},
+    }
+    # independent of the JSON backend and the key order of the request
+    data = json.dumps(canonical, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def is_cacheable(result: Dict[str, Any], exact_no_match: bool = False) -> bool:
+    """Returns True if the result is the same for every run of the test.
+
+    Messages not matching the WHERE clause are only cached with
+    exact_no_match, i.e. if the local evaluator decided it exactly. In the
+    state machines it is the heartbeat timeout of a task, which can be
+    transient.
+    """
+    errors = CACHEABLE_ERRORS + ((NO_MATCH_ERROR,) if exact_no_match else ())
+    if result.get("error") not in errors:
+        return False
+    return all(item.get("error") in errors for item in result.get("results", []))
+
+
+class ResultCache(ABC):
+    """Stores results of rule tests by cache key.
+
+    Results are stored as JSON, lookups return a new copy.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    def put(self, key: str, result: Dict[str, Any]) -> bool: ...
+
+
+class InMemoryResultCache(ResultCache):
+    """LRU cache of results, kept per Lambda container."""
+
+    def __init__(
+        self,
+        max_entries: int = RESULT_CACHE_MAX_ENTRIES,
+        ttl: float = RESULT_CACHE_TTL_SECONDS,
+        max_bytes: int = RESULT_CACHE_MAX_BYTES,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._clock = clock
+        self._results = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._results.get(key)
+        if entry is None:
+            return None
+        expires_at, data = entry
+        if expires_at <= self._clock():
+            del self._results[key]
+            return None
+        self._results.move_to_end(key)
+        return loads(data)
+
+    def put(self, key: str, result: Dict[str, Any]) -> bool:
+        data = dumps(result)
+        if len(data) > self.max_bytes:
+            return False
+        self._results[key] = (self._clock() + self.ttl, data)
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+        return True
+
+
+class DynamoDbResultCache(ResultCache):
+    """Results shared by all Lambda containers in a DynamoDB table keyed by
+    cache key. Expired items are removed by the TTL of the table."""
+
+    def __init__(
+        self,
+        dynamodb_client,
+        table_name: str,
+        ttl: float = RESULT_CACHE_TTL_SECONDS,
+        max_bytes: int = RESULT_CACHE_MAX_BYTES,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.dynamodb_client = dynamodb_client
+        self.table_name = table_name
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._clock = clock
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        response = self.dynamodb_client.get_item(
+            TableName=self.table_name, Key={"requestKey": {"S": key}}
+        )
+        item = response.get("Item")
+        # expired items are only deleted eventually
+        if item is None or float(item["expiresAt"]["N"]) <= self._clock():
+            return None
+        return loads(item["result"]["S"])
+
+    def put(self, key: str, result: Dict[str, Any]) -> bool:
+        data = dumps(result)
+        if len(data) > self.max_bytes:
+            return False
+        self.dynamodb_client.put_item(
+            TableName=self.table_name,
+            Item={
+                "requestKey": {"S": key},
+                "result": {"S": data},
+                "expiresAt": {"N": str(int(self._clock() + self.ttl))},
+            },
+        )
+        return True
+
+
+def get_result_cache(
+    dynamodb_client=None,
+    backend: str = RESULT_CACHE,
+    table_name: Optional[str] = RESULT_CACHE_TABLE,
+) -> Optional[ResultCache]:
+    backend = backend.lower()
+    if backend == "memory":
+        return InMemoryResultCache()
+    if backend == "dynamodb":
+        if not table_name:
+            raise Exception("RESULT_CACHE_TABLE environment variable not defined")
+        return DynamoDbResultCache(dynamodb_client, table_name)
+    if backend == "none":
+        return None
+    raise ValueError(f"Unknown result cache backend {backend}")
@@ -0,0 +1,88 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Naming and bookkeeping for pooled ingest rules.
+
+Instead of creating and deleting an ingest rule for every test, the rule name
+is derived from the normalized SQL statement, the SQL version and the current
+pool generation. Tests of the same statement within one generation share the
+rule. Rules of past generations are removed by the sweep rules Lambda.
+"""
+
+import hashlib
+import re
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+POOLED_RULE_INFIX = "ingest_pool"
+# executions started at the very end of a generation must still find their rule
+GENERATION_GRACE_PERIOD_SECONDS = 600
+
+_WHITESPACE_OUTSIDE_LITERALS = re.compile(r"('(?:[^']|'')*')|\s+")
+
+
+def normalize_sql(sql: str) -> str:
+    return _WHITESPACE_OUTSIDE_LITERALS.sub(
+        lambda m: m.group(1) if m.group(1) else " ", sql
+    ).strip()
+
+
+def get_fingerprint(sql: str, aws_iot_sql_version: str) -> str:
+    normalized = f"{aws_iot_sql_version}\n{normalize_sql(sql)}"
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:20]
+
+
+def get_generation(now: float, ttl: int) -> int:
+    return int(now // ttl)
+
+
+def get_pooled_rule_name(
+    prefix: str, sql: str, aws_iot_sql_version: str, ttl: int, now: float
+) -> str:
+    fingerprint = get_fingerprint(sql, aws_iot_sql_version)
+    return f"{prefix}_{POOLED_RULE_INFIX}_{fingerprint}_{get_generation(now, ttl)}"
+
+
+def parse_pooled_rule_name(prefix: str, rule_name: str) -> Optional[Tuple[str, int]]:
+    pool_prefix = f"{prefix}_{POOLED_RULE_INFIX}_"
+    if not rule_name.startswith(pool_prefix):
+        return None
+    fingerprint, _, generation = rule_name[len(pool_prefix) :].rpartition("_")
+    if not fingerprint or not generation.isdigit():
+        return None
+    return fingerprint, int(generation)
+
+
+def is_expired(generation: int, ttl: int, now: float) -> bool:
+    generation_end = (generation + 1) * ttl
+    return generation_end + GENERATION_GRACE_PERIOD_SECONDS < now
+
+
+class RulePoolCache:
+    """LRU set of pooled rules known to exist, kept per Lambda container."""
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._rules = OrderedDict()
+
+    def __contains__(self, rule_name: str) -> bool:
+        return rule_name in self._rules
+
+    def __len__(self) -> int:
+        return len(self._rules)
+
+    def lookup(self, rule_name: str) -> bool:
+        if rule_name in self._rules:
+            self._rules.move_to_end(rule_name)
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, rule_name: str) -> None:
+        self._rules[rule_name] = True
+        self._rules.move_to_end(rule_name)
+        while len(self._rules) > self.max_size:
+            self._rules.popitem(last=False)
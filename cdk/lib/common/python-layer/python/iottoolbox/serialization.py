@@ -0,0 +1,67 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""JSON serialization for the payload-heavy paths.
+
+Uses orjson when it is installed (e.g. from an additional layer) and the
+standard library otherwise. Set TOOLBOX_JSON_BACKEND=json to always use the
+standard library. The backends produce equivalent, but not byte-identical
+JSON: orjson writes no whitespace and doesn't escape non-ASCII characters.
+Compare the backends with benchmarks/bench_serialization.py.
+"""
+
+import json
+import os
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# payloads of these types are encoded JSON already and aren't encoded again
+ENCODED_TYPES = (bytes, bytearray, memoryview)
+
+
+def get_backend(setting: str = os.getenv("TOOLBOX_JSON_BACKEND", "auto")) -> str:
+    if setting.lower() == "json" or orjson is None:
+        return "json"
+    return "orjson"
+
+
+BACKEND = get_backend()
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """Returns obj as UTF-8 encoded JSON, encoded payloads are returned as is."""
+    if isinstance(obj, ENCODED_TYPES):
+        return bytes(obj)
+    if BACKEND == "orjson":
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # e.g. integers above 64 bit or non-string keys
+            pass
+    return json.dumps(obj).encode("utf-8")
+
+
+def dumps(obj: Any) -> str:
+    """Returns obj as JSON string, encoded payloads are only decoded."""
+    if isinstance(obj, ENCODED_TYPES):
+        return bytes(obj).decode("utf-8")
+    if BACKEND == "orjson":
+        try:
+            return orjson.dumps(obj).decode("utf-8")
+        except TypeError:
+            pass
+    return json.dumps(obj)
+
+
+def loads(data: Union[str, bytes, bytearray, memoryview]) -> Any:
+    if BACKEND == "orjson":
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # the standard library also accepts NaN and Infinity
+            pass
+    return json.loads(bytes(data) if isinstance(data, memoryview) else data)
@@ -0,0 +1,610 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Tokenizer and parser for the AWS IoT SQL dialect.
+
+Supports both SQL versions (2015-10-08 and 2016-03-23). The tokenizer is a
+single pass over the statement, the parser is a recursive descent parser with
+precedence climbing for operators. Parsed statements are immutable and
+memoized, so repeated tests of the same statement are parsed only once.
+"""
+
+import re
+from dataclasses import dataclass, field, fields, is_dataclass
+from functools import lru_cache
+from typing import Any, Iterator, Optional, Tuple
+
+SQL_VERSION_2015_10_08 = "2015-10-08"
+SQL_VERSION_2016_03_23 = "2016-03-23"
+DEFAULT_SQL_VERSION = SQL_VERSION_2016_03_23
+
+KEYWORDS = frozenset(
+    [
+        "SELECT",
+        "FROM",
+        "WHERE",
+        "AS",
+        "AND",
+        "OR",
+        "NOT",
+        "CASE",
+        "WHEN",
+        "THEN",
+        "ELSE",
+        "END",
+        "TRUE",
+        "FALSE",
+        "NULL",
+    ]
+)
+
+_TOKEN_PATTERN = re.compile(
+    r"""
+    (?P<whitespace>\s+)
+    |(?P<number>(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?)
+    |(?P<string>'(?:[^'\\]|\\.|'')*')
+    |(?P<quoted>"(?:[^"]|"")*")
+    |(?P<name>[A-Za-z_][A-Za-z0-9_]*)
+    |(?P<operator><>|!=|<=|>=|=|<|>|\+|-|\*|/|%)
+    |(?P<punctuation>[(),.\[\]{}:;])
+    """,
+    re.VERBOSE,
+)
+
+# binding power of infix operators, higher binds tighter
+_INFIX_PRECEDENCE = {
+    "OR": 1,
+    "AND": 2,
+    "=": 4,
+    "<>": 4,
+    "!=": 4,
+    "<": 4,
+    ">": 4,
+    "<=": 4,
+    ">=": 4,
+    "+": 5,
+    "-": 5,
+    "*": 6,
+    "/": 6,
+    "%": 6,
+}
+_COMPARISON_PRECEDENCE = 4
+_NOT_PRECEDENCE = 3
+_UNARY_MINUS_PRECEDENCE = 7
+
+# tokens that can start an expression, used to tell "SELECT VALUE x" apart
+# from selecting a field named "value"
+_EXPRESSION_START = frozenset(["name", "number", "string", "quoted"])
+_EXPRESSION_START_PUNCTUATION = frozenset(["(", "[", "{"])
+
+
+class SqlSyntaxError(Exception):
+    def __init__(self, message: str, sql: str, position: int):
+        self.message = message
+        self.position = position
+        self.line = sql.count("\n", 0, position) + 1
+        self.column = position - (sql.rfind("\n", 0, position) + 1) + 1
+        super().__init__(f"{message} at line {self.line}, column {self.column}")
+
+
+@dataclass(frozen=True)
+class Token:
+    kind: str
+    value: str
+    position: int
+
+    @property
+    def end(self) -> int:
+        return self.position + len(self.value)
+
+    def is_keyword(self, *keywords: str) -> bool:
+        return self.kind == "keyword" and self.value.upper() in keywords
+
+    def is_symbol(self, *symbols: str) -> bool:
+        return self.kind in ("operator", "punctuation") and self.value in symbols
+
+
+@dataclass(frozen=True)
+class Literal:
+    value: Any
+
+
+@dataclass(frozen=True)
+class Field:
+    name: str
+
+
+@dataclass(frozen=True)
+class FieldAccess:
+    base: Any
+    name: str
+
+
+@dataclass(frozen=True)
+class Index:
+    base: Any
+    index: Any
+
+
+@dataclass(frozen=True)
+class Wildcard:
+    pass
+
+
+@dataclass(frozen=True)
+class FieldWildcard:
+    """All fields of a nested object, e.g. state.reported.*"""
+
+    base: Any
+
+
+@dataclass(frozen=True)
+class FunctionCall:
+    name: str
+    args: Tuple[Any, ...]
+
+
+@dataclass(frozen=True)
+class UnaryOp:
+    operator: str
+    operand: Any
+
+
+@dataclass(frozen=True)
+class BinaryOp:
+    operator: str
+    left: Any
+    right: Any
+
+
+@dataclass(frozen=True)
+class IsCheck:
+    """expression IS [NOT] NULL or expression IS [NOT] UNDEFINED"""
+
+    operand: Any
+    kind: str
+    negated: bool = False
+
+
+@dataclass(frozen=True)
+class Like:
+    operand: Any
+    pattern: Any
+
+
+@dataclass(frozen=True)
+class Case:
+    operand: Any
+    whens: Tuple[Tuple[Any, Any], ...]
+    default: Any
+
+
+@dataclass(frozen=True)
+class ArrayLiteral:
+    items: Tuple[Any, ...]
+
+
+@dataclass(frozen=True)
+class ObjectLiteral:
+    items: Tuple[Tuple[str, Any], ...]
+
+
+@dataclass(frozen=True)
+class Projection:
+    expression: Any
+    alias: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class Select:
+    projections: Tuple[Projection, ...]
+    value: bool = False
+    source: Any = None
+    where: Any = None
+    # (start, end) offsets into the statement text
+    select_span: Tuple[int, int] = field(default=(0, 0), compare=False)
+    source_span: Optional[Tuple[int, int]] = field(default=None, compare=False)
+    where_span: Optional[Tuple[int, int]] = field(default=None, compare=False)
+
+    @property
+    def topic(self) -> Optional[str]:
+        if isinstance(self.source, Literal) and isinstance(self.source.value, str):
+            return self.source.value
+        return None
+
+
+@dataclass(frozen=True)
+class Subquery:
+    select: Select
+
+
+def tokenize(sql: str) -> Iterator[Token]:
+    position = 0
+    length = len(sql)
+    while position < length:
+        match = _TOKEN_PATTERN.match(sql, position)
+        if not match:
+            if sql[position] in "'\"":
+                raise SqlSyntaxError("Unterminated quoted string", sql, position)
+            raise SqlSyntaxError(
+                f"Unexpected character {sql[position]!r}", sql, position
+            )
+        kind = match.lastgroup
+        value = match.group()
+        if kind == "name" and value.upper() in KEYWORDS:
+            kind = "keyword"
+        if kind != "whitespace":
+            yield Token(kind, value, position)
+        position = match.end()
+    yield Token("eof", "", length)
+
+
+def _unquote(value: str) -> str:
+    quote = value[0]
+    value = value[1:-1].replace(quote * 2, quote)
+    if quote == "'":
+        # quotes can be escaped with a backslash as well
+        value = value.replace("\\'", "'")
+    return value
+
+
+class _Parser:
+    def __init__(self, sql: str, aws_iot_sql_version: str):
+        self.sql = sql
+        self.aws_iot_sql_version = aws_iot_sql_version
+        self.tokens = list(tokenize(sql))
+        self.index = 0
+
+    @property
+    def current(self) -> Token:
+        return self.tokens[self.index]
+
+    def peek(self, offset: int = 1) -> Token:
+        return self.tokens[min(self.index + offset, len(self.tokens) - 1)]
+
+    def advance(self) -> Token:
+        token = self.current
+        self.index = min(self.index + 1, len(self.tokens) - 1)
+        return token
+
+    def error(self, message: str, token: Optional[Token] = None):
+        token = token or self.current
+        found = "end of statement" if token.kind == "eof" else repr(token.value)
+        return SqlSyntaxError(f"{message}, found {found}", self.sql, token.position)
+
+    def expect_keyword(self, keyword: str) -> Token:
+        if not self.current.is_keyword(keyword):
+            raise self.error(f"Expected {keyword}")
+        return self.advance()
+
+    def expect_symbol(self, symbol: str) -> Token:
+        if not self.current.is_symbol(symbol):
+            raise self.error(f"Expected {symbol!r}")
+        return self.advance()
+
+    def require_nested_queries(self, token: Token) -> None:
+        if self.aws_iot_sql_version == SQL_VERSION_2015_10_08:
+            raise SqlSyntaxError(
+                f"{token.value.upper()} requires SQL version {SQL_VERSION_2016_03_23}",
+                self.sql,
+                token.position,
+            )
+
+    def parse_statement(self) -> Select:
+        select = self.parse_select(nested=False)
+        if self.current.is_symbol(";"):
+            self.advance()
+        if self.current.kind != "eof":
+            raise self.error("Expected end of statement")
+        return select
+
+    def parse_select(self, nested: bool) -> Select:
+        self.expect_keyword("SELECT")
+        value = False
+        if self.current.kind == "name" and self.current.value.upper() == "VALUE":
+            next_token = self.peek()
+            if (
+                next_token.kind in _EXPRESSION_START
+                or next_token.is_keyword("CASE", "NOT", "TRUE", "FALSE", "NULL")
+                or next_token.is_symbol(*_EXPRESSION_START_PUNCTUATION)
+            ):
+                self.require_nested_queries(self.current)
+                value = True
+                self.advance()
+
+        select_start = self.current.position
+        projections = [self.parse_projection()]
+        while self.current.is_symbol(","):
+            self.advance()
+            projections.append(self.parse_projection())
+        select_span = (select_start, self.tokens[self.index - 1].end)
+
+        source = None
+        source_span = None
+        if self.current.is_keyword("FROM"):
+            self.advance()
+            source_start = self.current.position
+            if nested:
+                source = self.parse_expression()
+            else:
+                if self.current.kind != "string":
+                    raise self.error("Expected topic filter in single quotes")
+                source = Literal(_unquote(self.advance().value))
+            source_span = (source_start, self.tokens[self.index - 1].end)
+
+        where = None
+        where_span = None
+        if self.current.is_keyword("WHERE"):
+            self.advance()
+            where_start = self.current.position
+            where = self.parse_expression()
+            where_span = (where_start, self.tokens[self.index - 1].end)
+
+        return Select(
+            projections=tuple(projections),
+            value=value,
+            source=source,
+            where=where,
+            select_span=select_span,
+            source_span=source_span,
+            where_span=where_span,
+        )
+
+    def parse_projection(self) -> Projection:
+        expression = self.parse_expression()
+        alias = None
+        if self.current.is_keyword("AS"):
+            self.advance()
+            token = self.advance()
+            if token.kind == "name" or token.kind == "keyword":
+                alias = token.value
+            elif token.kind in ("quoted", "string"):
+                alias = _unquote(token.value)
+            else:
+                raise self.error("Expected alias", token)
+        return Projection(expression, alias)
+
+    def parse_expression(self, min_precedence: int = 0):
+        left = self.parse_prefix()
+        while True:
+            token = self.current
+            if token.kind == "name" and token.value.upper() in ("IS", "LIKE"):
+                # not reserved, fields can still be named "is" or "like"
+                if _COMPARISON_PRECEDENCE <= min_precedence:
+                    break
+                left = self.parse_comparison_keyword(left)
+                continue
+            operator = token.value.upper() if token.kind == "keyword" else token.value
+            if token.kind not in ("operator", "keyword"):
+                break
+            precedence = _INFIX_PRECEDENCE.get(operator)
+            if precedence is None or precedence <= min_precedence:
+                break
+            self.advance()
+            right = self.parse_expression(precedence)
+            left = BinaryOp(operator, left, right)
+        return left
+
+    def parse_comparison_keyword(self, left):
+        token = self.advance()
+        if token.value.upper() == "LIKE":
+            return Like(left, self.parse_expression(_COMPARISON_PRECEDENCE))
+        negated = False
+        if self.current.is_keyword("NOT"):
+            self.advance()
+            negated = True
+        kind = self.current.value.upper()
+        if not (self.current.is_keyword("NULL") or kind == "UNDEFINED"):
+            raise self.error("Expected NULL or UNDEFINED")
+        self.advance()
+        return IsCheck(left, kind, negated)
+
+    def parse_prefix(self):
+        token = self.current
+        if token.is_keyword("NOT"):
+            self.advance()
+            return UnaryOp("NOT", self.parse_expression(_NOT_PRECEDENCE))
+        if token.is_symbol("-"):
+            self.advance()
+            return UnaryOp("-", self.parse_expression(_UNARY_MINUS_PRECEDENCE))
+        return self.parse_postfix(self.parse_primary())
+
+    def parse_postfix(self, expression):
+        while True:
+            if self.current.is_symbol("."):
+                self.advance()
+                token = self.advance()
+                if token.is_symbol("*"):
+                    expression = FieldWildcard(expression)
+                elif token.kind in ("name", "keyword"):
+                    expression = FieldAccess(expression, token.value)
+                elif token.kind == "quoted":
+                    expression = FieldAccess(expression, _unquote(token.value))
+                else:
+                    raise self.error("Expected field name", token)
+            elif self.current.is_symbol("["):
+                self.advance()
+                index = self.parse_expression()
+                self.expect_symbol("]")
+                expression = Index(expression, index)
+            else:
+                return expression
+
+    def parse_primary(self):
+        token = self.current
+        if token.kind == "number":
+            self.advance()
+            text = token.value
+            if "." in text or "e" in text or "E" in text:
+                return Literal(float(text))
+            return Literal(int(text))
+        if token.kind == "string":
+            self.advance()
+            return Literal(_unquote(token.value))
+        if token.is_keyword("TRUE", "FALSE"):
+            self.advance()
+            return Literal(token.value.upper() == "TRUE")
+        if token.is_keyword("NULL"):
+            self.advance()
+            return Literal(None)
+        if token.is_keyword("CASE"):
+            return self.parse_case()
+        if token.kind == "name":
+            self.advance()
+            if self.current.is_symbol("("):
+                return self.parse_function_call(token.value)
+            return Field(token.value)
+        if token.kind == "quoted":
+            self.advance()
+            return Field(_unquote(token.value))
+        if token.is_symbol("*"):
+            self.advance()
+            return Wildcard()
+        if token.is_symbol("("):
+            self.advance()
+            if self.current.is_keyword("SELECT"):
+                self.require_nested_queries(self.current)
+                expression = Subquery(self.parse_select(nested=True))
+            else:
+                expression = self.parse_expression()
+            self.expect_symbol(")")
+            return expression
+        if token.is_symbol("["):
+            return self.parse_array()
+        if token.is_symbol("{"):
+            return self.parse_object()
+        raise self.error("Expected expression")
+
+    def parse_function_call(self, name: str) -> FunctionCall:
+        self.expect_symbol("(")
+        args = []
+        if not self.current.is_symbol(")"):
+            args.append(self.parse_expression())
+            while self.current.is_symbol(","):
+                self.advance()
+                args.append(self.parse_expression())
+        self.expect_symbol(")")
+        return FunctionCall(name, tuple(args))
+
+    def parse_case(self) -> Case:
+        self.expect_keyword("CASE")
+        operand = None
+        if not self.current.is_keyword("WHEN"):
+            operand = self.parse_expression()
+        whens = []
+        while self.current.is_keyword("WHEN"):
+            self.advance()
+            condition = self.parse_expression()
+            self.expect_keyword("THEN")
+            whens.append((condition, self.parse_expression()))
+        if not whens:
+            raise self.error("Expected WHEN")
+        default = None
+        if self.current.is_keyword("ELSE"):
+            self.advance()
+            default = self.parse_expression()
+        self.expect_keyword("END")
+        return Case(operand, tuple(whens), default)
+
+    def parse_array(self) -> ArrayLiteral:
+        self.expect_symbol("[")
+        items = []
+        if not self.current.is_symbol("]"):
+            items.append(self.parse_expression())
+            while self.current.is_symbol(","):
+                self.advance()
+                items.append(self.parse_expression())
+        self.expect_symbol("]")
+        return ArrayLiteral(tuple(items))
+
+    def parse_object(self) -> ObjectLiteral:
+        self.expect_symbol("{")
+        items = []
+        if not self.current.is_symbol("}"):
+            items.append(self.parse_object_item())
+            while self.current.is_symbol(","):
+                self.advance()
+                # trailing commas are accepted by the rules engine
+                if self.current.is_symbol("}"):
+                    break
+                items.append(self.parse_object_item())
+        self.expect_symbol("}")
+        return ObjectLiteral(tuple(items))
+
+    def parse_object_item(self) -> Tuple[str, Any]:
+        token = self.advance()
+        if token.kind in ("string", "quoted"):
+            key = _unquote(token.value)
+        elif token.kind in ("name", "keyword"):
+            key = token.value
+        else:
+            raise self.error("Expected object key", token)
+        self.expect_symbol(":")
+        return key, self.parse_expression()
+
+
+@lru_cache(maxsize=512)
+def parse(sql: str, aws_iot_sql_version: str = DEFAULT_SQL_VERSION) -> Select:
+    """Parses an AWS IoT SQL statement, raises SqlSyntaxError if malformed."""
+    return _Parser(sql, aws_iot_sql_version).parse_statement()
+
+
+@dataclass(frozen=True)
+class SqlDiagnostic:
+    message: str
+    position: int
+    line: int
+    column: int
+
+    def to_dict(self) -> dict:
+        return {
+            "message": self.message,
+            "position": self.position,
+            "line": self.line,
+            "column": self.column,
+        }
+
+
+@lru_cache(maxsize=512)
+def validate(
+    sql: str, aws_iot_sql_version: str = DEFAULT_SQL_VERSION, require_topic=False
+) -> Optional[SqlDiagnostic]:
+    """Returns the syntax error of a statement or None if it's valid.
+
+    Malformed statements are memoized like parsed ones, so repeated
+    submissions aren't parsed again. With require_topic, statements without
+    a topic filter in their FROM clause are rejected as well.
+    """
+    try:
+        statement = parse(sql, aws_iot_sql_version)
+    except SqlSyntaxError as e:
+        return SqlDiagnostic(e.message, e.position, e.line, e.column)
+    if require_topic and not statement.topic:
+        error = SqlSyntaxError("FROM clause with topic filter missing", sql, len(sql))
+        return SqlDiagnostic(error.message, error.position, error.line, error.column)
+    return None
+
+
+def get_select_sql(sql: str, statement: Select) -> str:
+    return sql[statement.select_span[0] : statement.select_span[1]]
+
+
+def get_where_sql(sql: str, statement: Select) -> Optional[str]:
+    if statement.where_span is None:
+        return None
+    return sql[statement.where_span[0] : statement.where_span[1]]
+
+
+def iter_function_calls(node) -> Iterator[FunctionCall]:
+    """Yields the function calls of a parsed statement or expression,
+    including the ones of nested queries."""
+    stack = [node]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, FunctionCall):
+            yield value
+        if isinstance(value, tuple):
+            stack.extend(value)
+        elif is_dataclass(value):
+            # spans are offsets into the statement, not part of the tree
+            stack.extend(getattr(value, f.name) for f in fields(value) if f.compare)
@@ -0,0 +1,279 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Column-at-a-time evaluation of AWS IoT SQL statements over many payloads.
+
+Validating a statement against recorded traffic evaluates the same AST for
+every message. Instead of walking the AST once per message, ColumnarBatch
+extracts every referenced field path once into a column (a list with one
+value per payload, UNDEFINED where missing) and the operators are applied to
+whole columns. Paths share their prefixes, so "a.b.c" and "a.b.d" extract
+"a.b" only once. Projections are only computed for the rows matched by the
+WHERE clause.
+
+Expressions without a columnar implementation (functions, CASE, nested
+queries, ...) are evaluated row by row with iottoolbox.sql_eval, so results
+are always identical to evaluating each payload on its own.
+"""
+
+import operator
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from iottoolbox.sql import (
+    DEFAULT_SQL_VERSION,
+    BinaryOp,
+    Field,
+    FieldAccess,
+    Index,
+    Literal,
+    Select,
+    SqlSyntaxError,
+    UnaryOp,
+    Wildcard,
+    parse,
+)
+from iottoolbox.sql_eval import (
+    UNDEFINED,
+    EvaluationContext,
+    Evaluator,
+    UnsupportedSqlError,
+    arithmetic,
+    compare,
+    get_request_context,
+    get_response,
+    logical,
+    projection_name,
+    strip_undefined,
+    to_boolean,
+    to_number,
+)
+
+_COMPARISONS = {
+    "<": operator.lt,
+    ">": operator.gt,
+    "<=": operator.le,
+    ">=": operator.ge,
+}
+_NUMBER_TYPES = (int, float)
+
+
+@dataclass
+class BatchResult:
+    # mask[i] is True if payload i matched the WHERE clause
+    mask: List[bool]
+    # projected row per payload, None if not matched
+    rows: List[Optional[Any]]
+
+
+def _get_path(expression) -> Optional[Tuple]:
+    """Returns the field path of an expression, None if it isn't a plain path."""
+    if isinstance(expression, Field):
+        return (expression.name,)
+    if isinstance(expression, FieldAccess):
+        base = _get_path(expression.base)
+        return None if base is None else base + (expression.name,)
+    if isinstance(expression, Index) and isinstance(expression.index, Literal):
+        if type(expression.index.value) not in (int, str):
+            return None
+        base = _get_path(expression.base)
+        return None if base is None else base + (expression.index.value,)
+    return None
+
+
+def _get_child(value, key):
+    if isinstance(key, str):
+        if isinstance(value, dict):
+            return value.get(key, UNDEFINED)
+        return UNDEFINED
+    if isinstance(value, list) and type(key) is int and 0 <= key < len(value):
+        return value[key]
+    return UNDEFINED
+
+
+class ColumnarBatch:
+    def __init__(
+        self,
+        payloads: Sequence[Any],
+        contexts: Optional[Sequence[EvaluationContext]] = None,
+    ):
+        self.payloads = payloads
+        self.contexts = contexts
+        self._columns: Dict[Tuple, List[Any]] = {(): list(payloads)}
+
+    def __len__(self):
+        return len(self.payloads)
+
+    def column(self, path: Tuple) -> List[Any]:
+        column = self._columns.get(path)
+        if column is None:
+            key = path[-1]
+            column = [_get_child(value, key) for value in self.column(path[:-1])]
+            self._columns[path] = column
+        return column
+
+    def select(self, indices: List[int]) -> "ColumnarBatch":
+        """Returns a batch with the payloads at the given indices."""
+        contexts = None
+        if self.contexts is not None:
+            contexts = [self.contexts[i] for i in indices]
+        return ColumnarBatch([self.payloads[i] for i in indices], contexts)
+
+
+class BatchEvaluator:
+    def __init__(self, batch: ColumnarBatch):
+        self.batch = batch
+
+    def evaluate(self, expression) -> List[Any]:
+        path = _get_path(expression)
+        if path is not None:
+            return self.batch.column(path)
+        if isinstance(expression, Literal):
+            return [expression.value] * len(self.batch)
+        if isinstance(expression, Wildcard):
+            return self.batch.column(())
+        if isinstance(expression, BinaryOp):
+            return self.evaluate_binary(expression)
+        if isinstance(expression, UnaryOp):
+            return self.evaluate_unary(expression)
+        return self.evaluate_rows(expression)
+
+    def evaluate_rows(self, expression) -> List[Any]:
+        contexts = self.batch.contexts
+        if contexts is None:
+            evaluator = Evaluator(EvaluationContext())
+            return [evaluator.evaluate(expression, p) for p in self.batch.payloads]
+        return [
+            Evaluator(context).evaluate(expression, p)
+            for context, p in zip(contexts, self.batch.payloads)
+        ]
+
+    def evaluate_unary(self, expression: UnaryOp) -> List[Any]:
+        operand = self.evaluate(expression.operand)
+        if expression.operator == "NOT":
+            negated = []
+            for value in operand:
+                value = to_boolean(value)
+                negated.append(UNDEFINED if value is UNDEFINED else not value)
+            return negated
+        negated = []
+        for value in operand:
+            value = to_number(value)
+            negated.append(UNDEFINED if value is UNDEFINED else -value)
+        return negated
+
+    def evaluate_binary(self, expression: BinaryOp) -> List[Any]:
+        op = expression.operator
+        left = self.evaluate(expression.left)
+        if op in ("AND", "OR"):
+            return [
+                logical(op, a, b) for a, b in zip(left, self.evaluate(expression.right))
+            ]
+
+        if isinstance(expression.right, Literal):
+            return self.evaluate_with_literal(op, left, expression.right.value)
+
+        right = self.evaluate(expression.right)
+        if op in ("+", "-", "*", "/", "%"):
+            return [arithmetic(op, a, b) for a, b in zip(left, right)]
+        return [compare(op, a, b) for a, b in zip(left, right)]
+
+    def evaluate_with_literal(self, op: str, column: List[Any], literal) -> List[Any]:
+        # the common "field <op> constant" case, numbers are compared directly
+        # and only other types go through the generic comparison
+        compare_numbers = _COMPARISONS.get(op)
+        if compare_numbers is not None and type(literal) in _NUMBER_TYPES:
+            return [
+                (
+                    compare_numbers(value, literal)
+                    if type(value) in _NUMBER_TYPES
+                    else compare(op, value, literal)
+                )
+                for value in column
+            ]
+        if op in ("+", "-", "*", "/", "%"):
+            return [arithmetic(op, value, literal) for value in column]
+        return [compare(op, value, literal) for value in column]
+
+
+def evaluate_batch(
+    statement: Select,
+    payloads: Sequence[Any],
+    contexts: Optional[Sequence[EvaluationContext]] = None,
+) -> BatchResult:
+    """Evaluates a parsed statement for every payload.
+
+    contexts optionally provides the evaluation context per payload.
+    """
+    batch = ColumnarBatch(payloads, contexts)
+    if statement.where is None:
+        mask = [True] * len(batch)
+    else:
+        mask = [
+            value is True for value in BatchEvaluator(batch).evaluate(statement.where)
+        ]
+
+    indices = [i for i, matched in enumerate(mask) if matched]
+    rows: List[Optional[Any]] = [None] * len(batch)
+    if not indices:
+        return BatchResult(mask, rows)
+
+    matched = batch if len(indices) == len(batch) else batch.select(indices)
+    evaluator = BatchEvaluator(matched)
+
+    if statement.value:
+        values = evaluator.evaluate(statement.projections[0].expression)
+        for i, value in zip(indices, values):
+            rows[i] = strip_undefined(value)
+        return BatchResult(mask, rows)
+
+    projected = [{} for _ in indices]
+    for projection in statement.projections:
+        if isinstance(projection.expression, Wildcard) and projection.alias is None:
+            for row, payload in zip(projected, matched.payloads):
+                if isinstance(payload, dict):
+                    row.update(payload)
+            continue
+        name = projection_name(projection)
+        for row, value in zip(projected, evaluator.evaluate(projection.expression)):
+            if value is not UNDEFINED:
+                row[name] = value
+
+    for i, row in zip(indices, projected):
+        rows[i] = strip_undefined(row)
+    return BatchResult(mask, rows)
+
+
+def evaluate_sql_batch(
+    sql: str,
+    payloads: Sequence[Any],
+    aws_iot_sql_version: str = DEFAULT_SQL_VERSION,
+    contexts: Optional[Sequence[EvaluationContext]] = None,
+) -> BatchResult:
+    """Parses and evaluates a statement, raises SqlSyntaxError if malformed."""
+    return evaluate_batch(parse(sql, aws_iot_sql_version), payloads, contexts)
+
+
+def evaluate_batch_request(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Answers a batch message test request like the batch message state machine.
+
+    Raises UnsupportedSqlError if the statement can't be evaluated locally,
+    including statements the parser rejects.
+    """
+    try:
+        statement = parse(
+            event["sql"], event.get("awsIotSqlVersion", DEFAULT_SQL_VERSION)
+        )
+    except SqlSyntaxError as e:
+        raise UnsupportedSqlError(str(e))
+
+    items = event["messages"]
+    result = evaluate_batch(
+        statement,
+        [item["message"] for item in items],
+        [get_request_context(item) for item in items],
+    )
+    return {
+        "results": [get_response(item, row) for item, row in zip(items, result.rows)],
+        "error": None,
+    }
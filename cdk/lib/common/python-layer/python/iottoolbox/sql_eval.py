@@ -0,0 +1,545 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Local evaluation of AWS IoT SQL statements.
+
+Evaluates the statements produced by iottoolbox.sql against a JSON payload
+in-process, so a rule test can be answered without creating a topic rule and
+publishing a message. Only a subset of the dialect is supported: SELECT
+projections, WHERE predicates, nested field access, nested queries, CASE and
+the functions registered in FUNCTIONS. Anything else raises
+UnsupportedSqlError, callers are expected to fall back to the rules engine.
+
+Missing fields and type mismatches evaluate to UNDEFINED like in the rules
+engine: undefined projections are dropped and an undefined WHERE clause does
+not match.
+"""
+
+import base64
+import json
+import math
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from iottoolbox.sql import (
+    DEFAULT_SQL_VERSION,
+    ArrayLiteral,
+    BinaryOp,
+    Case,
+    Field,
+    FieldAccess,
+    FunctionCall,
+    Index,
+    Literal,
+    ObjectLiteral,
+    Select,
+    Subquery,
+    SqlSyntaxError,
+    UnaryOp,
+    Wildcard,
+    parse,
+)
+
+# errors reported by the rule tester state machines, local results use the same
+SQL_PARSE_ERROR = "SqlParseException"
+NO_MATCH_ERROR = "States.HeartbeatTimeout"
+# key of the task output ingest_message sends for messages that don't match
+NO_MATCH_KEY = "sfnNoMatch"
+
+# functions depending on how the rules engine received the message
+ENVIRONMENT_FUNCTIONS = frozenset(
+    ["topic", "timestamp", "clientid", "principal", "newuuid"]
+)
+
+# constructs the evaluator gives the same result for as the rules engine, only
+# WHERE clauses built from these are decided before publishing
+EXACT_OPERATORS = frozenset(["AND", "OR", "NOT", "=", "<>", "!=", "<", ">", "<=", ">="])
+EXACT_FUNCTIONS = frozenset(["isundefined", "isnull", "startswith", "endswith"])
+
+
+class UnsupportedSqlError(Exception):
+    pass
+
+
+class _Undefined:
+    def __repr__(self):
+        return "UNDEFINED"
+
+    def __bool__(self):
+        return False
+
+
+UNDEFINED = _Undefined()
+
+# request property names of the rule tester mapped to get_mqtt_property names
+MQTT_PROPERTY_NAMES = {
+    "format_indicator": "payloadFormatIndicator",
+    "content_type": "contentType",
+    "response_topic": "responseTopic",
+    "correlation_data": "correlationData",
+    "message_expiry": "messageExpiry",
+}
+
+
+@dataclass
+class EvaluationContext:
+    topic: str = ""
+    client_id: Optional[str] = None
+    principal: Optional[str] = None
+    timestamp: Optional[int] = None
+    mqtt_properties: Dict[str, str] = field(default_factory=dict)
+    user_properties: List[Dict[str, str]] = field(default_factory=list)
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def to_number(value):
+    if _is_number(value):
+        return value
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            pass
+        try:
+            number = float(value)
+        except ValueError:
+            return UNDEFINED
+        return number if math.isfinite(number) else UNDEFINED
+    return UNDEFINED
+
+
+def compare(operator: str, left, right):
+    if left is UNDEFINED or right is UNDEFINED:
+        return UNDEFINED
+    if operator in ("=", "<>", "!="):
+        if _is_number(left) and _is_number(right):
+            equal = left == right
+        else:
+            equal = type(left) is type(right) and left == right
+        return equal if operator == "=" else not equal
+
+    if isinstance(left, str) and isinstance(right, str):
+        pass
+    elif _is_number(left) or _is_number(right):
+        left, right = to_number(left), to_number(right)
+        if left is UNDEFINED or right is UNDEFINED:
+            return UNDEFINED
+    else:
+        return UNDEFINED
+
+    if operator == "<":
+        return left < right
+    if operator == ">":
+        return left > right
+    if operator == "<=":
+        return left <= right
+    return left >= right
+
+
+def arithmetic(operator: str, left, right):
+    if operator == "+" and isinstance(left, str) and isinstance(right, str):
+        return left + right
+    left, right = to_number(left), to_number(right)
+    if left is UNDEFINED or right is UNDEFINED:
+        return UNDEFINED
+    integers = isinstance(left, int) and isinstance(right, int)
+    if operator == "+":
+        return left + right
+    if operator == "-":
+        return left - right
+    if operator == "*":
+        return left * right
+    if right == 0:
+        return UNDEFINED
+    if operator == "/":
+        if integers:
+            # integer division truncates towards zero
+            return int(left / right)
+        return left / right
+    if not integers:
+        return UNDEFINED
+    return int(math.fmod(left, right))
+
+
+def to_boolean(value):
+    if isinstance(value, bool):
+        return value
+    # "true" and "false" are converted in logical operators, case-insensitive
+    if isinstance(value, str) and value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    return UNDEFINED
+
+
+def logical(operator: str, left, right):
+    left, right = to_boolean(left), to_boolean(right)
+    if left is UNDEFINED or right is UNDEFINED:
+        return UNDEFINED
+    return (left and right) if operator == "AND" else (left or right)
+
+
+def projection_name(projection) -> str:
+    if projection.alias is not None:
+        return projection.alias
+    expression = projection.expression
+    if isinstance(expression, Field):
+        return expression.name
+    if isinstance(expression, FieldAccess):
+        return expression.name
+    raise UnsupportedSqlError(
+        f"Unsupported projection without alias: {type(expression).__name__}"
+    )
+
+
+def strip_undefined(value):
+    if isinstance(value, dict):
+        return {k: strip_undefined(v) for k, v in value.items() if v is not UNDEFINED}
+    if isinstance(value, list):
+        return [strip_undefined(v) for v in value if v is not UNDEFINED]
+    return value
+
+
+class Evaluator:
+    def __init__(self, context: EvaluationContext):
+        self.context = context
+
+    def evaluate(self, expression, payload):
+        method = getattr(self, f"evaluate_{type(expression).__name__}", None)
+        if method is None:
+            raise UnsupportedSqlError(
+                f"Unsupported expression {type(expression).__name__}"
+            )
+        return method(expression, payload)
+
+    def evaluate_Literal(self, expression: Literal, payload):
+        return expression.value
+
+    def evaluate_Wildcard(self, expression: Wildcard, payload):
+        return payload
+
+    def evaluate_Field(self, expression: Field, payload):
+        if isinstance(payload, dict):
+            return payload.get(expression.name, UNDEFINED)
+        return UNDEFINED
+
+    def evaluate_FieldAccess(self, expression: FieldAccess, payload):
+        base = self.evaluate(expression.base, payload)
+        if isinstance(base, dict):
+            return base.get(expression.name, UNDEFINED)
+        return UNDEFINED
+
+    def evaluate_Index(self, expression: Index, payload):
+        base = self.evaluate(expression.base, payload)
+        index = self.evaluate(expression.index, payload)
+        if isinstance(base, list) and isinstance(index, int):
+            if 0 <= index < len(base):
+                return base[index]
+        elif isinstance(base, dict) and isinstance(index, str):
+            return base.get(index, UNDEFINED)
+        return UNDEFINED
+
+    def evaluate_UnaryOp(self, expression: UnaryOp, payload):
+        operand = self.evaluate(expression.operand, payload)
+        if expression.operator == "NOT":
+            operand = to_boolean(operand)
+            return UNDEFINED if operand is UNDEFINED else not operand
+        operand = to_number(operand)
+        return UNDEFINED if operand is UNDEFINED else -operand
+
+    def evaluate_BinaryOp(self, expression: BinaryOp, payload):
+        left = self.evaluate(expression.left, payload)
+        right = self.evaluate(expression.right, payload)
+        operator = expression.operator
+        if operator in ("AND", "OR"):
+            return logical(operator, left, right)
+        if operator in ("+", "-", "*", "/", "%"):
+            return arithmetic(operator, left, right)
+        return compare(operator, left, right)
+
+    def evaluate_Case(self, expression: Case, payload):
+        operand = UNDEFINED
+        if expression.operand is not None:
+            operand = self.evaluate(expression.operand, payload)
+        for condition, result in expression.whens:
+            value = self.evaluate(condition, payload)
+            if expression.operand is not None:
+                value = compare("=", operand, value)
+            if value is True:
+                return self.evaluate(result, payload)
+        if expression.default is None:
+            return UNDEFINED
+        return self.evaluate(expression.default, payload)
+
+    def evaluate_ArrayLiteral(self, expression: ArrayLiteral, payload):
+        return [self.evaluate(item, payload) for item in expression.items]
+
+    def evaluate_ObjectLiteral(self, expression: ObjectLiteral, payload):
+        return {key: self.evaluate(value, payload) for key, value in expression.items}
+
+    def evaluate_FunctionCall(self, expression: FunctionCall, payload):
+        function = FUNCTIONS.get(expression.name.lower())
+        if function is None:
+            raise UnsupportedSqlError(f"Unsupported function {expression.name}")
+        args = [self.evaluate(arg, payload) for arg in expression.args]
+        try:
+            return function(self.context, *args)
+        except TypeError:
+            raise UnsupportedSqlError(
+                f"Unsupported arguments for function {expression.name}"
+            )
+
+    def evaluate_Subquery(self, expression: Subquery, payload):
+        select = expression.select
+        items = self.evaluate(select.source, payload)
+        if isinstance(items, dict):
+            items = [items]
+        if not isinstance(items, list):
+            return UNDEFINED
+        results = []
+        for item in items:
+            result = self.evaluate_select(select, item)
+            if result is not None:
+                results.append(result)
+        return results
+
+    def matches(self, select: Select, payload) -> bool:
+        return select.where is None or self.evaluate(select.where, payload) is True
+
+    def evaluate_select(self, select: Select, payload):
+        if not self.matches(select, payload):
+            return None
+        if select.value:
+            return self.evaluate(select.projections[0].expression, payload)
+
+        result = {}
+        for projection in select.projections:
+            if isinstance(projection.expression, Wildcard) and projection.alias is None:
+                if isinstance(payload, dict):
+                    result.update(payload)
+                continue
+            value = self.evaluate(projection.expression, payload)
+            if value is not UNDEFINED:
+                result[projection_name(projection)] = value
+        return result
+
+
+def _topic(context: EvaluationContext, level=None):
+    if level is None:
+        return context.topic
+    if not isinstance(level, int):
+        return UNDEFINED
+    levels = context.topic.split("/")
+    if 1 <= level <= len(levels):
+        return levels[level - 1]
+    return UNDEFINED
+
+
+def _timestamp(context: EvaluationContext):
+    if context.timestamp is not None:
+        return context.timestamp
+    return int(time.time() * 1000)
+
+
+def _get_mqtt_property(context: EvaluationContext, name):
+    key = MQTT_PROPERTY_NAMES.get(name)
+    if key is None or key not in context.mqtt_properties:
+        return UNDEFINED
+    return context.mqtt_properties[key]
+
+
+def _get_user_properties(context: EvaluationContext, name):
+    values = [p[name] for p in context.user_properties if name in p]
+    return values if values else UNDEFINED
+
+
+def _encode(context: EvaluationContext, value, encoding):
+    if encoding != "base64" or value is UNDEFINED:
+        return UNDEFINED
+    if isinstance(value, str):
+        data = value.encode("utf-8")
+    else:
+        data = json.dumps(strip_undefined(value)).encode("utf-8")
+    return base64.b64encode(data).decode("ascii")
+
+
+def _string_function(function: Callable) -> Callable:
+    def wrapper(context, *args):
+        if not all(isinstance(arg, str) for arg in args):
+            return UNDEFINED
+        return function(*args)
+
+    return wrapper
+
+
+def _number_function(function: Callable) -> Callable:
+    def wrapper(context, value):
+        value = to_number(value)
+        if value is UNDEFINED:
+            return UNDEFINED
+        return function(value)
+
+    return wrapper
+
+
+def _concat(context: EvaluationContext, *args):
+    if any(arg is UNDEFINED for arg in args):
+        return UNDEFINED
+    if any(isinstance(arg, list) for arg in args):
+        result = []
+        for arg in args:
+            result.extend(arg if isinstance(arg, list) else [arg])
+        return result
+    return "".join(arg if isinstance(arg, str) else json.dumps(arg) for arg in args)
+
+
+def _substring(context: EvaluationContext, value, start, end=None):
+    if not isinstance(value, str) or not isinstance(start, int):
+        return UNDEFINED
+    if end is None:
+        return value[start:]
+    if not isinstance(end, int):
+        return UNDEFINED
+    return value[start:end]
+
+
+FUNCTIONS: Dict[str, Callable] = {
+    "topic": _topic,
+    "timestamp": _timestamp,
+    "clientid": lambda context: context.client_id or UNDEFINED,
+    "principal": lambda context: context.principal or UNDEFINED,
+    "newuuid": lambda context: str(uuid.uuid4()),
+    "get_mqtt_property": _get_mqtt_property,
+    "get_user_properties": _get_user_properties,
+    "encode": _encode,
+    "upper": _string_function(str.upper),
+    "lower": _string_function(str.lower),
+    "trim": _string_function(str.strip),
+    "length": _string_function(len),
+    "startswith": _string_function(str.startswith),
+    "endswith": _string_function(str.endswith),
+    "substring": _substring,
+    "concat": _concat,
+    "abs": _number_function(abs),
+    "ceil": _number_function(math.ceil),
+    "floor": _number_function(math.floor),
+    "round": _number_function(lambda value: int(math.floor(value + 0.5))),
+    "isundefined": lambda context, value: value is UNDEFINED,
+    "isnull": lambda context, value: value is None,
+}
+
+
+def evaluate(
+    statement: Select, payload, context: Optional[EvaluationContext] = None
+) -> Optional[Any]:
+    """Evaluates a parsed statement, returns None if the WHERE clause doesn't match."""
+    result = Evaluator(context or EvaluationContext()).evaluate_select(
+        statement, payload
+    )
+    return None if result is None else strip_undefined(result)
+
+
+def evaluate_sql(
+    sql: str,
+    payload,
+    aws_iot_sql_version: str = DEFAULT_SQL_VERSION,
+    context: Optional[EvaluationContext] = None,
+) -> Optional[Any]:
+    """Parses and evaluates a statement, raises SqlSyntaxError if malformed."""
+    return evaluate(parse(sql, aws_iot_sql_version), payload, context)
+
+
+def is_exact(expression) -> bool:
+    """Returns True if the expression only uses EXACT_OPERATORS,
+    EXACT_FUNCTIONS, literals and field references."""
+    stack = [expression]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, (Literal, Field)):
+            continue
+        if isinstance(node, FieldAccess):
+            stack.append(node.base)
+        elif isinstance(node, Index):
+            stack.extend([node.base, node.index])
+        elif isinstance(node, UnaryOp) and node.operator in EXACT_OPERATORS:
+            stack.append(node.operand)
+        elif isinstance(node, BinaryOp) and node.operator in EXACT_OPERATORS:
+            stack.extend([node.left, node.right])
+        elif isinstance(node, FunctionCall) and node.name.lower() in EXACT_FUNCTIONS:
+            stack.extend(node.args)
+        else:
+            return False
+    return True
+
+
+def is_exact_sql(sql: str, aws_iot_sql_version: str = DEFAULT_SQL_VERSION) -> bool:
+    """Returns True if the statement has no WHERE clause or it is_exact."""
+    statement = parse(sql, aws_iot_sql_version)
+    return statement.where is None or is_exact(statement.where)
+
+
+def matches_sql(
+    sql: str,
+    payload,
+    aws_iot_sql_version: str = DEFAULT_SQL_VERSION,
+    context: Optional[EvaluationContext] = None,
+) -> bool:
+    """Evaluates only the WHERE clause of a statement.
+
+    Raises UnsupportedSqlError unless the clause is_exact, SqlSyntaxError if
+    malformed.
+    """
+    statement = parse(sql, aws_iot_sql_version)
+    if statement.where is None:
+        return True
+    if not is_exact(statement.where):
+        raise UnsupportedSqlError("WHERE clause can't be evaluated exactly")
+    return Evaluator(context or EvaluationContext()).matches(statement, payload)
+
+
+def is_no_match(result) -> bool:
+    """Returns True for the task output of messages that don't match."""
+    return isinstance(result, dict) and result.get(NO_MATCH_KEY) is True
+
+
+def get_request_context(request: Dict[str, Any]) -> EvaluationContext:
+    return EvaluationContext(
+        topic=request.get("topic", ""),
+        mqtt_properties=request.get("mqttProperties", {}),
+        user_properties=request.get("userProperties", []),
+    )
+
+
+def get_response(request: Dict[str, Any], output, error=None) -> Dict[str, Any]:
+    """Creates a response in the format of the rule tester state machines."""
+    if output is None and error is None:
+        error = NO_MATCH_ERROR
+    return {
+        "output": output,
+        "error": error,
+        "input": request["message"],
+        "userProperties": request.get("userProperties", []),
+        "mqttProperties": request.get("mqttProperties", {}),
+    }
+
+
+def evaluate_request(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Answers a custom message test request like the custom message state machine.
+
+    Raises UnsupportedSqlError if the statement can't be evaluated locally,
+    including statements the parser rejects, only the rules engine decides
+    whether they are invalid.
+    """
+    try:
+        output = evaluate_sql(
+            event["sql"],
+            event["message"],
+            event.get("awsIotSqlVersion", DEFAULT_SQL_VERSION),
+            get_request_context(event),
+        )
+    except SqlSyntaxError as e:
+        raise UnsupportedSqlError(str(e))
+    return get_response(event, output)
@@ -0,0 +1,99 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import io
+
+import pytest
+from iottoolbox.claim_check import (
+    is_reference,
+    offload_fields,
+    put_payload,
+    resolve,
+    resolve_all,
+)
+from iottoolbox.serialization import dumps
+
+
+class FakeS3:
+    """S3 client keeping the objects in memory."""
+
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[(Bucket, Key)] = Body
+
+    def get_object(self, Bucket, Key):
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        ({"claimCheck": {"bucket": "b", "key": "k"}}, True),
+        ({"claimCheck": {"bucket": "b"}}, False),
+        ({"claimCheck": {"bucket": "b", "key": "k"}, "other": 1}, False),
+        ({"claimCheck": "k"}, False),
+        ([], False),
+    ],
+)
+def test_is_reference(value, expected):
+    assert is_reference(value) == expected
+
+
+def test_put_and_resolve():
+    s3 = FakeS3()
+
+    reference = put_payload(s3, "bucket", {"a": [1, 2]})
+
+    assert is_reference(reference)
+    assert resolve(s3, reference) == {"a": [1, 2]}
+    assert resolve(s3, {"a": 1}) == {"a": 1}
+
+
+def test_offload_fields_largest_first():
+    s3 = FakeS3()
+    items = [
+        {"message": {"data": "a" * 100}},
+        {"message": {"data": "b" * 1000}},
+        {"message": {"data": "c" * 10}},
+    ]
+    size = len(dumps(items))
+
+    new_size = offload_fields(s3, "bucket", items, "message", size, threshold=500)
+
+    assert new_size == len(dumps(items))
+    assert new_size <= 500
+    assert is_reference(items[1]["message"])
+    assert items[0]["message"] == {"data": "a" * 100}
+    assert len(s3.objects) == 1
+
+
+def test_offload_fields_below_threshold():
+    s3 = FakeS3()
+    items = [{"message": {"data": "a"}}]
+
+    offload_fields(s3, "bucket", items, "message", len(dumps(items)), threshold=500)
+
+    assert items == [{"message": {"data": "a"}}]
+    assert s3.objects == {}
+
+
+def test_resolve_all():
+    s3 = FakeS3()
+    result = {
+        "results": [
+            {"input": put_payload(s3, "bucket", {"a": 1}), "output": {"b": 1}},
+            {"input": {"a": 2}, "output": put_payload(s3, "bucket", [1, 2])},
+        ],
+        "error": None,
+    }
+
+    assert resolve_all(s3, result) == {
+        "results": [
+            {"input": {"a": 1}, "output": {"b": 1}},
+            {"input": {"a": 2}, "output": [1, 2]},
+        ],
+        "error": None,
+    }
+    assert resolve_all(s3, put_payload(s3, "bucket", {"c": 3})) == {"c": 3}
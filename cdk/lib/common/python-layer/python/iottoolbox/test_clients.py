@@ -0,0 +1,43 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import pytest
+from iottoolbox import clients
+from iottoolbox.clients import get_client, get_config, lazy_client
+
+
+@pytest.fixture(autouse=True)
+def reset_clients(mocker):
+    mocker.patch.dict(clients._clients, clear=True)
+
+
+def test_get_config():
+    config = get_config()
+
+    assert config.retries == {"mode": "adaptive", "max_attempts": 5}
+    assert config.max_pool_connections == 20
+    assert config.tcp_keepalive is True
+    assert config.connect_timeout == 5
+    assert config.read_timeout == 10
+
+
+def test_get_client_is_cached(mocker):
+    boto3_client = mocker.patch("boto3.client")
+
+    assert get_client("iot") is get_client("iot")
+    boto3_client.assert_called_once()
+    assert boto3_client.call_args.args == ("iot",)
+
+
+def test_lazy_client_creates_client_on_first_use(mocker):
+    boto3_client = mocker.patch("boto3.client")
+
+    client = lazy_client("stepfunctions")
+    boto3_client.assert_not_called()
+
+    client.describe_execution(executionArn="arn")
+
+    boto3_client.assert_called_once()
+    boto3_client.return_value.describe_execution.assert_called_once_with(
+        executionArn="arn"
+    )
@@ -0,0 +1,85 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+from unittest.mock import Mock
+
+import pytest
+from iottoolbox.execution_results import (
+    RUNNING,
+    get_async_execution_name,
+    get_execution_id,
+    get_result,
+    is_async_execution,
+    put_result,
+    put_running,
+)
+
+TABLE = "results"
+EXECUTION_ARN = "arn:aws:states:us-east-1:123456789012:execution:sm:exec-1"
+
+
+class ConditionalCheckFailedException(Exception):
+    pass
+
+
+def test_get_execution_id():
+    assert get_execution_id(EXECUTION_ARN) == "exec-1"
+
+
+def test_is_async_execution():
+    name = get_async_execution_name()
+
+    assert is_async_execution(
+        f"arn:aws:states:us-east-1:123456789012:execution:sm:{name}"
+    )
+    assert not is_async_execution(EXECUTION_ARN)
+
+
+def test_put_running():
+    dynamodb_client = Mock()
+
+    put_running(dynamodb_client, TABLE, EXECUTION_ARN)
+
+    kwargs = dynamodb_client.put_item.call_args.kwargs
+    assert kwargs["Item"]["executionId"] == {"S": "exec-1"}
+    assert kwargs["Item"]["status"] == {"S": RUNNING}
+    assert kwargs["ConditionExpression"] == "attribute_not_exists(executionId)"
+
+
+def test_put_running_already_finished():
+    dynamodb_client = Mock()
+    dynamodb_client.put_item.side_effect = ConditionalCheckFailedException()
+
+    put_running(dynamodb_client, TABLE, EXECUTION_ARN)
+
+
+def test_put_running_error():
+    dynamodb_client = Mock()
+    dynamodb_client.put_item.side_effect = ValueError()
+
+    with pytest.raises(ValueError):
+        put_running(dynamodb_client, TABLE, EXECUTION_ARN)
+
+
+def test_put_and_get_result():
+    dynamodb_client = Mock()
+    put_result(dynamodb_client, TABLE, EXECUTION_ARN, "SUCCEEDED", output='{"a": 1}')
+    item = dynamodb_client.put_item.call_args.kwargs["Item"]
+    dynamodb_client.get_item.return_value = {"Item": item}
+
+    result = get_result(dynamodb_client, TABLE, "exec-1")
+
+    assert result == {
+        "executionId": "exec-1",
+        "status": "SUCCEEDED",
+        "output": {"a": 1},
+        "error": None,
+    }
+    assert int(item["expiresAt"]["N"]) > 0
+
+
+def test_get_result_unknown():
+    dynamodb_client = Mock()
+    dynamodb_client.get_item.return_value = {}
+
+    assert get_result(dynamodb_client, TABLE, "exec-1") is None
@@ -0,0 +1,162 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import base64
+from concurrent.futures import Future
+from unittest.mock import Mock
+
+import pytest
+from iottoolbox.ingest_transport import (
+    HttpsTransport,
+    MqttTransport,
+    get_ingest_transport,
+    get_publish_packet,
+)
+
+REQUEST = {"topic": "$aws/rules/rule", "qos": 1, "payload": b'{"a": 1}'}
+
+
+class FakeConnection:
+    """MQTT connection whose publishes complete when the test acknowledges
+    them."""
+
+    def __init__(self, connected=True):
+        self.connected = connected
+        self.packets = []
+        self.futures = []
+
+    def wait_connected(self, timeout):
+        return self.connected
+
+    def publish(self, packet):
+        self.packets.append(packet)
+        future = Future()
+        self.futures.append(future)
+        return future
+
+
+def completed(reason_code):
+    future = Future()
+    future.set_result(reason_code)
+    return future
+
+
+def test_get_publish_packet():
+    request = {
+        **REQUEST,
+        "userProperties": [{"a": "b"}, {"c": "d", "e": 1}],
+        "contentType": "application/json",
+        "payloadFormatIndicator": "UTF8_DATA",
+        "responseTopic": "response",
+        "correlationData": base64.b64encode(b"\x00id").decode(),
+        "messageExpiry": "60",
+    }
+
+    assert get_publish_packet(request) == {
+        "topic": "$aws/rules/rule",
+        "qos": 1,
+        "payload": b'{"a": 1}',
+        "user_properties": [("a", "b"), ("c", "d"), ("e", "1")],
+        "content_type": "application/json",
+        "utf8": True,
+        "response_topic": "response",
+        "correlation_data": b"\x00id",
+        "message_expiry": 60,
+    }
+    assert get_publish_packet({**REQUEST, "userProperties": []}) == REQUEST
+    assert not get_publish_packet(
+        {**REQUEST, "payloadFormatIndicator": "UNSPECIFIED_BYTES"}
+    )["utf8"]
+
+
+def test_mqtt_transport_publish():
+    connection = FakeConnection()
+    fallback = Mock()
+    transport = MqttTransport(connection, fallback)
+    connection.publish = Mock(side_effect=lambda packet: completed(16))
+
+    assert transport.publish(REQUEST) == {"transport": "mqtt", "reasonCode": 16}
+    connection.publish.assert_called_once_with(REQUEST)
+    fallback.publish_many.assert_not_called()
+
+
+def test_mqtt_transport_pipelines_publishes():
+    connection = FakeConnection()
+    transport = MqttTransport(connection, Mock(), max_in_flight=2)
+    requests = [{**REQUEST, "payload": str(i).encode()} for i in range(3)]
+    waits = []
+
+    def wait(request, future):
+        waits.append(len(connection.packets))
+        return {"transport": "mqtt", "reasonCode": 0}
+
+    transport._wait = wait
+
+    assert len(transport.publish_many(requests)) == 3
+    # both publishes of the first window were sent before the first wait
+    assert waits == [2, 2, 3]
+    assert [p["payload"] for p in connection.packets] == [b"0", b"1", b"2"]
+
+
+@pytest.mark.parametrize(
+    "connection,reason",
+    [
+        (FakeConnection(connected=False), "not connected"),
+        (Mock(publish=Mock(side_effect=ValueError("closed"))), "ValueError('closed')"),
+        (Mock(publish=Mock(return_value=completed(135))), "PUBACK 135"),
+    ],
+)
+def test_mqtt_transport_falls_back(connection, reason):
+    iot_data_client = Mock()
+    iot_data_client.publish.return_value = {"ResponseMetadata": {}}
+    transport = MqttTransport(connection, HttpsTransport(iot_data_client))
+
+    assert transport.publish(REQUEST) == {
+        "ResponseMetadata": {},
+        "transport": "https",
+        "fallbackReason": reason,
+    }
+    iot_data_client.publish.assert_called_once_with(**REQUEST)
+    assert transport.fallbacks == 1
+
+
+def test_mqtt_transport_publish_timeout():
+    iot_data_client = Mock()
+    iot_data_client.publish.return_value = {}
+    transport = MqttTransport(
+        FakeConnection(), HttpsTransport(iot_data_client), publish_timeout=0.01
+    )
+
+    assert transport.publish(REQUEST)["transport"] == "https"
+    iot_data_client.publish.assert_called_once_with(**REQUEST)
+
+
+def test_get_ingest_transport(mocker):
+    iot_data_client = Mock()
+
+    transport = get_ingest_transport(iot_data_client, transport="https")
+    assert isinstance(transport, HttpsTransport)
+    assert transport.iot_data_client is iot_data_client
+
+    mocker.patch("iottoolbox.ingest_transport.crt_available", return_value=False)
+    assert isinstance(
+        get_ingest_transport(iot_data_client, transport="mqtt", endpoint="host"),
+        HttpsTransport,
+    )
+    with pytest.raises(ValueError):
+        get_ingest_transport(iot_data_client, transport="websocket")
+
+
+def test_get_ingest_transport_mqtt(mocker):
+    mocker.patch("iottoolbox.ingest_transport.crt_available", return_value=True)
+    connection = mocker.patch("iottoolbox.ingest_transport.CrtMqttConnection")
+
+    transport = get_ingest_transport(
+        Mock(), transport="MQTT", endpoint="host", region="eu-west-1"
+    )
+
+    assert isinstance(transport, MqttTransport)
+    assert isinstance(transport.fallback, HttpsTransport)
+    connection.assert_called_once_with("host", region="eu-west-1")
+    with pytest.raises(Exception):
+        get_ingest_transport(Mock(), transport="mqtt", endpoint=None)
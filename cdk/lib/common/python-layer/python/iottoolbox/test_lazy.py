@@ -0,0 +1,34 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import sys
+
+import pytest
+from iottoolbox.lazy import lazy_import
+
+
+@pytest.fixture
+def unload_colorsys():
+    sys.modules.pop("colorsys", None)
+    yield
+    sys.modules.pop("colorsys", None)
+
+
+def test_lazy_import_defers_execution(unload_colorsys):
+    module = lazy_import("colorsys", lazy=True)
+
+    # plain attribute access would execute the module
+    assert "rgb_to_hsv" not in object.__getattribute__(module, "__dict__")
+    assert module.rgb_to_hsv(1, 0, 0) == (0, 1, 1)
+    assert sys.modules["colorsys"] is module
+
+
+def test_lazy_import_eager(unload_colorsys):
+    module = lazy_import("colorsys", lazy=False)
+
+    assert "rgb_to_hsv" in module.__dict__
+
+
+def test_lazy_import_missing_module():
+    with pytest.raises(ModuleNotFoundError):
+        lazy_import("iottoolbox.does_not_exist", lazy=True)
@@ -0,0 +1,123 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import logging
+from unittest.mock import Mock
+
+import pytest
+from iottoolbox import log_budget
+from iottoolbox.log_budget import log_event, log_payload, redact, summarize
+from iottoolbox.serialization import dumps_bytes
+
+EVENT = {"message": {"temperature": 55}, "taskToken": "token"}
+
+
+@pytest.fixture
+def logger():
+    logger = Mock()
+    logger.isEnabledFor = lambda level: level >= logging.INFO
+    return logger
+
+
+@pytest.fixture
+def summary_mode(mocker):
+    mocker.patch.object(log_budget, "LOG_MODE", "summary")
+
+
+def test_summarize():
+    summary = summarize(EVENT)
+
+    assert summary["keys"] == ["message"]
+    assert summary["size"] == len(dumps_bytes({"message": {"temperature": 55}}))
+    # task tokens differ per invocation and don't change the hash
+    assert summary["sha256"] == summarize({**EVENT, "taskToken": "other"})["sha256"]
+    assert summary["sha256"] != summarize({"message": {}})["sha256"]
+
+
+def test_summarize_many_keys():
+    summary = summarize({f"key{i}": i for i in range(25)})
+
+    assert len(summary["keys"]) == log_budget.MAX_KEYS
+    assert summary["moreKeys"] == 5
+    assert summarize([1, 2, 3])["items"] == 3
+
+
+def test_redact():
+    payload = {
+        "sfnTaskToken": "token",
+        "text": "a" * 300,
+        "items": list(range(30)),
+        "nested": [{"taskToken": "token", "a": 1}],
+    }
+
+    redacted = redact(payload)
+
+    assert redacted["sfnTaskToken"] == "***"
+    assert redacted["text"] == "a" * 256 + "...(300 chars)"
+    assert redacted["items"] == list(range(20)) + ["...(30 items)"]
+    assert redacted["nested"] == [{"taskToken": "***", "a": 1}]
+    assert payload["sfnTaskToken"] == "token"
+
+
+def test_redact_deep():
+    payload = inner = {}
+    for _ in range(20):
+        inner["nested"] = {}
+        inner = inner["nested"]
+
+    redacted = redact(payload)
+    for _ in range(log_budget.MAX_DEPTH):
+        redacted = redacted["nested"]
+    assert redacted == "..."
+
+
+def test_log_event_full(logger):
+    log_event(logger, EVENT)
+
+    logger.info.assert_called_once_with(EVENT)
+
+
+def test_log_event_summary(logger, summary_mode):
+    log_event(logger, EVENT)
+
+    logger.info.assert_called_once_with(
+        "Event", extra={"eventSummary": summarize(EVENT)}
+    )
+    logger.debug.assert_not_called()
+
+
+def test_log_payload_summary_debug(logger, summary_mode):
+    logger.isEnabledFor = lambda level: True
+
+    log_payload(logger, "Request", EVENT, key="request")
+
+    logger.debug.assert_called_once_with(
+        "Request", extra={"request": {**EVENT, "taskToken": "***"}}
+    )
+
+
+def test_log_payload_summary_disabled(logger, summary_mode, mocker):
+    logger.isEnabledFor = lambda level: False
+    summarize = mocker.patch.object(log_budget, "summarize")
+    redact = mocker.patch.object(log_budget, "redact")
+
+    log_payload(logger, "Request", EVENT)
+
+    summarize.assert_not_called()
+    redact.assert_not_called()
+    logger.info.assert_not_called()
+
+
+def test_log_event_sampled(logger, summary_mode, mocker):
+    mocker.patch.object(log_budget, "SAMPLE_RATE", 1)
+
+    log_event(logger, EVENT)
+    log_payload(logger, "Request", EVENT)
+
+    logger.info.assert_any_call(
+        "Request",
+        extra={"payload": {**EVENT, "taskToken": "***"}, "sampled": True},
+    )
+    mocker.patch.object(log_budget, "SAMPLE_RATE", 0)
+    log_event(logger, EVENT)
+    assert not log_budget._sampled
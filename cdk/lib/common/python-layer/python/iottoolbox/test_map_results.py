@@ -0,0 +1,84 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import io
+import json
+
+from iottoolbox.map_results import get_item_result, is_written, read_results
+
+
+class FakeS3:
+    """S3 client keeping the objects in memory."""
+
+    def __init__(self, objects):
+        self.objects = {
+            key: json.dumps(value).encode() for key, value in objects.items()
+        }
+
+    def get_object(self, Bucket, Key):
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
+
+
+def entry(item, status="SUCCEEDED", **kwargs):
+    return {
+        "Input": json.dumps(
+            {"itemIndex": item["itemIndex"], "message": item["message"]}
+        ),
+        "Output": json.dumps(item) if status == "SUCCEEDED" else None,
+        "Status": status,
+        **kwargs,
+    }
+
+
+def test_is_written():
+    assert is_written({"ResultWriterDetails": {"Bucket": "b", "Key": "k"}})
+    assert not is_written([{"result": 1}])
+    assert not is_written(None)
+
+
+def test_read_results_in_item_order():
+    s3 = FakeS3(
+        {
+            ("bucket", "results/manifest.json"): {
+                "DestinationBucket": "bucket",
+                "ResultFiles": {
+                    "FAILED": [{"Key": "results/FAILED_0.json"}],
+                    "PENDING": [],
+                    "SUCCEEDED": [{"Key": "results/SUCCEEDED_0.json"}],
+                },
+            },
+            ("bucket", "results/SUCCEEDED_0.json"): [
+                entry({"itemIndex": 2, "message": {"a": 3}, "result": {"b": 3}}),
+                entry({"itemIndex": 0, "message": {"a": 1}, "result": {"b": 1}}),
+            ],
+            ("bucket", "results/FAILED_0.json"): [
+                entry(
+                    {"itemIndex": 1, "message": {"a": 2}},
+                    status="FAILED",
+                    Error="Lambda.Unknown",
+                    Cause="timeout",
+                ),
+            ],
+        }
+    )
+
+    results = read_results(
+        s3,
+        {"ResultWriterDetails": {"Bucket": "bucket", "Key": "results/manifest.json"}},
+    )
+
+    assert results == [
+        {"itemIndex": 0, "message": {"a": 1}, "result": {"b": 1}},
+        {
+            "itemIndex": 1,
+            "message": {"a": 2},
+            "error": {"Error": "Lambda.Unknown", "Cause": "timeout"},
+        },
+        {"itemIndex": 2, "message": {"a": 3}, "result": {"b": 3}},
+    ]
+
+
+def test_get_item_result_without_error():
+    assert get_item_result({"Status": "ABORTED", "Input": "{}"}) == {
+        "error": {"Error": "ABORTED", "Cause": None}
+    }
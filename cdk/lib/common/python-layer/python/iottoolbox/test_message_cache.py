@@ -0,0 +1,119 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+from unittest.mock import Mock
+
+import pytest
+from iottoolbox.message_cache import (
+    CAPTURE_PROPERTIES,
+    get_message,
+    parse_captured_properties,
+    put_message,
+)
+
+TABLE = "messages"
+CAPTURED = {
+    "message": {"temperature": 21},
+    "properties": {"userProperties": [{"a": "b"}], "mqttProperties": {}},
+}
+
+
+class ConditionalCheckFailedException(Exception):
+    pass
+
+
+class FakeCacheTable:
+    """DynamoDB client holding the items of the message cache."""
+
+    def __init__(self):
+        self.items = {}
+
+    def put_item(self, Item, ExpressionAttributeValues, **kwargs):
+        key = Item["topicFilter"]["S"]
+        stored = self.items.get(key)
+        if stored and float(stored["capturedAt"]["N"]) >= float(
+            ExpressionAttributeValues[":capturedAt"]["N"]
+        ):
+            raise ConditionalCheckFailedException()
+        self.items[key] = Item
+
+    def get_item(self, Key, **kwargs):
+        item = self.items.get(Key["topicFilter"]["S"])
+        return {"Item": item} if item else {}
+
+
+def test_put_and_get_message():
+    table = FakeCacheTable()
+
+    assert put_message(table, TABLE, "device/+/data", CAPTURED, now=1000)
+
+    assert get_message(table, TABLE, "device/+/data", 60, now=1030) == {
+        **CAPTURED,
+        "capturedAt": 1000,
+    }
+    assert get_message(table, TABLE, "device/#", 60, now=1030) is None
+
+
+def test_get_message_too_old():
+    table = FakeCacheTable()
+    put_message(table, TABLE, "device/+/data", CAPTURED, now=1000)
+
+    assert get_message(table, TABLE, "device/+/data", 60, now=1061) is None
+
+
+def test_put_message_keeps_newer_message():
+    table = FakeCacheTable()
+    put_message(table, TABLE, "device/+/data", CAPTURED, now=1000)
+
+    assert not put_message(
+        table, TABLE, "device/+/data", {"message": {"temperature": 20}}, now=999
+    )
+    assert get_message(table, TABLE, "device/+/data", 60, now=1000)["message"] == {
+        "temperature": 21
+    }
+
+
+def test_put_message_too_large(mocker):
+    mocker.patch("iottoolbox.message_cache.MESSAGE_CACHE_MAX_BYTES", 10)
+    dynamodb_client = Mock()
+
+    assert not put_message(dynamodb_client, TABLE, "device/+/data", CAPTURED)
+    dynamodb_client.put_item.assert_not_called()
+
+
+def test_put_message_error():
+    dynamodb_client = Mock()
+    dynamodb_client.put_item.side_effect = ValueError()
+
+    with pytest.raises(ValueError):
+        put_message(dynamodb_client, TABLE, "device/+/data", CAPTURED)
+
+
+def test_get_message_with_properties():
+    table = FakeCacheTable()
+    put_message(
+        table, TABLE, "device/+/data", CAPTURED, now=1000, properties=["content_type"]
+    )
+
+    assert get_message(
+        table, TABLE, "device/+/data", 60, properties=["content_type"], now=1000
+    )
+    assert (
+        get_message(table, TABLE, "device/+/data", 60, properties=[], now=1000)
+        is not None
+    )
+    assert (
+        get_message(
+            table, TABLE, "device/+/data", 60, properties=["user_properties"], now=1000
+        )
+        is None
+    )
+
+
+def test_parse_captured_properties():
+    assert parse_captured_properties("content_type,user_properties") == {
+        "content_type",
+        "user_properties",
+    }
+    assert parse_captured_properties("") == frozenset()
+    assert parse_captured_properties(None) == CAPTURE_PROPERTIES
@@ -0,0 +1,214 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+from unittest.mock import Mock
+
+import pytest
+from botocore.exceptions import ClientError
+from iottoolbox.rate_limit import (
+    DynamoDbRateLimiter,
+    LocalTokenBucket,
+    RateLimitedClient,
+    RateLimitExceededException,
+    call_with_backoff,
+    get_max_call_seconds,
+    is_throttling,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class ThrottlingIotStub:
+    """IoT control plane that throttles calls above max_tps per second."""
+
+    def __init__(self, clock, max_tps):
+        self.clock = clock
+        self.max_tps = max_tps
+        self.calls = []
+        self.throttled = 0
+
+    def _call(self, operation):
+        second = int(self.clock())
+        if sum(1 for s in self.calls if s == second) >= self.max_tps:
+            self.throttled += 1
+            raise ClientError({"Error": {"Code": "ThrottlingException"}}, operation)
+        self.calls.append(second)
+        return {}
+
+    def create_topic_rule(self, **kwargs):
+        return self._call("CreateTopicRule")
+
+    def delete_topic_rule(self, **kwargs):
+        return self._call("DeleteTopicRule")
+
+    def get_topic_rule(self, **kwargs):
+        return {"rule": kwargs}
+
+
+class ConditionalCheckFailedException(Exception):
+    pass
+
+
+class FakeCounterTable:
+    """DynamoDB client holding the counters of DynamoDbRateLimiter."""
+
+    def __init__(self):
+        self.counters = {}
+
+    def update_item(self, Key, ExpressionAttributeValues, **kwargs):
+        key = Key["bucket"]["S"]
+        if self.counters.get(key, 0) >= int(ExpressionAttributeValues[":rate"]["N"]):
+            raise ConditionalCheckFailedException()
+        self.counters[key] = self.counters.get(key, 0) + 1
+
+
+@pytest.mark.parametrize(
+    "e,expected",
+    [
+        (ClientError({"Error": {"Code": "ThrottlingException"}}, "op"), True),
+        (ClientError({"Error": {"Code": "InvalidRequestException"}}, "op"), False),
+        (type("TooManyRequestsException", (Exception,), {})(), True),
+        (ValueError(), False),
+    ],
+)
+def test_is_throttling(e, expected):
+    assert is_throttling(e) == expected
+
+
+def test_local_token_bucket():
+    clock = FakeClock()
+    bucket = LocalTokenBucket(2, clock=clock, sleep=clock.sleep)
+
+    waits = [bucket.acquire() for _ in range(4)]
+
+    assert waits == pytest.approx([0, 0, 0.5, 0.5])
+    assert clock.now == pytest.approx(1)
+
+
+def test_local_token_bucket_timeout():
+    clock = FakeClock()
+    bucket = LocalTokenBucket(1, clock=clock, sleep=clock.sleep)
+    bucket.acquire()
+
+    with pytest.raises(RateLimitExceededException):
+        bucket.acquire(timeout=0.5)
+
+
+def test_dynamodb_rate_limiter():
+    clock = FakeClock()
+    table = FakeCounterTable()
+    limiter = DynamoDbRateLimiter(
+        table, "limits", "iot-rules", 2, clock=clock, sleep=clock.sleep, rand=lambda: 0
+    )
+
+    for _ in range(5):
+        limiter.acquire()
+
+    assert table.counters == {
+        "iot-rules#0": 2,
+        "iot-rules#1": 2,
+        "iot-rules#2": 1,
+    }
+    assert clock.now == pytest.approx(2)
+
+
+def test_dynamodb_rate_limiter_timeout():
+    clock = FakeClock()
+    limiter = DynamoDbRateLimiter(
+        FakeCounterTable(), "limits", "iot-rules", 1, clock=clock, sleep=clock.sleep
+    )
+    limiter.acquire()
+
+    with pytest.raises(RateLimitExceededException):
+        limiter.acquire(timeout=0.5)
+
+
+def test_dynamodb_rate_limiter_error():
+    dynamodb_client = Mock()
+    dynamodb_client.update_item.side_effect = ValueError()
+    limiter = DynamoDbRateLimiter(dynamodb_client, "limits", "iot-rules", 1)
+
+    with pytest.raises(ValueError):
+        limiter.acquire()
+
+
+def test_call_with_backoff_retries_throttling():
+    clock = FakeClock()
+    fn = Mock(
+        side_effect=[
+            ClientError({"Error": {"Code": "ThrottlingException"}}, "op"),
+            {"ok": True},
+        ]
+    )
+
+    result = call_with_backoff(None, fn, 1, sleep=clock.sleep, rand=lambda: 1, a=2)
+
+    assert result == {"ok": True}
+    fn.assert_called_with(1, a=2)
+    assert clock.now == pytest.approx(1)
+
+
+def test_call_with_backoff_gives_up():
+    fn = Mock(side_effect=ClientError({"Error": {"Code": "ThrottlingException"}}, "op"))
+
+    with pytest.raises(ClientError):
+        call_with_backoff(None, fn, max_attempts=3, sleep=lambda s: None)
+
+    assert fn.call_count == 3
+
+
+def test_call_with_backoff_other_errors():
+    fn = Mock(side_effect=ValueError())
+
+    with pytest.raises(ValueError):
+        call_with_backoff(None, fn, sleep=lambda s: None)
+
+    fn.assert_called_once()
+
+
+def test_get_max_call_seconds():
+    # 3 tokens and the backoff of 1 and 2 seconds between the attempts
+    assert get_max_call_seconds(3, 10) == 33
+    assert get_max_call_seconds(1, 10) == 10
+    assert get_max_call_seconds(6, 0) == 1 + 2 + 4 + 8 + 8
+
+
+def test_rate_limited_client_stays_below_limit(mocker):
+    clock = FakeClock()
+    mocker.patch("iottoolbox.rate_limit.time.sleep", clock.sleep)
+    iot_client = ThrottlingIotStub(clock, max_tps=2)
+    limiter = LocalTokenBucket(2, burst=1, clock=clock, sleep=clock.sleep)
+    client = RateLimitedClient(iot_client, limiter)
+
+    for i in range(10):
+        client.create_topic_rule(ruleName=f"rule{i}")
+        client.delete_topic_rule(ruleName=f"rule{i}")
+
+    assert iot_client.throttled == 0
+    assert len(iot_client.calls) == 20
+    # other operations are passed through
+    assert client.get_topic_rule(ruleName="rule") == {"rule": {"ruleName": "rule"}}
+
+
+def test_rate_limited_client_retries_throttling(mocker):
+    clock = FakeClock()
+    mocker.patch("iottoolbox.rate_limit.time.sleep", clock.sleep)
+    mocker.patch("iottoolbox.rate_limit.random.random", return_value=1)
+    iot_client = ThrottlingIotStub(clock, max_tps=1)
+    # the limit of the bucket is above the one of the account
+    client = RateLimitedClient(iot_client, None)
+
+    client.create_topic_rule(ruleName="rule1")
+    client.create_topic_rule(ruleName="rule2")
+
+    assert iot_client.throttled == 1
+    assert len(iot_client.calls) == 2
@@ -0,0 +1,189 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+from unittest.mock import Mock
+
+import pytest
+from iottoolbox.result_cache import (
+    DynamoDbResultCache,
+    InMemoryResultCache,
+    get_cache_key,
+    get_result_cache,
+    is_cacheable,
+)
+
+REQUEST = {
+    "sql": "SELECT a FROM 'foo'",
+    "awsIotSqlVersion": "2016-03-23",
+    "message": {"a": 1, "b": 2},
+    "userProperties": [],
+    "mqttProperties": {},
+}
+RESULT = {"output": {"a": 1}, "error": None, "input": {"a": 1, "b": 2}}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeResultTable:
+    """DynamoDB client holding the items of the result cache."""
+
+    def __init__(self):
+        self.items = {}
+
+    def put_item(self, Item, **kwargs):
+        self.items[Item["requestKey"]["S"]] = Item
+
+    def get_item(self, Key, **kwargs):
+        item = self.items.get(Key["requestKey"]["S"])
+        return {"Item": item} if item else {}
+
+
+def test_get_cache_key():
+    key = get_cache_key(REQUEST)
+
+    assert len(key) == 64
+    reordered = {
+        **REQUEST,
+        "sql": "SELECT  a\nFROM 'foo'",
+        "message": {"b": 2, "a": 1},
+    }
+    assert get_cache_key(reordered) == key
+    # fields the result doesn't depend on
+    assert get_cache_key({**REQUEST, "variants": ["SELECT b"]}) == key
+
+    assert get_cache_key({**REQUEST, "message": {"a": 2, "b": 2}}) != key
+    assert get_cache_key({**REQUEST, "sql": "SELECT a FROM 'Foo'"}) != key
+    assert get_cache_key({**REQUEST, "awsIotSqlVersion": "2015-10-08"}) != key
+    assert get_cache_key({**REQUEST, "mode": "local"}) != key
+    assert get_cache_key({**REQUEST, "userProperties": [{"k": "v"}]}) != key
+
+
+def test_get_cache_key_default_sql_version():
+    request = {"sql": "SELECT *", "message": {}}
+
+    assert get_cache_key(request) == get_cache_key(
+        {**request, "awsIotSqlVersion": "2016-03-23"}
+    )
+
+
+def test_get_cache_key_topic_message():
+    assert get_cache_key({"sql": "SELECT * FROM 'foo'"}) is None
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "SELECT timestamp() AS ts FROM 'foo'",
+        "SELECT a, newuuid() AS id FROM 'foo'",
+        "SELECT * FROM 'foo' WHERE topic(1) = 'foo'",
+        "SELECT (SELECT VALUE rand() FROM a) AS r FROM 'foo'",
+        "SELECT get_thing_shadow('thing', 'arn') AS s FROM 'foo'",
+    ],
+)
+def test_get_cache_key_nondeterministic(sql):
+    assert get_cache_key({**REQUEST, "sql": sql}) is None
+
+
+@pytest.mark.parametrize(
+    "result,expected",
+    [
+        (RESULT, True),
+        ({"output": None, "error": "SqlParseException"}, True),
+        ({"output": None, "error": "States.HeartbeatTimeout"}, False),
+        ({"output": None, "error": "States.Timeout"}, False),
+        ({"output": None, "error": "IotRuleActionError: failed"}, False),
+        ({"results": [RESULT], "error": None}, True),
+        ({"results": [RESULT, {"error": "IotRuleActionError"}], "error": None}, False),
+    ],
+)
+def test_is_cacheable(result, expected):
+    assert is_cacheable(result) == expected
+
+
+def test_is_cacheable_exact_no_match():
+    no_match = {"output": None, "error": "States.HeartbeatTimeout"}
+
+    assert is_cacheable(no_match, exact_no_match=True)
+    assert is_cacheable({"results": [RESULT, no_match]}, exact_no_match=True)
+    assert not is_cacheable({"results": [RESULT, no_match]})
+    assert not is_cacheable(
+        {"output": None, "error": "States.Timeout"}, exact_no_match=True
+    )
+
+
+def test_in_memory_result_cache():
+    clock = FakeClock()
+    cache = InMemoryResultCache(ttl=60, clock=clock)
+
+    assert cache.get("key") is None
+    assert cache.put("key", RESULT)
+    cached = cache.get("key")
+    assert cached == RESULT
+    # lookups return a copy
+    cached["cache"] = "hit"
+    assert cache.get("key") == RESULT
+
+    clock.now += 60
+    assert cache.get("key") is None
+    assert len(cache) == 0
+
+
+def test_in_memory_result_cache_evicts_least_recently_used():
+    cache = InMemoryResultCache(max_entries=2)
+    cache.put("a", RESULT)
+    cache.put("b", RESULT)
+    cache.get("a")
+
+    cache.put("c", RESULT)
+
+    assert cache.get("a") == RESULT
+    assert cache.get("b") is None
+    assert cache.get("c") == RESULT
+
+
+def test_in_memory_result_cache_too_large():
+    cache = InMemoryResultCache(max_bytes=10)
+
+    assert not cache.put("key", RESULT)
+    assert cache.get("key") is None
+
+
+def test_dynamodb_result_cache():
+    clock = FakeClock()
+    table = FakeResultTable()
+    cache = DynamoDbResultCache(table, "results", ttl=60, clock=clock)
+
+    assert cache.get("key") is None
+    assert cache.put("key", RESULT)
+    assert table.items["key"]["expiresAt"] == {"N": "1060"}
+    assert cache.get("key") == RESULT
+
+    clock.now += 60
+    assert cache.get("key") is None
+
+
+def test_dynamodb_result_cache_too_large():
+    dynamodb_client = Mock()
+    cache = DynamoDbResultCache(dynamodb_client, "results", max_bytes=10)
+
+    assert not cache.put("key", RESULT)
+    dynamodb_client.put_item.assert_not_called()
+
+
+def test_get_result_cache():
+    assert isinstance(get_result_cache(backend="memory"), InMemoryResultCache)
+    cache = get_result_cache(Mock(), backend="DynamoDB", table_name="results")
+    assert isinstance(cache, DynamoDbResultCache)
+    assert cache.table_name == "results"
+    assert get_result_cache(backend="none") is None
+
+    with pytest.raises(Exception):
+        get_result_cache(Mock(), backend="dynamodb", table_name=None)
+    with pytest.raises(ValueError):
+        get_result_cache(backend="redis")
@@ -0,0 +1,84 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import pytest
+from iottoolbox.rule_pool import (
+    RulePoolCache,
+    get_fingerprint,
+    get_pooled_rule_name,
+    is_expired,
+    normalize_sql,
+    parse_pooled_rule_name,
+)
+
+
+@pytest.mark.parametrize(
+    "sql,expected",
+    [
+        ("SELECT *", "SELECT *"),
+        ("  SELECT   a,\n\tb  WHERE c = 1 ", "SELECT a, b WHERE c = 1"),
+        ("SELECT * WHERE a = 'x   y'", "SELECT * WHERE a = 'x   y'"),
+        ("SELECT * WHERE a = 'it''s  ok'  ", "SELECT * WHERE a = 'it''s  ok'"),
+    ],
+)
+def test_normalize_sql(sql, expected):
+    assert normalize_sql(sql) == expected
+
+
+def test_get_fingerprint():
+    assert get_fingerprint("SELECT  *", "2016-03-23") == get_fingerprint(
+        "SELECT *", "2016-03-23"
+    )
+    assert get_fingerprint("SELECT *", "2016-03-23") != get_fingerprint(
+        "SELECT *", "2015-10-08"
+    )
+    assert get_fingerprint("SELECT a", "2016-03-23") != get_fingerprint(
+        "SELECT b", "2016-03-23"
+    )
+
+
+def test_pooled_rule_name_roundtrip():
+    rule_name = get_pooled_rule_name("prefix", "SELECT *", "2016-03-23", 900, 1800)
+
+    assert rule_name == (
+        f"prefix_ingest_pool_{get_fingerprint('SELECT *', '2016-03-23')}_2"
+    )
+    assert parse_pooled_rule_name("prefix", rule_name) == (
+        get_fingerprint("SELECT *", "2016-03-23"),
+        2,
+    )
+
+
+@pytest.mark.parametrize(
+    "rule_name",
+    ["prefix_ingest_123", "other_ingest_pool_abc_1", "prefix_ingest_pool_abc_x"],
+)
+def test_parse_pooled_rule_name_ignores_other_rules(rule_name):
+    assert parse_pooled_rule_name("prefix", rule_name) is None
+
+
+@pytest.mark.parametrize(
+    "generation,now,expected",
+    [
+        (1, 1000, False),
+        (1, 1800, False),
+        (1, 2399, False),
+        (1, 2401, True),
+    ],
+)
+def test_is_expired(generation, now, expected):
+    assert is_expired(generation, 900, now) == expected
+
+
+def test_rule_pool_cache_is_bounded_lru():
+    cache = RulePoolCache(max_size=2)
+    cache.add("a")
+    cache.add("b")
+    assert cache.lookup("a")
+    cache.add("c")
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+    assert not cache.lookup("b")
+    assert (cache.hits, cache.misses) == (1, 1)
@@ -0,0 +1,66 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import json
+
+import pytest
+from iottoolbox import serialization
+from iottoolbox.serialization import dumps, dumps_bytes, get_backend, loads
+
+BACKENDS = ["json"] + (["orjson"] if serialization.orjson is not None else [])
+
+PAYLOAD = {
+    "temperature": 21.5,
+    "device": "sensor-ü",
+    "readings": [1, 2, {"nested": None, "ok": True}],
+}
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, mocker):
+    mocker.patch.object(serialization, "BACKEND", request.param)
+    return request.param
+
+
+def test_dumps(backend):
+    assert json.loads(dumps(PAYLOAD)) == PAYLOAD
+    assert json.loads(dumps_bytes(PAYLOAD)) == PAYLOAD
+    assert isinstance(dumps(PAYLOAD), str)
+    assert isinstance(dumps_bytes(PAYLOAD), bytes)
+
+
+def test_dumps_encoded_payload(backend):
+    encoded = json.dumps(PAYLOAD).encode("utf-8")
+
+    assert dumps_bytes(encoded) is encoded
+    assert dumps_bytes(bytearray(encoded)) == encoded
+    assert dumps(memoryview(encoded)) == encoded.decode("utf-8")
+
+
+@pytest.mark.parametrize("obj", [{"big": 2**70}, {1: "non-string key"}])
+def test_dumps_unsupported_by_orjson(backend, obj):
+    assert dumps(obj) == json.dumps(obj)
+    assert dumps_bytes(obj) == json.dumps(obj).encode("utf-8")
+
+
+@pytest.mark.parametrize(
+    "data", [json.dumps(PAYLOAD), json.dumps(PAYLOAD).encode("utf-8")]
+)
+def test_loads(backend, data):
+    assert loads(data) == PAYLOAD
+    assert loads(memoryview(json.dumps(PAYLOAD).encode("utf-8"))) == PAYLOAD
+
+
+def test_loads_nan(backend):
+    assert loads('{"a": NaN}')["a"] != loads('{"a": NaN}')["a"]
+
+
+def test_loads_invalid(backend):
+    with pytest.raises(json.JSONDecodeError):
+        loads("{")
+
+
+def test_get_backend(mocker):
+    assert get_backend("json") == "json"
+    mocker.patch.object(serialization, "orjson", None)
+    assert get_backend("auto") == "json"
@@ -0,0 +1,209 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import json
+import os
+
+import pytest
+from iottoolbox.sql import (
+    SQL_VERSION_2015_10_08,
+    BinaryOp,
+    Case,
+    Field,
+    FieldAccess,
+    FieldWildcard,
+    FunctionCall,
+    Index,
+    IsCheck,
+    Like,
+    Literal,
+    ObjectLiteral,
+    Projection,
+    SqlDiagnostic,
+    SqlSyntaxError,
+    Subquery,
+    UnaryOp,
+    Wildcard,
+    get_select_sql,
+    get_where_sql,
+    iter_function_calls,
+    parse,
+    tokenize,
+    validate,
+)
+
+with open(os.path.join(os.path.dirname(__file__), "testdata", "sql_corpus.json")) as f:
+    SQL_CORPUS = json.load(f)
+
+VALID_CORPUS = [case for case in SQL_CORPUS if case.get("valid", True)]
+INVALID_CORPUS = [case for case in SQL_CORPUS if not case.get("valid", True)]
+
+
+def test_tokenize():
+    tokens = list(tokenize("SELECT a.b AS 'c' FROM 't' WHERE x <> 1.5"))
+
+    assert [(t.kind, t.value) for t in tokens] == [
+        ("keyword", "SELECT"),
+        ("name", "a"),
+        ("punctuation", "."),
+        ("name", "b"),
+        ("keyword", "AS"),
+        ("string", "'c'"),
+        ("keyword", "FROM"),
+        ("string", "'t'"),
+        ("keyword", "WHERE"),
+        ("name", "x"),
+        ("operator", "<>"),
+        ("number", "1.5"),
+        ("eof", ""),
+    ]
+    assert tokens[1].position == 7
+    assert tokens[-1].position == 41
+
+
+def test_tokenize_keywords_are_case_insensitive():
+    tokens = list(tokenize("select Value fRoM"))
+
+    assert [t.kind for t in tokens] == ["keyword", "name", "keyword", "eof"]
+
+
+@pytest.mark.parametrize("case", VALID_CORPUS, ids=lambda case: case["sql"])
+def test_parse_corpus(case):
+    sql = case["sql"]
+    statement = parse(sql, case.get("version", "2016-03-23"))
+
+    assert get_select_sql(sql, statement) == case["select"]
+    assert get_where_sql(sql, statement) == case.get("where")
+    assert statement.topic == case.get("topic")
+
+
+@pytest.mark.parametrize("case", INVALID_CORPUS, ids=lambda case: case["sql"])
+def test_parse_corpus_errors(case):
+    with pytest.raises(SqlSyntaxError) as e:
+        parse(case["sql"], case.get("version", "2016-03-23"))
+
+    assert e.value.line == case.get("error_line", 1)
+    assert e.value.column == case["error_column"]
+
+
+def test_parse_ast():
+    statement = parse(
+        "SELECT *, state.reported[0] AS r, upper(name) FROM 'a/b' "
+        "WHERE NOT a = 1 OR -b * 2 > 3 AND c"
+    )
+
+    assert statement.projections == (
+        Projection(Wildcard()),
+        Projection(Index(FieldAccess(Field("state"), "reported"), Literal(0)), "r"),
+        Projection(FunctionCall("upper", (Field("name"),))),
+    )
+    assert statement.source == Literal("a/b")
+    assert statement.where == BinaryOp(
+        "OR",
+        UnaryOp("NOT", BinaryOp("=", Field("a"), Literal(1))),
+        BinaryOp(
+            "AND",
+            BinaryOp(
+                ">",
+                BinaryOp("*", UnaryOp("-", Field("b")), Literal(2)),
+                Literal(3),
+            ),
+            Field("c"),
+        ),
+    )
+
+
+def test_parse_rule_engine_extensions():
+    statement = parse(
+        "SELECT state.reported.* FROM 'a' "
+        "WHERE b IS NOT NULL AND c IS UNDEFINED OR d LIKE 'it\\'s%';"
+    )
+
+    assert statement.projections == (
+        Projection(FieldWildcard(FieldAccess(Field("state"), "reported"))),
+    )
+    assert statement.where == BinaryOp(
+        "OR",
+        BinaryOp(
+            "AND",
+            IsCheck(Field("b"), "NULL", negated=True),
+            IsCheck(Field("c"), "UNDEFINED"),
+        ),
+        Like(Field("d"), Literal("it's%")),
+    )
+
+
+def test_parse_case_and_object():
+    statement = parse("SELECT CASE a WHEN 1 THEN {'x': b} ELSE null END")
+
+    assert statement.projections[0].expression == Case(
+        Field("a"),
+        ((Literal(1), ObjectLiteral((("x", Field("b")),))),),
+        Literal(None),
+    )
+
+
+def test_parse_value_keyword():
+    assert parse("SELECT value FROM 't'").projections == (Projection(Field("value")),)
+
+    subquery = parse("SELECT (SELECT VALUE v FROM s) AS x").projections[0].expression
+    assert isinstance(subquery, Subquery)
+    assert subquery.select.value is True
+    assert subquery.select.source == Field("s")
+
+
+def test_parse_nested_queries_require_2016_version():
+    with pytest.raises(SqlSyntaxError, match="requires SQL version 2016-03-23"):
+        parse("SELECT (SELECT VALUE v FROM s) AS x", SQL_VERSION_2015_10_08)
+
+
+def test_parse_error_message():
+    with pytest.raises(SqlSyntaxError) as e:
+        parse("SELECT * FROM topic")
+
+    assert str(e.value) == (
+        "Expected topic filter in single quotes, found 'topic' at line 1, column 15"
+    )
+
+
+def test_parse_is_memoized():
+    sql = "SELECT memoized FROM 'x'"
+
+    assert parse(sql) is parse(sql)
+    assert parse(sql) is not parse(sql, SQL_VERSION_2015_10_08)
+
+
+def test_iter_function_calls():
+    statement = parse(
+        "SELECT upper(a) AS b, (SELECT VALUE abs(c) FROM d) AS e FROM 'x' "
+        "WHERE get_mqtt_property('content_type') = 'json'"
+    )
+
+    assert sorted(call.name for call in iter_function_calls(statement)) == [
+        "abs",
+        "get_mqtt_property",
+        "upper",
+    ]
+
+
+def test_validate():
+    assert validate("SELECT a FROM 'x' WHERE b > 1") is None
+
+    diagnostic = validate("SELECT *\nFROM topic")
+    assert diagnostic == SqlDiagnostic(
+        "Expected topic filter in single quotes, found 'topic'", 14, 2, 6
+    )
+    assert diagnostic.to_dict() == {
+        "message": "Expected topic filter in single quotes, found 'topic'",
+        "position": 14,
+        "line": 2,
+        "column": 6,
+    }
+    assert validate("SELECT *\nFROM topic") is diagnostic
+
+
+def test_validate_require_topic():
+    assert validate("SELECT a") is None
+    assert validate("SELECT a", require_topic=True) == SqlDiagnostic(
+        "FROM clause with topic filter missing", 8, 1, 9
+    )
@@ -0,0 +1,92 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import json
+import os
+
+import pytest
+from iottoolbox.sql import DEFAULT_SQL_VERSION, SqlSyntaxError
+from iottoolbox.sql_batch import ColumnarBatch, evaluate_sql_batch
+from iottoolbox.sql_eval import (
+    UNDEFINED,
+    EvaluationContext,
+    UnsupportedSqlError,
+    evaluate_sql,
+)
+
+
+def load_testdata(name):
+    with open(os.path.join(os.path.dirname(__file__), "testdata", name)) as f:
+        return json.load(f)
+
+
+SQL_CORPUS = load_testdata("sql_corpus.json")
+RECORDINGS = load_testdata("sql_differential.json")
+
+PAYLOADS = [
+    {"a": 1, "b": {"c": [10, 20]}, "s": "x"},
+    {"a": 2.5, "b": {"c": [30]}, "s": "y"},
+    {"a": "3", "b": {"c": "no list"}},
+    {"a": True, "b": None},
+    {"b": {"c": [40, 50]}, "s": "z"},
+    ["not", "an", "object"],
+    {"a": -4, "s": "x"},
+] + [recording["message"] for recording in RECORDINGS]
+
+# the statements of both fixtures, evaluated against every payload
+STATEMENTS = [
+    (case["sql"], case.get("version", DEFAULT_SQL_VERSION))
+    for case in SQL_CORPUS
+    if case.get("valid", True)
+] + [(r["sql"], r["awsIotSqlVersion"]) for r in RECORDINGS]
+
+CONTEXT = EvaluationContext(topic="iot/dev1/data", client_id="client", timestamp=42)
+
+
+def evaluate_rows(sql, version):
+    """Evaluates the statement for each payload on its own, returns the
+    results or the exception raised for any of them."""
+    try:
+        return [evaluate_sql(sql, p, version, CONTEXT) for p in PAYLOADS], None
+    except (SqlSyntaxError, UnsupportedSqlError) as e:
+        return None, type(e)
+
+
+@pytest.mark.parametrize("sql,version", STATEMENTS, ids=lambda v: v)
+def test_evaluate_batch_matches_row_evaluation(sql, version):
+    expected, error = evaluate_rows(sql, version)
+
+    if error is not None:
+        with pytest.raises(error):
+            evaluate_sql_batch(sql, PAYLOADS, version, [CONTEXT] * len(PAYLOADS))
+        return
+    result = evaluate_sql_batch(sql, PAYLOADS, version, [CONTEXT] * len(PAYLOADS))
+    assert result.rows == expected
+    assert result.mask == [row is not None for row in expected]
+
+
+def test_evaluate_batch_contexts():
+    contexts = [
+        EvaluationContext(topic="a/1"),
+        EvaluationContext(topic="a/2"),
+    ]
+
+    result = evaluate_sql_batch(
+        "SELECT topic(2) AS t WHERE x = 1", [{"x": 1}, {"x": 1}], contexts=contexts
+    )
+
+    assert result.rows == [{"t": "1"}, {"t": "2"}]
+
+
+def test_columnar_batch_shares_path_prefixes():
+    batch = ColumnarBatch([{"a": {"b": 1, "c": 2}}, {"a": 3}])
+
+    assert batch.column(("a", "b")) == [1, UNDEFINED]
+    assert batch.column(("a", "c")) == [2, UNDEFINED]
+    assert set(batch._columns) == {(), ("a",), ("a", "b"), ("a", "c")}
+
+
+def test_columnar_batch_select():
+    batch = ColumnarBatch([{"a": 1}, {"a": 2}, {"a": 3}])
+
+    assert batch.select([0, 2]).column(("a",)) == [1, 3]
@@ -0,0 +1,167 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import json
+import os
+
+import pytest
+from iottoolbox.sql_eval import (
+    NO_MATCH_ERROR,
+    SQL_PARSE_ERROR,
+    EvaluationContext,
+    UnsupportedSqlError,
+    evaluate_request,
+    evaluate_sql,
+    matches_sql,
+)
+
+# Recorded responses of the custom message state machine, see
+# tools/record_sql_differential.py. The local evaluator must give the same
+# output and error for every recording.
+with open(
+    os.path.join(os.path.dirname(__file__), "testdata", "sql_differential.json")
+) as f:
+    RECORDINGS = json.load(f)
+
+
+@pytest.mark.parametrize("recording", RECORDINGS, ids=lambda r: r["sql"])
+def test_differential(recording):
+    if recording["error"] == SQL_PARSE_ERROR:
+        # statements the parser rejects are left to the rules engine
+        with pytest.raises(UnsupportedSqlError):
+            evaluate_request(recording)
+        return
+
+    response = evaluate_request(recording)
+
+    assert response["output"] == recording["output"]
+    assert response["error"] == recording["error"]
+    assert response["input"] == recording["message"]
+
+
+@pytest.mark.parametrize(
+    "sql,payload,expected",
+    [
+        ("SELECT a FROM 't' WHERE b", {"a": 1, "b": True}, {"a": 1}),
+        ("SELECT a FROM 't' WHERE b", {"a": 1, "b": 1}, None),
+        ("SELECT a FROM 't' WHERE b = '1'", {"a": 1, "b": 1}, None),
+        ("SELECT a FROM 't' WHERE b > '1'", {"a": 1, "b": 2}, {"a": 1}),
+        ("SELECT a FROM 't' WHERE b < 'abc'", {"a": 1, "b": 2}, None),
+        ("SELECT a FROM 't' WHERE b <> 2", {"a": 1, "b": 2.0}, None),
+        (
+            "SELECT -7 / 2 AS a, 7 % -3 AS b, 7.0 / 2 AS c",
+            {},
+            {"a": -3, "b": 1, "c": 3.5},
+        ),
+        ("SELECT 1 / 0 AS a, 'a' + 'b' AS b, '2' * 3 AS c", {}, {"b": "ab", "c": 6}),
+        ("SELECT a[5] AS x, a[0] AS y, b.c AS z", {"a": [1], "b": 1}, {"y": 1}),
+        ("SELECT {'x': missing, 'y': 1} AS o", {}, {"o": {"y": 1}}),
+        ("SELECT CASE WHEN a > 1 THEN 'big' END AS size", {"a": 0}, {}),
+        ("SELECT *, a AS b", {"a": 1}, {"a": 1, "b": 1}),
+        (
+            "SELECT isUndefined(a) AS u, isNull(b) AS n",
+            {"b": None},
+            {"u": True, "n": True},
+        ),
+        (
+            "SELECT substring(s, 1, 3) AS s, length(s) AS l",
+            {"s": "abcd"},
+            {"s": "bc", "l": 4},
+        ),
+        (
+            "SELECT round(2.5) AS r, floor(-1.5) AS f, abs(-3) AS a",
+            {},
+            {"r": 3, "f": -2, "a": 3},
+        ),
+        ("SELECT concat([1], 2, [3]) AS c", {}, {"c": [1, 2, 3]}),
+        ("SELECT encode(*, 'base64') AS e", {"a": 1}, {"e": "eyJhIjogMX0="}),
+        (
+            "SELECT (SELECT a FROM items WHERE a > 1) AS i",
+            {"items": [{"a": 1}, {"a": 2}]},
+            {"i": [{"a": 2}]},
+        ),
+    ],
+)
+def test_evaluate_sql(sql, payload, expected):
+    assert evaluate_sql(sql, payload) == expected
+
+
+def test_evaluate_sql_context_functions():
+    context = EvaluationContext(
+        topic="iot/dev1/data", client_id="client", principal="p", timestamp=42
+    )
+
+    assert evaluate_sql(
+        "SELECT topic() AS t, topic(2) AS d, topic(9) AS x, clientid() AS c, "
+        "principal() AS p, timestamp() AS ts",
+        {},
+        context=context,
+    ) == {"t": "iot/dev1/data", "d": "dev1", "c": "client", "p": "p", "ts": 42}
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "SELECT unknown_function(a) AS x",
+        "SELECT upper(a)",
+        "SELECT topic(1, 2) AS x",
+        "SELECT a.* FROM 't'",
+        "SELECT * FROM 't' WHERE a IS NOT NULL",
+        "SELECT * FROM 't' WHERE a LIKE 'b%'",
+    ],
+)
+def test_evaluate_sql_unsupported(sql):
+    with pytest.raises(UnsupportedSqlError):
+        evaluate_sql(sql, {"a": "b"})
+
+
+def test_evaluate_request_no_match():
+    event = {
+        "sql": "SELECT * FROM 't' WHERE a = 2",
+        "awsIotSqlVersion": "2016-03-23",
+        "message": {"a": 1},
+        "userProperties": [],
+        "mqttProperties": {},
+    }
+
+    assert evaluate_request(event) == {
+        "output": None,
+        "error": NO_MATCH_ERROR,
+        "input": {"a": 1},
+        "userProperties": [],
+        "mqttProperties": {},
+    }
+
+
+@pytest.mark.parametrize(
+    "sql,payload,expected",
+    [
+        ("SELECT * FROM 't'", {"a": 1}, True),
+        ("SELECT * FROM 't' WHERE a = 1", {"a": 1}, True),
+        ("SELECT * FROM 't' WHERE a = 2", {"a": 1}, False),
+        ("SELECT * FROM 't' WHERE b > 2", {"a": 1}, False),
+        ("SELECT unknown_function(a) AS x FROM 't' WHERE a = 1", {"a": 1}, True),
+        ("SELECT * FROM 't' WHERE a AND b > 1", {"a": "true", "b": 5}, True),
+        ("SELECT * FROM 't' WHERE NOT a", {"a": "False"}, True),
+        ("SELECT * FROM 't' WHERE a OR b", {"a": "yes", "b": True}, False),
+        ("SELECT * FROM 't' WHERE isUndefined(a) AND b <> 'x'", {"b": "y"}, True),
+    ],
+)
+def test_matches_sql(sql, payload, expected):
+    assert matches_sql(sql, payload) == expected
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "SELECT * FROM 't' WHERE unknown_function(a) = 1",
+        "SELECT * FROM 't' WHERE topic(2) = 'dev1'",
+        "SELECT * FROM 't' WHERE TIMESTAMP() > 0",
+        "SELECT * FROM 't' WHERE a + 1 > 2",
+        "SELECT * FROM 't' WHERE upper(a) = 'B'",
+        "SELECT * FROM 't' WHERE CASE a WHEN 1 THEN true END",
+    ],
+)
+def test_matches_sql_unsupported(sql):
+    with pytest.raises(UnsupportedSqlError):
+        matches_sql(sql, {"a": 1})
@@ -0,0 +1,122 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+from unittest.mock import Mock, call
+
+import pytest
+from aws_lambda_powertools.metrics import MetricUnit
+from iottoolbox import timing
+from iottoolbox.timing import (
+    collect,
+    get_correlation_id,
+    get_task_token_id,
+    link_task_token,
+    record_size,
+    set_correlation_id,
+    timed,
+)
+
+
+@pytest.fixture
+def metrics(mocker):
+    mocker.patch.object(timing, "_correlation_id", None)
+    return Mock()
+
+
+def test_timed(metrics):
+    with collect() as collector:
+        set_correlation_id(metrics, "exec-1")
+        with timed(metrics, "Publish"):
+            pass
+
+    assert metrics.add_metric.call_args.kwargs["name"] == "PublishLatency"
+    assert metrics.add_metric.call_args.kwargs["unit"] == MetricUnit.Milliseconds
+    metrics.add_metadata.assert_any_call(key="correlationId", value="exec-1")
+    assert [(t.stage, t.correlation_id) for t in collector.timings] == [
+        ("Publish", "exec-1")
+    ]
+
+
+def test_timed_exception(metrics):
+    with collect() as collector:
+        with pytest.raises(ValueError):
+            with timed(metrics, "CreateTopicRule"):
+                raise ValueError()
+
+    assert collector.aggregate()["CreateTopicRule"]["count"] == 1
+
+
+def test_record_size(metrics):
+    with collect() as collector:
+        record_size(metrics, "Publish", 128)
+
+    metrics.add_metric.assert_called_once_with(
+        name="PublishSize", unit=MetricUnit.Bytes, value=128
+    )
+    assert collector.sizes == {"Publish": [128]}
+
+
+def test_collect_inactive(metrics):
+    with collect() as collector:
+        pass
+    with timed(metrics, "Publish"):
+        pass
+
+    assert collector.timings == []
+
+
+def test_aggregate(metrics, mocker):
+    perf_counter = mocker.patch("iottoolbox.timing.time.perf_counter")
+    perf_counter.side_effect = [0, 0.001, 0, 0.003, 0, 0.002]
+
+    with collect() as collector:
+        for _ in range(3):
+            with timed(metrics, "Publish"):
+                pass
+
+    assert collector.aggregate() == {
+        "Publish": {
+            "count": 3,
+            "totalMs": pytest.approx(6),
+            "p50Ms": pytest.approx(2),
+            "maxMs": pytest.approx(3),
+        }
+    }
+
+
+def test_waterfall(metrics):
+    with collect() as collector:
+        # ingest_message hands out the task token
+        set_correlation_id(metrics, "exec-1")
+        with timed(metrics, "Publish"):
+            link_task_token(metrics, "token")
+        # receive_message only knows the token
+        set_correlation_id(metrics, get_task_token_id("token"))
+        with timed(metrics, "SendTaskSuccess"):
+            pass
+        set_correlation_id(metrics, "exec-2")
+        with timed(metrics, "Publish"):
+            pass
+
+    assert [t.stage for t in collector.waterfall("exec-1")] == [
+        "Publish",
+        "SendTaskSuccess",
+    ]
+    assert [t.stage for t in collector.waterfall("exec-2")] == ["Publish"]
+    assert (
+        call(key="taskTokenId", value=get_task_token_id("token"))
+        in metrics.add_metadata.call_args_list
+    )
+
+
+@pytest.mark.parametrize(
+    "event,expected",
+    [
+        ({"execution": "exec-1", "input": {}}, "exec-1"),
+        ({"input": {"execution": "exec-1"}}, "exec-1"),
+        ({"input": "x"}, None),
+        ({}, None),
+    ],
+)
+def test_get_correlation_id(event, expected):
+    assert get_correlation_id(event) == expected
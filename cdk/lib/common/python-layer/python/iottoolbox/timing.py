@@ -0,0 +1,138 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Per-stage timings of the rule tests as CloudWatch Embedded Metric Format.
+
+Handlers time their stages (AWS calls, SQL rewriting) with timed() and
+record payload sizes with record_size(). Both are added to the powertools
+Metrics of the handler as <stage>Latency and <stage>Size, so the handler
+must be decorated with @metrics.log_metrics.
+
+Every record carries the correlation ID of the test as metadata, the name
+of the Step Functions execution. receive_message only knows the task token
+of the rule's message, so it uses a hash of the token, and the functions
+handing out task tokens link the hash to the execution. Together with the
+start time of every stage this gives an end-to-end latency waterfall.
+
+Tests aggregate the timings locally with collect().
+"""
+
+import hashlib
+import statistics
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from aws_lambda_powertools.metrics import MetricUnit
+
+CORRELATION_ID_KEY = "correlationId"
+TASK_TOKEN_ID_KEY = "taskTokenId"
+
+
+class StageTiming(NamedTuple):
+    stage: str
+    correlation_id: Optional[str]
+    start_ms: float
+    duration_ms: float
+
+
+class TimingCollector:
+    """Aggregates the timings recorded while it is active, see collect()."""
+
+    def __init__(self):
+        self.timings: List[StageTiming] = []
+        self.sizes: Dict[str, List[int]] = defaultdict(list)
+        self.links: Dict[str, str] = {}
+
+    def aggregate(self) -> Dict[str, Dict[str, float]]:
+        durations = defaultdict(list)
+        for timing in self.timings:
+            durations[timing.stage].append(timing.duration_ms)
+        return {
+            stage: {
+                "count": len(values),
+                "totalMs": sum(values),
+                "p50Ms": statistics.median(values),
+                "maxMs": max(values),
+            }
+            for stage, values in durations.items()
+        }
+
+    def waterfall(self, correlation_id: str) -> List[StageTiming]:
+        """Returns the timings of one test ordered by their start."""
+        return sorted(
+            (
+                t
+                for t in self.timings
+                if self.links.get(t.correlation_id, t.correlation_id) == correlation_id
+            ),
+            key=lambda t: t.start_ms,
+        )
+
+
+_collectors: List[TimingCollector] = []
+_correlation_id: Optional[str] = None
+
+
+@contextmanager
+def collect():
+    collector = TimingCollector()
+    _collectors.append(collector)
+    try:
+        yield collector
+    finally:
+        _collectors.remove(collector)
+
+
+def get_correlation_id(event: Dict[str, Any]) -> Optional[str]:
+    """Returns the execution name passed by the state machine tasks."""
+    execution = event.get("execution")
+    if execution is None and isinstance(event.get("input"), dict):
+        execution = event["input"].get("execution")
+    return execution
+
+
+def get_task_token_id(task_token: str) -> str:
+    return hashlib.sha256(task_token.encode("utf-8")).hexdigest()[:16]
+
+
+def set_correlation_id(metrics, correlation_id: Optional[str]):
+    """Sets the correlation ID of the current invocation."""
+    global _correlation_id
+    _correlation_id = correlation_id
+    if correlation_id is not None:
+        metrics.add_metadata(key=CORRELATION_ID_KEY, value=correlation_id)
+
+
+def link_task_token(metrics, task_token: str):
+    """Links the timings of the function receiving task_token to the current
+    correlation ID."""
+    task_token_id = get_task_token_id(task_token)
+    metrics.add_metadata(key=TASK_TOKEN_ID_KEY, value=task_token_id)
+    if _correlation_id is not None:
+        for collector in _collectors:
+            collector.links[task_token_id] = _correlation_id
+
+
+@contextmanager
+def timed(metrics, stage: str):
+    start = time.time()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration_ms = (time.perf_counter() - started) * 1000
+        metrics.add_metric(
+            name=f"{stage}Latency", unit=MetricUnit.Milliseconds, value=duration_ms
+        )
+        metrics.add_metadata(key=f"{stage}StartTime", value=int(start * 1000))
+        timing = StageTiming(stage, _correlation_id, start * 1000, duration_ms)
+        for collector in _collectors:
+            collector.timings.append(timing)
+
+
+def record_size(metrics, stage: str, size: int):
+    metrics.add_metric(name=f"{stage}Size", unit=MetricUnit.Bytes, value=size)
+    for collector in _collectors:
+        collector.sizes[stage].append(size)
@@ -10,6 +10,8 @@ import { FunctionOptions, FunctionProps } from 'aws-cdk-lib/aws-lambda/lib/funct
 import { Construct } from 'constructs'
 import { Code } from 'aws-cdk-lib/aws-lambda/lib/code'
 import { Stack } from 'aws-cdk-lib'
+import { TOOLBOX_LOG_MODE, TOOLBOX_LOG_SAMPLE_RATE } from '../constants'
+import path = require('path');
 
 const POWERTOOL_LAYER_VERSIONS: { [key: number]: string; } = {
   [RuntimeFamily.PYTHON]: '017000801446:layer:AWSLambdaPowertoolsPythonV2-Arm64:40',
@@ -18,6 +20,8 @@ const POWERTOOL_LAYER_VERSIONS: { [key: number]: string; } = {
 
 const powertoolsLayers: { [key: number]: lambda.ILayerVersion; } = {}
 
+const TOOLBOX_PYTHON_LAYER_ID = 'ToolboxPythonLayer'
+
 interface RequiredLambdaFunctionProps extends FunctionOptions {
   readonly runtime: lambda.Runtime
   readonly code: Code
@@ -42,6 +46,9 @@ export class ToolboxLambdaFunction extends lambda.Function {
     if (props.serviceName) {
       environment.POWERTOOLS_SERVICE_NAME = props.serviceName
     }
+    if (!environment.POWERTOOLS_METRICS_NAMESPACE) {
+      environment.POWERTOOLS_METRICS_NAMESPACE = 'IotToolbox'
+    }
 
     const defaultFunctionProps = {
       handler: 'index.lambda_handler',
@@ -60,7 +67,12 @@ export class ToolboxLambdaFunction extends lambda.Function {
   }
 
   static Python (scope: Construct, id: string, props: LambdaFunctionProps) {
-    return this.withProperties(scope, id, { ...props, runtime: lambda.Runtime.PYTHON_3_11 })
+    const environment = {
+      TOOLBOX_LOG_MODE,
+      TOOLBOX_LOG_SAMPLE_RATE: `${TOOLBOX_LOG_SAMPLE_RATE}`,
+      ...props.environment
+    }
+    return this.withProperties(scope, id, { ...props, environment, runtime: lambda.Runtime.PYTHON_3_11 })
   }
 
   static NodeJS (scope: Construct, id: string, props: LambdaFunctionProps) {
@@ -77,8 +89,28 @@ export class ToolboxLambdaFunction extends lambda.Function {
         }
         layers.push(powertoolsLayers[props.runtime.family])
       }
+      if (props.runtime.family === RuntimeFamily.PYTHON) {
+        layers.push(this.toolboxPythonLayer(scope))
+      }
     }
 
     return new this(scope, id, { ...props, layers })
   }
+
+  // shared Python modules (iottoolbox package), created once per stack
+  private static toolboxPythonLayer (scope: Construct): lambda.ILayerVersion {
+    const stack = Stack.of(scope)
+    const existingLayer = stack.node.tryFindChild(TOOLBOX_PYTHON_LAYER_ID) as lambda.ILayerVersion | undefined
+    if (existingLayer) {
+      return existingLayer
+    }
+    return new lambda.LayerVersion(stack, TOOLBOX_PYTHON_LAYER_ID, {
+      code: lambda.Code.fromAsset(path.join(__dirname, 'python-layer'), {
+        exclude: ['**/test_*.py', '**/testdata', '**/__pycache__']
+      }),
+      compatibleRuntimes: [lambda.Runtime.PYTHON_3_11],
+      compatibleArchitectures: [lambda.Architecture.ARM_64],
+      description: 'Shared Python modules of the Toolbox for AWS IoT'
+    })
+  }
 }
@@ -7,3 +7,31 @@ export const TOOLBOX_NAME = 'iottoolbox'
 export const TOOLBOX_IOT_RULE_PREFIX = `${TOOLBOX_NAME}`
 export const TOOLBOX_ECS_TASK_PREFIX = `${TOOLBOX_NAME}`
 export const TOOLBOX_ERROR_TOPIC = `${TOOLBOX_NAME}/republish/error`
+export const TOOLBOX_RULE_POOL_TTL_SECONDS = 900
+// account-wide calls per second of CreateTopicRule and DeleteTopicRule by the rule tests
+export const TOOLBOX_IOT_RULE_TPS = 5
+// seconds a call of CreateTopicRule or DeleteTopicRule waits at most for its share of TOOLBOX_IOT_RULE_TPS
+export const TOOLBOX_RATE_LIMIT_MAX_WAIT_SECONDS = 10
+// timeout of the functions creating and deleting rules, a call waits up to 33 seconds (3 attempts with
+// TOOLBOX_RATE_LIMIT_MAX_WAIT_SECONDS each and the backoff between them) and delete_rule may delete two rules
+export const TOOLBOX_RATE_LIMITED_LAMBDA_TIMEOUT_SECONDS = 90
+// temporary rules older than this are deleted by the scheduled sweep, longer than any test runs
+export const TOOLBOX_ORPHANED_RULE_AGE_SECONDS = 900
+// run the deterministic stages of the rule tester state machines in one Lambda function
+export const TOOLBOX_FUSED_STAGES = false
+// 'summary' only logs the size, top-level keys and a hash of messages, 'full' logs them as they are
+export const TOOLBOX_LOG_MODE = 'summary'
+// share of invocations logging redacted messages in summary mode
+export const TOOLBOX_LOG_SAMPLE_RATE = 0.01
+// how long results of asynchronous rule tests can be fetched
+export const TOOLBOX_RESULT_TTL_SECONDS = 3600
+// how long identical custom and batch message tests are answered from the result cache
+export const TOOLBOX_RESULT_CACHE_TTL_SECONDS = 300
+// how long captured topic messages can be served to tests with a maxMessageAge
+export const TOOLBOX_MESSAGE_CACHE_TTL_SECONDS = 600
+// messages of rule tests are passed to the state machines through Amazon S3 above this size in bytes
+export const TOOLBOX_CLAIM_CHECK_THRESHOLD = 65536
+// messages per batch message test, 20 in parallel with up to 2 seconds each fit the 5 minute timeout of the state machine
+export const TOOLBOX_BATCH_MAX_MESSAGES = 1000
+// 'mqtt' publishes test messages over a persistent MQTT 5 connection, needs awscrt from an additional layer
+export const TOOLBOX_INGEST_TRANSPORT = 'https'
@@ -62,6 +62,8 @@ export class IotToolbox extends cdk.Stack {
     const apiConstruct = new ApiConstruct(this, 'API', {
       stepfunctionCustomMessage: this.testIotRulesConstruct.stepfunctionCustomMessage,
       stepfunctionTopicMessage: this.testIotRulesConstruct.stepfunctionTopicMessage,
+      stepfunctionBatchMessage: this.testIotRulesConstruct.stepfunctionBatchMessage,
+      claimCheckBucket: this.testIotRulesConstruct.claimCheckBucket,
       startRecordingFunction: this.recordMessagesConstruct.startRecordingFunction,
       stopRecordingFunction: this.recordMessagesConstruct.stopRecordingFunction,
       listRecordingsFunction: this.recordMessagesConstruct.listRecordingsFunction,
@@ -7,6 +7,7 @@ import * as cdk from 'aws-cdk-lib'
 import { Construct } from 'constructs'
 import { TopicMessage } from './stepfunction/topic-message/infrastructure'
 import { CustomMessage } from './stepfunction/custom-message/infrastructure'
+import { BatchMessage } from './stepfunction/batch-message/infrastructure'
 import { SharedRuleProcessingConstructs, SharedRuleProcessingConstructsProps } from './stepfunction/shared/infrastructure'
 
 interface TestIotRulesConstructProps extends SharedRuleProcessingConstructsProps {}
@@ -14,13 +15,25 @@ interface TestIotRulesConstructProps extends SharedRuleProcessingConstructsProps
 export class TestIotRulesConstruct extends Construct {
   stepfunctionTopicMessage: cdk.aws_stepfunctions.StateMachine
   stepfunctionCustomMessage: cdk.aws_stepfunctions.StateMachine
+  stepfunctionBatchMessage: cdk.aws_stepfunctions.StateMachine
+  claimCheckBucket: cdk.aws_s3.Bucket
 
   constructor (scope: Construct, id: string, props: TestIotRulesConstructProps) {
     super(scope, id)
 
     const sharedConstructs = new SharedRuleProcessingConstructs(this, 'SharedConstructs', { ...props })
 
-    this.stepfunctionTopicMessage = new TopicMessage(this, 'TopicMessage', { ...sharedConstructs }).stepfunction
-    this.stepfunctionCustomMessage = new CustomMessage(this, 'CustomMessage', { ...sharedConstructs }).stepfunction
+    this.claimCheckBucket = sharedConstructs.claimCheckBucket
+
+    const customMessage = new CustomMessage(this, 'CustomMessage', { ...sharedConstructs })
+    this.stepfunctionCustomMessage = customMessage.stepfunction
+    this.stepfunctionTopicMessage = new TopicMessage(this, 'TopicMessage', {
+      ...sharedConstructs,
+      customMessageStateMachine: customMessage.stepfunction
+    }).stepfunction
+    this.stepfunctionBatchMessage = new BatchMessage(this, 'BatchMessage', {
+      ...sharedConstructs,
+      defineRuleNameLambda: customMessage.defineRuleNameLambda
+    }).stepfunction
   }
 }
@@ -0,0 +1,144 @@
+/*
+ * Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ * SPDX-License-Identifier: Apache-2.0
+ */
+
+import * as cdk from 'aws-cdk-lib'
+import { Construct } from 'constructs'
+import * as lambda from 'aws-cdk-lib/aws-lambda'
+import * as s3 from 'aws-cdk-lib/aws-s3'
+import * as sfn from 'aws-cdk-lib/aws-stepfunctions'
+import { DefinitionBody } from 'aws-cdk-lib/aws-stepfunctions'
+import * as sfntasks from 'aws-cdk-lib/aws-stepfunctions-tasks'
+import { fusedStageTask, RULE_ACTION_ERROR } from '../shared/infrastructure'
+import { TOOLBOX_BATCH_MAX_MESSAGES } from '../../../constants'
+
+export interface BatchMessageProps {
+  defineRuleNameLambda: lambda.Function;
+  createIngestRuleLambda: lambda.Function;
+  ingestMessageLambda: lambda.Function
+  deleteRuleLambda: lambda.Function
+  fusedStagesLambda?: lambda.Function
+  claimCheckBucket: s3.IBucket
+  maxConcurrency?: number
+}
+
+export class BatchMessage extends Construct {
+  stepfunction: cdk.aws_stepfunctions.StateMachine
+
+  constructor (scope: Construct, id: string, props: BatchMessageProps) {
+    super(scope, id)
+
+    let createRuleTask: sfntasks.LambdaInvoke
+    let prepare: sfn.Chain
+    if (props.fusedStagesLambda) {
+      // defines the rule name and creates the ingest rule in one invocation
+      createRuleTask = fusedStageTask(
+        this,
+        'PrepareTask',
+        props.fusedStagesLambda,
+        'prepare_batch_message',
+        { outputPath: '$' },
+        { 'execution.$': '$$.Execution.Name' }
+      )
+      prepare = sfn.Chain.start(createRuleTask)
+    } else {
+      const defineRuleNameTask = new sfntasks.LambdaInvoke(
+        this,
+        'DefineRuleNameTask',
+        {
+          lambdaFunction: props.defineRuleNameLambda,
+          payloadResponseOnly: true,
+          payload: sfn.TaskInput.fromObject({
+            'execution.$': '$$.Execution.Name',
+            'input.$': '$'
+          }),
+          outputPath: '$'
+        }
+      )
+
+      createRuleTask = new sfntasks.LambdaInvoke(this, 'CreateRuleTask', {
+        lambdaFunction: props.createIngestRuleLambda,
+        payloadResponseOnly: true,
+        resultPath: '$.createIngestRuleOutput'
+      })
+      prepare = defineRuleNameTask.next(createRuleTask)
+    }
+
+    // every message gets its own task token and child execution, so the
+    // history of the batch stays small. The messages are read from the claim
+    // check bucket and the results are written to it, both would exceed the
+    // state size limit. Child executions carry the index of their message,
+    // delete_rule returns the results in the order of the input.
+    const ingestMessagesMap = new sfn.DistributedMap(this, 'IngestMessagesMap', {
+      itemReader: new sfn.S3JsonItemReader({
+        bucket: props.claimCheckBucket,
+        key: sfn.JsonPath.stringAt('$.messages.claimCheck.key'),
+        maxItems: TOOLBOX_BATCH_MAX_MESSAGES
+      }),
+      itemSelector: {
+        'itemIndex.$': '$$.Map.Item.Index',
+        'message.$': '$$.Map.Item.Value.message',
+        properties: {
+          'userProperties.$': '$$.Map.Item.Value.userProperties',
+          'mqttProperties.$': '$$.Map.Item.Value.mqttProperties'
+        },
+        'ingestRuleName.$': '$.ingestRuleName',
+        'sql.$': '$.sql',
+        'awsIotSqlVersion.$': '$.awsIotSqlVersion'
+      },
+      // task tokens aren't supported by express workflows
+      mapExecutionType: sfn.StateMachineType.STANDARD,
+      maxConcurrency: props.maxConcurrency || 20,
+      resultWriter: new sfn.ResultWriter({
+        bucket: props.claimCheckBucket,
+        prefix: 'results'
+      }),
+      resultPath: '$.results'
+    })
+
+    const ingestMessageTask = new sfntasks.LambdaInvoke(
+      this,
+      'IngestMessageTask',
+      {
+        lambdaFunction: props.ingestMessageLambda,
+        integrationPattern: sfn.IntegrationPattern.WAIT_FOR_TASK_TOKEN,
+        payload: sfn.TaskInput.fromObject({
+          taskToken: sfn.JsonPath.taskToken,
+          'execution.$': '$$.Execution.Name',
+          'input.$': '$'
+        }),
+        heartbeatTimeout: sfn.Timeout.duration(cdk.Duration.seconds(2)),
+        resultPath: '$.result'
+      }
+    )
+
+    ingestMessageTask.addCatch(new sfn.Pass(this, 'NoResult'), {
+      errors: ['States.HeartbeatTimeout', RULE_ACTION_ERROR],
+      resultPath: '$.error'
+    })
+
+    ingestMessagesMap.itemProcessor(ingestMessageTask)
+
+    const deleteRuleTask = props.fusedStagesLambda
+      ? fusedStageTask(this, 'DeleteRuleTask', props.fusedStagesLambda, 'delete_rule', { outputPath: '$' })
+      : new sfntasks.LambdaInvoke(this, 'DeleteRuleTask', {
+        lambdaFunction: props.deleteRuleLambda,
+        payloadResponseOnly: true,
+        outputPath: '$'
+      })
+
+    createRuleTask.addCatch(deleteRuleTask, {
+      errors: ['SqlParseException'],
+      resultPath: '$.error'
+    })
+
+    const definition = prepare.next(ingestMessagesMap.next(deleteRuleTask))
+
+    this.stepfunction = new sfn.StateMachine(this, 'StateMachine', {
+      definitionBody: DefinitionBody.fromChainable(definition),
+      timeout: cdk.Duration.minutes(5),
+      tracingEnabled: true
+    })
+  }
+}
@@ -10,22 +10,25 @@ import * as sfn from 'aws-cdk-lib/aws-stepfunctions'
 import { DefinitionBody } from 'aws-cdk-lib/aws-stepfunctions'
 import * as sfntasks from 'aws-cdk-lib/aws-stepfunctions-tasks'
 import { ToolboxLambdaFunction } from '../../../common/toolbox-lambda-function'
-import { TOOLBOX_IOT_RULE_PREFIX } from '../../../constants'
+import { TOOLBOX_IOT_RULE_PREFIX, TOOLBOX_RULE_POOL_TTL_SECONDS } from '../../../constants'
+import { fusedStageTask, RULE_ACTION_ERROR } from '../shared/infrastructure'
 import path = require('path');
 
 export interface CustomMessageProps {
   createIngestRuleLambda: lambda.Function;
   ingestMessageLambda: lambda.Function
   deleteRuleLambda: lambda.Function
+  fusedStagesLambda?: lambda.Function
 }
 
 export class CustomMessage extends Construct {
   stepfunction: cdk.aws_stepfunctions.StateMachine
+  defineRuleNameLambda: lambda.Function
 
   constructor (scope: Construct, id: string, props: CustomMessageProps) {
     super(scope, id)
 
-    const defineRuleNameLambda = ToolboxLambdaFunction.Python(
+    this.defineRuleNameLambda = ToolboxLambdaFunction.Python(
       this,
       'defineRuleNameLambda',
       {
@@ -34,30 +37,47 @@ export class CustomMessage extends Construct {
         ),
         serviceName: 'IotToolbox-DefineCustomMessageRuleName',
         environment: {
-          TOOLBOX_IOT_RULE_PREFIX
+          TOOLBOX_IOT_RULE_PREFIX,
+          RULE_POOL_TTL_SECONDS: `${TOOLBOX_RULE_POOL_TTL_SECONDS}`
         }
       }
     )
 
-    const defineRuleNameTask = new sfntasks.LambdaInvoke(
-      this,
-      'DefineRuleNameTask',
-      {
-        lambdaFunction: defineRuleNameLambda,
-        payloadResponseOnly: true,
-        payload: sfn.TaskInput.fromObject({
-          'execution.$': '$$.Execution.Name',
-          'input.$': '$'
-        }),
-        outputPath: '$'
-      }
-    )
+    let createRuleTask: sfntasks.LambdaInvoke
+    let prepare: sfn.Chain
+    if (props.fusedStagesLambda) {
+      // defines the rule name and creates the ingest rule in one invocation
+      createRuleTask = fusedStageTask(
+        this,
+        'PrepareTask',
+        props.fusedStagesLambda,
+        'prepare_custom_message',
+        { outputPath: '$' },
+        { 'execution.$': '$$.Execution.Name' }
+      )
+      prepare = sfn.Chain.start(createRuleTask)
+    } else {
+      const defineRuleNameTask = new sfntasks.LambdaInvoke(
+        this,
+        'DefineRuleNameTask',
+        {
+          lambdaFunction: this.defineRuleNameLambda,
+          payloadResponseOnly: true,
+          payload: sfn.TaskInput.fromObject({
+            'execution.$': '$$.Execution.Name',
+            'input.$': '$'
+          }),
+          outputPath: '$'
+        }
+      )
 
-    const createRuleTask = new sfntasks.LambdaInvoke(this, 'CreateRuleTask', {
-      lambdaFunction: props.createIngestRuleLambda,
-      payloadResponseOnly: true,
-      resultPath: '$.input'
-    })
+      createRuleTask = new sfntasks.LambdaInvoke(this, 'CreateRuleTask', {
+        lambdaFunction: props.createIngestRuleLambda,
+        payloadResponseOnly: true,
+        resultPath: '$.input'
+      })
+      prepare = defineRuleNameTask.next(createRuleTask)
+    }
 
     const ingestMessageTask = new sfntasks.LambdaInvoke(
       this,
@@ -74,14 +94,16 @@ export class CustomMessage extends Construct {
       }
     )
 
-    const deleteRuleTask = new sfntasks.LambdaInvoke(this, 'DeleteRuleTask', {
-      lambdaFunction: props.deleteRuleLambda,
-      payloadResponseOnly: true,
-      outputPath: '$'
-    })
+    const deleteRuleTask = props.fusedStagesLambda
+      ? fusedStageTask(this, 'DeleteRuleTask', props.fusedStagesLambda, 'delete_rule', { outputPath: '$' })
+      : new sfntasks.LambdaInvoke(this, 'DeleteRuleTask', {
+        lambdaFunction: props.deleteRuleLambda,
+        payloadResponseOnly: true,
+        outputPath: '$'
+      })
 
     ingestMessageTask.addCatch(deleteRuleTask, {
-      errors: ['States.HeartbeatTimeout'],
+      errors: ['States.HeartbeatTimeout', RULE_ACTION_ERROR],
       resultPath: '$.error'
     })
 
@@ -90,9 +112,7 @@ export class CustomMessage extends Construct {
       resultPath: '$.error'
     })
 
-    const definition = defineRuleNameTask
-      .next(createRuleTask)
-      .next(ingestMessageTask.next(deleteRuleTask))
+    const definition = prepare.next(ingestMessageTask.next(deleteRuleTask))
 
     this.stepfunction = new sfn.StateMachine(this, 'StateMachine', {
       definitionBody: DefinitionBody.fromChainable(definition),
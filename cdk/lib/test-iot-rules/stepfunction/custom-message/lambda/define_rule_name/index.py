@@ -2,11 +2,15 @@
 #  SPDX-License-Identifier: Apache-2.0
 
 import os
+import time
 
 from aws_lambda_powertools import Logger
+from iottoolbox.log_budget import log_event
+from iottoolbox.rule_pool import get_pooled_rule_name
 
 logger = Logger()
 TOOLBOX_IOT_RULE_PREFIX = os.getenv("TOOLBOX_IOT_RULE_PREFIX", "iottoolbox_tmp_rule_")
+RULE_POOL_TTL_SECONDS = int(os.getenv("RULE_POOL_TTL_SECONDS", "0"))
 
 
 def get_execution_id(event):
@@ -19,10 +23,20 @@ def get_ingest_rule_name(event, toolbox_iot_rule_prefix):
     return f"{toolbox_iot_rule_prefix}_ingest_{execution_id}"
 
 
-def handle_event(event, toolbox_iot_rule_prefix):
+def handle_event(event, toolbox_iot_rule_prefix, rule_pool_ttl=0):
     input = event.pop("input")
     event = event | input
-    event["ingestRuleName"] = get_ingest_rule_name(event, toolbox_iot_rule_prefix)
+    if rule_pool_ttl > 0:
+        event["ingestRuleName"] = get_pooled_rule_name(
+            toolbox_iot_rule_prefix,
+            event["sql"],
+            event["awsIotSqlVersion"],
+            rule_pool_ttl,
+            time.time(),
+        )
+        event["pooledIngestRule"] = True
+    else:
+        event["ingestRuleName"] = get_ingest_rule_name(event, toolbox_iot_rule_prefix)
     return event
 
 
@@ -31,8 +45,14 @@ def check_env():
         raise Exception("TOOLBOX_IOT_RULE_PREFIX environment variable not defined")
 
 
+def run(event):
+    """Runs the stage with the clients and configuration of this module,
+    also used by the fused_stages function."""
+    return handle_event(event, TOOLBOX_IOT_RULE_PREFIX, RULE_POOL_TTL_SECONDS)
+
+
 @logger.inject_lambda_context
 def lambda_handler(event, context):
     check_env()
-    logger.info(event)
-    return handle_event(event, TOOLBOX_IOT_RULE_PREFIX)
+    log_event(logger, event)
+    return run(event)
@@ -55,3 +55,15 @@ def test_handle_event():
     result = handle_event(event, "prefix")
 
     assert expected == result
+
+
+def test_handle_event_pooled_rule():
+    event = {
+        "input": {"sql": "SELECT *", "awsIotSqlVersion": "2016-03-23"},
+        "execution": "exec",
+    }
+
+    result = handle_event(event, "prefix", rule_pool_ttl=900)
+
+    assert result["pooledIngestRule"] is True
+    assert result["ingestRuleName"].startswith("prefix_ingest_pool_")
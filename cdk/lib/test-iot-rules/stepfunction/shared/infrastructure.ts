@@ -8,10 +8,44 @@ import { Construct } from 'constructs'
 
 import * as lambda from 'aws-cdk-lib/aws-lambda'
 import * as iam from 'aws-cdk-lib/aws-iam'
+import * as dynamodb from 'aws-cdk-lib/aws-dynamodb'
+import * as sqs from 'aws-cdk-lib/aws-sqs'
+import * as s3 from 'aws-cdk-lib/aws-s3'
+import * as lambdaEventSources from 'aws-cdk-lib/aws-lambda-event-sources'
+import * as events from 'aws-cdk-lib/aws-events'
+import * as iot from 'aws-cdk-lib/aws-iot'
+import * as targets from 'aws-cdk-lib/aws-events-targets'
+import * as sfn from 'aws-cdk-lib/aws-stepfunctions'
+import * as sfntasks from 'aws-cdk-lib/aws-stepfunctions-tasks'
+import * as cr from 'aws-cdk-lib/custom-resources'
 import { ToolboxLambdaFunction } from '../../../common/toolbox-lambda-function'
-import { TOOLBOX_ERROR_TOPIC, TOOLBOX_IOT_RULE_PREFIX } from '../../../constants'
+import { TOOLBOX_CLAIM_CHECK_THRESHOLD, TOOLBOX_ERROR_TOPIC, TOOLBOX_FUSED_STAGES, TOOLBOX_INGEST_TRANSPORT, TOOLBOX_IOT_RULE_PREFIX, TOOLBOX_IOT_RULE_TPS, TOOLBOX_MESSAGE_CACHE_TTL_SECONDS, TOOLBOX_NAME, TOOLBOX_ORPHANED_RULE_AGE_SECONDS, TOOLBOX_RATE_LIMIT_MAX_WAIT_SECONDS, TOOLBOX_RATE_LIMITED_LAMBDA_TIMEOUT_SECONDS, TOOLBOX_RULE_POOL_TTL_SECONDS } from '../../../constants'
 import path = require('path');
 
+// error of tasks failed by the receive error Lambda function, see receive_error/index.py
+export const RULE_ACTION_ERROR = 'IotRuleActionError'
+
+// invokes one stage of the fused stages Lambda function with the state as input
+export function fusedStageTask (
+  scope: Construct,
+  id: string,
+  fusedStagesLambda: lambda.Function,
+  stage: string,
+  props: Partial<sfntasks.LambdaInvokeProps> = {},
+  payload: { [key: string]: any } = {}
+): sfntasks.LambdaInvoke {
+  return new sfntasks.LambdaInvoke(scope, id, {
+    lambdaFunction: fusedStagesLambda,
+    payloadResponseOnly: true,
+    payload: sfn.TaskInput.fromObject({
+      stage,
+      'input.$': '$',
+      ...payload
+    }),
+    ...props
+  })
+}
+
 export interface SharedRuleProcessingConstructsProps {
   ruleRoleArns: string[]
 }
@@ -21,11 +55,77 @@ export class SharedRuleProcessingConstructs extends Construct {
   readonly createIngestRuleLambda: lambda.Function
   readonly ingestMessageLambda: lambda.Function
   readonly deleteRuleLambda: lambda.Function
+  readonly sweepRulesLambda: lambda.Function
+  readonly receiveErrorLambda: lambda.Function
+  readonly fusedStagesLambda?: lambda.Function
   readonly publishMessageLambdaRole: iam.Role
   readonly createRuleLambdaRole: iam.Role
+  readonly rateLimitTable: dynamodb.Table
+  readonly rateLimitEnvironment: { [key: string]: string }
+  readonly ruleDeleteQueue: sqs.Queue
+  readonly messageCacheTable: dynamodb.Table
+  readonly messageCacheEnvironment: { [key: string]: string }
+  readonly claimCheckBucket: s3.Bucket
+  readonly claimCheckEnvironment: { [key: string]: string }
 
   constructor (scope: Construct, id: string, props: SharedRuleProcessingConstructsProps) {
     super(scope, id)
+
+    // account-wide rate limit of CreateTopicRule and DeleteTopicRule, see iottoolbox/rate_limit.py
+    this.rateLimitTable = new dynamodb.Table(this, 'RateLimitTable', {
+      partitionKey: {
+        name: 'bucket',
+        type: dynamodb.AttributeType.STRING
+      },
+      timeToLiveAttribute: 'expiresAt',
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      removalPolicy: cdk.RemovalPolicy.DESTROY,
+      encryption: dynamodb.TableEncryption.AWS_MANAGED
+    })
+    this.rateLimitEnvironment = {
+      RATE_LIMIT_TABLE: this.rateLimitTable.tableName,
+      TOOLBOX_IOT_RULE_TPS: `${TOOLBOX_IOT_RULE_TPS}`,
+      TOOLBOX_RATE_LIMIT_MAX_WAIT: `${TOOLBOX_RATE_LIMIT_MAX_WAIT_SECONDS}`
+    }
+
+    // latest captured message per topic filter, see iottoolbox/message_cache.py
+    this.messageCacheTable = new dynamodb.Table(this, 'MessageCacheTable', {
+      partitionKey: {
+        name: 'topicFilter',
+        type: dynamodb.AttributeType.STRING
+      },
+      timeToLiveAttribute: 'expiresAt',
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      removalPolicy: cdk.RemovalPolicy.DESTROY,
+      encryption: dynamodb.TableEncryption.AWS_MANAGED
+    })
+    this.messageCacheEnvironment = {
+      MESSAGE_CACHE_TABLE: this.messageCacheTable.tableName,
+      TOOLBOX_MESSAGE_CACHE_TTL_SECONDS: `${TOOLBOX_MESSAGE_CACHE_TTL_SECONDS}`
+    }
+
+    // payloads above the claim check threshold, see iottoolbox/claim_check.py
+    this.claimCheckBucket = new s3.Bucket(this, 'ClaimCheckBucket', {
+      blockPublicAccess: s3.BlockPublicAccess.BLOCK_ALL,
+      enforceSSL: true,
+      removalPolicy: cdk.RemovalPolicy.DESTROY,
+      autoDeleteObjects: true,
+      encryption: s3.BucketEncryption.S3_MANAGED,
+      lifecycleRules: [{ expiration: cdk.Duration.days(1) }]
+    })
+    this.claimCheckEnvironment = {
+      CLAIM_CHECK_BUCKET: this.claimCheckBucket.bucketName,
+      TOOLBOX_CLAIM_CHECK_THRESHOLD: `${TOOLBOX_CLAIM_CHECK_THRESHOLD}`
+    }
+
+    // rules of finished tests, deleted by the sweep rules Lambda off the result path
+    this.ruleDeleteQueue = new sqs.Queue(this, 'RuleDeleteQueue', {
+      visibilityTimeout: cdk.Duration.minutes(5),
+      retentionPeriod: cdk.Duration.hours(1),
+      encryption: sqs.QueueEncryption.SQS_MANAGED,
+      enforceSSL: true
+    })
+
     const receiveMessageRole = new iam.Role(this, 'ReceiveMessageRole', {
       assumedBy: new iam.ServicePrincipal('lambda.amazonaws.com')
     })
@@ -49,15 +149,28 @@ export class SharedRuleProcessingConstructs extends Construct {
         code: lambda.Code.fromAsset(
           path.join(__dirname, 'lambda/receive_message')
         ),
-        role: receiveMessageRole
+        role: receiveMessageRole,
+        environment: {
+          ...this.messageCacheEnvironment,
+          ...this.claimCheckEnvironment
+        }
       }
     )
+    this.messageCacheTable.grantWriteData(receiveMessageRole)
+    receiveMessageRole.addToPolicy(
+      new iam.PolicyStatement({
+        resources: [this.claimCheckBucket.arnForObjects('*')],
+        actions: ['s3:PutObject']
+      })
+    )
 
     this.receiveMessageLambda.addPermission('IotRuleInvoke', {
       action: 'lambda:InvokeFunction',
       principal: new iam.ServicePrincipal('iot.amazonaws.com')
     })
 
+    this.receiveErrorLambda = this.createReceiveErrorLambda()
+
     this.publishMessageLambdaRole = new iam.Role(
       this,
       'aws-iot-rule-forward-tmp-role',
@@ -105,6 +218,8 @@ export class SharedRuleProcessingConstructs extends Construct {
         actions: ['states:SendTaskSuccess', 'states:SendTaskFailure']
       })
     )
+    this.rateLimitTable.grantWriteData(this.createRuleLambdaRole)
+    this.messageCacheTable.grantReadData(this.createRuleLambdaRole)
 
     this.createIngestRuleLambda = ToolboxLambdaFunction.Python(
       this,
@@ -116,10 +231,12 @@ export class SharedRuleProcessingConstructs extends Construct {
         environment: {
           RECEIVE_MESSAGE_LAMBDA_ARN: this.receiveMessageLambda.functionArn,
           PUBLISH_MESSAGE_ROLE_ARN: this.publishMessageLambdaRole.roleArn,
-          REPUBLISH_ERROR_TOPIC: TOOLBOX_ERROR_TOPIC
+          REPUBLISH_ERROR_TOPIC: TOOLBOX_ERROR_TOPIC,
+          ...this.rateLimitEnvironment
         },
         role: this.createRuleLambdaRole,
-        serviceName: 'IotToolbox-CreateIngestRule'
+        serviceName: 'IotToolbox-CreateIngestRule',
+        timeout: cdk.Duration.seconds(TOOLBOX_RATE_LIMITED_LAMBDA_TIMEOUT_SECONDS)
       }
     )
 
@@ -137,6 +254,19 @@ export class SharedRuleProcessingConstructs extends Construct {
         actions: ['iot:Publish']
       })
     )
+    ingestMessageRuleLambdaRole.addToPolicy(
+      new iam.PolicyStatement({
+        resources: [this.claimCheckBucket.arnForObjects('*')],
+        actions: ['s3:GetObject']
+      })
+    )
+    // answers tests whose WHERE clause doesn't match the message
+    ingestMessageRuleLambdaRole.addToPolicy(
+      new iam.PolicyStatement({
+        resources: ['*'],
+        actions: ['states:SendTaskSuccess']
+      })
+    )
     ingestMessageRuleLambdaRole.addManagedPolicy(
       iam.ManagedPolicy.fromAwsManagedPolicyName(
         'service-role/AWSLambdaBasicExecutionRole'
@@ -154,6 +284,9 @@ export class SharedRuleProcessingConstructs extends Construct {
         serviceName: 'IotToolbox-IngestMessage'
       }
     )
+    if (TOOLBOX_INGEST_TRANSPORT === 'mqtt') {
+      this.useMqttIngestTransport(ingestMessageRuleLambdaRole)
+    }
 
     const deleteRuleRole = new iam.Role(this, 'DeleteRuleRole', {
       assumedBy: new iam.ServicePrincipal('lambda.amazonaws.com')
@@ -162,8 +295,23 @@ export class SharedRuleProcessingConstructs extends Construct {
     this.deleteRuleLambda = ToolboxLambdaFunction.Python(this, 'DeleteRuleLambda', {
       code: lambda.Code.fromAsset(path.join(__dirname, 'lambda/delete_rule')),
       role: deleteRuleRole,
-      serviceName: 'IotToolbox-DeleteRule'
+      serviceName: 'IotToolbox-DeleteRule',
+      environment: {
+        RULE_DELETE_QUEUE_URL: this.ruleDeleteQueue.queueUrl,
+        ...this.rateLimitEnvironment,
+        ...this.claimCheckEnvironment
+      },
+      timeout: cdk.Duration.seconds(TOOLBOX_RATE_LIMITED_LAMBDA_TIMEOUT_SECONDS)
     })
+    this.rateLimitTable.grantWriteData(deleteRuleRole)
+    this.ruleDeleteQueue.grantSendMessages(deleteRuleRole)
+    // reads the results of batch tests and stores them if they are too large
+    deleteRuleRole.addToPolicy(
+      new iam.PolicyStatement({
+        resources: [this.claimCheckBucket.arnForObjects('*')],
+        actions: ['s3:GetObject', 's3:PutObject']
+      })
+    )
     deleteRuleRole.addManagedPolicy(
       iam.ManagedPolicy.fromAwsManagedPolicyName(
         'service-role/AWSLambdaBasicExecutionRole'
@@ -175,5 +323,190 @@ export class SharedRuleProcessingConstructs extends Construct {
         actions: ['iot:DeleteTopicRule']
       })
     )
+
+    if (TOOLBOX_FUSED_STAGES) {
+      this.fusedStagesLambda = this.createFusedStagesLambda(props)
+    }
+
+    const sweepRulesRole = new iam.Role(this, 'SweepRulesRole', {
+      assumedBy: new iam.ServicePrincipal('lambda.amazonaws.com')
+    })
+    sweepRulesRole.addManagedPolicy(
+      iam.ManagedPolicy.fromAwsManagedPolicyName(
+        'service-role/AWSLambdaBasicExecutionRole'
+      )
+    )
+    sweepRulesRole.addToPolicy(
+      new iam.PolicyStatement({
+        resources: ['*'],
+        actions: ['iot:ListTopicRules']
+      })
+    )
+    // only the temporary rules of the rule tester, not e.g. the rules of recordings
+    sweepRulesRole.addToPolicy(
+      new iam.PolicyStatement({
+        resources: ['ingest', 'getMessage'].map(infix =>
+          `arn:aws:iot:${cdk.Stack.of(this).region}:${cdk.Stack.of(this).account}:rule/${TOOLBOX_IOT_RULE_PREFIX}_${infix}_*`
+        ),
+        actions: ['iot:DeleteTopicRule']
+      })
+    )
+
+    this.sweepRulesLambda = ToolboxLambdaFunction.Python(this, 'SweepRulesLambda', {
+      code: lambda.Code.fromAsset(path.join(__dirname, 'lambda/sweep_rules')),
+      role: sweepRulesRole,
+      serviceName: 'IotToolbox-SweepRules',
+      environment: {
+        TOOLBOX_IOT_RULE_PREFIX,
+        RULE_POOL_TTL_SECONDS: `${TOOLBOX_RULE_POOL_TTL_SECONDS}`,
+        ORPHANED_RULE_AGE_SECONDS: `${TOOLBOX_ORPHANED_RULE_AGE_SECONDS}`,
+        ...this.rateLimitEnvironment
+      },
+      // stops deleting before the timeout, see sweep_rules/index.py
+      timeout: cdk.Duration.minutes(5)
+    })
+    this.rateLimitTable.grantWriteData(sweepRulesRole)
+    this.sweepRulesLambda.addEventSource(
+      new lambdaEventSources.SqsEventSource(this.ruleDeleteQueue, {
+        batchSize: 10,
+        maxBatchingWindow: cdk.Duration.seconds(5),
+        reportBatchItemFailures: true
+      })
+    )
+
+    new events.Rule(this, 'SweepRulesSchedule', {
+      schedule: events.Schedule.rate(cdk.Duration.minutes(5)),
+      targets: [new targets.LambdaFunction(this.sweepRulesLambda)]
+    })
+  }
+
+  // publishes test messages over a persistent MQTT connection, see iottoolbox/ingest_transport.py
+  private useMqttIngestTransport (role: iam.Role) {
+    const endpoint = new cr.AwsCustomResource(this, 'IotDataEndpoint', {
+      onUpdate: {
+        service: 'Iot',
+        action: 'describeEndpoint',
+        parameters: { endpointType: 'iot:Data-ATS' },
+        physicalResourceId: cr.PhysicalResourceId.of('IotDataEndpoint')
+      },
+      policy: cr.AwsCustomResourcePolicy.fromSdkCalls({
+        resources: cr.AwsCustomResourcePolicy.ANY_RESOURCE
+      })
+    })
+    const clientIdPrefix = `${TOOLBOX_NAME}-ingest`
+    this.ingestMessageLambda.addEnvironment('TOOLBOX_INGEST_TRANSPORT', 'mqtt')
+    this.ingestMessageLambda.addEnvironment('IOT_DATA_ENDPOINT', endpoint.getResponseField('endpointAddress'))
+    this.ingestMessageLambda.addEnvironment('TOOLBOX_MQTT_CLIENT_ID_PREFIX', clientIdPrefix)
+    role.addToPolicy(
+      new iam.PolicyStatement({
+        resources: [`arn:aws:iot:${cdk.Stack.of(this).region}:${cdk.Stack.of(this).account}:client/${clientIdPrefix}-*`],
+        actions: ['iot:Connect']
+      })
+    )
+  }
+
+  // fails the task of a test as soon as the action of its rule fails, the
+  // temporary rules republish action errors to TOOLBOX_ERROR_TOPIC
+  private createReceiveErrorLambda (): lambda.Function {
+    const receiveErrorRole = new iam.Role(this, 'ReceiveErrorRole', {
+      assumedBy: new iam.ServicePrincipal('lambda.amazonaws.com')
+    })
+    receiveErrorRole.addManagedPolicy(
+      iam.ManagedPolicy.fromAwsManagedPolicyName(
+        'service-role/AWSLambdaBasicExecutionRole'
+      )
+    )
+    receiveErrorRole.addToPolicy(
+      new iam.PolicyStatement({
+        resources: ['*'],
+        actions: ['states:SendTaskFailure']
+      })
+    )
+    // getMessage rules only carry the task token in their statement
+    receiveErrorRole.addToPolicy(
+      new iam.PolicyStatement({
+        resources: [`arn:aws:iot:${cdk.Stack.of(this).region}:${cdk.Stack.of(this).account}:rule/${TOOLBOX_IOT_RULE_PREFIX}*`],
+        actions: ['iot:GetTopicRule']
+      })
+    )
+
+    const receiveErrorLambda = ToolboxLambdaFunction.Python(this, 'ReceiveErrorLambda', {
+      code: lambda.Code.fromAsset(path.join(__dirname, 'lambda/receive_error')),
+      role: receiveErrorRole,
+      serviceName: 'IotToolbox-ReceiveError',
+      environment: {
+        TOOLBOX_IOT_RULE_PREFIX
+      }
+    })
+
+    // not named with the rule prefix, so it's never swept as temporary rule
+    const errorTopicRule = new iot.CfnTopicRule(this, 'ErrorTopicRule', {
+      topicRulePayload: {
+        sql: `SELECT * FROM '${TOOLBOX_ERROR_TOPIC}'`,
+        awsIotSqlVersion: '2016-03-23',
+        ruleDisabled: false,
+        actions: [{ lambda: { functionArn: receiveErrorLambda.functionArn } }]
+      }
+    })
+    receiveErrorLambda.addPermission('IotRuleInvoke', {
+      action: 'lambda:InvokeFunction',
+      principal: new iam.ServicePrincipal('iot.amazonaws.com'),
+      sourceArn: errorTopicRule.attrArn
+    })
+    return receiveErrorLambda
+  }
+
+  // runs the stages that don't wait for a callback in-process, see fused_stages/index.py
+  private createFusedStagesLambda (props: SharedRuleProcessingConstructsProps): lambda.Function {
+    const fusedStagesRole = new iam.Role(this, 'FusedStagesRole', {
+      assumedBy: new iam.ServicePrincipal('lambda.amazonaws.com')
+    })
+    fusedStagesRole.addManagedPolicy(
+      iam.ManagedPolicy.fromAwsManagedPolicyName(
+        'service-role/AWSLambdaBasicExecutionRole'
+      )
+    )
+    fusedStagesRole.addToPolicy(
+      new iam.PolicyStatement({
+        resources: [`arn:aws:iot:${cdk.Stack.of(this).region}:${cdk.Stack.of(this).account}:rule/${TOOLBOX_IOT_RULE_PREFIX}*`],
+        actions: ['iot:CreateTopicRule', 'iot:DeleteTopicRule']
+      })
+    )
+    fusedStagesRole.addToPolicy(
+      new iam.PolicyStatement({
+        resources: [this.publishMessageLambdaRole.roleArn].concat(props.ruleRoleArns),
+        actions: ['iam:PassRole']
+      })
+    )
+    this.rateLimitTable.grantWriteData(fusedStagesRole)
+    this.ruleDeleteQueue.grantSendMessages(fusedStagesRole)
+    fusedStagesRole.addToPolicy(
+      new iam.PolicyStatement({
+        resources: [this.claimCheckBucket.arnForObjects('*')],
+        actions: ['s3:GetObject', 's3:PutObject']
+      })
+    )
+
+    // the asset contains the whole stepfunction folder, so the stages can be
+    // loaded from the folders of the per-stage Lambda functions
+    return ToolboxLambdaFunction.Python(this, 'FusedStagesLambda', {
+      code: lambda.Code.fromAsset(path.join(__dirname, '..'), {
+        exclude: ['**/*.ts', '**/test_*.py', '**/__pycache__']
+      }),
+      handler: 'shared/lambda/fused_stages/index.lambda_handler',
+      role: fusedStagesRole,
+      serviceName: 'IotToolbox-FusedStages',
+      environment: {
+        TOOLBOX_IOT_RULE_PREFIX,
+        RULE_POOL_TTL_SECONDS: `${TOOLBOX_RULE_POOL_TTL_SECONDS}`,
+        RECEIVE_MESSAGE_LAMBDA_ARN: this.receiveMessageLambda.functionArn,
+        PUBLISH_MESSAGE_ROLE_ARN: this.publishMessageLambdaRole.roleArn,
+        REPUBLISH_ERROR_TOPIC: TOOLBOX_ERROR_TOPIC,
+        RULE_DELETE_QUEUE_URL: this.ruleDeleteQueue.queueUrl,
+        ...this.rateLimitEnvironment,
+        ...this.claimCheckEnvironment
+      },
+      timeout: cdk.Duration.seconds(TOOLBOX_RATE_LIMITED_LAMBDA_TIMEOUT_SECONDS)
+    })
   }
 }
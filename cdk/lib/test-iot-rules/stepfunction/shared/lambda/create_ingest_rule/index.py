@@ -3,14 +3,28 @@
 
 import os
 import re
-from typing import Optional, Dict
-
-import boto3
-from aws_lambda_powertools import Logger
+from typing import Dict, Optional, Tuple
+
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+from iottoolbox.clients import lazy_client
+from iottoolbox.log_budget import log_event
+from iottoolbox.rate_limit import rate_limited
+from iottoolbox.rule_pool import RulePoolCache
+from iottoolbox.sql import (
+    DEFAULT_SQL_VERSION,
+    SqlSyntaxError,
+    get_select_sql,
+    get_where_sql,
+    parse,
+)
+from iottoolbox.timing import get_correlation_id, set_correlation_id, timed
 
 logger = Logger()
+metrics = Metrics()
 
-_iot_client = boto3.client("iot")
+_iot_client = rate_limited(lazy_client("iot"))
+_rule_pool_cache = RulePoolCache()
 
 RECEIVE_MESSAGE_LAMBDA_ARN = os.getenv("RECEIVE_MESSAGE_LAMBDA_ARN", None)
 PUBLISH_MESSAGE_ROLE_ARN = os.getenv("PUBLISH_MESSAGE_ROLE_ARN", None)
@@ -21,43 +35,55 @@ class SqlParseException(Exception):
     pass
 
 
-def create_ingest_sql(input_sql: str) -> Optional[str]:
+def split_ingest_sql(input_sql: str) -> Tuple[Optional[str], Optional[str]]:
+    """Splits the statement into its SELECT and WHERE clause with regular
+    expressions, used for statements the local parser doesn't support."""
     where_str = None
     select_str = None
     if re.search("WHERE", input_sql, flags=re.IGNORECASE):
         where_str = re.split("WHERE", input_sql, flags=re.IGNORECASE)[-1]
 
     if re.search("^SELECT", input_sql, flags=re.IGNORECASE):
-        if where_str:
-            select_str = re.split(
-                "^SELECT",
-                re.split("WHERE", input_sql, flags=re.IGNORECASE)[0],
-                flags=re.IGNORECASE,
-            )[-1]
-        else:
-            select_str = re.split(
-                "^SELECT",
-                input_sql,
-                flags=re.IGNORECASE,
-            )[-1]
-
-    if select_str and re.search("FROM", select_str, flags=re.IGNORECASE):
         select_str = re.split(
             "^SELECT",
-            re.split("FROM", select_str, flags=re.IGNORECASE)[0],
+            re.split("WHERE", input_sql, flags=re.IGNORECASE)[0],
             flags=re.IGNORECASE,
         )[-1]
 
-    if select_str and where_str:
-        new_sql = """SELECT {0}, sfnTaskToken WHERE {1}""".format(
-            select_str.strip(), where_str.strip()
-        )
-    elif select_str:
-        new_sql = """SELECT {0}, sfnTaskToken""".format(select_str.strip())
+    if select_str and re.search("FROM", select_str, flags=re.IGNORECASE):
+        select_str = re.split("FROM", select_str, flags=re.IGNORECASE)[0]
+
+    return (
+        select_str.strip() if select_str else None,
+        # an empty WHERE clause is kept for CreateTopicRule to reject
+        where_str.strip() if where_str is not None else None,
+    )
+
+
+def create_ingest_sql(
+    input_sql: str, aws_iot_sql_version: str = DEFAULT_SQL_VERSION
+) -> Optional[str]:
+    try:
+        statement = parse(input_sql, aws_iot_sql_version)
+    except SqlSyntaxError as e:
+        # only the rules engine decides whether a statement is invalid, the
+        # statement is rewritten like before the parser existed
+        logger.warning("Unparsed SQL", extra={"sql": input_sql, "error": str(e)})
+        metrics.add_metric(name="SqlParseFallback", unit=MetricUnit.Count, value=1)
+        select_str, where_str = split_ingest_sql(input_sql)
+        if not select_str:
+            # CreateTopicRule rejects it with a SqlParseException
+            return input_sql
     else:
-        new_sql = ""
+        select_str = get_select_sql(input_sql, statement)
+        where_str = get_where_sql(input_sql, statement)
 
-    logger.info("Updated SQL", extra={"new_sql": new_sql})
+    if where_str is not None:
+        new_sql = """SELECT {0}, sfnTaskToken WHERE {1}""".format(select_str, where_str)
+    else:
+        new_sql = """SELECT {0}, sfnTaskToken""".format(select_str)
+
+    logger.debug("Updated SQL", extra={"new_sql": new_sql})
 
     return new_sql
 
@@ -72,28 +98,29 @@ def create_ingest_topic_rule(
     republish_error_topic: str,
 ):
     try:
-        response_lambda_rule = iot_client.create_topic_rule(
-            ruleName=rule_name,
-            topicRulePayload={
-                "sql": sql,
-                "description": "temporary IoT rule to forward messages to ingest lambda",
-                "actions": [
-                    {
-                        "lambda": {"functionArn": receive_message_lambda_arn},
+        with timed(metrics, "CreateTopicRule"):
+            response_lambda_rule = iot_client.create_topic_rule(
+                ruleName=rule_name,
+                topicRulePayload={
+                    "sql": sql,
+                    "description": "temporary IoT rule to forward messages to ingest lambda",
+                    "actions": [
+                        {
+                            "lambda": {"functionArn": receive_message_lambda_arn},
+                        },
+                    ],
+                    "ruleDisabled": False,
+                    "awsIotSqlVersion": aws_iot_sql_version,
+                    "errorAction": {
+                        "republish": {
+                            "roleArn": publish_message_role_arn,
+                            "topic": republish_error_topic,
+                            "qos": 1,
+                        }
                     },
-                ],
-                "ruleDisabled": False,
-                "awsIotSqlVersion": aws_iot_sql_version,
-                "errorAction": {
-                    "republish": {
-                        "roleArn": publish_message_role_arn,
-                        "topic": republish_error_topic,
-                        "qos": 1,
-                    }
                 },
-            },
-        )
-        logger.info(
+            )
+        logger.debug(
             "CreateTopicRule Response", extra={"response": response_lambda_rule}
         )
         return
@@ -104,13 +131,49 @@ def create_ingest_topic_rule(
         raise e
 
 
+def create_pooled_ingest_topic_rule(
+    iot_client,
+    rule_pool_cache: RulePoolCache,
+    rule_name: str,
+    sql: str,
+    aws_iot_sql_version: str,
+    receive_message_lambda_arn: str,
+    publish_message_role_arn: str,
+    republish_error_topic: str,
+):
+    if rule_pool_cache.lookup(rule_name):
+        metrics.add_metric(name="RulePoolHit", unit=MetricUnit.Count, value=1)
+        return
+
+    try:
+        create_ingest_topic_rule(
+            iot_client,
+            rule_name,
+            sql,
+            aws_iot_sql_version,
+            receive_message_lambda_arn,
+            publish_message_role_arn,
+            republish_error_topic,
+        )
+        metrics.add_metric(name="RulePoolMiss", unit=MetricUnit.Count, value=1)
+    except Exception as e:
+        if e.__class__.__name__ != "ResourceAlreadyExistsException":
+            raise e
+        # created by another container within the same pool generation
+        metrics.add_metric(name="RulePoolHit", unit=MetricUnit.Count, value=1)
+
+    rule_pool_cache.add(rule_name)
+
+
 def handle_event(
     iot_client,
     event: Dict[str, any],
     receive_message_lambda_arn: str,
     publish_message_role_arn: str,
     republish_error_topic: str,
+    rule_pool_cache: Optional[RulePoolCache] = None,
 ) -> Optional[str]:
+    set_correlation_id(metrics, get_correlation_id(event))
     if "input" in event:
         input = event.pop("input")
         event = event | input
@@ -118,7 +181,20 @@ def handle_event(
     aws_iot_sql_version = event["awsIotSqlVersion"]
     ingest_rule_name = event["ingestRuleName"]
 
-    new_sql = create_ingest_sql(sql)
+    with timed(metrics, "SqlRewrite"):
+        new_sql = create_ingest_sql(sql, aws_iot_sql_version)
+    if event.get("pooledIngestRule", False) and rule_pool_cache is not None:
+        return create_pooled_ingest_topic_rule(
+            iot_client,
+            rule_pool_cache,
+            ingest_rule_name,
+            new_sql,
+            aws_iot_sql_version,
+            receive_message_lambda_arn,
+            publish_message_role_arn,
+            republish_error_topic,
+        )
+
     return create_ingest_topic_rule(
         iot_client,
         ingest_rule_name,
@@ -141,15 +217,22 @@ def check_env():
         raise Exception("REPUBLISH_ERROR_TOPIC environment variable not defined")
 
 
-@logger.inject_lambda_context
-def lambda_handler(event, context):
-    check_env()
-    logger.info(event)
-
+def run(event):
+    """Runs the stage with the clients and configuration of this module,
+    also used by the fused_stages function."""
     return handle_event(
         _iot_client,
         event,
         RECEIVE_MESSAGE_LAMBDA_ARN,
         PUBLISH_MESSAGE_ROLE_ARN,
         REPUBLISH_ERROR_TOPIC,
+        _rule_pool_cache,
     )
+
+
+@metrics.log_metrics
+@logger.inject_lambda_context
+def lambda_handler(event, context):
+    check_env()
+    log_event(logger, event)
+    return run(event)
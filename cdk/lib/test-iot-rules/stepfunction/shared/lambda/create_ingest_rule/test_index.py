@@ -4,7 +4,13 @@
 from unittest.mock import Mock
 
 import pytest
-from create_ingest_rule.index import create_ingest_sql, create_ingest_topic_rule
+from create_ingest_rule.index import (
+    create_ingest_sql,
+    create_ingest_topic_rule,
+    create_pooled_ingest_topic_rule,
+    handle_event,
+)
+from iottoolbox.rule_pool import RulePoolCache
 
 TEST_ENVIRONMENT = {
     "RECEIVE_MESSAGE_LAMBDA_ARN": "foo",
@@ -34,12 +40,52 @@ TEST_ENVIRONMENT = {
             "SELECT * FROM 'iot/test' WHERE foo = 'bar'",
             "SELECT *, sfnTaskToken WHERE foo = 'bar'",
         ),
+        (
+            "SELECT a FROM 'iot/test' WHERE b = 'x WHERE y FROM z'",
+            "SELECT a, sfnTaskToken WHERE b = 'x WHERE y FROM z'",
+        ),
+        (
+            "SELECT {'from': a, 'where': b} AS c WHERE d > 1",
+            "SELECT {'from': a, 'where': b} AS c, sfnTaskToken WHERE d > 1",
+        ),
+        (
+            "SELECT concat(a, 'WHERE') AS w FROM 'iot/#'",
+            "SELECT concat(a, 'WHERE') AS w, sfnTaskToken",
+        ),
+        (
+            "SELECT state.reported.* FROM 'a' WHERE b IS NOT NULL;",
+            "SELECT state.reported.*, sfnTaskToken WHERE b IS NOT NULL",
+        ),
+        (
+            "SELECT * FROM 'a' WHERE name LIKE 'it\\'s%'",
+            "SELECT *, sfnTaskToken WHERE name LIKE 'it\\'s%'",
+        ),
     ],
 )
 def test_create_ingest_sql(input_sql, expected_sql):
     assert create_ingest_sql(input_sql) == expected_sql
 
 
+@pytest.mark.parametrize(
+    "input_sql,expected_sql",
+    [
+        # unparsed statements are rewritten with regular expressions and
+        # left to CreateTopicRule to reject
+        ("", ""),
+        ("asd where foo", "asd where foo"),
+        ("SELECT", "SELECT"),
+        ("SELECT * WHERE", "SELECT *, sfnTaskToken WHERE "),
+        ("SELECT a FROM iot/test", "SELECT a, sfnTaskToken"),
+        (
+            "SELECT a FROM 'iot/test' WHERE b NOT IN [1, 2]",
+            "SELECT a, sfnTaskToken WHERE b NOT IN [1, 2]",
+        ),
+    ],
+)
+def test_create_ingest_sql_fallback(input_sql, expected_sql):
+    assert create_ingest_sql(input_sql) == expected_sql
+
+
 def test_create_ingest_topic_rule():
     sfn_client_mock = Mock()
     sfn_client_mock.create_topic_rule = Mock(return_value="Mock response")
@@ -80,3 +126,50 @@ def test_create_ingest_topic_rule():
             },
         },
     )
+
+
+def test_create_pooled_ingest_topic_rule(mocker):
+    create_rule = mocker.patch("create_ingest_rule.index.create_ingest_topic_rule")
+    iot_client = Mock()
+    cache = RulePoolCache()
+    args = ("rule", "SELECT *", "2016-03-23", "receive", "publish", "error")
+
+    create_pooled_ingest_topic_rule(iot_client, cache, *args)
+    create_pooled_ingest_topic_rule(iot_client, cache, *args)
+
+    create_rule.assert_called_once_with(iot_client, *args)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_create_pooled_ingest_topic_rule_already_exists(mocker):
+    class ResourceAlreadyExistsException(Exception):
+        pass
+
+    create_rule = mocker.patch("create_ingest_rule.index.create_ingest_topic_rule")
+    create_rule.side_effect = ResourceAlreadyExistsException()
+    cache = RulePoolCache()
+
+    create_pooled_ingest_topic_rule(
+        Mock(), cache, "rule", "SELECT *", "2016-03-23", "r", "p", "e"
+    )
+
+    assert "rule" in cache
+
+
+@pytest.mark.parametrize("pooled", [True, False])
+def test_handle_event_pooled_rule(mocker, pooled):
+    create_rule = mocker.patch("create_ingest_rule.index.create_ingest_topic_rule")
+    create_pooled_rule = mocker.patch(
+        "create_ingest_rule.index.create_pooled_ingest_topic_rule"
+    )
+    event = {
+        "sql": "SELECT *",
+        "awsIotSqlVersion": "2016-03-23",
+        "ingestRuleName": "rule",
+        "pooledIngestRule": pooled,
+    }
+
+    handle_event(Mock(), event, "r", "p", "e", RulePoolCache())
+
+    assert create_pooled_rule.called == pooled
+    assert create_rule.called != pooled
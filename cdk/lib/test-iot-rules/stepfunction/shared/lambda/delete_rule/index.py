@@ -1,15 +1,128 @@
 #  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 #  SPDX-License-Identifier: Apache-2.0
 
-import boto3
-from aws_lambda_powertools import Logger
+import os
+from typing import List, Optional
+
+from aws_lambda_powertools import Logger, Metrics
+from iottoolbox.claim_check import CLAIM_CHECK_THRESHOLD, put_payload
+from iottoolbox.clients import lazy_client
+from iottoolbox.log_budget import log_event
+from iottoolbox.map_results import is_written, read_results
+from iottoolbox.rate_limit import rate_limited
+from iottoolbox.serialization import dumps, dumps_bytes
+from iottoolbox.sql_eval import NO_MATCH_ERROR, is_no_match
+from iottoolbox.timing import get_correlation_id, set_correlation_id, timed
 
 logger = Logger()
+metrics = Metrics()
+
+iot_client = rate_limited(lazy_client("iot"))
+sqs_client = lazy_client("sqs")
+s3_client = lazy_client("s3")
+RULE_DELETE_QUEUE_URL = os.getenv("RULE_DELETE_QUEUE_URL", None)
+CLAIM_CHECK_BUCKET = os.getenv("CLAIM_CHECK_BUCKET", None)
+
+# sent by receive_error with the error of the failed rule action as cause
+RULE_ACTION_ERROR = "IotRuleActionError"
+
+
+def get_error(error) -> str:
+    """Returns the error of a caught task failure."""
+    name = error.get("Error", "Unknown error")
+    if name == RULE_ACTION_ERROR and error.get("Cause"):
+        return f"{name}: {error['Cause']}"
+    return name
+
+
+def get_batch_results(results):
+    batch_results = []
+    for item in results:
+        properties = item.get("properties", {})
+        result = item.get("result", None)
+        if is_no_match(result):
+            output, error = None, NO_MATCH_ERROR
+        elif "error" in item:
+            output, error = result, get_error(item["error"])
+        else:
+            output, error = result, None
+        batch_results.append(
+            {
+                "output": output,
+                "error": error,
+                "input": item.get("message", None),
+                "userProperties": properties.get("userProperties", []),
+                "mqttProperties": properties.get("mqttProperties", {}),
+            }
+        )
+    return batch_results
+
+
+def get_variant_results(variant_results):
+    """Returns the results of the SQL variants tested against the captured
+    topic message, in the order of the request."""
+    results = []
+    for item in variant_results:
+        result = item.get("result", {})
+        results.append(
+            {
+                "sql": item["sql"],
+                "output": result.get("output", None),
+                "error": (
+                    get_error(item["error"])
+                    if "error" in item
+                    else result.get("error", None)
+                ),
+            }
+        )
+    return results
+
+
+def delete_rules(rule_names: List[str]):
+    for rule_name in rule_names:
+        try:
+            with timed(metrics, "DeleteTopicRule"):
+                iot_client.delete_topic_rule(ruleName=rule_name)
+        except Exception as e:
+            logger.error(f"Failed to delete rule {rule_name}", extra={"exception": e})
+
+
+def enqueue_rules(rule_names: List[str], rule_delete_queue_url: Optional[str]):
+    """Hands the rules to the sweep rules Lambda, which deletes them off the
+    result path. Deletes them right away if there is no queue or enqueueing
+    failed."""
+    if not rule_names:
+        return
+    if rule_delete_queue_url:
+        try:
+            with timed(metrics, "EnqueueRuleDelete"):
+                sqs_client.send_message(
+                    QueueUrl=rule_delete_queue_url,
+                    MessageBody=dumps({"ruleNames": rule_names}),
+                )
+            return
+        except Exception as e:
+            logger.error("Failed to enqueue rules", extra={"exception": e})
+    delete_rules(rule_names)
 
-iot_client = boto3.client("iot")
 
+def offload_batch_results(s3_client, bucket: Optional[str], response):
+    """Stores the results of a batch test in S3 if they exceed the claim
+    check threshold, the output of the execution is limited like its state."""
+    if not bucket:
+        return
+    if len(dumps_bytes(response["results"])) > CLAIM_CHECK_THRESHOLD:
+        with timed(metrics, "ClaimCheck"):
+            response["results"] = put_payload(s3_client, bucket, response["results"])
 
-def handle_event(event):
+
+def handle_event(
+    event,
+    rule_delete_queue_url: Optional[str] = None,
+    s3_client=None,
+    claim_check_bucket: Optional[str] = None,
+):
+    set_correlation_id(metrics, get_correlation_id(event))
     response = {}
 
     result = event.get("result", None)
@@ -20,12 +133,23 @@ def handle_event(event):
 
         response = {"output": None, "error": f"{error_code}:  {error_msg}"}
 
+    elif "results" in event:
+        results = event["results"]
+        # the distributed Map of batch tests writes its results to S3
+        if is_written(results):
+            with timed(metrics, "ReadMapResults"):
+                results = read_results(s3_client, results)
+        response = {"results": get_batch_results(results), "error": None}
+        offload_batch_results(s3_client, claim_check_bucket, response)
+    # ingest_message answers messages not matching the WHERE clause itself
+    elif is_no_match(result):
+        response = {"output": None, "error": NO_MATCH_ERROR}
     elif result:
         response = {"output": result, "error": None}
     elif "error" in event:
         response = {
             "output": None,
-            "error": event["error"].get("Error", "Unknown error"),
+            "error": get_error(event["error"]),
         }
     else:
         if "createMessageRuleOutput" in event:
@@ -44,25 +168,36 @@ def handle_event(event):
         response["mqttProperties"] = create_msg_rule_output.get("properties", {}).get(
             "mqttProperties", {}
         )
+        if create_msg_rule_output.get("cached", False):
+            response["capturedAt"] = create_msg_rule_output.get("capturedAt", None)
     elif "message" in event or "userProperties" in event or "mqttProperties" in event:
         response["input"] = event.get("message", None)
         response["userProperties"] = event.get("userProperties", [])
         response["mqttProperties"] = event.get("mqttProperties", {})
 
-    # delete all rules
-    for r in ["ingestRuleName", "getMessageRuleName"]:
-        if r in event:
-            try:
-                iot_client.delete_topic_rule(ruleName=event[r])
-            except Exception as e:
-                logger.error(
-                    f"Failed to delete rule {event[r]}", extra={"exception": e}
-                )
+    if "variantResults" in event:
+        response["variants"] = get_variant_results(event["variantResults"])
+
+    # delete all rules, pooled ingest rules are removed by the sweep rules Lambda
+    rules = ["ingestRuleName", "getMessageRuleName"]
+    if event.get("pooledIngestRule", False):
+        rules.remove("ingestRuleName")
+    # messages served from the message cache don't create a getMessage rule
+    if event.get("createMessageRuleOutput", {}).get("cached", False):
+        rules.remove("getMessageRuleName")
+    enqueue_rules([event[r] for r in rules if r in event], rule_delete_queue_url)
 
     return response
 
 
+def run(event):
+    """Runs the stage with the clients and configuration of this module,
+    also used by the fused_stages function."""
+    return handle_event(event, RULE_DELETE_QUEUE_URL, s3_client, CLAIM_CHECK_BUCKET)
+
+
+@metrics.log_metrics
 @logger.inject_lambda_context
 def lambda_handler(event, context):
-    logger.info(event)
-    return handle_event(event)
+    log_event(logger, event)
+    return run(event)
@@ -0,0 +1,252 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+from delete_rule.index import get_batch_results, handle_event
+from iottoolbox.serialization import dumps
+
+
+def test_get_batch_results():
+    results = [
+        {
+            "message": {"a": 1},
+            "properties": {
+                "userProperties": [{"foo": "bar"}],
+                "mqttProperties": {"contentType": "json"},
+            },
+            "ingestRuleName": "rule",
+            "result": {"b": 1},
+        },
+        {
+            "message": {"a": 2},
+            "properties": {"userProperties": [], "mqttProperties": {}},
+            "ingestRuleName": "rule",
+            "error": {"Error": "States.HeartbeatTimeout", "Cause": "null"},
+        },
+        {
+            "message": {"a": 3},
+            "properties": {"userProperties": [], "mqttProperties": {}},
+            "ingestRuleName": "rule",
+            "result": {"sfnNoMatch": True},
+        },
+    ]
+
+    assert get_batch_results(results) == [
+        {
+            "output": {"b": 1},
+            "error": None,
+            "input": {"a": 1},
+            "userProperties": [{"foo": "bar"}],
+            "mqttProperties": {"contentType": "json"},
+        },
+        {
+            "output": None,
+            "error": "States.HeartbeatTimeout",
+            "input": {"a": 2},
+            "userProperties": [],
+            "mqttProperties": {},
+        },
+        {
+            "output": None,
+            "error": "States.HeartbeatTimeout",
+            "input": {"a": 3},
+            "userProperties": [],
+            "mqttProperties": {},
+        },
+    ]
+
+
+def test_handle_event_custom_message(mocker):
+    iot_client = mocker.patch("delete_rule.index.iot_client")
+    event = {
+        "ingestRuleName": "rule",
+        "message": {"a": 1},
+        "userProperties": [],
+        "mqttProperties": {},
+        "result": {"b": 1},
+    }
+
+    assert handle_event(event) == {
+        "output": {"b": 1},
+        "error": None,
+        "input": {"a": 1},
+        "userProperties": [],
+        "mqttProperties": {},
+    }
+    iot_client.delete_topic_rule.assert_called_once_with(ruleName="rule")
+
+
+def test_handle_event_no_match(mocker):
+    mocker.patch("delete_rule.index.iot_client")
+    event = {
+        "ingestRuleName": "rule",
+        "message": {"a": 1},
+        "userProperties": [],
+        "mqttProperties": {},
+        "result": {"sfnNoMatch": True},
+    }
+
+    assert handle_event(event) == {
+        "output": None,
+        "error": "States.HeartbeatTimeout",
+        "input": {"a": 1},
+        "userProperties": [],
+        "mqttProperties": {},
+    }
+
+
+def test_handle_event_batch_message(mocker):
+    iot_client = mocker.patch("delete_rule.index.iot_client")
+    event = {
+        "ingestRuleName": "rule",
+        "messages": [{"message": {"a": 1}}],
+        "results": [{"message": {"a": 1}, "result": {"b": 1}}],
+    }
+
+    assert handle_event(event) == {
+        "results": [
+            {
+                "output": {"b": 1},
+                "error": None,
+                "input": {"a": 1},
+                "userProperties": [],
+                "mqttProperties": {},
+            }
+        ],
+        "error": None,
+    }
+    iot_client.delete_topic_rule.assert_called_once_with(ruleName="rule")
+
+
+def test_handle_event_batch_message_written_results(mocker):
+    mocker.patch("delete_rule.index.iot_client")
+    read_results = mocker.patch(
+        "delete_rule.index.read_results",
+        return_value=[{"itemIndex": 0, "message": {"a": 1}, "result": {"b": 1}}],
+    )
+    put_payload = mocker.patch(
+        "delete_rule.index.put_payload",
+        return_value={"claimCheck": {"bucket": "bucket", "key": "k"}},
+    )
+    mocker.patch("delete_rule.index.CLAIM_CHECK_THRESHOLD", 10)
+    s3_client = mocker.Mock()
+    results = {"ResultWriterDetails": {"Bucket": "bucket", "Key": "manifest.json"}}
+    event = {"ingestRuleName": "rule", "results": results}
+
+    response = handle_event(event, None, s3_client, "bucket")
+
+    # results above the claim check threshold are resolved by the API
+    assert response == {
+        "results": {"claimCheck": {"bucket": "bucket", "key": "k"}},
+        "error": None,
+    }
+    read_results.assert_called_once_with(s3_client, results)
+    assert put_payload.call_args.args[2] == [
+        {
+            "output": {"b": 1},
+            "error": None,
+            "input": {"a": 1},
+            "userProperties": [],
+            "mqttProperties": {},
+        }
+    ]
+
+
+def test_handle_event_sql_exception(mocker):
+    mocker.patch("delete_rule.index.iot_client")
+    event = {
+        "ingestRuleName": "rule",
+        "message": {"a": 1},
+        "error": {"Error": "SqlParseException"},
+    }
+
+    response = handle_event(event)
+
+    assert response["output"] is None
+    assert response["error"] == "SqlParseException"
+
+
+def test_handle_event_enqueues_rules(mocker):
+    iot_client = mocker.patch("delete_rule.index.iot_client")
+    sqs_client = mocker.patch("delete_rule.index.sqs_client")
+    event = {
+        "getMessageRuleName": "get-rule",
+        "ingestRuleName": "pooled-rule",
+        "pooledIngestRule": True,
+        "result": {"b": 1},
+    }
+
+    handle_event(event, "queue-url")
+
+    sqs_client.send_message.assert_called_once_with(
+        QueueUrl="queue-url", MessageBody=dumps({"ruleNames": ["get-rule"]})
+    )
+    iot_client.delete_topic_rule.assert_not_called()
+
+
+def test_handle_event_cached_message(mocker):
+    iot_client = mocker.patch("delete_rule.index.iot_client")
+    event = {
+        "getMessageRuleName": "get-rule",
+        "ingestRuleName": "ingest-rule",
+        "createMessageRuleOutput": {
+            "message": {"a": 1},
+            "properties": {},
+            "cached": True,
+            "capturedAt": 1000,
+        },
+        "result": {"a": 1},
+    }
+
+    response = handle_event(event)
+
+    assert response["capturedAt"] == 1000
+    iot_client.delete_topic_rule.assert_called_once_with(ruleName="ingest-rule")
+
+
+def test_handle_event_enqueue_failed(mocker):
+    iot_client = mocker.patch("delete_rule.index.iot_client")
+    sqs_client = mocker.patch("delete_rule.index.sqs_client")
+    sqs_client.send_message.side_effect = Exception("unavailable")
+
+    handle_event({"ingestRuleName": "rule", "result": {"b": 1}}, "queue-url")
+
+    iot_client.delete_topic_rule.assert_called_once_with(ruleName="rule")
+
+
+def test_handle_event_variants(mocker):
+    mocker.patch("delete_rule.index.iot_client")
+    event = {
+        "createMessageRuleOutput": {"message": {"a": 1}, "properties": {}},
+        "result": {"a": 1},
+        "variantResults": [
+            {"sql": "SELECT a AS b", "result": {"output": {"b": 1}, "error": None}},
+            {"sql": "SELECT c", "error": {"Error": "States.Timeout"}},
+        ],
+    }
+
+    response = handle_event(event)
+
+    assert response["output"] == {"a": 1}
+    assert response["variants"] == [
+        {"sql": "SELECT a AS b", "output": {"b": 1}, "error": None},
+        {"sql": "SELECT c", "output": None, "error": "States.Timeout"},
+    ]
+
+
+def test_handle_event_rule_action_error(mocker):
+    mocker.patch("delete_rule.index.iot_client")
+    event = {
+        "ingestRuleName": "rule",
+        "message": {"a": 1},
+        "error": {
+            "Error": "IotRuleActionError",
+            "Cause": "LambdaAction arn: Payload is too large",
+        },
+    }
+
+    response = handle_event(event)
+
+    assert response["output"] is None
+    assert response["error"] == (
+        "IotRuleActionError: LambdaAction arn: Payload is too large"
+    )
@@ -0,0 +1,106 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import importlib.util
+import os
+import sys
+from typing import Callable, Dict
+
+from aws_lambda_powertools import Logger, Metrics
+from iottoolbox.log_budget import log_event
+
+logger = Logger()
+metrics = Metrics()
+
+# the Lambda asset of this function is the whole stepfunction folder, so the
+# per-stage modules are loaded from their own folders and run through their
+# run() entry point
+STEPFUNCTION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../..")
+STAGE_MODULE_PATHS = {
+    "define_rule_name": "custom-message/lambda/define_rule_name/index.py",
+    "define_topicmsg_rule_name": "topic-message/lambda/define_topicmsg_rule_name/index.py",
+    "create_ingest_rule": "shared/lambda/create_ingest_rule/index.py",
+    "delete_rule": "shared/lambda/delete_rule/index.py",
+}
+
+_stage_modules = {}
+
+
+class UnknownStageException(Exception):
+    pass
+
+
+def get_stage_module(name: str):
+    module = _stage_modules.get(name)
+    if module is None:
+        module_name = f"fused_stage_{name}"
+        spec = importlib.util.spec_from_file_location(
+            module_name, os.path.join(STEPFUNCTION_DIR, STAGE_MODULE_PATHS[name])
+        )
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        spec.loader.exec_module(module)
+        if hasattr(module, "check_env"):
+            module.check_env()
+        _stage_modules[name] = module
+    return module
+
+
+def define_rule_name(event):
+    return get_stage_module("define_rule_name").run(event)
+
+
+def define_topicmsg_rule_name(event):
+    return get_stage_module("define_topicmsg_rule_name").run(event)
+
+
+def create_ingest_rule(event):
+    return get_stage_module("create_ingest_rule").run(event)
+
+
+def delete_rule(event):
+    return get_stage_module("delete_rule").run(event["input"])
+
+
+def prepare(event, result_key: str):
+    """Defines the rule name and creates the ingest rule in one invocation.
+
+    Returns the same state as the separate tasks, the output of
+    create_ingest_rule is stored at the resultPath of the replaced task.
+    """
+    state = define_rule_name(event)
+    state[result_key] = create_ingest_rule(dict(state))
+    return state
+
+
+def prepare_custom_message(event):
+    return prepare(event, "input")
+
+
+def prepare_batch_message(event):
+    return prepare(event, "createIngestRuleOutput")
+
+
+STAGES: Dict[str, Callable] = {
+    "define_rule_name": define_rule_name,
+    "define_topicmsg_rule_name": define_topicmsg_rule_name,
+    "create_ingest_rule": create_ingest_rule,
+    "prepare_custom_message": prepare_custom_message,
+    "prepare_batch_message": prepare_batch_message,
+    "delete_rule": delete_rule,
+}
+
+
+def handle_event(event):
+    stage = event.pop("stage", None)
+    if stage not in STAGES:
+        raise UnknownStageException(f"Unknown stage {stage}")
+    logger.append_keys(stage=stage)
+    return STAGES[stage](event)
+
+
+@metrics.log_metrics
+@logger.inject_lambda_context
+def lambda_handler(event, context):
+    log_event(logger, event)
+    return handle_event(event)
@@ -0,0 +1,132 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import pytest
+from fused_stages import index
+from fused_stages.index import UnknownStageException, get_stage_module, handle_event
+
+TEST_ENVIRONMENT = {
+    "RECEIVE_MESSAGE_LAMBDA_ARN": "receive-arn",
+    "PUBLISH_MESSAGE_ROLE_ARN": "role-arn",
+    "REPUBLISH_ERROR_TOPIC": "error/topic",
+    "TOOLBOX_IOT_RULE_PREFIX": "prefix",
+    "RULE_POOL_TTL_SECONDS": "0",
+}
+
+
+@pytest.fixture(autouse=True)
+def stage_modules(mocker):
+    mocker.patch.dict("os.environ", TEST_ENVIRONMENT)
+    mocker.patch.dict(index._stage_modules, clear=True)
+
+
+@pytest.fixture
+def iot_client(mocker):
+    get_stage_module("create_ingest_rule")
+    get_stage_module("delete_rule")
+    client = mocker.Mock()
+    mocker.patch.object(
+        index._stage_modules["create_ingest_rule"], "_iot_client", client
+    )
+    mocker.patch.object(index._stage_modules["delete_rule"], "iot_client", client)
+    return client
+
+
+def test_handle_event_unknown_stage():
+    with pytest.raises(UnknownStageException):
+        handle_event({"stage": "receive_message"})
+
+
+def test_define_topicmsg_rule_name():
+    event = {
+        "stage": "define_topicmsg_rule_name",
+        "execution": "abc-123",
+        "input": {"sql": "SELECT * FROM 'a'", "awsIotSqlVersion": "2016-03-23"},
+    }
+
+    assert handle_event(event) == {
+        "execution": "abc-123",
+        "getMessageRuleName": "prefix_getMessage_abc123",
+        "ingestRuleName": "prefix_ingest_abc123",
+        "sql": "SELECT * FROM 'a'",
+        "awsIotSqlVersion": "2016-03-23",
+    }
+
+
+def test_prepare_custom_message(iot_client):
+    event = {
+        "stage": "prepare_custom_message",
+        "execution": "abc-123",
+        "input": {
+            "sql": "SELECT a FROM 'a' WHERE b = 1",
+            "awsIotSqlVersion": "2016-03-23",
+            "message": {"a": 1},
+        },
+    }
+
+    state = handle_event(event)
+
+    assert state["ingestRuleName"] == "prefix_ingest_abc123"
+    assert state["message"] == {"a": 1}
+    assert state["input"] is None
+    payload = iot_client.create_topic_rule.call_args.kwargs["topicRulePayload"]
+    assert payload["sql"] == "SELECT a, sfnTaskToken WHERE b = 1"
+    assert iot_client.create_topic_rule.call_args.kwargs["ruleName"] == (
+        "prefix_ingest_abc123"
+    )
+
+
+def test_prepare_batch_message(iot_client):
+    event = {
+        "stage": "prepare_batch_message",
+        "execution": "abc-123",
+        "input": {
+            "sql": "SELECT a FROM 'a'",
+            "awsIotSqlVersion": "2016-03-23",
+            "messages": [{"message": {"a": 1}}],
+        },
+    }
+
+    state = handle_event(event)
+
+    assert state["messages"] == [{"message": {"a": 1}}]
+    assert state["createIngestRuleOutput"] is None
+    iot_client.create_topic_rule.assert_called_once()
+
+
+def test_prepare_custom_message_sql_exception(iot_client):
+    event = {
+        "stage": "prepare_custom_message",
+        "execution": "abc-123",
+        "input": {"sql": "SELECT FROM", "awsIotSqlVersion": "2016-03-23"},
+    }
+    # the statement is only rejected by the rules engine
+    iot_client.create_topic_rule.side_effect = type(
+        "SqlParseException", (Exception,), {}
+    )
+
+    with pytest.raises(Exception) as e:
+        handle_event(event)
+
+    # the state machines catch the error by its name
+    assert e.type.__name__ == "SqlParseException"
+    assert (
+        iot_client.create_topic_rule.call_args.kwargs["topicRulePayload"]["sql"]
+        == "SELECT FROM"
+    )
+
+
+def test_delete_rule(iot_client):
+    event = {
+        "stage": "delete_rule",
+        "input": {"ingestRuleName": "rule", "message": {"a": 1}, "result": {"b": 1}},
+    }
+
+    assert handle_event(event) == {
+        "output": {"b": 1},
+        "error": None,
+        "input": {"a": 1},
+        "userProperties": [],
+        "mqttProperties": {},
+    }
+    iot_client.delete_topic_rule.assert_called_once_with(ruleName="rule")
@@ -1,15 +1,33 @@
 #  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 #  SPDX-License-Identifier: Apache-2.0
 
-import json
 from typing import Dict
 
-import boto3
-from aws_lambda_powertools import Logger
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+from iottoolbox.claim_check import resolve
+from iottoolbox.clients import lazy_client
+from iottoolbox.ingest_transport import HttpsTransport, get_ingest_transport
+from iottoolbox.log_budget import log_event, log_payload
+from iottoolbox.serialization import dumps, dumps_bytes
+from iottoolbox.sql import DEFAULT_SQL_VERSION
+from iottoolbox.sql_eval import NO_MATCH_KEY, EvaluationContext, matches_sql
+from iottoolbox.timing import (
+    get_correlation_id,
+    link_task_token,
+    record_size,
+    set_correlation_id,
+    timed,
+)
 
 logger = Logger()
+metrics = Metrics()
 
-_iot_data_client = boto3.client("iot-data")
+_iot_data_client = lazy_client("iot-data")
+_s3_client = lazy_client("s3")
+_sfn_client = lazy_client("stepfunctions")
+# connects during init if the MQTT transport is configured
+_ingest_transport = get_ingest_transport(_iot_data_client)
 
 
 def get_rule_name(event):
@@ -19,6 +37,9 @@ def get_rule_name(event):
 def prepare_request(event, rule_name) -> Dict[str, any]:
     payload = event["message"]
     payload["sfnTaskToken"] = event["taskToken"]
+    link_task_token(metrics, event["taskToken"])
+    encoded_payload = dumps_bytes(payload)
+    record_size(metrics, "Publish", len(encoded_payload))
 
     userProperties = event.get("properties", {}).get("userProperties", [])
     mqttProperties = event.get("properties", {}).get("mqttProperties", {})
@@ -26,13 +47,51 @@ def prepare_request(event, rule_name) -> Dict[str, any]:
     return dict(
         topic=f"$aws/rules/{rule_name}",
         qos=1,
-        payload=json.dumps(payload),
+        payload=encoded_payload,
         userProperties=userProperties,
         **mqttProperties,
     )
 
 
-def handle_event(iot_data_client, event):
+def matches(event) -> bool:
+    """Checks the WHERE clause of the test against the message. Returns False
+    only if the message doesn't match, WHERE clauses that can't be evaluated
+    exactly are left to the rules engine."""
+    if "sql" not in event:
+        return True
+    properties = event.get("properties", {})
+    context = EvaluationContext(
+        mqtt_properties=properties.get("mqttProperties", {}),
+        user_properties=properties.get("userProperties", []),
+    )
+    try:
+        with timed(metrics, "MatchCheck"):
+            return matches_sql(
+                event["sql"],
+                event["message"],
+                event.get("awsIotSqlVersion", DEFAULT_SQL_VERSION),
+                context,
+            )
+    except Exception as e:
+        logger.info("WHERE clause not checked locally", extra={"reason": str(e)})
+        return True
+
+
+def send_no_match(sfn_client, task_token):
+    """Answers the task right away instead of letting it run into the
+    heartbeat timeout, the rule would never invoke receive_message."""
+    with timed(metrics, "SendTaskSuccess"):
+        sfn_client.send_task_success(
+            taskToken=task_token, output=dumps({NO_MATCH_KEY: True})
+        )
+    metrics.add_metric(name="LocalNoMatch", unit=MetricUnit.Count, value=1)
+
+
+def handle_event(
+    iot_data_client, event, s3_client=None, sfn_client=None, transport=None
+):
+    transport = transport or HttpsTransport(iot_data_client)
+    set_correlation_id(metrics, get_correlation_id(event))
     input = event.pop("input")
     event = event | input
     try:
@@ -45,10 +104,19 @@ def handle_event(iot_data_client, event):
         return e.__class__.__name__
 
     try:
+        # messages above the claim check threshold are passed as reference
+        if "message" in event:
+            event["message"] = resolve(s3_client, event["message"])
+        if sfn_client is not None and not matches(event):
+            send_no_match(sfn_client, event["taskToken"])
+            return
         request = prepare_request(event, ingest_rule_name)
-        logger.info("Publish message request", extra={"request": request})
-        response = iot_data_client.publish(**request)
+        log_payload(logger, "Publish message request", request, key="request")
+        with timed(metrics, "Publish"):
+            response = transport.publish(request)
         logger.info("Publish message response", extra={"response": response})
+        if response.get("fallbackReason"):
+            metrics.add_metric(name="IngestFallback", unit=MetricUnit.Count, value=1)
     except Exception as e:
         logger.error(
             f"Failed to ingest message to $aws/rules/{ingest_rule_name}",
@@ -59,7 +127,10 @@ def handle_event(iot_data_client, event):
     return
 
 
+@metrics.log_metrics
 @logger.inject_lambda_context
 def lambda_handler(event, context):
-    logger.info(event)
-    return handle_event(_iot_data_client, event)
+    log_event(logger, event)
+    return handle_event(
+        _iot_data_client, event, _s3_client, _sfn_client, _ingest_transport
+    )
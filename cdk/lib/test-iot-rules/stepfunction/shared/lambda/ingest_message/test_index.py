@@ -1,11 +1,13 @@
 #  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 #  SPDX-License-Identifier: Apache-2.0
 
-import json
+import io
 from contextlib import nullcontext as does_not_raise
 from unittest.mock import Mock
 
 import pytest
+from iottoolbox.serialization import dumps_bytes
+from iottoolbox.ingest_transport import HttpsTransport, MqttTransport
 from ingest_message.index import get_rule_name, prepare_request, handle_event
 
 
@@ -30,7 +32,7 @@ def test_get_rule_name(event, expected, exception_expectation):
             dict(
                 topic=f"$aws/rules/rule",
                 qos=1,
-                payload=json.dumps({"my": "msg", "sfnTaskToken": "token"}),
+                payload=dumps_bytes({"my": "msg", "sfnTaskToken": "token"}),
                 userProperties=[],
             ),
             does_not_raise(),
@@ -45,7 +47,7 @@ def test_get_rule_name(event, expected, exception_expectation):
             dict(
                 topic=f"$aws/rules/rule",
                 qos=1,
-                payload=json.dumps({"my": "msg", "sfnTaskToken": "token"}),
+                payload=dumps_bytes({"my": "msg", "sfnTaskToken": "token"}),
                 userProperties=[],
             ),
             does_not_raise(),
@@ -60,7 +62,7 @@ def test_get_rule_name(event, expected, exception_expectation):
             dict(
                 topic=f"$aws/rules/rule",
                 qos=1,
-                payload=json.dumps({"my": "msg", "sfnTaskToken": "token"}),
+                payload=dumps_bytes({"my": "msg", "sfnTaskToken": "token"}),
                 userProperties=[{"foo": "bar"}],
             ),
             does_not_raise(),
@@ -78,7 +80,7 @@ def test_get_rule_name(event, expected, exception_expectation):
             dict(
                 topic=f"$aws/rules/rule",
                 qos=1,
-                payload=json.dumps({"my": "msg", "sfnTaskToken": "token"}),
+                payload=dumps_bytes({"my": "msg", "sfnTaskToken": "token"}),
                 userProperties=[{"foo": "bar"}],
                 testProp="foo",
             ),
@@ -90,7 +92,7 @@ def test_get_rule_name(event, expected, exception_expectation):
             dict(
                 topic=f"$aws/rules/rule",
                 qos=1,
-                payload=json.dumps({"my": "msg", "sfnTaskToken": "token"}),
+                payload=dumps_bytes({"my": "msg", "sfnTaskToken": "token"}),
                 userProperties=[],
             ),
             pytest.raises(KeyError),
@@ -101,7 +103,7 @@ def test_get_rule_name(event, expected, exception_expectation):
             dict(
                 topic=f"$aws/rules/rule",
                 qos=1,
-                payload=json.dumps({"my": "msg", "sfnTaskToken": "token"}),
+                payload=dumps_bytes({"my": "msg", "sfnTaskToken": "token"}),
                 userProperties=[],
             ),
             pytest.raises(KeyError),
@@ -121,7 +123,7 @@ def test_handle_event(mocker):
     prep_request = mocker.patch("ingest_message.index.prepare_request")
     prep_request.return_value = prep_request_return
     iot_client = Mock()
-    iot_client.publish = Mock(return_value="okay")
+    iot_client.publish = Mock(return_value={"ResponseMetadata": {}})
     event = {
         "foo": "bar",
         "sfnTaskToken": "token",
@@ -134,8 +136,86 @@ def test_handle_event(mocker):
         "sfnTaskToken": "nestedToken",
     }
 
-    handle_event(iot_client, event)
+    assert handle_event(iot_client, event) is None
 
     get_rule.assert_called_with(expected_event)
     prep_request.assert_called_with(expected_event, get_rule.return_value)
     iot_client.publish.assert_called_with(**prep_request_return)
+
+
+def test_handle_event_claim_check():
+    iot_client = Mock()
+    s3_client = Mock()
+    s3_client.get_object.return_value = {"Body": io.BytesIO(b'{"my": "msg"}')}
+    event = {
+        "taskToken": "token",
+        "input": {
+            "message": {"claimCheck": {"bucket": "bucket", "key": "key"}},
+            "ingestRuleName": "rule",
+        },
+    }
+
+    handle_event(iot_client, event, s3_client)
+
+    s3_client.get_object.assert_called_with(Bucket="bucket", Key="key")
+    assert iot_client.publish.call_args.kwargs["payload"] == dumps_bytes(
+        {"my": "msg", "sfnTaskToken": "token"}
+    )
+
+
+@pytest.mark.parametrize(
+    "sql,published",
+    [
+        ("SELECT * FROM 't' WHERE my = 'msg'", True),
+        ("SELECT * FROM 't' WHERE my = 'other'", False),
+        ("SELECT * FROM 't' WHERE get_mqtt_property('content_type') = 'json'", True),
+        ("SELECT * FROM 't' WHERE topic(1) = 'other'", True),
+        ("SELECT * FROM 't' WHERE", True),
+        ("SELECT * FROM 't' WHERE 'true' AND my = 'msg'", True),
+        ("SELECT * FROM 't' WHERE NOT 'false'", True),
+        ("SELECT * FROM 't' WHERE my AND my = 'msg'", False),
+        # not evaluated exactly, left to the rules engine
+        ("SELECT * FROM 't' WHERE my + 1 = 2", True),
+    ],
+)
+def test_handle_event_no_match(sql, published):
+    iot_client = Mock()
+    sfn_client = Mock()
+    event = {
+        "taskToken": "token",
+        "input": {
+            "message": {"my": "msg"},
+            "properties": {"mqttProperties": {"contentType": "json"}},
+            "sql": sql,
+            "awsIotSqlVersion": "2016-03-23",
+            "ingestRuleName": "rule",
+        },
+    }
+
+    handle_event(iot_client, event, sfn_client=sfn_client)
+
+    assert iot_client.publish.called == published
+    if published:
+        sfn_client.send_task_success.assert_not_called()
+    else:
+        sfn_client.send_task_success.assert_called_with(
+            taskToken="token", output='{"sfnNoMatch":true}'
+        )
+
+
+def test_handle_event_transport():
+    connection = Mock()
+    connection.wait_connected.return_value = False
+    iot_client = Mock()
+    iot_client.publish.return_value = {"ResponseMetadata": {}}
+    transport = MqttTransport(connection, HttpsTransport(iot_client))
+    event = {
+        "taskToken": "token",
+        "input": {"message": {"my": "msg"}, "ingestRuleName": "rule"},
+    }
+
+    assert handle_event(None, event, transport=transport) is None
+
+    # published over HTTPS while the connection is down
+    assert iot_client.publish.call_args.kwargs["topic"] == "$aws/rules/rule"
+    assert transport.fallbacks == 1
@@ -0,0 +1,114 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Consumer of the republish error topic.
+
+The temporary rules republish to REPUBLISH_ERROR_TOPIC if their action
+fails, e.g. the Lambda function receiving the output can't be invoked. The
+rule never reaches receive_message then and the test would only end with the
+heartbeat timeout of the task. The error message is correlated to the task
+token, ingest rules forward it in the original payload and getMessage rules
+select it as literal in their statement, and the task is failed at once
+with the error of the failed action.
+"""
+
+import base64
+import binascii
+import os
+import re
+from typing import Any, Dict, Optional
+
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+from iottoolbox.clients import lazy_client
+from iottoolbox.log_budget import log_event
+from iottoolbox.serialization import loads
+from iottoolbox.timing import get_task_token_id, set_correlation_id, timed
+
+logger = Logger()
+metrics = Metrics()
+
+_iot_client = lazy_client("iot")
+_sfn_client = lazy_client("stepfunctions")
+TOOLBOX_IOT_RULE_PREFIX = os.getenv("TOOLBOX_IOT_RULE_PREFIX", "iottoolbox_tmp_rule_")
+
+TASK_TOKEN_KEY = "sfnTaskToken"
+RULE_ACTION_ERROR = "IotRuleActionError"
+# task token literal of the getMessage rule statement, see create_get_message_rule
+RULE_TASK_TOKEN_PATTERN = re.compile(r"'sfnTaskToken': '([^']+)'")
+# limit of the cause of SendTaskFailure
+MAX_CAUSE_LENGTH = 32768
+
+# errors of tasks that already finished, e.g. with the heartbeat timeout
+FINISHED_TASK_ERRORS = ("TaskTimedOut", "TaskDoesNotExist", "InvalidToken")
+
+
+def get_payload_task_token(event) -> Optional[str]:
+    """Returns the task token of the message published to an ingest rule."""
+    try:
+        payload = loads(base64.b64decode(event.get("base64OriginalPayload", "")))
+    except (binascii.Error, ValueError):
+        return None
+    if isinstance(payload, dict) and isinstance(payload.get(TASK_TOKEN_KEY), str):
+        return payload[TASK_TOKEN_KEY]
+    return None
+
+
+def get_rule_task_token(iot_client, rule_name: str) -> Optional[str]:
+    """Returns the task token of the statement of a getMessage rule."""
+    try:
+        with timed(metrics, "GetTopicRule"):
+            response = iot_client.get_topic_rule(ruleName=rule_name)
+    except Exception as e:
+        logger.warning(f"Failed to get rule {rule_name}", extra={"exception": e})
+        return None
+    match = RULE_TASK_TOKEN_PATTERN.search(response.get("rule", {}).get("sql", ""))
+    return match.group(1) if match else None
+
+
+def get_cause(event) -> str:
+    failures = event.get("failures", [])
+    cause = "; ".join(
+        f"{failure.get('failedAction', 'Action')} {failure.get('failedResource', '')}: "
+        f"{failure.get('errorMessage', 'Unknown error')}"
+        for failure in failures
+    )
+    return (cause or "Unknown error")[:MAX_CAUSE_LENGTH]
+
+
+def handle_event(iot_client, sfn_client, event, rule_prefix: str) -> Dict[str, Any]:
+    rule_name = event.get("ruleName", "")
+    if not rule_name.startswith(f"{rule_prefix}_"):
+        logger.info(f"Ignoring error of rule {rule_name}")
+        return {"failed": False}
+
+    task_token = get_payload_task_token(event) or get_rule_task_token(
+        iot_client, rule_name
+    )
+    if task_token is None:
+        logger.warning(f"No task token for the error of rule {rule_name}")
+        metrics.add_metric(
+            name="RuleActionErrorUnmatched", unit=MetricUnit.Count, value=1
+        )
+        return {"failed": False}
+    set_correlation_id(metrics, get_task_token_id(task_token))
+
+    try:
+        with timed(metrics, "SendTaskFailure"):
+            sfn_client.send_task_failure(
+                taskToken=task_token, error=RULE_ACTION_ERROR, cause=get_cause(event)
+            )
+    except Exception as e:
+        if e.__class__.__name__ not in FINISHED_TASK_ERRORS:
+            raise e
+        logger.info("Task already finished", extra={"exception": e})
+        return {"failed": False}
+    metrics.add_metric(name="RuleActionError", unit=MetricUnit.Count, value=1)
+    return {"failed": True}
+
+
+@metrics.log_metrics
+@logger.inject_lambda_context
+def lambda_handler(event, context):
+    log_event(logger, event)
+    return handle_event(_iot_client, _sfn_client, event, TOOLBOX_IOT_RULE_PREFIX)
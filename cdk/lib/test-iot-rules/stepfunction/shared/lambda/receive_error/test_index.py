@@ -0,0 +1,127 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import base64
+from unittest.mock import Mock
+
+import pytest
+from iottoolbox.serialization import dumps_bytes
+from receive_error.index import (
+    get_cause,
+    get_payload_task_token,
+    get_rule_task_token,
+    handle_event,
+)
+
+FAILURES = [
+    {
+        "failedAction": "LambdaAction",
+        "failedResource": "arn:aws:lambda:us-east-1:123:function:receive",
+        "errorMessage": "Payload is too large",
+    }
+]
+
+
+class TaskTimedOut(Exception):
+    pass
+
+
+def error_message(rule_name, payload):
+    return {
+        "ruleName": rule_name,
+        "topic": f"$aws/rules/{rule_name}",
+        "base64OriginalPayload": base64.b64encode(dumps_bytes(payload)).decode(),
+        "failures": FAILURES,
+    }
+
+
+@pytest.mark.parametrize(
+    "payload,expected",
+    [
+        ({"a": 1, "sfnTaskToken": "token"}, "token"),
+        ({"a": 1}, None),
+        ([1, 2], None),
+    ],
+)
+def test_get_payload_task_token(payload, expected):
+    assert get_payload_task_token(error_message("rule", payload)) == expected
+
+
+def test_get_payload_task_token_invalid_payload():
+    assert get_payload_task_token({"base64OriginalPayload": "bm90IGpzb24="}) is None
+    assert get_payload_task_token({}) is None
+
+
+def test_get_rule_task_token():
+    iot_client = Mock()
+    iot_client.get_topic_rule.return_value = {
+        "rule": {
+            "sql": "SELECT {'message': *, 'sfnTaskToken': 'token', "
+            "'captureTopicFilter': 'a/b'} FROM 'a/b'"
+        }
+    }
+
+    assert get_rule_task_token(iot_client, "rule") == "token"
+
+    iot_client.get_topic_rule.side_effect = ValueError()
+    assert get_rule_task_token(iot_client, "rule") is None
+
+
+def test_get_cause():
+    assert get_cause({"failures": FAILURES}) == (
+        "LambdaAction arn:aws:lambda:us-east-1:123:function:receive: "
+        "Payload is too large"
+    )
+    assert get_cause({}) == "Unknown error"
+
+
+def test_handle_event_ingest_rule():
+    iot_client = Mock()
+    sfn_client = Mock()
+    event = error_message("prefix_ingest_123", {"a": 1, "sfnTaskToken": "token"})
+
+    assert handle_event(iot_client, sfn_client, event, "prefix") == {"failed": True}
+
+    sfn_client.send_task_failure.assert_called_once_with(
+        taskToken="token", error="IotRuleActionError", cause=get_cause(event)
+    )
+    iot_client.get_topic_rule.assert_not_called()
+
+
+def test_handle_event_get_message_rule():
+    iot_client = Mock()
+    iot_client.get_topic_rule.return_value = {
+        "rule": {"sql": "SELECT {'message': *, 'sfnTaskToken': 'token'} FROM 'a'"}
+    }
+    sfn_client = Mock()
+    event = error_message("prefix_getMessage_123", {"a": 1})
+
+    assert handle_event(iot_client, sfn_client, event, "prefix") == {"failed": True}
+
+    iot_client.get_topic_rule.assert_called_once_with(ruleName="prefix_getMessage_123")
+    assert sfn_client.send_task_failure.call_args.kwargs["taskToken"] == "token"
+
+
+def test_handle_event_other_rule():
+    sfn_client = Mock()
+    event = error_message("other_rule", {"sfnTaskToken": "token"})
+
+    assert handle_event(Mock(), sfn_client, event, "prefix") == {"failed": False}
+    sfn_client.send_task_failure.assert_not_called()
+
+
+def test_handle_event_task_finished():
+    sfn_client = Mock()
+    sfn_client.send_task_failure.side_effect = TaskTimedOut()
+    event = error_message("prefix_ingest_123", {"sfnTaskToken": "token"})
+
+    assert handle_event(Mock(), sfn_client, event, "prefix") == {"failed": False}
+
+
+def test_handle_event_error():
+    sfn_client = Mock()
+    sfn_client.send_task_failure.side_effect = ValueError()
+    event = error_message("prefix_ingest_123", {"sfnTaskToken": "token"})
+
+    with pytest.raises(ValueError):
+        handle_event(Mock(), sfn_client, event, "prefix")
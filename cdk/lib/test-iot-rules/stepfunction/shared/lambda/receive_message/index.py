@@ -1,36 +1,136 @@
 #  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 #  SPDX-License-Identifier: Apache-2.0
 
-import json
+import os
+from typing import Optional
 
-import boto3
-from aws_lambda_powertools import Logger
+from aws_lambda_powertools import Logger, Metrics
+from iottoolbox.claim_check import CLAIM_CHECK_THRESHOLD, offload_fields, put_payload
+from iottoolbox.clients import lazy_client
+from iottoolbox.log_budget import log_event
+from iottoolbox.message_cache import (
+    CAPTURED_PROPERTIES_KEY,
+    TOPIC_FILTER_KEY,
+    parse_captured_properties,
+    put_message,
+)
+from iottoolbox.serialization import dumps
+from iottoolbox.timing import get_task_token_id, record_size, set_correlation_id, timed
 
 logger = Logger()
+metrics = Metrics()
 
-_sfn_client = boto3.client("stepfunctions")
+_sfn_client = lazy_client("stepfunctions")
+_dynamodb_client = lazy_client("dynamodb")
+_s3_client = lazy_client("s3")
+MESSAGE_CACHE_TABLE = os.getenv("MESSAGE_CACHE_TABLE", None)
+CLAIM_CHECK_BUCKET = os.getenv("CLAIM_CHECK_BUCKET", None)
+
+TASK_TOKEN_KEY = "sfnTaskToken"
 
 
 def remove_key_from_message(message, remove_key):
-    if isinstance(message, dict):
-        for key in list(message.keys()):
-            if key == remove_key:
-                del message[key]
-            else:
-                remove_key_from_message(message[key], remove_key)
-
-
-def handle_event(sfn_client, event):
-    task_token = event.pop("sfnTaskToken")
-    remove_key_from_message(event, "sfnTaskToken")
-    sfn_response = sfn_client.send_task_success(
-        taskToken=str(task_token), output=json.dumps(event)
-    )
+    """Removes remove_key from all objects of the message, including objects
+    in arrays. Walks the message iteratively, so deeply nested messages don't
+    exceed the recursion limit."""
+    stack = [message]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            value.pop(remove_key, None)
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+
+
+def cache_message(
+    dynamodb_client,
+    table_name: str,
+    topic_filter: str,
+    captured_properties: Optional[str],
+    event,
+):
+    """Stores a message captured by a getMessage rule, tests are answered
+    even if caching failed."""
+    try:
+        with timed(metrics, "CacheMessage"):
+            put_message(
+                dynamodb_client,
+                table_name,
+                topic_filter,
+                event,
+                properties=parse_captured_properties(captured_properties),
+            )
+    except Exception as e:
+        logger.warning("Failed to cache message", extra={"exception": e})
+
+
+def offload_output(s3_client, bucket: str, event, output: str, captured: bool):
+    """Stores the captured message of a getMessage rule or the whole output
+    of an ingest rule in S3, only the reference is passed to the state
+    machine."""
+    if captured:
+        offload_fields(
+            s3_client, bucket, [event], "message", len(output), CLAIM_CHECK_THRESHOLD
+        )
+        return event
+    return put_payload(s3_client, bucket, event)
+
+
+def handle_event(
+    sfn_client,
+    event,
+    dynamodb_client=None,
+    message_cache_table: Optional[str] = None,
+    s3_client=None,
+    claim_check_bucket: Optional[str] = None,
+):
+    # the ingest rule selects the task token as top level field
+    task_token = str(event.pop(TASK_TOKEN_KEY))
+    # only set by getMessage rules, see create_get_message_rule
+    topic_filter = event.pop(TOPIC_FILTER_KEY, None)
+    captured_properties = event.pop(CAPTURED_PROPERTIES_KEY, None)
+    # linked to the execution by the function that handed out the token
+    set_correlation_id(metrics, get_task_token_id(task_token))
+    output = dumps(event)
+    # nested tokens are only left if the statement selected the whole message
+    # into a nested object, e.g. SELECT {'copy': *} FROM 'topic', so the
+    # message is only walked if the serialized output contains the key
+    if f'"{TASK_TOKEN_KEY}"' in output:
+        remove_key_from_message(event, TASK_TOKEN_KEY)
+        output = dumps(event)
+    if claim_check_bucket and len(output) > CLAIM_CHECK_THRESHOLD:
+        with timed(metrics, "ClaimCheck"):
+            event = offload_output(
+                s3_client, claim_check_bucket, event, output, topic_filter is not None
+            )
+        output = dumps(event)
+    record_size(metrics, "SendTaskSuccess", len(output))
+    with timed(metrics, "SendTaskSuccess"):
+        sfn_response = sfn_client.send_task_success(taskToken=task_token, output=output)
     logger.info("SendTaskSuccess response", extra={"response": sfn_response})
+
+    # cached after the test continued, off the result path
+    if topic_filter and message_cache_table:
+        cache_message(
+            dynamodb_client,
+            message_cache_table,
+            topic_filter,
+            captured_properties,
+            event,
+        )
     return
 
 
+@metrics.log_metrics
 @logger.inject_lambda_context
 def lambda_handler(event, context):
-    logger.info(event)
-    return handle_event(_sfn_client, event)
+    log_event(logger, event)
+    return handle_event(
+        _sfn_client,
+        event,
+        _dynamodb_client,
+        MESSAGE_CACHE_TABLE,
+        _s3_client,
+        CLAIM_CHECK_BUCKET,
+    )
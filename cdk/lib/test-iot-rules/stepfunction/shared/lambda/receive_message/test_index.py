@@ -1,10 +1,12 @@
 #  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 #  SPDX-License-Identifier: Apache-2.0
 
-import json
+import sys
 from unittest.mock import Mock
 
 import pytest
+from iottoolbox.serialization import dumps
+from iottoolbox.timing import collect
 from receive_message.index import remove_key_from_message, handle_event
 
 TEST_ENVIRONMENT = {
@@ -46,6 +48,12 @@ TEST_ENVIRONMENT = {
             },
             {"foo": "bar", "nested1": {"nestedFoo": "nestedBar", "nested2": {}}},
         ),
+        (
+            "sfnTaskToken",
+            {"foo": [{"sfnTaskToken": "token", "a": 1}, [{"sfnTaskToken": "t"}]]},
+            {"foo": [{"a": 1}, [{}]]},
+        ),
+        ("sfnTaskToken", [{"sfnTaskToken": "token"}, 1, "a"], [{}, 1, "a"]),
     ],
 )
 def test_remove_key_from_message(remove_key, input_dict, expected_dict):
@@ -53,6 +61,35 @@ def test_remove_key_from_message(remove_key, input_dict, expected_dict):
     assert input_dict == expected_dict
 
 
+def test_remove_key_from_deeply_nested_message():
+    depth = sys.getrecursionlimit() * 2
+    message = inner = {}
+    for _ in range(depth):
+        inner["sfnTaskToken"] = "token"
+        inner["nested"] = [{}]
+        inner = inner["nested"][0]
+
+    remove_key_from_message(message, "sfnTaskToken")
+
+    inner = message
+    for _ in range(depth):
+        assert list(inner) == ["nested"]
+        inner = inner["nested"][0]
+
+
+def test_handle_event_top_level_token(mocker):
+    remove_key = mocker.patch("receive_message.index.remove_key_from_message")
+    sfn_client = Mock()
+    event = {"foo": "bar", "sfnTaskToken": "token", "nested": [{"n": "n"}]}
+
+    handle_event(sfn_client, event)
+
+    remove_key.assert_not_called()
+    sfn_client.send_task_success.assert_called_with(
+        taskToken="token", output=dumps({"foo": "bar", "nested": [{"n": "n"}]})
+    )
+
+
 def test_handle_event():
     sfn_client = Mock()
     sfn_client.send_task_success = Mock(return_value="Okay")
@@ -61,9 +98,106 @@ def test_handle_event():
         "sfnTaskToken": "token",
         "nested": {"n": "n", "sfnTaskToken": "nestedToken"},
     }
-    expectedOutpu = json.dumps({"foo": "bar", "nested": {"n": "n"}})
+    expectedOutpu = dumps({"foo": "bar", "nested": {"n": "n"}})
 
     handle_event(sfn_client, event)
     sfn_client.send_task_success.assert_called_with(
         taskToken="token", output=expectedOutpu
     )
+
+
+def test_handle_event_timings():
+    sfn_client = Mock()
+    output = dumps({"foo": "bar"})
+
+    with collect() as collector:
+        handle_event(sfn_client, {"foo": "bar", "sfnTaskToken": "token"})
+
+    assert collector.aggregate()["SendTaskSuccess"]["count"] == 1
+    assert collector.sizes["SendTaskSuccess"] == [len(output)]
+
+
+def test_handle_event_caches_captured_message(mocker):
+    put_message = mocker.patch("receive_message.index.put_message")
+    sfn_client = Mock()
+    dynamodb_client = Mock()
+    event = {
+        "message": {"a": 1},
+        "properties": {"userProperties": [], "mqttProperties": {}},
+        "sfnTaskToken": "token",
+        "captureTopicFilter": "device/+/data",
+        "captureProperties": "content_type",
+    }
+
+    handle_event(sfn_client, event, dynamodb_client, "messages")
+
+    captured = {
+        "message": {"a": 1},
+        "properties": {"userProperties": [], "mqttProperties": {}},
+    }
+    sfn_client.send_task_success.assert_called_with(
+        taskToken="token", output=dumps(captured)
+    )
+    put_message.assert_called_with(
+        dynamodb_client,
+        "messages",
+        "device/+/data",
+        captured,
+        properties=frozenset(["content_type"]),
+    )
+
+
+def test_handle_event_cache_error(mocker):
+    mocker.patch("receive_message.index.put_message", side_effect=ValueError())
+    sfn_client = Mock()
+    event = {"message": {}, "sfnTaskToken": "token", "captureTopicFilter": "t"}
+
+    handle_event(sfn_client, event, Mock(), "messages")
+
+    sfn_client.send_task_success.assert_called_once()
+
+
+def test_handle_event_claim_check_captured_message(mocker):
+    mocker.patch("receive_message.index.CLAIM_CHECK_THRESHOLD", 100)
+    reference = {"claimCheck": {"bucket": "bucket", "key": "k"}}
+    put_payload = mocker.patch(
+        "iottoolbox.claim_check.put_payload", return_value=reference
+    )
+    sfn_client = Mock()
+    s3_client = Mock()
+    event = {
+        "message": {"data": "a" * 200},
+        "properties": {"userProperties": [], "mqttProperties": {}},
+        "sfnTaskToken": "token",
+        "captureTopicFilter": "device/+/data",
+    }
+
+    handle_event(sfn_client, event, s3_client=s3_client, claim_check_bucket="bucket")
+
+    put_payload.assert_called_once_with(s3_client, "bucket", {"data": "a" * 200})
+    sfn_client.send_task_success.assert_called_with(
+        taskToken="token",
+        output=dumps(
+            {
+                "message": reference,
+                "properties": {"userProperties": [], "mqttProperties": {}},
+            }
+        ),
+    )
+
+
+def test_handle_event_claim_check_rule_output(mocker):
+    mocker.patch("receive_message.index.CLAIM_CHECK_THRESHOLD", 100)
+    reference = {"claimCheck": {"bucket": "bucket", "key": "k"}}
+    put_payload = mocker.patch(
+        "receive_message.index.put_payload", return_value=reference
+    )
+    sfn_client = Mock()
+    event = {"data": "a" * 200, "sfnTaskToken": "token"}
+
+    handle_event(sfn_client, event, s3_client=Mock(), claim_check_bucket="bucket")
+
+    assert put_payload.call_args.args[2] == {"data": "a" * 200}
+    sfn_client.send_task_success.assert_called_with(
+        taskToken="token", output=dumps(reference)
+    )
@@ -0,0 +1,188 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Garbage collector of the temporary IoT rules.
+
+delete_rule enqueues the rules of finished tests, they are deleted here off
+the result path. On schedule all rules with the toolbox prefix are listed
+and pooled rules of expired generations as well as temporary rules older
+than any test (e.g. left behind by failed deletes) are deleted. Only the
+ingest and getMessage rules of the rule tester are swept, other features
+like record-messages share the prefix for their long-lived rules. All deletes
+share the rate limit of the IoT control plane, the sweep stops before a
+rate limited delete could exceed the timeout of the function. The remaining
+rules are deleted by the next sweep or the retry of their message.
+"""
+
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+from iottoolbox.clients import lazy_client
+from iottoolbox.rate_limit import get_max_call_seconds, rate_limited
+from iottoolbox.rule_pool import is_expired, parse_pooled_rule_name
+from iottoolbox.serialization import loads
+
+logger = Logger()
+metrics = Metrics()
+
+_iot_client = rate_limited(lazy_client("iot"))
+TOOLBOX_IOT_RULE_PREFIX = os.getenv("TOOLBOX_IOT_RULE_PREFIX", "iottoolbox_tmp_rule_")
+RULE_POOL_TTL_SECONDS = int(os.getenv("RULE_POOL_TTL_SECONDS", "0"))
+ORPHANED_RULE_AGE_SECONDS = int(os.getenv("ORPHANED_RULE_AGE_SECONDS", "900"))
+
+# infixes of the temporary rules created by the rule tester
+TEMPORARY_RULE_INFIXES = ("ingest", "getMessage")
+# time left for the longest rate limited delete and the call itself
+DELETE_RESERVE_MILLIS = int((get_max_call_seconds() + 5) * 1000)
+
+
+def list_rules(iot_client) -> Iterator[Dict[str, Any]]:
+    paginator = iot_client.get_paginator("list_topic_rules")
+    for page in paginator.paginate():
+        yield from page.get("rules", [])
+
+
+def get_expired_pooled_rules(rule_names, prefix: str, ttl: int, now: float):
+    expired = []
+    for rule_name in rule_names:
+        pooled_rule = parse_pooled_rule_name(prefix, rule_name)
+        if pooled_rule and is_expired(pooled_rule[1], ttl, now):
+            expired.append(rule_name)
+    return expired
+
+
+def is_temporary_rule(prefix: str, rule_name: str) -> bool:
+    return any(
+        rule_name.startswith(f"{prefix}_{infix}_") for infix in TEMPORARY_RULE_INFIXES
+    )
+
+
+def get_orphaned_rules(rules, prefix: str, max_age: int, now: float) -> List[str]:
+    orphaned = []
+    for rule in rules:
+        rule_name = rule["ruleName"]
+        created_at = rule.get("createdAt")
+        if (
+            is_temporary_rule(prefix, rule_name)
+            and parse_pooled_rule_name(prefix, rule_name) is None
+            and created_at is not None
+            and created_at.timestamp() + max_age < now
+        ):
+            orphaned.append(rule_name)
+    return orphaned
+
+
+def has_time_left(remaining_millis: Optional[Callable[[], int]]) -> bool:
+    return remaining_millis is None or remaining_millis() > DELETE_RESERVE_MILLIS
+
+
+def delete_rules(
+    iot_client,
+    rule_names: Iterable[str],
+    remaining_millis: Optional[Callable[[], int]] = None,
+) -> int:
+    """Deletes the rules while there is time left, returns how many were
+    deleted."""
+    deleted = 0
+    for rule_name in rule_names:
+        if not has_time_left(remaining_millis):
+            logger.warning("Sweep stopped before the timeout")
+            metrics.add_metric(name="SweepTimeout", unit=MetricUnit.Count, value=1)
+            break
+        try:
+            iot_client.delete_topic_rule(ruleName=rule_name)
+            deleted += 1
+        except Exception as e:
+            logger.error(f"Failed to delete rule {rule_name}", extra={"exception": e})
+    return deleted
+
+
+def handle_records(
+    iot_client,
+    records: List[Dict[str, Any]],
+    remaining_millis: Optional[Callable[[], int]] = None,
+):
+    """Deletes the rules enqueued by delete_rule, messages with failed deletes
+    or without time left are retried. Rules that keep failing are left to the
+    scheduled sweep."""
+    batch_item_failures = []
+    deleted = 0
+    for record in records:
+        rule_names = loads(record["body"])["ruleNames"]
+        deleted_rules = delete_rules(iot_client, rule_names, remaining_millis)
+        deleted += deleted_rules
+        if deleted_rules < len(rule_names):
+            batch_item_failures.append({"itemIdentifier": record["messageId"]})
+
+    metrics.add_metric(name="RulesDeleted", unit=MetricUnit.Count, value=deleted)
+    return {"batchItemFailures": batch_item_failures}
+
+
+def handle_event(
+    iot_client,
+    toolbox_iot_rule_prefix: str,
+    rule_pool_ttl: int,
+    orphaned_rule_age: int = ORPHANED_RULE_AGE_SECONDS,
+    remaining_millis: Optional[Callable[[], int]] = None,
+):
+    now = time.time()
+    rules = list(list_rules(iot_client))
+
+    expired = []
+    if rule_pool_ttl > 0:
+        expired = get_expired_pooled_rules(
+            (rule["ruleName"] for rule in rules),
+            toolbox_iot_rule_prefix,
+            rule_pool_ttl,
+            now,
+        )
+    orphaned = get_orphaned_rules(
+        rules, toolbox_iot_rule_prefix, orphaned_rule_age, now
+    )
+
+    deleted_expired = delete_rules(iot_client, expired, remaining_millis)
+    deleted_orphaned = delete_rules(iot_client, orphaned, remaining_millis)
+
+    logger.info(
+        "Swept rules",
+        extra={
+            "expired": len(expired),
+            "orphaned": len(orphaned),
+            "deleted": deleted_expired + deleted_orphaned,
+        },
+    )
+    metrics.add_metric(
+        name="RulePoolReclaimed", unit=MetricUnit.Count, value=deleted_expired
+    )
+    metrics.add_metric(
+        name="OrphanedRulesReclaimed", unit=MetricUnit.Count, value=deleted_orphaned
+    )
+    return {
+        "expired": len(expired),
+        "orphaned": len(orphaned),
+        "deleted": deleted_expired + deleted_orphaned,
+    }
+
+
+def check_env():
+    if not TOOLBOX_IOT_RULE_PREFIX:
+        raise Exception("TOOLBOX_IOT_RULE_PREFIX environment variable not defined")
+
+
+@metrics.log_metrics
+@logger.inject_lambda_context
+def lambda_handler(event, context):
+    check_env()
+    if "Records" in event:
+        return handle_records(
+            _iot_client, event["Records"], context.get_remaining_time_in_millis
+        )
+    return handle_event(
+        _iot_client,
+        TOOLBOX_IOT_RULE_PREFIX,
+        RULE_POOL_TTL_SECONDS,
+        remaining_millis=context.get_remaining_time_in_millis,
+    )
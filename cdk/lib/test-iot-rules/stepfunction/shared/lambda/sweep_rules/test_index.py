@@ -0,0 +1,140 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+from datetime import datetime, timezone
+from unittest.mock import Mock
+
+from iottoolbox.serialization import dumps
+from sweep_rules.index import (
+    get_expired_pooled_rules,
+    get_orphaned_rules,
+    handle_event,
+    handle_records,
+)
+
+
+def created_at(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc)
+
+
+def test_get_expired_pooled_rules():
+    rule_names = [
+        "prefix_ingest_123",
+        "prefix_ingest_pool_abc_1",
+        "prefix_ingest_pool_def_5",
+        "prefix_getMessage_123",
+    ]
+
+    assert get_expired_pooled_rules(rule_names, "prefix", 900, 5000) == [
+        "prefix_ingest_pool_abc_1"
+    ]
+
+
+def test_get_orphaned_rules():
+    rules = [
+        {"ruleName": "prefix_ingest_123", "createdAt": created_at(1000)},
+        {"ruleName": "prefix_getMessage_456", "createdAt": created_at(9500)},
+        {"ruleName": "prefix_ingest_pool_abc_1", "createdAt": created_at(1000)},
+        {"ruleName": "other_rule", "createdAt": created_at(1000)},
+        {"ruleName": "prefix_ingest_789"},
+    ]
+
+    assert get_orphaned_rules(rules, "prefix", 900, 10_000) == ["prefix_ingest_123"]
+
+
+def test_get_orphaned_rules_keeps_other_rules():
+    rules = [
+        {"ruleName": "prefix_record_x", "createdAt": created_at(1000)},
+        {"ruleName": "prefix_other", "createdAt": created_at(1000)},
+        {"ruleName": "prefix_getMessage_123", "createdAt": created_at(1000)},
+    ]
+
+    assert get_orphaned_rules(rules, "prefix", 900, 10_000) == ["prefix_getMessage_123"]
+
+
+def test_handle_event(mocker):
+    mocker.patch("sweep_rules.index.time.time", return_value=10_000)
+    iot_client = Mock()
+    iot_client.get_paginator.return_value.paginate.return_value = [
+        {"rules": [{"ruleName": "prefix_ingest_pool_abc_1"}]},
+        {"rules": [{"ruleName": "prefix_ingest_pool_def_11"}]},
+    ]
+
+    assert handle_event(iot_client, "prefix", 900) == {
+        "expired": 1,
+        "orphaned": 0,
+        "deleted": 1,
+    }
+    iot_client.delete_topic_rule.assert_called_once_with(
+        ruleName="prefix_ingest_pool_abc_1"
+    )
+
+
+def test_handle_event_orphaned_rules(mocker):
+    mocker.patch("sweep_rules.index.time.time", return_value=10_000)
+    iot_client = Mock()
+    iot_client.get_paginator.return_value.paginate.return_value = [
+        {
+            "rules": [
+                {"ruleName": "prefix_ingest_123", "createdAt": created_at(1000)},
+                {"ruleName": "prefix_ingest_pool_abc_1"},
+                # long-lived rule of a recording
+                {"ruleName": "prefix_record_x", "createdAt": created_at(1000)},
+            ]
+        },
+    ]
+
+    # without rule pool only orphaned rules are swept
+    assert handle_event(iot_client, "prefix", 0, orphaned_rule_age=900) == {
+        "expired": 0,
+        "orphaned": 1,
+        "deleted": 1,
+    }
+    iot_client.delete_topic_rule.assert_called_once_with(ruleName="prefix_ingest_123")
+
+
+def test_handle_records():
+    iot_client = Mock()
+    iot_client.delete_topic_rule.side_effect = [{}, {}, Exception("throttled")]
+    records = [
+        {"messageId": "1", "body": dumps({"ruleNames": ["rule1", "rule2"]})},
+        {"messageId": "2", "body": dumps({"ruleNames": ["rule3"]})},
+    ]
+
+    assert handle_records(iot_client, records) == {
+        "batchItemFailures": [{"itemIdentifier": "2"}]
+    }
+    assert iot_client.delete_topic_rule.call_count == 3
+
+
+def test_handle_records_stops_before_timeout():
+    iot_client = Mock()
+    remaining_millis = Mock(side_effect=[120_000, 1_000, 1_000])
+    records = [
+        {"messageId": "1", "body": dumps({"ruleNames": ["rule1", "rule2"]})},
+        {"messageId": "2", "body": dumps({"ruleNames": ["rule3"]})},
+    ]
+
+    # messages with rules left are retried
+    assert handle_records(iot_client, records, remaining_millis) == {
+        "batchItemFailures": [{"itemIdentifier": "1"}, {"itemIdentifier": "2"}]
+    }
+    iot_client.delete_topic_rule.assert_called_once_with(ruleName="rule1")
+
+
+def test_handle_event_stops_before_timeout(mocker):
+    mocker.patch("sweep_rules.index.time.time", return_value=10_000)
+    iot_client = Mock()
+    iot_client.get_paginator.return_value.paginate.return_value = [
+        {
+            "rules": [
+                {"ruleName": "prefix_ingest_123", "createdAt": created_at(1000)},
+                {"ruleName": "prefix_ingest_456", "createdAt": created_at(1000)},
+            ]
+        },
+    ]
+
+    assert handle_event(
+        iot_client, "prefix", 0, remaining_millis=Mock(side_effect=[120_000, 1_000])
+    ) == {"expired": 0, "orphaned": 2, "deleted": 1}
+    iot_client.delete_topic_rule.assert_called_once_with(ruleName="prefix_ingest_123")
@@ -11,7 +11,8 @@ import { DefinitionBody } from 'aws-cdk-lib/aws-stepfunctions'
 import * as sfntasks from 'aws-cdk-lib/aws-stepfunctions-tasks'
 import * as iam from 'aws-cdk-lib/aws-iam'
 import { ToolboxLambdaFunction } from '../../../common/toolbox-lambda-function'
-import { TOOLBOX_ERROR_TOPIC, TOOLBOX_IOT_RULE_PREFIX } from '../../../constants'
+import { TOOLBOX_ERROR_TOPIC, TOOLBOX_IOT_RULE_PREFIX, TOOLBOX_RATE_LIMITED_LAMBDA_TIMEOUT_SECONDS, TOOLBOX_RULE_POOL_TTL_SECONDS } from '../../../constants'
+import { fusedStageTask, RULE_ACTION_ERROR } from '../shared/infrastructure'
 import path = require('path');
 
 export interface TopicMessageProps {
@@ -21,7 +22,10 @@ export interface TopicMessageProps {
   deleteRuleLambda: lambda.Function
   publishMessageLambdaRole: iam.Role
   createRuleLambdaRole: iam.Role
-
+  fusedStagesLambda?: lambda.Function
+  rateLimitEnvironment: { [key: string]: string }
+  messageCacheEnvironment: { [key: string]: string }
+  customMessageStateMachine?: sfn.StateMachine
 }
 
 export class TopicMessage extends Construct {
@@ -40,40 +44,26 @@ export class TopicMessage extends Construct {
         environment: {
           RECEIVE_MESSAGE_LAMBDA_ARN: props.receiveMessageLambda.functionArn,
           PUBLISH_MESSAGE_ROLE_ARN: props.publishMessageLambdaRole.roleArn,
-          REPUBLISH_ERROR_TOPIC: TOOLBOX_ERROR_TOPIC
+          REPUBLISH_ERROR_TOPIC: TOOLBOX_ERROR_TOPIC,
+          ...props.rateLimitEnvironment,
+          ...props.messageCacheEnvironment
         },
         role: props.createRuleLambdaRole,
-        serviceName: 'IotToolbox-CreateGetMessageRule'
+        serviceName: 'IotToolbox-CreateGetMessageRule',
+        timeout: cdk.Duration.seconds(TOOLBOX_RATE_LIMITED_LAMBDA_TIMEOUT_SECONDS)
       }
     )
 
-    const defineRuleNameLambda = ToolboxLambdaFunction.Python(
-      this,
-      'defineRuleNameLambda',
-      {
-        code: lambda.Code.fromAsset(
-          path.join(__dirname, 'lambda/define_topicmsg_rule_name')
-        ),
-        serviceName: 'IotToolbox-DefineTopicMessageRuleName',
-        environment: {
-          TOOLBOX_IOT_RULE_PREFIX
-        }
-      }
-    )
-
-    const defineRuleNameTask = new sfntasks.LambdaInvoke(
-      this,
-      'DefineRuleNameTask',
-      {
-        lambdaFunction: defineRuleNameLambda,
-        payloadResponseOnly: true,
-        payload: sfn.TaskInput.fromObject({
-          'execution.$': '$$.Execution.Name',
-          'input.$': '$'
-        }),
-        outputPath: '$'
-      }
-    )
+    const defineRuleNameTask = props.fusedStagesLambda
+      ? fusedStageTask(
+        this,
+        'DefineRuleNameTask',
+        props.fusedStagesLambda,
+        'define_topicmsg_rule_name',
+        { outputPath: '$' },
+        { 'execution.$': '$$.Execution.Name' }
+      )
+      : this.createDefineRuleNameTask()
 
     const createGetMessageRuleTask = new sfntasks.LambdaInvoke(
       this,
@@ -90,19 +80,23 @@ export class TopicMessage extends Construct {
       }
     )
 
-    const createIngestRuleTask = new sfntasks.LambdaInvoke(
-      this,
-      'CreateIngestRuleTask',
-      {
-        lambdaFunction: props.createIngestRuleLambda,
-        payloadResponseOnly: true,
-        resultPath: '$.createIngestRuleOutput',
-        payload: sfn.TaskInput.fromObject({
-          // taskToken: sfn.JsonPath.taskToken,
-          'input.$': '$'
-        })
-      }
-    )
+    const createIngestRuleTask = props.fusedStagesLambda
+      ? fusedStageTask(this, 'CreateIngestRuleTask', props.fusedStagesLambda, 'create_ingest_rule', {
+        resultPath: '$.createIngestRuleOutput'
+      })
+      : new sfntasks.LambdaInvoke(
+        this,
+        'CreateIngestRuleTask',
+        {
+          lambdaFunction: props.createIngestRuleLambda,
+          payloadResponseOnly: true,
+          resultPath: '$.createIngestRuleOutput',
+          payload: sfn.TaskInput.fromObject({
+            // taskToken: sfn.JsonPath.taskToken,
+            'input.$': '$'
+          })
+        }
+      )
 
     const ingestMessageTask = new sfntasks.LambdaInvoke(
       this,
@@ -112,27 +106,37 @@ export class TopicMessage extends Construct {
         integrationPattern: sfn.IntegrationPattern.WAIT_FOR_TASK_TOKEN,
         payload: sfn.TaskInput.fromObject({
           taskToken: sfn.JsonPath.taskToken,
+          'execution.$': '$$.Execution.Name',
           'input.$': '$.createMessageRuleOutput',
-          'ingestRuleName.$': '$.ingestRuleName'
+          'ingestRuleName.$': '$.ingestRuleName',
+          'sql.$': '$.sql',
+          'awsIotSqlVersion.$': '$.awsIotSqlVersion'
         }),
         heartbeatTimeout: sfn.Timeout.duration(cdk.Duration.seconds(2)),
         resultPath: '$.result'
       }
     )
 
-    const deleteRuleTask = new sfntasks.LambdaInvoke(this, 'DeleteRuleTask', {
-      lambdaFunction: props.deleteRuleLambda,
-      payloadResponseOnly: true,
-      outputPath: '$'
-    })
+    const deleteRuleTask = props.fusedStagesLambda
+      ? fusedStageTask(this, 'DeleteRuleTask', props.fusedStagesLambda, 'delete_rule', { outputPath: '$' })
+      : new sfntasks.LambdaInvoke(this, 'DeleteRuleTask', {
+        lambdaFunction: props.deleteRuleLambda,
+        payloadResponseOnly: true,
+        outputPath: '$'
+      })
 
-    ingestMessageTask.addCatch(deleteRuleTask, {
-      errors: ['States.HeartbeatTimeout'],
+    createIngestRuleTask.addCatch(deleteRuleTask, {
+      errors: ['SqlParseException'],
       resultPath: '$.error'
     })
 
-    createIngestRuleTask.addCatch(deleteRuleTask, {
-      errors: ['SqlParseException'],
+    const afterIngest = props.customMessageStateMachine
+      ? this.createCompareVariantsState(props.customMessageStateMachine, deleteRuleTask)
+      : deleteRuleTask
+
+    // variants are compared even if the message doesn't match the original statement
+    ingestMessageTask.addCatch(afterIngest, {
+      errors: ['States.HeartbeatTimeout', RULE_ACTION_ERROR],
       resultPath: '$.error'
     })
 
@@ -141,7 +145,7 @@ export class TopicMessage extends Construct {
         resultPath: '$.error'
       }))
       .next(createIngestRuleTask)
-      .next(ingestMessageTask.next(deleteRuleTask))
+      .next(ingestMessageTask.next(afterIngest))
 
     this.stepfunction = new sfn.StateMachine(this, 'StateMachine', {
       definitionBody: DefinitionBody.fromChainable(definition),
@@ -149,4 +153,71 @@ export class TopicMessage extends Construct {
       tracingEnabled: true
     })
   }
+
+  // evaluates the SQL variants of the request against the captured message in
+  // parallel, every variant runs in its own custom message execution
+  private createCompareVariantsState (customMessageStateMachine: sfn.StateMachine, deleteRuleTask: sfn.IChainable): sfn.Choice {
+    const compareVariantsMap = new sfn.Map(this, 'CompareVariantsMap', {
+      itemsPath: '$.variants',
+      itemSelector: {
+        'sql.$': '$$.Map.Item.Value',
+        'awsIotSqlVersion.$': '$.awsIotSqlVersion',
+        'message.$': '$.createMessageRuleOutput.message',
+        'userProperties.$': '$.createMessageRuleOutput.properties.userProperties',
+        'mqttProperties.$': '$.createMessageRuleOutput.properties.mqttProperties'
+      },
+      maxConcurrency: 10,
+      resultPath: '$.variantResults'
+    })
+
+    const testVariantTask = new sfntasks.StepFunctionsStartExecution(this, 'TestVariantTask', {
+      stateMachine: customMessageStateMachine,
+      integrationPattern: sfn.IntegrationPattern.RUN_JOB,
+      input: sfn.TaskInput.fromJsonPathAt('$'),
+      resultSelector: {
+        'result.$': 'States.StringToJson($.Output)'
+      },
+      resultPath: '$.result'
+    })
+    testVariantTask.addCatch(new sfn.Pass(this, 'VariantFailed'), {
+      resultPath: '$.error'
+    })
+    compareVariantsMap.itemProcessor(testVariantTask)
+
+    // variants of synchronous local mode requests are evaluated by the API Lambda function
+    return new sfn.Choice(this, 'CompareVariants')
+      .when(sfn.Condition.isPresent('$.variants'), compareVariantsMap.next(deleteRuleTask))
+      .otherwise(deleteRuleTask)
+  }
+
+  private createDefineRuleNameTask (): sfntasks.LambdaInvoke {
+    const defineRuleNameLambda = ToolboxLambdaFunction.Python(
+      this,
+      'defineRuleNameLambda',
+      {
+        code: lambda.Code.fromAsset(
+          path.join(__dirname, 'lambda/define_topicmsg_rule_name')
+        ),
+        serviceName: 'IotToolbox-DefineTopicMessageRuleName',
+        environment: {
+          TOOLBOX_IOT_RULE_PREFIX,
+          RULE_POOL_TTL_SECONDS: `${TOOLBOX_RULE_POOL_TTL_SECONDS}`
+        }
+      }
+    )
+
+    return new sfntasks.LambdaInvoke(
+      this,
+      'DefineRuleNameTask',
+      {
+        lambdaFunction: defineRuleNameLambda,
+        payloadResponseOnly: true,
+        payload: sfn.TaskInput.fromObject({
+          'execution.$': '$$.Execution.Name',
+          'input.$': '$'
+        }),
+        outputPath: '$'
+      }
+    )
+  }
 }
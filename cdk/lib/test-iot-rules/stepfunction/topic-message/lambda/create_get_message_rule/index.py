@@ -3,76 +3,194 @@
 
 import os
 import re
-from typing import Optional, Dict
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, Optional, Tuple
 
-import boto3
-from aws_lambda_powertools import Logger
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+from iottoolbox.clients import lazy_client
+from iottoolbox.log_budget import REDACTED, log_event
+from iottoolbox.message_cache import (
+    CAPTURE_PROPERTIES,
+    CAPTURED_PROPERTIES_KEY,
+    MQTT_PROPERTIES,
+    TOPIC_FILTER_KEY,
+    USER_PROPERTIES,
+    get_message,
+)
+from iottoolbox.rate_limit import rate_limited
+from iottoolbox.serialization import dumps
+from iottoolbox.sql import (
+    DEFAULT_SQL_VERSION,
+    Literal,
+    SqlSyntaxError,
+    iter_function_calls,
+    parse,
+)
+from iottoolbox.timing import (
+    get_correlation_id,
+    link_task_token,
+    set_correlation_id,
+    timed,
+)
 
 logger = Logger()
+metrics = Metrics()
 
-_iot_client = boto3.client("iot")
-_sfn_client = boto3.client("stepfunctions")
+_iot_client = rate_limited(lazy_client("iot"))
+_sfn_client = lazy_client("stepfunctions")
+_dynamodb_client = lazy_client("dynamodb")
 RECEIVE_MESSAGE_LAMBDA_ARN = os.getenv("RECEIVE_MESSAGE_LAMBDA_ARN", None)
 PUBLISH_MESSAGE_ROLE_ARN = os.getenv("PUBLISH_MESSAGE_ROLE_ARN", None)
 REPUBLISH_ERROR_TOPIC = os.getenv("REPUBLISH_ERROR_TOPIC", None)
+MESSAGE_CACHE_TABLE = os.getenv("MESSAGE_CACHE_TABLE", None)
 
 
 class SqlParseException(Exception):
     pass
 
 
-def parse_input_sql(input_sql):
-    # Raise an exception if anything after the FROM clause is not a WHERE clause
+def match_topic_filter(input_sql: str) -> Optional[str]:
+    """Returns the topic filter of the statement found with regular
+    expressions, used for statements the local parser doesn't support."""
+    # anything after the FROM clause has to be a WHERE clause
     if not re.search(
         r"FROM\s+'[^']+'(?=(?:\s+WHERE.*)|$)", input_sql, flags=re.IGNORECASE
     ):
-        raise SqlParseException
-
-    from_str = None
-    select_str_exists = False
-    if from_str_match := re.search(r"FROM\s+'([^']+)'", input_sql, flags=re.IGNORECASE):
-        from_str = from_str_match.group(1)
-    if re.search("^SELECT", input_sql, flags=re.IGNORECASE):
-        select_str_exists = True
-
-    if not (from_str and select_str_exists):
-        raise SqlParseException
-
-    return from_str, select_str_exists
-
-
-def create_wrapper_sql(input_sql: str, task_token: str) -> Optional[str]:
-    from_str, select_str_exists = parse_input_sql(input_sql)
-
-    new_sql = """SELECT {
-            'message': *,
-            'sfnTaskToken': '##TASKTOKEN##',
-            'properties': {
-                'userProperties': get_user_properties(),
-                'mqttProperties': {
-                    'contentType': get_mqtt_property('content_type'),
-                    'payloadFormatIndicator': get_mqtt_property('format_indicator'),
-                    'responseTopic': get_mqtt_property('response_topic'),
-                    'correlationData': get_mqtt_property('correlation_data'),
-                }
-            }
-        }
-        FROM '##FROM##'
-        """.replace(
-        "##TASKTOKEN##", task_token
-    ).replace(
-        "##FROM##", from_str.strip()
-    )
-    logger.info("Updated SQL", extra={"new_sql": new_sql})
-    return new_sql
+        return None
+    if not re.search("^SELECT", input_sql, flags=re.IGNORECASE):
+        return None
+    return re.search(r"FROM\s+'([^']+)'", input_sql, flags=re.IGNORECASE).group(1)
+
+
+def parse_input_sql(input_sql, aws_iot_sql_version=DEFAULT_SQL_VERSION) -> str:
+    """Returns the topic filter of the FROM clause, raises SqlParseException
+    if there is none."""
+    try:
+        topic = parse(input_sql, aws_iot_sql_version).topic
+    except SqlSyntaxError as e:
+        # only the rules engine decides whether a statement is invalid
+        logger.warning("Unparsed SQL", extra={"sql": input_sql, "error": str(e)})
+        metrics.add_metric(name="SqlParseFallback", unit=MetricUnit.Count, value=1)
+        topic = match_topic_filter(input_sql)
+
+    # a topic message test needs the topic filter to subscribe to
+    if not topic:
+        raise SqlParseException("FROM clause with topic filter missing")
+
+    return topic
+
+
+@lru_cache(maxsize=512)
+def get_statement_properties(
+    sql: str, aws_iot_sql_version: str = DEFAULT_SQL_VERSION
+) -> FrozenSet[str]:
+    """Returns the message properties a statement reads, raises
+    SqlSyntaxError if it is malformed."""
+    properties = set()
+    for call in iter_function_calls(parse(sql, aws_iot_sql_version)):
+        name = call.name.lower()
+        if name == "get_user_properties":
+            properties.add(USER_PROPERTIES)
+        elif name == "get_mqtt_property":
+            argument = call.args[0] if call.args else None
+            if isinstance(argument, Literal) and argument.value in MQTT_PROPERTIES:
+                properties.add(argument.value)
+            else:
+                # the property is only known when the rule runs
+                properties.update(MQTT_PROPERTIES)
+    return frozenset(properties)
+
+
+def get_capture_properties(
+    input_sql: str,
+    aws_iot_sql_version: str = DEFAULT_SQL_VERSION,
+    variants: Iterable[str] = (),
+) -> FrozenSet[str]:
+    """Returns the properties of the message the statement and its variants
+    read, only these are captured and carried through the later stages."""
+    properties = frozenset()
+    for sql in (input_sql, *variants):
+        try:
+            properties |= get_statement_properties(sql, aws_iot_sql_version)
+        except SqlSyntaxError:
+            # invalid variants fail on their own, capture everything for them
+            return CAPTURE_PROPERTIES
+    return properties
 
 
-def send_sql_exception_failure(sfn_client, task_token: str) -> None:
-    snf_response = sfn_client.send_task_failure(
-        taskToken=task_token, error="SqlParseException"
+@lru_cache(maxsize=256)
+def get_wrapper_template(
+    topic_filter: str, properties: FrozenSet[str]
+) -> Tuple[str, str]:
+    """Returns the SQL of the getMessage rule before and after the task
+    token. Only the token differs between tests of the same topic filter and
+    property set."""
+    user_properties = "get_user_properties()" if USER_PROPERTIES in properties else "[]"
+    mqtt_properties = ", ".join(
+        f"'{key}': get_mqtt_property('{name}')"
+        for name, key in MQTT_PROPERTIES.items()
+        if name in properties
     )
-    logger.info("SendTaskFailure", extra={"response": snf_response})
-    return
+    captured = ",".join(sorted(properties))
+    # quotes are escaped by doubling them in string literals
+    topic_filter = topic_filter.replace("'", "''")
+    head = "SELECT {'message': *, 'sfnTaskToken': '"
+    tail = (
+        f"', '{TOPIC_FILTER_KEY}': '{topic_filter}', "
+        f"'{CAPTURED_PROPERTIES_KEY}': '{captured}', "
+        f"'properties': {{'userProperties': {user_properties}, "
+        f"'mqttProperties': {{{mqtt_properties}}}}}}} FROM '{topic_filter}'"
+    )
+    return head, tail
+
+
+def create_wrapper_sql(
+    input_sql: str,
+    task_token: str,
+    aws_iot_sql_version: str = DEFAULT_SQL_VERSION,
+    variants: Iterable[str] = (),
+) -> str:
+    topic_filter = parse_input_sql(input_sql, aws_iot_sql_version)
+    properties = get_capture_properties(input_sql, aws_iot_sql_version, variants)
+    head, tail = get_wrapper_template(topic_filter.strip(), properties)
+    # the task token is a credential for the execution, it is never logged
+    logger.debug("Updated SQL", extra={"new_sql": head + REDACTED + tail})
+    return head + task_token + tail
+
+
+def send_cached_message(
+    dynamodb_client,
+    sfn_client,
+    message_cache_table: str,
+    input_sql: str,
+    task_token: str,
+    max_age: float,
+    properties: FrozenSet[str] = CAPTURE_PROPERTIES,
+    aws_iot_sql_version: str = DEFAULT_SQL_VERSION,
+) -> bool:
+    """Answers the task with the latest cached message of the topic filter
+    if it was captured within max_age seconds with the given properties.
+    Returns False if there is none, the message is then captured by a
+    getMessage rule."""
+    topic_filter = parse_input_sql(input_sql, aws_iot_sql_version)
+    with timed(metrics, "MessageCacheLookup"):
+        captured = get_message(
+            dynamodb_client,
+            message_cache_table,
+            topic_filter.strip(),
+            max_age,
+            properties,
+        )
+    if captured is None:
+        metrics.add_metric(name="MessageCacheMiss", unit=MetricUnit.Count, value=1)
+        return False
+
+    metrics.add_metric(name="MessageCacheHit", unit=MetricUnit.Count, value=1)
+    # no getMessage rule was created, delete_rule skips it
+    captured["cached"] = True
+    sfn_client.send_task_success(taskToken=task_token, output=dumps(captured))
+    return True
 
 
 def create_topic_rule(
@@ -85,28 +203,29 @@ def create_topic_rule(
     republish_error_topic: str,
 ) -> Optional[str]:
     try:
-        response_lambda_rule = iot_client.create_topic_rule(
-            ruleName=rule_name,
-            topicRulePayload={
-                "sql": sql,
-                "description": "temporary IoT rule to forward messages to Lambda",
-                "actions": [
-                    {
-                        "lambda": {"functionArn": receive_message_lambda_arn},
+        with timed(metrics, "CreateTopicRule"):
+            response_lambda_rule = iot_client.create_topic_rule(
+                ruleName=rule_name,
+                topicRulePayload={
+                    "sql": sql,
+                    "description": "temporary IoT rule to forward messages to Lambda",
+                    "actions": [
+                        {
+                            "lambda": {"functionArn": receive_message_lambda_arn},
+                        },
+                    ],
+                    "ruleDisabled": False,
+                    "awsIotSqlVersion": aws_iot_sql_version,
+                    "errorAction": {
+                        "republish": {
+                            "roleArn": publish_message_role_arn,
+                            "topic": republish_error_topic,
+                            "qos": 1,
+                        }
                     },
-                ],
-                "ruleDisabled": False,
-                "awsIotSqlVersion": aws_iot_sql_version,
-                "errorAction": {
-                    "republish": {
-                        "roleArn": publish_message_role_arn,
-                        "topic": republish_error_topic,
-                        "qos": 1,
-                    }
                 },
-            },
-        )
-        logger.info(
+            )
+        logger.debug(
             "CreateTopicRule Response", extra={"response": response_lambda_rule}
         )
         return
@@ -124,18 +243,38 @@ def handle_event(
     receive_message_lambda_arn: str,
     publish_message_role_arn: str,
     republish_error_topic: str,
+    dynamodb_client=None,
+    message_cache_table: Optional[str] = None,
 ) -> Optional[str]:
+    set_correlation_id(metrics, get_correlation_id(event))
     input = event.pop("input")
     event = event | input
 
     aws_iot_sql_version = event["awsIotSqlVersion"]
     task_token = event["taskToken"]
     get_message_rule_name = event["getMessageRuleName"]
+    link_task_token(metrics, task_token)
+    # the captured message is also tested against the variants
+    variants = event.get("variants", []) + event.get("localVariants", [])
 
-    new_sql = create_wrapper_sql(event["sql"], task_token)
+    max_message_age = event.get("maxMessageAge")
+    if max_message_age and message_cache_table:
+        if send_cached_message(
+            dynamodb_client,
+            sfn_client,
+            message_cache_table,
+            event["sql"],
+            task_token,
+            max_message_age,
+            get_capture_properties(event["sql"], aws_iot_sql_version, variants),
+            aws_iot_sql_version,
+        ):
+            return
 
-    if not new_sql:
-        return send_sql_exception_failure(sfn_client, task_token)
+    with timed(metrics, "SqlRewrite"):
+        new_sql = create_wrapper_sql(
+            event["sql"], task_token, aws_iot_sql_version, variants
+        )
 
     return create_topic_rule(
         iot_client,
@@ -159,10 +298,11 @@ def check_env():
         raise Exception("REPUBLISH_ERROR_TOPIC environment variable not defined")
 
 
+@metrics.log_metrics
 @logger.inject_lambda_context
 def lambda_handler(event, context):
     check_env()
-    logger.info(event)
+    log_event(logger, event)
     return handle_event(
         _iot_client,
         _sfn_client,
@@ -170,4 +310,6 @@ def lambda_handler(event, context):
         RECEIVE_MESSAGE_LAMBDA_ARN,
         PUBLISH_MESSAGE_ROLE_ARN,
         REPUBLISH_ERROR_TOPIC,
+        _dynamodb_client,
+        MESSAGE_CACHE_TABLE,
     )
@@ -2,11 +2,18 @@
 #  SPDX-License-Identifier: Apache-2.0
 
 from contextlib import nullcontext as does_not_raise
+from unittest.mock import Mock
 
 import pytest
+from iottoolbox.serialization import dumps
+from iottoolbox.sql import parse
+from create_get_message_rule import index
 from create_get_message_rule.index import (
     parse_input_sql,
     create_wrapper_sql,
+    get_capture_properties,
+    get_wrapper_template,
+    handle_event,
     SqlParseException,
 )
 
@@ -17,73 +24,240 @@ TEST_ENVIRONMENT = {
 
 
 @pytest.mark.parametrize(
-    "input_sql, exception_expectation, expected_from_str, expected_select_str_exist",
+    "input_sql, exception_expectation, expected_from_str",
     [
-        ("asd where foo", pytest.raises(SqlParseException), None, False),
-        ("SELECT *", pytest.raises(SqlParseException), None, True),
-        ("select *", pytest.raises(SqlParseException), None, True),
-        ("SELEcT a, b, SUM(d) as x", pytest.raises(SqlParseException), None, True),
+        ("asd where foo", pytest.raises(SqlParseException), None),
+        ("SELECT *", pytest.raises(SqlParseException), None),
+        ("select *", pytest.raises(SqlParseException), None),
+        ("SELEcT a, b, SUM(d) as x", pytest.raises(SqlParseException), None),
         (
             "SELECT a, b, SUM(d) as x WHERE foo = 'bar'",
             pytest.raises(SqlParseException),
             None,
-            True,
         ),
         (
             "SELECT a, b, SUM(d) as x      WHERE foo = 'bar'",
             pytest.raises(SqlParseException),
             None,
-            True,
         ),
-        ("SELECT * WHERE foo = 'bar'", pytest.raises(SqlParseException), None, True),
-        ("SELECT * where foo = 'bar'", pytest.raises(SqlParseException), None, True),
+        ("SELECT * WHERE foo = 'bar'", pytest.raises(SqlParseException), None),
+        ("SELECT * where foo = 'bar'", pytest.raises(SqlParseException), None),
         (
+            # unparsed statements are left to the rules engine to reject
             "SELECT abc, def, SUM(D) from 'iot/test' where foo = 'bar', AVG(def) = 5",
             does_not_raise(),
             "iot/test",
-            True,
         ),
-        ("SELECT * FROM 'iot/test'", does_not_raise(), "iot/test", True),
+        (
+            "SELECT state.reported.* FROM 'iot/test' WHERE a IS NOT NULL;",
+            does_not_raise(),
+            "iot/test",
+        ),
+        (
+            "SELECT abc, def, SUM(D) from 'iot/test' where foo = 'bar' AND AVG(def) = 5",
+            does_not_raise(),
+            "iot/test",
+        ),
+        (
+            "SELECT * FROM 'iot/test' WHERE foo = 'FROM ''x'' WHERE'",
+            does_not_raise(),
+            "iot/test",
+        ),
+        (
+            "SELECT * FROM 'iot/test' GROUP BY a",
+            pytest.raises(SqlParseException),
+            None,
+        ),
+        ("SELECT * FROM 'iot/test'", does_not_raise(), "iot/test"),
         (
             "SELECT * FROM 'iot/test' WHERE foo = 'bar' and sdf = 123",
             does_not_raise(),
             "iot/test",
-            True,
         ),
     ],
 )
-def test_parse_input_sql(
-    input_sql, exception_expectation, expected_from_str, expected_select_str_exist
-):
+def test_parse_input_sql(input_sql, exception_expectation, expected_from_str):
     with exception_expectation:
-        actual_from, actual_select = parse_input_sql(input_sql)
-        assert actual_from == expected_from_str
-        assert actual_select == expected_select_str_exist
+        assert parse_input_sql(input_sql) == expected_from_str
 
 
-def test_create_wrapper_sql(mocker):
-    parse_input_sql_mock = mocker.patch("create_get_message_rule.index.parse_input_sql")
-    parse_input_sql_mock.return_value = ("mocked/topic", True)
+def normalize(sql):
+    return "".join(sql.split())
+
+
+def test_create_wrapper_sql():
     expected_result = """SELECT {
         'message': *,
         'sfnTaskToken': 'TASKTOKEN',
+        'captureTopicFilter': 'mocked/topic',
+        'captureProperties': 'content_type,correlation_data,format_indicator,response_topic,user_properties',
         'properties': {
             'userProperties': get_user_properties(),
             'mqttProperties': {
                 'contentType': get_mqtt_property('content_type'),
                 'payloadFormatIndicator': get_mqtt_property('format_indicator'),
                 'responseTopic': get_mqtt_property('response_topic'),
-                'correlationData': get_mqtt_property('correlation_data'),
+                'correlationData': get_mqtt_property('correlation_data')
             }
         }
     }
     FROM 'mocked/topic'
     """
-    actual_result = create_wrapper_sql("Doesn't matter", "TASKTOKEN")
+    actual_result = create_wrapper_sql(
+        "SELECT get_user_properties('a') AS a FROM 'mocked/topic' "
+        "WHERE get_mqtt_property(b) = 'c'",
+        "TASKTOKEN",
+    )
+
+    assert normalize(actual_result) == normalize(expected_result)
+
+
+def test_create_wrapper_sql_without_properties():
+    expected_result = """SELECT {
+        'message': *,
+        'sfnTaskToken': 'TASKTOKEN',
+        'captureTopicFilter': 'mocked/topic',
+        'captureProperties': '',
+        'properties': {'userProperties': [], 'mqttProperties': {}}
+    }
+    FROM 'mocked/topic'
+    """
+    actual_result = create_wrapper_sql("SELECT * FROM 'mocked/topic'", "TASKTOKEN")
+
+    assert normalize(actual_result) == normalize(expected_result)
+
+
+def test_create_wrapper_sql_does_not_log_task_token(mocker):
+    logger = mocker.patch.object(index, "logger")
+
+    create_wrapper_sql("SELECT * FROM 'mocked/topic'", "TASKTOKEN")
+
+    logger.info.assert_not_called()
+    assert "TASKTOKEN" not in str(logger.mock_calls)
+
+
+@pytest.mark.parametrize(
+    "input_sql, variants, expected_properties",
+    [
+        ("SELECT * FROM 'a'", [], set()),
+        (
+            "SELECT get_mqtt_property('content_type') AS c FROM 'a'",
+            [],
+            {"content_type"},
+        ),
+        (
+            "SELECT * FROM 'a' WHERE get_mqtt_property('response_topic') = 'b'",
+            ["SELECT get_user_properties('c') AS c FROM 'a'"],
+            {"response_topic", "user_properties"},
+        ),
+        (
+            "SELECT * FROM 'a'",
+            ["SELECT FROM"],
+            {
+                "content_type",
+                "format_indicator",
+                "response_topic",
+                "correlation_data",
+                "user_properties",
+            },
+        ),
+    ],
+)
+def test_get_capture_properties(input_sql, variants, expected_properties):
+    assert get_capture_properties(input_sql, variants=variants) == expected_properties
+
+
+def test_create_wrapper_sql_escapes_topic_filter():
+    new_sql = create_wrapper_sql("SELECT * FROM 'it''s/topic'", "TASKTOKEN")
+
+    assert "'captureTopicFilter': 'it''s/topic'" in new_sql
+    assert parse(new_sql).topic == "it's/topic"
+
+
+def test_get_wrapper_template_is_cached():
+    properties = frozenset(["content_type"])
+
+    assert get_wrapper_template("a/b", properties) is get_wrapper_template(
+        "a/b", properties
+    )
+
+
+def create_event(**kwargs):
+    return {
+        "taskToken": "TASKTOKEN",
+        "input": {
+            "sql": "SELECT * FROM 'device/+/data'",
+            "awsIotSqlVersion": "2016-03-23",
+            "getMessageRuleName": "rule",
+            **kwargs,
+        },
+    }
+
+
+def test_handle_event_cached_message(mocker):
+    get_message = mocker.patch(
+        "create_get_message_rule.index.get_message",
+        return_value={"message": {"a": 1}, "properties": {}, "capturedAt": 1000},
+    )
+    parse_input_sql = mocker.spy(index, "parse_input_sql")
+    iot_client = Mock()
+    sfn_client = Mock()
+    dynamodb_client = Mock()
+
+    handle_event(
+        iot_client,
+        sfn_client,
+        create_event(
+            awsIotSqlVersion="2015-10-08",
+            maxMessageAge=60,
+            localVariants=["SELECT get_mqtt_property('content_type') FROM 'a'"],
+        ),
+        "lambda-arn",
+        "role-arn",
+        "error/topic",
+        dynamodb_client,
+        "messages",
+    )
+
+    parse_input_sql.assert_called_with("SELECT * FROM 'device/+/data'", "2015-10-08")
+    get_message.assert_called_with(
+        dynamodb_client, "messages", "device/+/data", 60, {"content_type"}
+    )
+    sfn_client.send_task_success.assert_called_with(
+        taskToken="TASKTOKEN",
+        output=dumps(
+            {
+                "message": {"a": 1},
+                "properties": {},
+                "capturedAt": 1000,
+                "cached": True,
+            }
+        ),
+    )
+    iot_client.create_topic_rule.assert_not_called()
+
 
-    parse_input_sql_mock.assert_called_with("Doesn't matter")
+@pytest.mark.parametrize("max_message_age", [None, 60])
+def test_handle_event_captures_message(mocker, max_message_age):
+    mocker.patch("create_get_message_rule.index.get_message", return_value=None)
+    iot_client = Mock()
+    sfn_client = Mock()
+    event = (
+        create_event(maxMessageAge=max_message_age)
+        if max_message_age
+        else create_event()
+    )
 
-    expected_result_str = "".join([x.strip() for x in expected_result.split("\n")])
-    actual_result_str = "".join([x.strip() for x in actual_result.split("\n")])
+    handle_event(
+        iot_client,
+        sfn_client,
+        event,
+        "lambda-arn",
+        "role-arn",
+        "error/topic",
+        Mock(),
+        "messages",
+    )
 
-    assert actual_result_str == expected_result_str
+    sfn_client.send_task_success.assert_not_called()
+    iot_client.create_topic_rule.assert_called_once()
@@ -2,12 +2,16 @@
 #  SPDX-License-Identifier: Apache-2.0
 
 import os
+import time
 
 from aws_lambda_powertools import Logger
+from iottoolbox.log_budget import log_event
+from iottoolbox.rule_pool import get_pooled_rule_name
 
 logger = Logger()
 
 TOOLBOX_IOT_RULE_PREFIX = os.getenv("TOOLBOX_IOT_RULE_PREFIX", "iottoolbox_tmp_rule_")
+RULE_POOL_TTL_SECONDS = int(os.getenv("RULE_POOL_TTL_SECONDS", "0"))
 
 
 def get_execution_id(event):
@@ -20,15 +24,37 @@ def get_rule_name(prefix, infix, event):
     return f"{prefix}_{infix}_{execution_id}"
 
 
-def handle_event(event, toolbox_iot_rule_prefix):
+def handle_event(event, toolbox_iot_rule_prefix, rule_pool_ttl=0):
     event["getMessageRuleName"] = get_rule_name(
         toolbox_iot_rule_prefix, "getMessage", event
     )
-    event["ingestRuleName"] = get_rule_name(toolbox_iot_rule_prefix, "ingest", event)
 
     input = event.pop("input")
     event["sql"] = input["sql"]
     event["awsIotSqlVersion"] = input["awsIotSqlVersion"]
+    # SQL variants to compare against the captured message
+    if "variants" in input:
+        event["variants"] = input["variants"]
+    # variants of local mode tests, compared by the API Lambda function
+    if "localVariants" in input:
+        event["localVariants"] = input["localVariants"]
+    # accept a cached message captured within maxMessageAge seconds
+    if "maxMessageAge" in input:
+        event["maxMessageAge"] = input["maxMessageAge"]
+
+    if rule_pool_ttl > 0:
+        event["ingestRuleName"] = get_pooled_rule_name(
+            toolbox_iot_rule_prefix,
+            event["sql"],
+            event["awsIotSqlVersion"],
+            rule_pool_ttl,
+            time.time(),
+        )
+        event["pooledIngestRule"] = True
+    else:
+        event["ingestRuleName"] = get_rule_name(
+            toolbox_iot_rule_prefix, "ingest", event
+        )
 
     return event
 
@@ -38,8 +64,14 @@ def check_env():
         raise Exception("TOOLBOX_IOT_RULE_PREFIX environment variable not defined")
 
 
+def run(event):
+    """Runs the stage with the clients and configuration of this module,
+    also used by the fused_stages function."""
+    return handle_event(event, TOOLBOX_IOT_RULE_PREFIX, RULE_POOL_TTL_SECONDS)
+
+
 @logger.inject_lambda_context
 def lambda_handler(event, context):
-    logger.info(event)
+    log_event(logger, event)
     check_env()
-    return handle_event(event, TOOLBOX_IOT_RULE_PREFIX)
+    return run(event)
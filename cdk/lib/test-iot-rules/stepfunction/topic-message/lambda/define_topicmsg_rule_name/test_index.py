@@ -78,3 +78,35 @@ def test_handle_event():
     result = handle_event(event, "prefix")
 
     assert expected == result
+
+
+def test_handle_event_pooled_rule():
+    event = {
+        "input": {"sql": "SELECT * FROM 'foo'", "awsIotSqlVersion": "2016-03-23"},
+        "execution": "exec",
+    }
+
+    result = handle_event(event, "prefix", rule_pool_ttl=900)
+
+    assert result["getMessageRuleName"] == "prefix_getMessage_exec"
+    assert result["pooledIngestRule"] is True
+    assert result["ingestRuleName"].startswith("prefix_ingest_pool_")
+
+
+def test_handle_event_variants():
+    event = {
+        "input": {
+            "sql": "SELECT * FROM 'foo'",
+            "awsIotSqlVersion": "2016-03-23",
+            "variants": ["SELECT a FROM 'foo'"],
+            "localVariants": ["SELECT b FROM 'foo'"],
+            "maxMessageAge": 60,
+        },
+        "execution": "exec",
+    }
+
+    result = handle_event(event, "prefix")
+
+    assert result["variants"] == ["SELECT a FROM 'foo'"]
+    assert result["localVariants"] == ["SELECT b FROM 'foo'"]
+    assert result["maxMessageAge"] == 60
@@ -0,0 +1,76 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""Records the responses of the deployed rule tester for the differential tests.
+
+Runs every request of iottoolbox/testdata/sql_differential.json through the
+custom message state machine and stores the returned output and error, so
+the local SQL evaluator is compared against the AWS IoT rules engine.
+Requires AWS credentials for the account the toolbox is deployed to.
+
+Usage: python tools/record_sql_differential.py <custom message state machine ARN>
+"""
+
+import json
+import os
+import sys
+
+import boto3
+
+sys.path.insert(
+    0,
+    os.path.join(os.path.dirname(__file__), "../lib/api/lambda/invoke-stepfunction"),
+)
+
+from index import BackoffWaiter  # noqa: E402
+
+RECORDINGS_PATH = os.path.join(
+    os.path.dirname(__file__),
+    "../lib/common/python-layer/python/iottoolbox/testdata/sql_differential.json",
+)
+REQUEST_KEYS = [
+    "sql",
+    "awsIotSqlVersion",
+    "message",
+    "userProperties",
+    "mqttProperties",
+]
+
+
+def record(sfn_client, statemachine_arn, recording):
+    request = {key: recording[key] for key in REQUEST_KEYS}
+    response_start = sfn_client.start_execution(
+        stateMachineArn=statemachine_arn, input=json.dumps(request)
+    )
+    response_describe = BackoffWaiter().wait(
+        sfn_client, response_start["executionArn"], timeout=60
+    )
+    if response_describe["status"] != "SUCCEEDED":
+        raise Exception(f"Execution {response_start['executionArn']} failed")
+
+    response = json.loads(response_describe["output"])
+    return request | {
+        "output": response["output"],
+        "error": response["error"],
+        "source": "cloud",
+    }
+
+
+def main():
+    if len(sys.argv) != 2:
+        sys.exit(__doc__)
+
+    sfn_client = boto3.client("stepfunctions")
+    with open(RECORDINGS_PATH) as f:
+        recordings = json.load(f)
+
+    recordings = [record(sfn_client, sys.argv[1], r) for r in recordings]
+
+    with open(RECORDINGS_PATH, "w") as f:
+        json.dump(recordings, f, indent=2)
+        f.write("\n")
+    print(f"Recorded {len(recordings)} responses")
+
+
+if __name__ == "__main__":
+    main()